@@ -0,0 +1,142 @@
+"""Adaptive candidate count for /chat reranking (stdlib only).
+
+Instead of always asking the upstream for RERANK_N candidates, a request
+starts with `min_n` and asks for the rest (up to `max_n`) in a second call
+only when the first candidates are a close call: their best and runner-up
+scores differ by less than `spread_threshold`. If every candidate scores the
+same (typically the neutral 0.5, no known tokens) the reranker has no signal
+and more candidates would not help, so none are requested. The second call
+must also fit the latency and token budgets.
+
+The policy learns per prompt (hash of the normalized last user message) how
+often a second round found a clearly better winner (by at least the spread
+threshold). Prompts where it rarely does stop expanding; prompts where it
+usually does ask for `max_n` up front and skip the extra round trip.
+Unknown prompts use the defaults above.
+
+AdaptiveN has no I/O, so bench/adaptive_n.py can replay it offline.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+_SPACE_RE = re.compile(r'\s+')
+
+
+def prompt_key(text):
+    """Short stable key for a prompt (case- and whitespace-insensitive)."""
+    norm = _SPACE_RE.sub(' ', str(text or '')).strip().lower()
+    return hashlib.sha256(norm.encode('utf-8')).hexdigest()[:16]
+
+
+def score_spread(scores):
+    """(best - runner-up, has_signal) for a list of candidate scores."""
+    if len(scores) < 2:
+        return 0.0, False
+    ordered = sorted(scores, reverse=True)
+    return ordered[0] - ordered[1], ordered[0] != ordered[-1]
+
+
+class _PromptStats:
+    __slots__ = ('rounds', 'wins', 'win_rate')
+
+    def __init__(self):
+        self.rounds = 0
+        self.wins = 0
+        self.win_rate = 0.0
+
+
+class AdaptiveN:
+    def __init__(self, min_n=2, max_n=5, spread_threshold=0.01, latency_budget_ms=0.0, token_budget=0,
+                 min_rounds=3, skip_below=0.15, upfront_above=0.6, alpha=0.3, max_prompts=10000):
+        self.min_n = max(1, min_n)
+        self.max_n = max(self.min_n, max_n)
+        self.spread_threshold = spread_threshold
+        # 0 means no budget
+        self.latency_budget_ms = latency_budget_ms
+        self.token_budget = token_budget
+        # learned behaviour only kicks in after min_rounds second rounds for a prompt
+        self.min_rounds = min_rounds
+        self.skip_below = skip_below
+        self.upfront_above = upfront_above
+        self.alpha = alpha
+        self.max_prompts = max(1, max_prompts)
+        self._prompts = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'requests': 0, 'expanded': 0, 'expansion_wins': 0, 'upfront': 0,
+                         'skipped_learned': 0, 'skipped_no_signal': 0, 'skipped_budget': 0,
+                         'candidates': 0}
+
+    def _stats(self, key, create=False):
+        st = self._prompts.get(key)
+        if st is None and create:
+            st = self._prompts[key] = _PromptStats()
+            if len(self._prompts) > self.max_prompts:
+                self._prompts.popitem(last=False)
+        if st is not None:
+            self._prompts.move_to_end(key)
+        return st
+
+    def initial_n(self, key):
+        """Candidates to request first: max_n for prompts where a second round usually wins."""
+        with self._lock:
+            self.counters['requests'] += 1
+            st = self._stats(key)
+            if st is not None and st.rounds >= self.min_rounds and st.win_rate >= self.upfront_above:
+                self.counters['upfront'] += 1
+                self.counters['candidates'] += self.max_n
+                return self.max_n
+            self.counters['candidates'] += self.min_n
+            return self.min_n
+
+    def extra_n(self, key, scores, elapsed_ms=0.0, tokens_used=0):
+        """How many more candidates to request after scoring the first ones, and why.
+
+        Returns (extra, reason) where reason is one of 'expand', 'enough',
+        'spread', 'no_signal', 'learned', 'latency_budget', 'token_budget'.
+        """
+        n = len(scores)
+        extra = self.max_n - n
+        if extra <= 0:
+            return 0, 'enough'
+        spread, signal = score_spread(scores)
+        with self._lock:
+            if not signal:
+                self.counters['skipped_no_signal'] += 1
+                return 0, 'no_signal'
+            if spread >= self.spread_threshold:
+                return 0, 'spread'
+            st = self._stats(key)
+            if st is not None and st.rounds >= self.min_rounds and st.win_rate < self.skip_below:
+                self.counters['skipped_learned'] += 1
+                return 0, 'learned'
+            # assume the second call costs about as much as the first did
+            if self.latency_budget_ms and elapsed_ms * 2 > self.latency_budget_ms:
+                self.counters['skipped_budget'] += 1
+                return 0, 'latency_budget'
+            if self.token_budget and n and tokens_used + tokens_used * extra / n > self.token_budget:
+                self.counters['skipped_budget'] += 1
+                return 0, 'token_budget'
+            self.counters['expanded'] += 1
+            self.counters['candidates'] += extra
+            return extra, 'expand'
+
+    def record(self, key, first_best, final_best):
+        """Record the outcome of a second round; it 'won' if it raised the best score by spread_threshold or more."""
+        won = final_best - first_best >= self.spread_threshold
+        with self._lock:
+            st = self._stats(key, create=True)
+            st.rounds += 1
+            st.wins += 1 if won else 0
+            st.win_rate = float(won) if st.rounds == 1 else (1 - self.alpha) * st.win_rate + self.alpha * won
+            if won:
+                self.counters['expansion_wins'] += 1
+        return won
+
+    def stats(self):
+        with self._lock:
+            out = dict(self.counters)
+            out.update({'prompts': len(self._prompts), 'min_n': self.min_n, 'max_n': self.max_n,
+                        'spread_threshold': self.spread_threshold})
+            return out
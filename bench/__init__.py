@@ -0,0 +1,4 @@
+"""Benchmarks and local load tools for the Python backend (stdlib only).
+
+Run them from the project root, e.g. ``python3 -m bench.load_mixed``.
+"""
@@ -0,0 +1,133 @@
+"""Offline simulation of adaptive RERANK_N over a reviews.json corpus.
+
+Reviews stand in for upstream candidates: half of them train the reranker,
+the other half are split into per-prompt candidate pools, and a simulated
+request draws candidates at random from its prompt's pool. A review's own
+ratings are the ground truth for how good the picked candidate is. Fixed
+RERANK_N is compared with the AdaptiveN policy from adaptive_n.py at a few
+spread thresholds (cost = candidates requested, quality = mean true score of
+the pick, 0..1):
+
+    python3 -m bench.adaptive_n                          # the repo's reviews.json
+    python3 -m bench.adaptive_n --reviews path/to/reviews.json
+    python3 -m bench.adaptive_n --synthetic 20000        # planted-signal corpus when reviews.json is small
+"""
+import argparse
+import json
+import os
+import random
+
+from adaptive_n import AdaptiveN
+from bench.corpus import synthetic_reviews
+from reranker import RerankerModel, score_batch
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_CRITERIA = ('factuality', 'clarity', 'ethics')
+
+
+def true_quality(review):
+    """The review's own composite rating on the reranker's 0..1 scale."""
+    crit = review.get('criteria') if isinstance(review.get('criteria'), dict) else {}
+    vals = []
+    for c in _CRITERIA:
+        v = crit.get(c, review.get('rating'))
+        try:
+            vals.append((float(v) - 1.0) / 4.0)
+        except (TypeError, ValueError):
+            continue
+    return sum(vals) / len(vals) if vals else 0.5
+
+
+def planted_reviews(n, seed=0, words=12, vocab_size=400):
+    """Synthetic reviews whose ratings follow a hidden per-token quality, so the reranker has signal."""
+    rnd = random.Random(seed)
+    reviews = synthetic_reviews(n, seed=seed, words=words, vocab_size=vocab_size)
+    hidden = {}
+    for r in reviews:
+        toks = r['assistantText'].split()
+        q = sum(hidden.setdefault(t, rnd.uniform(1, 5)) for t in toks) / len(toks)
+        q = 3 + (q - 3) * 3 + rnd.gauss(0, 0.5)
+        r['rating'] = max(1, min(5, int(round(q))))
+        r.pop('criteria', None)
+    return reviews
+
+
+def load(args):
+    if args.synthetic:
+        return planted_reviews(args.synthetic, seed=args.seed)
+    with open(args.reviews, 'r', encoding='utf-8') as f:
+        return [r for r in json.load(f) if isinstance(r, dict) and isinstance(r.get('assistantText'), str)]
+
+
+def simulate(requests, model, max_n, policy=None):
+    """Replay requests (prompt, pre-drawn candidates) with a fixed n (policy None) or an AdaptiveN."""
+    cost = 0
+    quality = 0.0
+    rounds = 0
+    for prompt, drawn in requests:
+        if policy is None:
+            cands = drawn[:max_n]
+        else:
+            n = policy.initial_n(prompt)
+            cands = drawn[:n]
+            scores = score_batch([c['assistantText'] for c in cands], model)
+            extra, _ = policy.extra_n(prompt, scores, elapsed_ms=0.0, tokens_used=0)
+            if extra:
+                rounds += 1
+                added = drawn[n:n + extra]
+                more = score_batch([c['assistantText'] for c in added], model)
+                policy.record(prompt, max(scores), max(scores + more))
+                cands = cands + added
+        cost += len(cands)
+        scores = score_batch([c['assistantText'] for c in cands], model)
+        quality += true_quality(cands[scores.index(max(scores))])
+    return cost, quality / max(1, len(requests)), rounds
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Adaptive RERANK_N offline simulation')
+    ap.add_argument('--reviews', default=os.path.join(_ROOT, 'reviews.json'))
+    ap.add_argument('--synthetic', type=int, default=0, help='use N synthetic reviews instead of a file')
+    ap.add_argument('--requests', type=int, default=5000)
+    ap.add_argument('--prompts', type=int, default=50, help='distinct prompts (repeats let the policy learn)')
+    ap.add_argument('--max-n', type=int, default=5)
+    ap.add_argument('--min-n', type=int, default=2)
+    ap.add_argument('--spreads', default='0.005,0.01,0.02,0.05')
+    ap.add_argument('--seed', type=int, default=0)
+    args = ap.parse_args()
+
+    rnd = random.Random(args.seed)
+    reviews = load(args)
+    rnd.shuffle(reviews)
+    half = len(reviews) // 2
+    train, pool = reviews[:half], reviews[half:]
+    if len(pool) < 2:
+        raise SystemExit('need at least 4 reviews with assistantText (try --synthetic 20000)')
+    model = RerankerModel.from_records(train).compiled()
+
+    # each prompt draws from its own slice of the held-out reviews
+    prompts = max(1, min(args.prompts, len(pool) // 2))
+    pools = [pool[i::prompts] for i in range(prompts)]
+    requests = []
+    for _ in range(args.requests):
+        p = rnd.randrange(prompts)
+        requests.append(('prompt-%d' % p, [rnd.choice(pools[p]) for _ in range(args.max_n)]))
+
+    print('%d reviews (%d train / %d candidates), %d requests over %d prompts' % (
+        len(reviews), len(train), len(pool), len(requests), prompts))
+    oracle = sum(max(true_quality(c) for c in drawn) for _, drawn in requests) / len(requests)
+    print('%-22s %20s quality %.4f' % ('oracle (best of %d)' % args.max_n, '', oracle))
+    for n in range(1, args.max_n + 1):
+        cost, q, _ = simulate(requests, model, n)
+        print('%-22s cost %7d  quality %.4f' % ('fixed n=%d' % n, cost, q))
+    base_cost, base_q = cost, q
+    for spread in [float(x) for x in args.spreads.split(',') if x.strip()]:
+        policy = AdaptiveN(min_n=args.min_n, max_n=args.max_n, spread_threshold=spread)
+        cost, q, rounds = simulate(requests, model, args.max_n, policy)
+        print('%-22s cost %7d  quality %.4f  saved %5.1f%%  quality lost %.4f  second rounds %5.1f%%' % (
+            'adaptive spread=%g' % spread, cost, q, 100.0 * (1 - cost / base_cost), base_q - q,
+            100.0 * rounds / len(requests)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""Classroom traffic against /chat with the response cache off and on.
+
+Every student sends the same preset prompts (the peer_dataset.json
+questions) at temperature 0, like a class working through the Compare page.
+The class runs twice (cold, then warm cache). Reports latency, upstream
+calls and the cache counters from /admin/stats:
+
+    python3 -m bench.chat_cache --students 30 --latency 0.3
+
+--check instead asserts the cache's behaviour against a fast stub (a repeat
+is a hit, a sampled request bypasses the cache, an expired entry is a miss,
+a hit is reranked with the caller's weights) and exits 1 if one fails:
+
+    python3 -m bench.chat_cache --check
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+from bench.common import backend, request, scratch_dir, summarize, wait_for_reranker
+from bench.corpus import criteria_reviews
+from bench.stub_openai import WORDS, start_stub
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def prompts():
+    with open(os.path.join(_ROOT, 'peer_dataset.json'), 'r', encoding='utf-8') as f:
+        return [item['question'] for item in json.load(f) if item.get('question')]
+
+
+def run_class(port, students, questions, weights):
+    latencies = []
+    lock = threading.Lock()
+
+    def student(i):
+        for q in questions:
+            # same prompt, slightly different whitespace and per-student weights
+            body = {'messages': [{'role': 'user', 'content': (' ' * (i % 2)) + q}],
+                    'n': 2, 'temperature': 0, 'weights': weights[i % len(weights)]}
+            status, data, elapsed = request(port, 'POST', '/chat', body)
+            assert status == 200, data
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=student, args=(i,)) for i in range(students)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies
+
+
+def check_weights(port, question):
+    """A hit must be reranked with the caller's weights, not replay the first caller's pick; the best_index picks."""
+    picks = set()
+    for w in ({'factuality': 1}, {'clarity': 1}, {'ethics': 1}, None):
+        body = {'messages': [{'role': 'user', 'content': question}], 'n': 4, 'temperature': 0}
+        if w:
+            body['weights'] = w
+        status, data, _ = request(port, 'POST', '/chat', body)
+        result = json.loads(data)
+        picks.add(result['best_index'])
+    return picks
+
+
+def upstream_calls(port, stub, body):
+    """Upstream calls one /chat request made."""
+    calls = stub.calls
+    status, data, _ = request(port, 'POST', '/chat', body)
+    if status != 200:
+        raise AssertionError('/chat answered %d: %r' % (status, data))
+    return stub.calls - calls
+
+
+def run_checks(ttl=1.0):
+    """Check hits, bypasses and expiry; returns the failed checks' descriptions."""
+    failed = []
+
+    def expect(name, got, want):
+        print('  %-44s %d upstream call(s)%s' % (name, got, '' if got == want else '  FAIL (expected %d)' % want))
+        if got != want:
+            failed.append(name)
+
+    def chat(content, **extra):
+        return dict({'messages': [{'role': 'user', 'content': content}], 'n': 2, 'temperature': 0}, **extra)
+
+    stub = start_stub(latency=0.01, tokens=20)
+    try:
+        env = {'OPENAI_API_KEY': 'stub', 'OPENAI_BASE_URL': stub.base_url, 'CHAT_CACHE': '1',
+               'CHAT_CACHE_TTL': str(ttl), 'SERVER_LOG_PATH': ''}
+        with scratch_dir() as d:
+            # reviews rating the stub's words per criterion, so different weights pick different candidates
+            with open(os.path.join(d, 'reviews.json'), 'w', encoding='utf-8') as f:
+                json.dump(criteria_reviews(WORDS), f)
+            with backend(d, env) as port:
+                if not wait_for_reranker(port):
+                    raise RuntimeError('the reranker model was not built')
+                expect('first request (miss)', upstream_calls(port, stub, chat('Why is the sky blue?')), 1)
+                expect('same request (hit)', upstream_calls(port, stub, chat('Why is the sky blue?')), 0)
+                expect('other whitespace (hit)', upstream_calls(port, stub, chat('  Why is the  sky blue? ')), 0)
+                expect('other weights (hit)', upstream_calls(port, stub, chat(
+                    'Why is the sky blue?', weights={'clarity': 1})), 0)
+                expect('other question (miss)', upstream_calls(port, stub, chat('Why is grass green?')), 1)
+                sampled = chat('Why is the sky blue?', temperature=0.7)
+                expect('sampled, twice (bypass)', upstream_calls(port, stub, sampled) +
+                       upstream_calls(port, stub, sampled), 2)
+                time.sleep(ttl + 0.2)
+                expect('after the TTL (miss)', upstream_calls(port, stub, chat('Why is the sky blue?')), 1)
+                expect('again (hit)', upstream_calls(port, stub, chat('Why is the sky blue?')), 0)
+                calls = stub.calls
+                picks = check_weights(port, 'Rank these candidates please')
+                expect('4 weightings of one prompt', stub.calls - calls, 1)
+                print('  %-44s %d distinct pick(s)%s' % ('  ... reranked per caller', len(picks),
+                                                         '' if len(picks) > 1 else '  FAIL (expected 2 or more)'))
+                if len(picks) < 2:
+                    failed.append('hits reranked with the caller\'s weights')
+    finally:
+        stub.shutdown()
+    return failed
+
+
+def main():
+    ap = argparse.ArgumentParser(description='/chat response cache benchmark')
+    ap.add_argument('--students', type=int, default=30)
+    ap.add_argument('--latency', type=float, default=0.3)
+    ap.add_argument('--check', action='store_true', help='only assert hits, bypasses and expiry; exit 1 on a failure')
+    args = ap.parse_args()
+
+    if args.check:
+        failed = run_checks()
+        if failed:
+            print('FAIL: %s' % ', '.join(failed))
+            sys.exit(1)
+        print('ok')
+        return
+
+    questions = prompts()
+    weights = [None, {'factuality': 2, 'clarity': 1, 'ethics': 1}, {'clarity': 1}]
+    stub = start_stub(latency=args.latency, tokens=40)
+    try:
+        for enabled in (False, True):
+            env = {'OPENAI_API_KEY': 'stub', 'OPENAI_BASE_URL': stub.base_url, 'CHAT_CACHE': '1' if enabled else '0'}
+            with scratch_dir() as d:
+                with backend(d, env) as port:
+                    for round_name in ('cold', 'warm'):
+                        calls = stub.calls
+                        lat = summarize(run_class(port, args.students, questions, weights))
+                        upstream = stub.calls - calls
+                        print('cache %-3s %s: %4d requests  p50 %7.1fms  p99 %7.1fms  upstream calls %4d' % (
+                            'on' if enabled else 'off', round_name, lat['count'], lat['p50_ms'], lat['p99_ms'], upstream))
+                    _, raw, _ = request(port, 'GET', '/admin/stats', headers={'X-Admin-Token': 'secret-token'})
+                    stats = json.loads(raw)['chat_cache']
+                    if stats:
+                        print('  counters: hits %(hits)d  misses %(misses)d  bypassed %(bypassed)d  '
+                              'evictions %(evictions)d  entries %(entries)d  bytes %(bytes)d' % stats)
+                    if enabled:
+                        calls = stub.calls
+                        picks = check_weights(port, 'Rank these candidates please')
+                        print('weights on hits: %d upstream call(s) for 4 weightings, %d distinct picks' % (
+                            stub.calls - calls, len(picks)))
+    finally:
+        stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
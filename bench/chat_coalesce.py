@@ -0,0 +1,112 @@
+"""Identical concurrent /chat requests with and without single-flight coalescing.
+
+Fires --clients simultaneous requests for the same prompt (temperature 0.7,
+as chat.html sends) at a stub upstream and checks that, with coalescing on,
+exactly one upstream call was made and each client's weights were still
+applied when reranking the shared candidates. The scratch reviews.json rates
+the stub's words differently per criterion (bench.corpus.criteria_reviews),
+so the weightings have to pick different candidates. A failed check makes
+the command exit 1; --check runs only the coalescing-on burst:
+
+    python3 -m bench.chat_coalesce --clients 30 --latency 0.5
+    python3 -m bench.chat_coalesce --check
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+
+from bench.common import backend, request, scratch_dir, summarize, wait_for_reranker
+from bench.corpus import criteria_reviews
+from bench.stub_openai import WORDS, start_stub
+
+_WEIGHTS = [{'factuality': 1}, {'clarity': 1}, {'ethics': 1}, None]
+
+
+def burst(port, clients, prompt):
+    barrier = threading.Barrier(clients)
+    results = [None] * clients
+
+    def client(i):
+        body = {'messages': [{'role': 'user', 'content': prompt}], 'n': 4, 'temperature': 0.7}
+        if _WEIGHTS[i % len(_WEIGHTS)]:
+            body['weights'] = _WEIGHTS[i % len(_WEIGHTS)]
+        barrier.wait()
+        status, data, elapsed = request(port, 'POST', '/chat', body)
+        results[i] = (status, json.loads(data) if status == 200 else data, elapsed)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def check_burst(results, upstream):
+    """The failed checks of a coalesced burst."""
+    failed = []
+    errors = [r for r in results if r[0] != 200]
+    if errors:
+        return ['%d of %d requests failed (first: %d %r)' % (len(errors), len(results), errors[0][0], errors[0][1])]
+    if upstream != 1:
+        failed.append('expected exactly one upstream call, got %d' % upstream)
+    if len({tuple(r[1]['replies']) for r in results}) != 1:
+        failed.append('clients saw different candidate sets')
+    picks = {}
+    for i, (_, result, _) in enumerate(results):
+        picks.setdefault(i % len(_WEIGHTS), set()).add(result['best_index'])
+    if not all(len(p) == 1 for p in picks.values()):
+        failed.append('same weights picked differently')
+    firsts = [sorted(picks[k])[0] for k in sorted(picks)]
+    print('%d weightings -> best_index %s' % (len(picks), firsts))
+    if len(set(firsts)) < 2:
+        failed.append('every weighting picked the same candidate (weights not applied?)')
+    return failed
+
+
+def run(stub, clients, coalesce):
+    """(results, upstream calls) of one burst against a fresh backend."""
+    env = {'OPENAI_API_KEY': 'stub', 'OPENAI_BASE_URL': stub.base_url, 'CHAT_COALESCE': coalesce,
+           'CHAT_CACHE': '0', 'SERVER_LOG_PATH': '',
+           # every client must be in flight at once for the burst to overlap
+           'SERVER_WORKERS': str(clients + 4)}
+    with scratch_dir() as d:
+        with open(os.path.join(d, 'reviews.json'), 'w', encoding='utf-8') as f:
+            json.dump(criteria_reviews(WORDS), f)
+        with backend(d, env) as port:
+            if not wait_for_reranker(port):
+                raise RuntimeError('the reranker model was not built')
+            calls = stub.calls
+            results = burst(port, clients, 'Why is the sky blue?')
+            upstream = stub.calls - calls
+    lat = summarize([r[2] for r in results])
+    print('coalesce %-3s %3d clients  upstream calls %3d  p50 %7.1fms  p99 %7.1fms' % (
+        'on' if coalesce == '1' else 'off', clients, upstream, lat['p50_ms'], lat['p99_ms']))
+    return results, upstream
+
+
+def main():
+    ap = argparse.ArgumentParser(description='/chat single-flight benchmark')
+    ap.add_argument('--clients', type=int, default=30)
+    ap.add_argument('--latency', type=float, default=0.5)
+    ap.add_argument('--check', action='store_true', help='only run the coalesced burst checks; exit 1 if one fails')
+    args = ap.parse_args()
+
+    stub = start_stub(latency=args.latency, tokens=40)
+    try:
+        if not args.check:
+            run(stub, args.clients, '0')
+        failed = check_burst(*run(stub, args.clients, '1'))
+    finally:
+        stub.shutdown()
+    for name in failed:
+        print('FAIL: %s' % name)
+    if failed:
+        sys.exit(1)
+    print('ok: exactly one upstream call, each weighting applied to the shared candidates')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Shared helpers for the benchmark scripts.
+
+The backend is always started as a subprocess (``python3 server_py.py``) in a
+scratch directory so benchmarks never touch the real JSON stores and every
+run starts from a clean module state.
+"""
+import http.client
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_SCRIPT = os.path.join(ROOT, 'server_py.py')
+DATA_FILES = ['reviews.json', 'peer_dataset.json', 'peer_rankings.json', 'suggestions.json',
+              'peer_rankings.jsonl', 'suggestions.jsonl']
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def wait_for_port(port, host='127.0.0.1', timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('server on port %d did not start' % port)
+
+
+def percentile(values, p):
+    """Nearest-rank percentile (p in 0..100) of a list of numbers; 0.0 if empty."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+def summarize(latencies):
+    """Return count/p50/p90/p99/max (milliseconds) for a list of latencies in seconds."""
+    ms = [v * 1000.0 for v in latencies]
+    return {
+        'count': len(ms),
+        'p50_ms': round(percentile(ms, 50), 2),
+        'p90_ms': round(percentile(ms, 90), 2),
+        'p99_ms': round(percentile(ms, 99), 2),
+        'max_ms': round(max(ms), 2) if ms else 0.0,
+    }
+
+
+def request(port, method, path, body=None, headers=None, host='127.0.0.1', timeout=60):
+    """Issue one HTTP request; returns (status, body bytes, elapsed seconds)."""
+    hdrs = dict(headers or {})
+    data = None
+    if body is not None:
+        data = body if isinstance(body, bytes) else json.dumps(body).encode('utf-8')
+        hdrs.setdefault('Content-Type', 'application/json')
+    t0 = time.perf_counter()
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        conn.request(method, path, body=data, headers=hdrs)
+        resp = conn.getresponse()
+        payload = resp.read()
+        status = resp.status
+    finally:
+        conn.close()
+    return status, payload, time.perf_counter() - t0
+
+
+def wait_for_reranker(port, timeout=10.0):
+    """Wait until the backend published its first reranker model (version >= 1); False on timeout."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status, body, _ = request(port, 'GET', '/admin/stats',
+                                  headers={'X-Admin-Token': os.environ.get('ADMIN_TOKEN', 'secret-token')})
+        if status == 200 and (json.loads(body).get('reranker') or {}).get('version'):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@contextmanager
+def scratch_dir(copy_data=True):
+    """Temporary working directory seeded with the repo's JSON data files."""
+    d = tempfile.mkdtemp(prefix='chatbench-')
+    try:
+        if copy_data:
+            for name in DATA_FILES:
+                src = os.path.join(ROOT, name)
+                if os.path.exists(src):
+                    shutil.copy(src, os.path.join(d, name))
+        yield d
+    finally:
+        shutil.rmtree(d, ignore_errors=True)
+
+
+@contextmanager
+def backend_process(workdir, env=None, port=None, quiet=True):
+    """Run server_py.py in workdir on a free port; yields (port, Popen)."""
+    port = port or free_port()
+    full_env = dict(os.environ)
+    # never let a developer's real key leak into a benchmark run
+    full_env.pop('OPENAI_API_KEY', None)
+    full_env.update({k: str(v) for k, v in (env or {}).items()})
+    full_env['PORT'] = str(port)
+    out = subprocess.DEVNULL if quiet else None
+    proc = subprocess.Popen([sys.executable, SERVER_SCRIPT], cwd=workdir, env=full_env, stdout=out, stderr=out)
+    try:
+        wait_for_port(port, timeout=60)
+        yield port, proc
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+@contextmanager
+def backend(workdir, env=None, port=None, quiet=True):
+    """Run server_py.py in workdir on a free port; yields the port."""
+    with backend_process(workdir, env, port, quiet) as (port, _):
+        yield port
+
+
+def proc_status_kb(pid, field):
+    """A kB value (e.g. VmRSS, VmHWM) from /proc/<pid>/status; 0 where unavailable."""
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def reset_peak_rss(pid):
+    """Reset VmHWM to the current RSS (Linux); returns False if not supported."""
+    try:
+        with open('/proc/%d/clear_refs' % pid, 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
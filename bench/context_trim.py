@@ -0,0 +1,121 @@
+"""Token-budget trimming of long conversations (context_budget.py).
+
+1. In-process, on a synthetic classroom session of --messages messages
+   (a system prompt, then questions of ~40 words and answers of ~150):
+   - cold: a fresh token cache counts every message once.
+   - per turn: the session grows by one question and answer per turn, as
+     clients resend it; the cache only counts the new messages. An uncached
+     recount of the whole history is shown for reference.
+   - the prompt tokens and JSON bytes sent upstream with and without the
+     budget.
+2. End to end: /chat against a stub whose latency grows with the prompt
+   (--prompt-delay seconds per 1000 characters, like prefill), for the
+   last --turns turns of the session, without and with CHAT_CONTEXT_BUDGET.
+
+    python3 -m bench.context_trim --messages 500 --budget 3000
+"""
+import argparse
+import json
+import random
+import time
+
+from bench.common import backend, request, scratch_dir, summarize
+from bench.corpus import _VOCAB
+from bench.stub_openai import start_stub
+from context_budget import ContextBudget, TokenCounter, estimate_tokens
+
+
+def session(messages, seed=0):
+    rnd = random.Random(seed)
+    out = [{'role': 'system', 'content': 'You are a patient tutor for a physics and history class. '
+                                         'Answer clearly and point out uncertain facts.'}]
+    while len(out) < messages:
+        words = 40 if len(out) % 2 else 150
+        role = 'user' if len(out) % 2 else 'assistant'
+        out.append({'role': role, 'content': ' '.join(rnd.choice(_VOCAB) for _ in range(words)) + '?'})
+    return out
+
+
+def timed(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        out = fn()
+    return (time.perf_counter() - t0) * 1000.0 / repeat, out
+
+
+def offline(args):
+    convo = session(args.messages)
+    turns = 50
+    print('session: %d messages, ~%d estimated prompt tokens, %.0f KB of JSON' % (
+        len(convo), sum(estimate_tokens(m['content']) + 4 for m in convo),
+        len(json.dumps(convo)) / 1024.0))
+
+    cold_ms, (out, info) = timed(lambda: ContextBudget(args.budget, args.keep_turns, args.clip).trim(convo), 20)
+    print('  cold trim (empty cache):       %7.3f ms  %d -> %d tokens, %d messages dropped, %d clipped' % (
+        cold_ms, info['tokens_in'], info['tokens_out'], info['dropped'], info['clipped']))
+
+    budget = ContextBudget(args.budget, args.keep_turns, args.clip, TokenCounter())
+    start = len(convo) - 2 * turns
+    budget.trim(convo[:start])
+    t0 = time.perf_counter()
+    for end in range(start + 2, len(convo) + 1, 2):
+        out, info = budget.trim(convo[:end])
+    warm_ms = (time.perf_counter() - t0) * 1000.0 / turns
+    recount_ms, _ = timed(lambda: sum(estimate_tokens(m['content']) for m in convo), 20)
+    print('  per turn (cached counts):      %7.3f ms  (uncached recount of the history alone: %.3f ms)' % (
+        warm_ms, recount_ms))
+    print('  sent upstream: %d -> %d tokens, %.0f KB -> %.0f KB of messages' % (
+        info['tokens_in'], info['tokens_out'], len(json.dumps(convo)) / 1024.0, len(json.dumps(out)) / 1024.0))
+    assert info['tokens_out'] <= args.budget, 'trimmed prompt is over budget'
+    assert out[0] == convo[0] and out[-1] == convo[-1], 'system prompt or last turn was dropped'
+    return warm_ms
+
+
+def end_to_end(args):
+    convo = session(args.messages)
+    stub = start_stub(latency=0.05, tokens=60, prompt_delay=args.prompt_delay)
+    results = {}
+    try:
+        for label, extra in (('full history', {}), ('CHAT_CONTEXT_BUDGET=%d' % args.budget, {
+                'CHAT_CONTEXT_BUDGET': str(args.budget), 'CHAT_CONTEXT_KEEP_TURNS': str(args.keep_turns),
+                'CHAT_CONTEXT_CLIP_TOKENS': str(args.clip)})):
+            env = {'OPENAI_API_KEY': 'stub', 'OPENAI_BASE_URL': stub.base_url, 'CHAT_CACHE': '0',
+                   'RERANK_ADAPTIVE': '0', 'RERANK_N': '1'}
+            env.update(extra)
+            with scratch_dir() as d:
+                with backend(d, env) as port:
+                    chars = stub.prompt_chars
+                    latencies = []
+                    for end in range(len(convo) - 2 * args.turns + 1, len(convo) + 1, 2):
+                        status, body, elapsed = request(port, 'POST', '/chat', {'messages': convo[:end]})
+                        assert status == 200, body
+                        latencies.append(elapsed)
+                    _, stats, _ = request(port, 'GET', '/admin/stats', headers={'X-Admin-Token': 'secret-token'})
+                    context = json.loads(stats.decode('utf-8'))['chat_context']
+            s = summarize(latencies)
+            per_request = (stub.prompt_chars - chars) / float(len(latencies))
+            results[label] = s
+            print('  %-26s p50 %7.1fms  p99 %7.1fms  prompt %7.0f chars/request  tokens saved %d/request' % (
+                label, s['p50_ms'], s['p99_ms'], per_request,
+                context['tokens_saved'] // max(1, context['requests'])))
+    finally:
+        stub.shutdown()
+    full, trimmed = list(results.values())
+    assert trimmed['p50_ms'] < full['p50_ms'], 'trimming did not cut latency'
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Token-budget conversation trimming')
+    ap.add_argument('--messages', type=int, default=500)
+    ap.add_argument('--budget', type=int, default=3000, help='prompt token budget')
+    ap.add_argument('--keep-turns', type=int, default=2)
+    ap.add_argument('--clip', type=int, default=0, help='clip older messages to this many tokens (0 = off)')
+    ap.add_argument('--turns', type=int, default=20, help='turns sent end to end')
+    ap.add_argument('--prompt-delay', type=float, default=0.005, help='stub seconds per 1000 prompt characters')
+    args = ap.parse_args()
+    offline(args)
+    end_to_end(args)
+
+
+if __name__ == '__main__':
+    main()
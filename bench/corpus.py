@@ -0,0 +1,95 @@
+"""Synthetic data generators for benchmarks (reviews.json- and peer_rankings.json-shaped corpora).
+
+Also usable on its own to seed a directory for manual testing:
+
+    python3 -m bench.corpus --dir /tmp/chat-data --reviews 100000 --rankings 100000
+"""
+import argparse
+import json
+import os
+import random
+
+_VOCAB = ('light scatter wavelength blue sky atmosphere molecule energy battle army king '
+          'treaty river empire trade economy population climate ocean planet orbit gravity '
+          'cell protein enzyme energy market price demand supply vote law court right '
+          'because therefore however clearly roughly mainly often usually the a of and in '
+          'to is was were be this that which with for on by from').split()
+_CRITERIA = ('factuality', 'clarity', 'ethics')
+
+
+def synthetic_review(i, rnd, words=60, vocab=None):
+    vocab = vocab or _VOCAB
+    text = ' '.join(rnd.choice(vocab) for _ in range(words))
+    review = {
+        'messageId': 'm-%d' % i,
+        'rating': rnd.randint(1, 5),
+        'comment': '',
+        'assistantText': text,
+        'timestamp': '2025-10-%02dT%02d:%02d:00Z' % (1 + i % 28, i % 24, i % 60),
+    }
+    if rnd.random() < 0.5:
+        review['criteria'] = {c: rnd.randint(1, 5) for c in _CRITERIA}
+    return review
+
+
+def synthetic_reviews(n, seed=0, words=60, vocab_size=None):
+    """n reviews with random ratings; vocab_size widens the vocabulary with synthetic tokens."""
+    rnd = random.Random(seed)
+    vocab = list(_VOCAB)
+    if vocab_size and vocab_size > len(vocab):
+        vocab += ['tok%d' % i for i in range(vocab_size - len(vocab))]
+    return [synthetic_review(i, rnd, words, vocab) for i in range(n)]
+
+
+def criteria_reviews(words):
+    """One review per word, rated 5 on one criterion (in turn) and 1 on the others.
+
+    Texts made of these words then score differently per criterion, so
+    different weights pick different candidates.
+    """
+    reviews = []
+    for i, word in enumerate(sorted(set(words))):
+        reviews.append({'messageId': 'criteria-%d' % i, 'rating': 3, 'comment': '', 'assistantText': word,
+                        'criteria': {c: 5 if k == i % len(_CRITERIA) else 1 for k, c in enumerate(_CRITERIA)},
+                        'timestamp': '2025-10-01T00:00:00Z'})
+    return reviews
+
+
+def write_reviews(path, n, seed=0, words=60, vocab_size=None):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(synthetic_reviews(n, seed, words, vocab_size), f, indent=2)
+
+
+def synthetic_rankings(n, items, seed=0):
+    """n peer rankings spread over `items` item ids (item-0 .. item-<items-1>)."""
+    rnd = random.Random(seed)
+    return [{'itemId': 'item-%d' % rnd.randrange(items), 'responseIndex': rnd.randrange(2),
+             'timestamp': '2025-10-01T00:00:00Z'} for _ in range(n)]
+
+
+def write_rankings(path, n, items, seed=0):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(synthetic_rankings(n, items, seed), f, indent=2)
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Write a synthetic reviews.json and peer_rankings.json')
+    ap.add_argument('--dir', default='.', help='output directory')
+    ap.add_argument('--reviews', type=int, default=10000)
+    ap.add_argument('--rankings', type=int, default=0)
+    ap.add_argument('--items', type=int, default=1000, help='distinct itemIds in the rankings')
+    ap.add_argument('--words', type=int, default=60, help='words per assistantText')
+    ap.add_argument('--vocab', type=int, default=0, help='distinct tokens (0 = the small built-in vocabulary)')
+    ap.add_argument('--seed', type=int, default=0)
+    args = ap.parse_args()
+
+    os.makedirs(args.dir, exist_ok=True)
+    write_reviews(os.path.join(args.dir, 'reviews.json'), args.reviews, args.seed, args.words, args.vocab or None)
+    print('wrote %d reviews to %s' % (args.reviews, os.path.join(args.dir, 'reviews.json')))
+    if args.rankings:
+        write_rankings(os.path.join(args.dir, 'peer_rankings.json'), args.rankings, args.items, args.seed)
+        print('wrote %d rankings to %s' % (args.rankings, os.path.join(args.dir, 'peer_rankings.json')))
+
+
+if __name__ == '__main__':
+    main()
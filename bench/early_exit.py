@@ -0,0 +1,116 @@
+"""Early-exit reranking (early_exit.py) against the stub upstream.
+
+The backend fans /chat out (CHAT_FANOUT=1, n=5) to a stub that answers one
+candidate per call after 100ms plus up to 400ms of jitter, and reranks with
+the model trained on the repo's reviews.json.
+
+1. wait for all: every request waits for its 5 candidates.
+2. early exit, abandon: requests opt in with "early_exit" and answer with
+   the first candidate scoring at least --threshold; the other calls are
+   cancelled.
+3. early exit, later: the same, but the other calls finish in the
+   background and GET /chat/alternatives returns all 5 candidates.
+
+Reports latency, the score of the returned reply, how often early exit
+fired and the latency it saved according to /admin/stats.
+
+    python3 -m bench.early_exit --requests 80 --threshold 0.83
+"""
+import argparse
+import json
+import threading
+
+from bench.common import backend, request, scratch_dir, summarize
+from bench.stub_openai import start_stub
+
+_COUNTER = [0]
+_COUNTER_LOCK = threading.Lock()
+
+
+def chat(port, early=None):
+    with _COUNTER_LOCK:
+        _COUNTER[0] += 1
+        i = _COUNTER[0]
+    body = {'messages': [{'role': 'user', 'content': 'question number %d' % i}], 'n': 5}
+    if early is not None:
+        body['early_exit'] = early
+    status, data, elapsed = request(port, 'POST', '/chat', body)
+    assert status == 200, data
+    return json.loads(data.decode('utf-8')), elapsed
+
+
+def load(port, clients, requests, early=None):
+    results = []
+    lock = threading.Lock()
+
+    def worker():
+        mine = [chat(port, early) for _ in range(requests // clients)]
+        with lock:
+            results.extend(mine)
+
+    ts = [threading.Thread(target=worker) for _ in range(clients)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return results
+
+
+def fanout_stats(port):
+    _, body, _ = request(port, 'GET', '/admin/stats', headers={'X-Admin-Token': 'secret-token'})
+    return json.loads(body.decode('utf-8'))['chat_fanout']
+
+
+def report(label, results, before, after):
+    s = summarize([r[1] for r in results])
+    score = sum(r[0]['score'] for r in results) / len(results)
+    exits = after['early_exits'] - before['early_exits']
+    measured = (after['early_exit_measured'] + after['early_exit_estimated']
+                - before['early_exit_measured'] - before['early_exit_estimated'])
+    saved = after['early_exit_saved_ms'] - before['early_exit_saved_ms']
+    print('  %-24s p50 %6.1fms  p99 %6.1fms  mean reply score %.4f  early exits %3d/%d  saved %s' % (
+        label, s['p50_ms'], s['p99_ms'], score, exits, len(results),
+        '%.0fms avg over %d' % (saved / measured, measured) if measured else 'n/a'))
+    return s, score, exits
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Early-exit reranking of fanned-out /chat candidates')
+    ap.add_argument('--requests', type=int, default=80, help='/chat requests per run')
+    ap.add_argument('--clients', type=int, default=4)
+    ap.add_argument('--threshold', type=float, default=0.83, help='early-exit score threshold')
+    args = ap.parse_args()
+
+    stub = start_stub(latency=0.1, jitter=0.4, tokens=30, n=1)
+    env = {'OPENAI_API_KEY': 'stub', 'OPENAI_BASE_URL': stub.base_url, 'CHAT_CACHE': '0', 'CHAT_FANOUT': '1'}
+    try:
+        with scratch_dir() as d:
+            with backend(d, env) as port:
+                # until the reranker has trained every candidate scores 0.5
+                load(port, args.clients, 20)
+                before = fanout_stats(port)
+                full, _, _ = report('wait for all', load(port, args.clients, args.requests),
+                                     before, fanout_stats(port))
+                before = fanout_stats(port)
+                early = {'threshold': args.threshold, 'margin': 0, 'rest': 'abandon'}
+                abandon, _, exits = report('early exit, abandon', load(port, args.clients, args.requests, early),
+                                           before, fanout_stats(port))
+                before = fanout_stats(port)
+                results = load(port, args.clients, args.requests, dict(early, rest='later'))
+                ids = [r[0]['alternatives'] for r in results if r[0].get('alternatives')]
+                complete = 0
+                for key in ids:
+                    status, body, _ = request(port, 'GET', '/chat/alternatives?id=%s&wait=5' % key)
+                    found = json.loads(body.decode('utf-8'))
+                    complete += int(status == 200 and found['complete'] and len(found['replies']) == 5)
+                report('early exit, later', results, before, fanout_stats(port))
+                print('  /chat/alternatives: %d of %d early-exited requests had all 5 candidates' % (
+                    complete, len(ids)))
+    finally:
+        stub.shutdown()
+    assert exits > 0 and abandon['p50_ms'] < full['p50_ms'], 'early exit did not answer sooner'
+    assert ids and complete == len(ids), 'alternatives were not completed'
+
+
+if __name__ == '__main__':
+    main()
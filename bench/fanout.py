@@ -0,0 +1,163 @@
+"""Fan-out of /chat candidates (fanout.py) against a stub that caps n.
+
+The stub answers every call with a single candidate (like a model or proxy
+that ignores n) and takes 100ms plus up to 400ms of jitter per call.
+
+1. candidates: n=4 as one call (1 candidate comes back) vs CHAT_FANOUT=1
+   (4 concurrent n=1 calls, the slowest one sets the latency).
+2. early answer: fan-out with CHAT_FANOUT_MIN=2, and with
+   CHAT_FANOUT_DEADLINE_MS=250. Calls still running are cancelled; the stub
+   counts the requests whose client hung up before the answer was ready.
+3. per request: "fanout" with explicit model/temperature variants on a
+   server where fan-out is off.
+
+    python3 -m bench.fanout --requests 80
+
+--check instead asserts fan-out's behaviour against a fast stub (n calls
+collected, calls capped at CHAT_FANOUT_MAX, a bad n rejected, calls cut off
+by an early answer cancelled upstream) and exits 1 if one fails:
+
+    python3 -m bench.fanout --check
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+
+from bench.common import backend, request, scratch_dir, summarize
+from bench.stub_openai import start_stub
+
+_COUNTER = [0]
+_COUNTER_LOCK = threading.Lock()
+
+
+def chat(port, extra=None):
+    """(status, response JSON, elapsed seconds) for one /chat call with a unique prompt and n=4."""
+    with _COUNTER_LOCK:
+        _COUNTER[0] += 1
+        i = _COUNTER[0]
+    body = {'messages': [{'role': 'user', 'content': 'question number %d' % i}], 'n': 4}
+    body.update(extra or {})
+    status, data, elapsed = request(port, 'POST', '/chat', body)
+    return status, json.loads(data.decode('utf-8')) if status == 200 else data, elapsed
+
+
+def load(port, clients, requests, extra=None):
+    results = []
+    lock = threading.Lock()
+
+    def worker():
+        mine = [chat(port, extra) for _ in range(requests // clients)]
+        with lock:
+            results.extend(mine)
+
+    ts = [threading.Thread(target=worker) for _ in range(clients)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return results
+
+
+def report(label, results, stub, calls, disconnects):
+    assert all(r[0] == 200 for r in results), [r for r in results if r[0] != 200][:1]
+    candidates = [len(r[1].get('replies') or []) for r in results]
+    s = summarize([r[2] for r in results])
+    print('  %-34s candidates %4.2f  p50 %6.1fms  p99 %6.1fms  upstream calls %4d  cut off %3d' % (
+        label, sum(candidates) / float(len(candidates)), s['p50_ms'], s['p99_ms'], stub.calls - calls,
+        stub.disconnects - disconnects))
+    return sum(candidates) / float(len(candidates)), s
+
+
+def run(stub, env, args, label, extra=None):
+    base = {'OPENAI_API_KEY': 'stub', 'OPENAI_BASE_URL': stub.base_url, 'CHAT_CACHE': '0',
+            'RERANK_ADAPTIVE': '0'}
+    base.update(env)
+    with scratch_dir() as d:
+        with backend(d, base) as port:
+            calls, disconnects = stub.calls, stub.disconnects
+            out = report(label, load(port, args.clients, args.requests, extra), stub, calls, disconnects)
+            # the stub only notices a cancelled call once its delay is over
+            time.sleep(0.6)
+            _, stats, _ = request(port, 'GET', '/admin/stats', headers={'X-Admin-Token': 'secret-token'})
+            return out + (json.loads(stats.decode('utf-8')).get('chat_fanout'),)
+
+
+def run_checks():
+    """Check collection, the call cap, n validation and cancellation; returns the failed checks' descriptions."""
+    failed = []
+
+    def expect(name, ok, detail):
+        print('  %-52s %s%s' % (name, detail, '' if ok else '  FAIL'))
+        if not ok:
+            failed.append(name)
+
+    stub = start_stub(latency=0.02, jitter=0.5, tokens=20, n=1)
+    try:
+        env = {'OPENAI_API_KEY': 'stub', 'OPENAI_BASE_URL': stub.base_url, 'CHAT_CACHE': '0',
+               'RERANK_ADAPTIVE': '0', 'SERVER_LOG_PATH': '', 'CHAT_FANOUT_MAX': '4'}
+        with scratch_dir() as d:
+            with backend(d, env) as port:
+                calls = stub.calls
+                status, data, _ = chat(port, {'fanout': True})
+                got = len(data.get('replies') or []) if status == 200 else 0
+                expect('n=4: 4 calls, 4 candidates', got == 4 and stub.calls - calls == 4,
+                       '%d candidates, %d upstream calls' % (got, stub.calls - calls))
+                calls = stub.calls
+                status, _, _ = chat(port, {'fanout': True, 'n': 50})
+                expect('n=50: capped at CHAT_FANOUT_MAX=4', status == 200 and stub.calls - calls == 4,
+                       'status %d, %d upstream calls' % (status, stub.calls - calls))
+                calls = stub.calls
+                status, _, _ = chat(port, {'fanout': True, 'n': 'many'})
+                expect('n="many": 400, no upstream call', status == 400 and stub.calls == calls,
+                       'status %d, %d upstream calls' % (status, stub.calls - calls))
+                gone = stub.disconnects
+                statuses = [chat(port, {'fanout': True, 'fanout_min': 1})[0] for _ in range(3)]
+                # the stub only notices a cancelled call once its delay is over
+                time.sleep(0.6)
+                expect('fanout_min=1: the slower calls are cancelled', statuses == [200] * 3 and
+                       stub.disconnects > gone, 'statuses %s, %d calls cut off' % (statuses, stub.disconnects - gone))
+    finally:
+        stub.shutdown()
+    return failed
+
+
+def main():
+    ap = argparse.ArgumentParser(description='/chat candidate fan-out')
+    ap.add_argument('--requests', type=int, default=80, help='/chat requests per run')
+    ap.add_argument('--clients', type=int, default=4)
+    ap.add_argument('--check', action='store_true', help='only run the behaviour checks; exit 1 if one fails')
+    args = ap.parse_args()
+    if args.check:
+        failed = run_checks()
+        if failed:
+            print('FAIL: %s' % ', '.join(failed))
+            sys.exit(1)
+        print('ok')
+        return
+
+    stub = start_stub(latency=0.1, jitter=0.4, tokens=30, n=1)
+    try:
+        print('stub answers 1 candidate per call after 100-500ms; /chat asks for n=4')
+        single, s_single, _ = run(stub, {}, args, 'one call (n=4)')
+        fan, s_fan, _ = run(stub, {'CHAT_FANOUT': '1'}, args, 'CHAT_FANOUT=1')
+        two, s_two, _ = run(stub, {'CHAT_FANOUT': '1', 'CHAT_FANOUT_MIN': '2'}, args, 'CHAT_FANOUT_MIN=2')
+        before = stub.disconnects
+        _, s_dl, stats = run(stub, {'CHAT_FANOUT': '1', 'CHAT_FANOUT_DEADLINE_MS': '250'}, args,
+                             'CHAT_FANOUT_DEADLINE_MS=250')
+        print('  deadline run: %s' % stats)
+        cut_off = stub.disconnects - before
+        variants = [{'model': 'model-a', 'temperature': 0.2}, {'model': 'model-b', 'temperature': 0.7},
+                    {'model': 'model-a', 'temperature': 1.0}]
+        per_request, _, _ = run(stub, {}, args, 'request "fanout": 3 variants', {'fanout': variants, 'n': None})
+    finally:
+        stub.shutdown()
+    assert single == 1 and fan == 4, 'fan-out did not collect the candidates'
+    assert two == 2 and s_two['p50_ms'] < s_fan['p50_ms'], 'CHAT_FANOUT_MIN did not answer early'
+    assert s_dl['p99_ms'] < s_fan['p99_ms'] and cut_off > 0, 'the deadline did not cancel slow calls'
+    assert per_request == 3, 'per-request variants were not used'
+
+
+if __name__ == '__main__':
+    main()
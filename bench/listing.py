@@ -0,0 +1,96 @@
+"""Bytes on the wire and server memory for /reviews at 50k reviews.
+
+Compares the full array (identity and gzip) with paginated, projected pages.
+Server memory is the growth of the backend's peak RSS (VmHWM, reset before
+each request) while serving it; the old handler's json.dumps of the whole
+list is measured in-process with tracemalloc for reference:
+
+    python3 -m bench.listing --reviews 50000
+"""
+import argparse
+import gzip
+import http.client
+import json
+import os
+import time
+import tracemalloc
+
+from bench.common import backend_process, proc_status_kb, reset_peak_rss, scratch_dir
+from bench.corpus import write_reviews
+
+
+def fetch(port, path, accept_gzip=False):
+    """(status, Content-Encoding, body bytes as sent, seconds)."""
+    headers = {'Accept-Encoding': 'gzip'} if accept_gzip else {}
+    t0 = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+    try:
+        conn.request('GET', path, headers=headers)
+        resp = conn.getresponse()
+        body = resp.read()
+    finally:
+        conn.close()
+    return resp.status, resp.getheader('Content-Encoding'), body, time.perf_counter() - t0
+
+
+def measured(pid, port, path, accept_gzip=False):
+    reset_peak_rss(pid)
+    base = proc_status_kb(pid, 'VmRSS')
+    status, encoding, body, elapsed = fetch(port, path, accept_gzip)
+    peak = proc_status_kb(pid, 'VmHWM')
+    return status, encoding, body, elapsed, max(0, peak - base)
+
+
+def main():
+    ap = argparse.ArgumentParser(description='/reviews pagination + gzip benchmark')
+    ap.add_argument('--reviews', type=int, default=50000)
+    ap.add_argument('--words', type=int, default=120, help='words per assistantText')
+    args = ap.parse_args()
+
+    with scratch_dir() as d:
+        path = os.path.join(d, 'reviews.json')
+        write_reviews(path, args.reviews, words=args.words)
+        with open(path, encoding='utf-8') as f:
+            reviews = json.load(f)
+        tracemalloc.start()
+        old_body = json.dumps(reviews).encode('utf-8')
+        old_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('%d reviews; old handler built a %.1f MB body (peak %.1f MB allocated)' % (
+            args.reviews, len(old_body) / 1e6, old_peak / 1e6))
+        del reviews, old_body
+
+        with backend_process(d) as (port, proc):
+            cases = [
+                ('full array', '/reviews', False),
+                ('full array, gzip', '/reviews', True),
+                ('page of 100', '/reviews?limit=100', False),
+                ('page of 100, no assistantText, gzip', '/reviews?limit=100&exclude=assistantText', True),
+            ]
+            for label, url, gz in cases:
+                status, encoding, body, elapsed, grew = measured(proc.pid, port, url, gz)
+                assert status == 200, body[:200]
+                print('%-38s %10.1f KB on the wire  %7.1fms  server peak RSS +%.1f MB%s' % (
+                    label, len(body) / 1e3, elapsed * 1e3, grew / 1e3, '  (gzip)' if encoding == 'gzip' else ''))
+
+            # walk every page the way admin.html's "Load more" does
+            total = 0
+            pages = 0
+            cursor = None
+            t0 = time.perf_counter()
+            while True:
+                url = '/reviews?limit=1000&exclude=assistantText' + ('&cursor=' + cursor if cursor else '')
+                status, encoding, body, _ = fetch(port, url, accept_gzip=True)
+                total += len(body)
+                pages += 1
+                if encoding == 'gzip':
+                    body = gzip.decompress(body)
+                cursor = json.loads(body)['next_cursor']
+                if not cursor:
+                    break
+            print('%-38s %10.1f KB on the wire  %7.1fms  (%d pages)' % (
+                'all pages of 1000, projected, gzip', total / 1e3, (time.perf_counter() - t0) * 1e3, pages))
+
+
+if __name__ == '__main__':
+    main()
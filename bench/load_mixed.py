@@ -0,0 +1,75 @@
+"""Mixed /chat + /reviews load against the backend with a stub upstream.
+
+Compares the single-threaded server (SERVER_WORKERS=1) with the pooled one
+and prints p50/p99 latency per endpoint:
+
+    python3 -m bench.load_mixed --workers 1,16 --clients 32 --requests 400
+"""
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.common import backend, request, scratch_dir, summarize
+from bench.stub_openai import start_stub
+
+
+def run(port, clients, total, chat_ratio, seed=0):
+    rnd = random.Random(seed)
+    plan = ['/chat' if rnd.random() < chat_ratio else '/reviews' for _ in range(total)]
+    lat = {'/chat': [], '/reviews': []}
+    errors = [0]
+    lock = threading.Lock()
+
+    def one(path):
+        try:
+            if path == '/chat':
+                body = {'messages': [{'role': 'user', 'content': 'Explain why the sky is blue.'}]}
+                status, _, elapsed = request(port, 'POST', '/chat', body)
+            else:
+                status, _, elapsed = request(port, 'GET', '/reviews')
+        except Exception:
+            status, elapsed = 0, 0.0
+        with lock:
+            if status != 200:
+                errors[0] += 1
+            else:
+                lat[path].append(elapsed)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(one, plan))
+    wall = time.perf_counter() - t0
+    return {'wall_s': round(wall, 2), 'rps': round(total / wall, 1), 'errors': errors[0],
+            'chat': summarize(lat['/chat']), 'reviews': summarize(lat['/reviews'])}
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Mixed /chat and /reviews latency benchmark')
+    ap.add_argument('--workers', default='1,16', help='comma-separated SERVER_WORKERS values to compare')
+    ap.add_argument('--clients', type=int, default=32)
+    ap.add_argument('--requests', type=int, default=400)
+    ap.add_argument('--chat-ratio', type=float, default=0.3)
+    ap.add_argument('--latency', type=float, default=0.3, help='stub upstream delay (seconds)')
+    args = ap.parse_args()
+
+    stub = start_stub(latency=args.latency)
+    try:
+        print('%-8s %8s %7s %6s %12s %12s %12s %12s' % ('workers', 'wall_s', 'rps', 'errs',
+              'chat_p50', 'chat_p99', 'reviews_p50', 'reviews_p99'))
+        for workers in [int(w) for w in args.workers.split(',') if w.strip()]:
+            with scratch_dir() as d:
+                env = {'OPENAI_API_KEY': 'stub', 'OPENAI_BASE_URL': stub.base_url,
+                       'SERVER_WORKERS': workers, 'SERVER_BACKLOG': 128}
+                with backend(d, env) as port:
+                    r = run(port, args.clients, args.requests, args.chat_ratio)
+            print('%-8d %8.2f %7.1f %6d %10.1fms %10.1fms %10.1fms %10.1fms' % (
+                workers, r['wall_s'], r['rps'], r['errors'], r['chat']['p50_ms'], r['chat']['p99_ms'],
+                r['reviews']['p50_ms'], r['reviews']['p99_ms']))
+    finally:
+        stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Cost of the request instrumentation (metrics.py): /metrics and server_py.log.
+
+1. In-process: the per-request recording (one request histogram, one
+   response counter, a handful of stage histograms), one JSON log line and
+   rendering /metrics.
+2. End-to-end: the same load against the server with everything off
+   (METRICS=0, SERVER_LOG_PATH=''), only metrics, only the log and both on
+   (the defaults), for a cheap GET (/peer_rank_summary) and for /chat
+   against the stub upstream with the response cache off. Reports the best
+   throughput over the rounds, latency and the difference to 'off':
+
+    python3 -m bench.metrics_overhead --requests 3000 --threads 8
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from bench.common import backend, request, scratch_dir, summarize
+from bench.stub_openai import start_stub
+from metrics import EventLog, Metrics
+
+_STAGES = ('parse', 'upstream_connect', 'upstream_wait', 'upstream_read', 'decode', 'score', 'serialize')
+
+
+def in_process(n):
+    m = Metrics()
+    labels = (('endpoint', '/chat'), ('method', 'POST'))
+    stage_labels = [(('endpoint', '/chat'), ('stage', s)) for s in _STAGES]
+    t0 = time.perf_counter()
+    for i in range(n):
+        m.observe('chatbot_http_request_seconds', 0.0123, labels)
+        m.inc('chatbot_http_responses_total', (('endpoint', '/chat'), ('status', '200')))
+        for sl in stage_labels:
+            m.observe('chatbot_stage_seconds', 0.001, sl)
+    record = (time.perf_counter() - t0) / n
+    fd, path = tempfile.mkstemp(prefix='chatbench-', suffix='.log')
+    os.close(fd)
+    log = EventLog(path)
+    try:
+        t0 = time.perf_counter()
+        for i in range(n):
+            log.write({'event': 'request', 'client': '127.0.0.1', 'method': 'POST', 'path': '/chat', 'status': 200,
+                       'duration_ms': 12.3, 'stages_ms': {s: 1.0 for s in _STAGES}, 'cache': 'MISS'})
+        write = (time.perf_counter() - t0) / n
+    finally:
+        log.close()
+        os.remove(path)
+    t0 = time.perf_counter()
+    text = m.render()
+    render = time.perf_counter() - t0
+    print('in-process: record %.1fus/request (%d histograms + 1 counter), log line %.1fus, '
+          'render %d lines %.2fms' % (record * 1e6, 1 + len(_STAGES), write * 1e6, text.count('\n'), render * 1e3))
+
+
+def load(port, path, body, requests, threads):
+    """(requests/s, latency summary) for `requests` calls split over `threads` threads."""
+    latencies = []
+    lock = threading.Lock()
+
+    def worker():
+        mine = []
+        for _ in range(requests // threads):
+            status, data, elapsed = request(port, 'POST' if body else 'GET', path, body)
+            assert status == 200, data
+            mine.append(elapsed)
+        with lock:
+            latencies.extend(mine)
+
+    ts = [threading.Thread(target=worker) for _ in range(threads)]
+    t0 = time.perf_counter()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return len(latencies) / (time.perf_counter() - t0), summarize(latencies)
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Request instrumentation overhead')
+    ap.add_argument('--requests', type=int, default=3000, help='requests per endpoint and configuration')
+    ap.add_argument('--threads', type=int, default=8)
+    ap.add_argument('--rounds', type=int, default=3, help='rounds over the configurations; the best of each is reported')
+    args = ap.parse_args()
+
+    in_process(20000)
+    stub = start_stub(latency=0, tokens=40)
+    chat = {'messages': [{'role': 'user', 'content': 'Explain photosynthesis briefly'}], 'n': 2}
+    cases = (('GET /peer_rank_summary', '/peer_rank_summary', None), ('POST /chat', '/chat', chat))
+    configs = (('off', {'METRICS': '0', 'SERVER_LOG_PATH': ''}), ('metrics', {'SERVER_LOG_PATH': ''}),
+               ('log', {'METRICS': '0'}), ('on', {}))
+    best = {}
+    try:
+        for _ in range(args.rounds):
+            for label, extra in configs:
+                env = {'OPENAI_API_KEY': 'stub', 'OPENAI_BASE_URL': stub.base_url, 'CHAT_CACHE': '0'}
+                env.update(extra)
+                with scratch_dir() as d:
+                    with backend(d, env) as port:
+                        for name, path, body in cases:
+                            load(port, path, body, args.threads * 20, args.threads)  # warm up
+                            rate, s = load(port, path, body, args.requests, args.threads)
+                            key = (name, label)
+                            if key not in best or rate > best[key][0]:
+                                best[key] = (rate, s)
+                        if label == 'on':
+                            _, text, _ = request(port, 'GET', '/metrics', headers={
+                                'X-Admin-Token': os.environ.get('ADMIN_TOKEN', 'secret-token')})
+                            series = text.decode('utf-8').count('\n')
+                            log_lines = 0
+                            with open(os.path.join(d, 'server_py.log'), 'rb') as f:
+                                log_lines = sum(1 for _ in f)
+    finally:
+        stub.shutdown()
+
+    for name, _, _ in cases:
+        off = best[(name, 'off')][0]
+        for label, _ in configs:
+            rate, s = best[(name, label)]
+            print('%-24s %-7s %7.0f req/s (%+5.1f%%)  p50 %6.2fms  p99 %6.2fms' % (
+                name, label, rate, (rate / off - 1) * 100, s['p50_ms'], s['p99_ms']))
+    print('last "on" run: /metrics returned %d lines, server_py.log holds %d lines' % (series, log_lines))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Refresh storm on the peer review page: many clients reloading at once.
+
+Each client fetches /peer_dataset and /peer_rank_summary --rounds times,
+either plainly (full 200 bodies) or revalidating with If-None-Match like a
+browser holding the previous response (304s). A background writer can post
+rankings and reviews during the storm to check that updates still show up.
+The per-request cost of the old uncached path (re-read, re-map and
+re-serialize everything) is measured in-process for reference:
+
+    python3 -m bench.peer_refresh --clients 200 --reviews 5000 --rankings 20000
+"""
+import argparse
+import http.client
+import json
+import os
+import threading
+import time
+
+from bench.common import backend, request, scratch_dir, summarize
+from bench.corpus import write_rankings, write_reviews
+from peer_views import review_item
+
+_PATHS = ('/peer_dataset', '/peer_rank_summary')
+
+
+def uncached_cost(workdir, repeat=3):
+    """Seconds the old handlers spent per /peer_dataset and /peer_rank_summary request."""
+    def dataset():
+        with open(os.path.join(workdir, 'peer_dataset.json'), encoding='utf-8') as f:
+            items = json.load(f)
+        with open(os.path.join(workdir, 'reviews.json'), encoding='utf-8') as f:
+            items += [review_item(r) for r in json.load(f)]
+        return json.dumps(items).encode('utf-8')
+
+    def summary():
+        with open(os.path.join(workdir, 'peer_rankings.json'), encoding='utf-8') as f:
+            ranks = json.load(f)
+        out = {}
+        for r in ranks:
+            out.setdefault(r['itemId'], {'0': 0, '1': 0})
+            out[r['itemId']][str(r['responseIndex'])] = out[r['itemId']].get(str(r['responseIndex']), 0) + 1
+        return json.dumps(out).encode('utf-8')
+
+    result = []
+    for fn in (dataset, summary):
+        best = None
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        result.append(best)
+    return result
+
+
+def storm(port, clients, rounds, revalidate):
+    latencies = []
+    statuses = {}
+    nbytes = [0]
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients)
+
+    def client():
+        etags = {}
+        barrier.wait()
+        for _ in range(rounds):
+            for path in _PATHS:
+                headers = {'If-None-Match': etags[path]} if revalidate and path in etags else {}
+                t0 = time.perf_counter()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+                try:
+                    conn.request('GET', path, headers=headers)
+                    resp = conn.getresponse()
+                    body = resp.read()
+                finally:
+                    conn.close()
+                elapsed = time.perf_counter() - t0
+                if resp.getheader('ETag'):
+                    etags[path] = resp.getheader('ETag')
+                with lock:
+                    latencies.append(elapsed)
+                    statuses[resp.status] = statuses.get(resp.status, 0) + 1
+                    nbytes[0] += len(body)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, statuses, nbytes[0], time.perf_counter() - t0
+
+
+def writer(port, stop, per_sec, counter):
+    i = 0
+    while not stop.is_set():
+        i += 1
+        request(port, 'POST', '/peer/rank', {'itemId': 'storm-item', 'responseIndex': i % 2})
+        if i % 5 == 0:
+            request(port, 'POST', '/review', {'messageId': 'storm-%d' % i, 'rating': 4, 'assistantText': 'storm'})
+        counter[0] = i
+        stop.wait(1.0 / per_sec)
+
+
+def main():
+    ap = argparse.ArgumentParser(description='/peer_dataset + /peer_rank_summary refresh storm')
+    ap.add_argument('--clients', type=int, default=200)
+    ap.add_argument('--rounds', type=int, default=3)
+    ap.add_argument('--reviews', type=int, default=5000)
+    ap.add_argument('--rankings', type=int, default=20000)
+    ap.add_argument('--writes-per-sec', type=float, default=5.0, help='0 disables the background writer')
+    args = ap.parse_args()
+
+    with scratch_dir() as d:
+        write_reviews(os.path.join(d, 'reviews.json'), args.reviews, words=40)
+        write_rankings(os.path.join(d, 'peer_rankings.json'), args.rankings, max(1, args.reviews))
+        ds, rs = uncached_cost(d)
+        print('%d reviews, %d rankings; old uncached path: /peer_dataset %.1fms, /peer_rank_summary %.1fms per request' % (
+            args.reviews, args.rankings, ds * 1e3, rs * 1e3))
+        # a backlog below the client count turns the burst into SYN retransmits (1s+ stalls)
+        with backend(d, {'SERVER_BACKLOG': str(max(64, 2 * args.clients))}) as port:
+            for revalidate in (False, True):
+                stop = threading.Event()
+                counter = [0]
+                w = None
+                if args.writes_per_sec > 0:
+                    w = threading.Thread(target=writer, args=(port, stop, args.writes_per_sec, counter))
+                    w.start()
+                lat, statuses, nbytes, wall = storm(port, args.clients, args.rounds, revalidate)
+                stop.set()
+                if w is not None:
+                    w.join()
+                s = summarize(lat)
+                print('%-11s %5d GETs in %5.2fs (%6.0f/s)  p50 %7.1fms  p99 %7.1fms  %s  %.1f MB  (%d writes during storm)' % (
+                    'revalidate' if revalidate else 'full', s['count'], wall, s['count'] / wall, s['p50_ms'],
+                    s['p99_ms'], ' '.join('%d:%d' % kv for kv in sorted(statuses.items())), nbytes / 1e6, counter[0]))
+            _, body, _ = request(port, 'GET', '/peer_rank_summary')
+            storm_votes = sum(json.loads(body).get('storm-item', {}).values())
+            _, body, _ = request(port, 'GET', '/peer_dataset')
+            items = len(json.loads(body))
+            print('after storm: storm-item has %d votes, /peer_dataset has %d items' % (storm_votes, items))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""Throughput of pre-fork mode (SERVER_PROCESSES, prefork.py) from 1 to N processes.
+
+The backend serves a reviews.json of --reviews synthetic reviews; /chat goes
+to a stub that answers at once with 5 candidates, so the backend's own work
+(HTTP handling, JSON, reranking) is the bottleneck. Load comes from client
+processes (so the client side is not capped by one GIL) mixing /chat and a
+page of /reviews for --seconds per process count. Reported: requests/s, p50,
+p99 and the speed-up over one process. Scaling needs free cores; with
+os.cpu_count() == 1 the runs can only show that pre-fork costs nothing.
+
+With the largest process count it then checks:
+
+1. coherence: reviews posted to one worker are listed by whichever worker
+   the next connection reaches, and every worker re-maps the reranker
+   model worker 0 saved after the change.
+2. restart: a worker killed under load is replaced.
+3. reload: SIGHUP under load replaces every worker; failed requests are
+   counted (connections queued on a retiring worker's socket can be reset).
+
+    python3 -m bench.prefork_scaling --processes 1,2,4 --seconds 10
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+from bench.common import backend_process, request, scratch_dir, summarize
+from bench.corpus import write_reviews
+from bench.stub_openai import start_stub
+
+_ADMIN = {'X-Admin-Token': 'secret-token'}
+
+
+def _client(port, threads, seconds, seed):
+    """One client process: `threads` threads in a closed loop; returns (latencies, errors)."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop = time.perf_counter() + seconds
+
+    def loop(tid):
+        i = 0
+        mine = []
+        while time.perf_counter() < stop:
+            i += 1
+            if i % 2:
+                body = json.dumps({'messages': [{'role': 'user', 'content': 'question %d %d %d' % (seed, tid, i)}],
+                                   'n': 5})
+                method, path = 'POST', '/chat'
+            else:
+                body, method, path = None, 'GET', '/reviews?limit=200&exclude=assistantText'
+            t0 = time.perf_counter()
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                conn.request(method, path, body=body, headers={'Content-Type': 'application/json'})
+                resp = conn.getresponse()
+                resp.read()
+                conn.close()
+                ok = resp.status == 200
+            except Exception:
+                ok = False
+            if ok:
+                mine.append(time.perf_counter() - t0)
+            else:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(mine)
+
+    ts = [threading.Thread(target=loop, args=(t,)) for t in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return latencies, errors[0]
+
+
+def load(port, procs, threads, seconds):
+    """Run the client processes; returns (requests/s, summary, errors)."""
+    with multiprocessing.Pool(procs) as pool:
+        t0 = time.perf_counter()
+        parts = pool.starmap(_client, [(port, threads, seconds, s) for s in range(procs)])
+        elapsed = time.perf_counter() - t0
+    latencies = [v for part, _ in parts for v in part]
+    return len(latencies) / elapsed, summarize(latencies), sum(e for _, e in parts)
+
+
+def workers(port, tries=60):
+    """{worker id: admin stats} seen over `tries` fresh connections."""
+    seen = {}
+    for _ in range(tries):
+        status, body, _ = request(port, 'GET', '/admin/stats', headers=_ADMIN)
+        if status == 200:
+            stats = json.loads(body.decode('utf-8'))
+            seen[stats['worker']['id']] = stats
+    return seen
+
+
+def wait_for_workers(port, processes, timeout=120.0):
+    """Wait until every worker answers and worker 0 has built the reranker."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        seen = workers(port, 4 * processes)
+        if len(seen) == processes and all((s['reranker'] or {}).get('version') for s in seen.values()):
+            return seen
+        time.sleep(0.5)
+    raise RuntimeError('only workers %s came up' % sorted(seen))
+
+
+def background_load(port, seconds):
+    """Start load() in a thread; returns a callable that joins it and returns its result."""
+    out = {}
+    t = threading.Thread(target=lambda: out.update(r=load(port, 2, 4, seconds)))
+    t.start()
+    return lambda: (t.join(), out['r'])[1]
+
+
+def check_coherence(port, processes):
+    readers = {i: s['reranker']['reloads'] for i, s in workers(port).items() if s['reranker'].get('shared')}
+    missing = 0
+    for k in range(20):
+        status, _, _ = request(port, 'POST', '/review', {'messageId': 'coherence-%d' % k, 'rating': 5,
+                                                          'assistantText': 'coherence check %d' % k})
+        assert status == 201, status
+        # the next connection usually reaches another worker
+        _, body, _ = request(port, 'GET', '/reviews?fields=messageId')
+        missing += b'"coherence-%d"' % k not in body
+    print('  coherence: %d of 20 reviews missing when read back over a new connection' % missing)
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        now = {i: s['reranker']['reloads'] for i, s in workers(port).items() if s['reranker'].get('shared')}
+        if len(now) == processes - 1 and all(now[i] > readers.get(i, 0) for i in now):
+            break
+        time.sleep(0.25)
+    stale = [i for i in now if now[i] <= readers.get(i, 0)]
+    print('  reranker: %d of %d reader workers re-mapped the model after the writes' % (
+        len(now) - len(stale), processes - 1))
+    return missing == 0 and not stale and len(now) == processes - 1
+
+
+def check_restart(port, processes):
+    before = {i: s['worker']['pid'] for i, s in workers(port).items()}
+    victim = max(before)
+    finish = background_load(port, 3)
+    time.sleep(1)
+    os.kill(before[victim], signal.SIGKILL)
+    rps, _, errors = finish()
+    deadline = time.time() + 15
+    after = {}
+    while time.time() < deadline:
+        after = {i: s['worker']['pid'] for i, s in workers(port).items()}
+        if after.get(victim) not in (None, before[victim]) and len(after) == processes:
+            break
+        time.sleep(0.5)
+    replaced = after.get(victim) not in (None, before[victim])
+    print('  restart: worker %d killed under load (%.0f req/s, %d failed); %s' % (
+        victim, rps, errors, 'replaced by pid %d' % after[victim] if replaced else 'NOT replaced'))
+    return replaced
+
+
+def check_reload(port, proc, processes):
+    before = {i: s['worker']['pid'] for i, s in workers(port).items()}
+    finish = background_load(port, 6)
+    time.sleep(1)
+    proc.send_signal(signal.SIGHUP)
+    rps, s, errors = finish()
+    deadline = time.time() + 30
+    after = {}
+    while time.time() < deadline:
+        after = {i: st['worker']['pid'] for i, st in workers(port).items()}
+        if len(after) == processes and not set(after.values()) & set(before.values()):
+            break
+        time.sleep(0.5)
+    renewed = len(after) == processes and not set(after.values()) & set(before.values())
+    print('  reload: SIGHUP under load (%.0f req/s, p99 %.1fms, %d failed of %d); %s' % (
+        rps, s['p99_ms'], errors, s['count'] + errors, 'all workers replaced' if renewed else 'NOT all replaced'))
+    return renewed, errors, s['count'] + errors
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Pre-fork throughput from 1 to N processes')
+    ap.add_argument('--processes', default='1,2,4', help='comma-separated SERVER_PROCESSES values')
+    ap.add_argument('--seconds', type=float, default=8.0, help='load duration per process count')
+    ap.add_argument('--client-procs', type=int, default=max(2, min(8, os.cpu_count() or 1)))
+    ap.add_argument('--threads', type=int, default=8, help='threads per client process')
+    ap.add_argument('--reviews', type=int, default=20000)
+    args = ap.parse_args()
+    counts = sorted(set(int(p) for p in args.processes.split(',') if p.strip()))
+
+    stub = start_stub(latency=0.0, tokens=30)
+    env = {'OPENAI_API_KEY': 'stub', 'OPENAI_BASE_URL': stub.base_url, 'CHAT_CACHE': '0',
+           'RERANK_ADAPTIVE': '0', 'SERVER_LOG_PATH': '', 'SERVER_DRAIN_TIMEOUT': '2'}
+    print('cores: %d; %d client processes x %d threads; %d reviews' % (
+        os.cpu_count() or 1, args.client_procs, args.threads, args.reviews))
+    results = {}
+    checks = None
+    try:
+        for n in counts:
+            with scratch_dir() as d:
+                write_reviews(os.path.join(d, 'reviews.json'), args.reviews)
+                with backend_process(d, dict(env, SERVER_PROCESSES=str(n))) as (port, proc):
+                    wait_for_workers(port, n)
+                    rps, s, errors = load(port, args.client_procs, args.threads, args.seconds)
+                    results[n] = rps
+                    print('  SERVER_PROCESSES=%-2d %8.0f req/s  x%.2f  p50 %7.1fms  p99 %7.1fms  failed %d' % (
+                        n, rps, rps / results[counts[0]], s['p50_ms'], s['p99_ms'], errors))
+                    if n == counts[-1] and n > 1:
+                        checks = (check_coherence(port, n), check_restart(port, n), check_reload(port, proc, n))
+    finally:
+        stub.shutdown()
+    if checks is not None:
+        coherent, restarted, (renewed, errors, total) = checks
+        assert coherent, 'workers did not see each other\'s review changes'
+        assert restarted, 'a killed worker was not replaced'
+        assert renewed and errors <= max(1, total // 100), 'reload did not replace the workers cleanly'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Sustained /peer/rank submissions against the JSON Lines ranking log.
+
+Concurrent clients post rankings for --seconds against a log that already
+holds --rankings entries, with group-commit fsync on and off. Afterwards
+every acknowledged ranking must be in /admin/peer_rankings and counted in
+/peer_rank_summary. The old handler (load peer_rankings.json, append,
+rewrite it) is replayed in-process at the same starting size for reference:
+
+    python3 -m bench.rank_throughput --clients 32 --rankings 20000
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+from bench.common import backend, request, scratch_dir, summarize
+from bench.corpus import write_rankings
+
+_ADMIN = {'X-Admin-Token': 'secret-token'}
+
+
+def old_rewrite_rate(workdir, seconds):
+    """Rankings/s of the old load + append + rewrite cycle (one writer, as it held a lock)."""
+    path = os.path.join(workdir, 'peer_rankings.json')
+    n = 0
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < seconds:
+        with open(path, 'r', encoding='utf-8') as f:
+            ranks = json.load(f)
+        ranks.append({'itemId': 'old-item', 'responseIndex': n % 2})
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(ranks, f, indent=2)
+        os.replace(tmp, path)
+        n += 1
+    return n / (time.perf_counter() - t0)
+
+
+def sustained(port, clients, seconds):
+    latencies = []
+    sent = {}
+    errors = [0]
+    lock = threading.Lock()
+    stop = time.perf_counter() + seconds
+
+    def client(cid):
+        i = 0
+        mine = []
+        while time.perf_counter() < stop:
+            status, _, elapsed = request(port, 'POST', '/peer/rank',
+                                         {'itemId': 'bench-%d' % cid, 'responseIndex': i % 2, 'seq': i})
+            if status == 201:
+                mine.append(elapsed)
+                i += 1
+            else:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(mine)
+            sent[cid] = i
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, sent, errors[0], time.perf_counter() - t0
+
+
+def check(port, sent, before):
+    """Every acknowledged ranking is in the log (in per-client order) and in the summary."""
+    _, body, _ = request(port, 'GET', '/admin/peer_rankings', headers=_ADMIN, timeout=300)
+    ranks = json.loads(body)
+    assert len(ranks) == before + sum(sent.values()), (len(ranks), before, sum(sent.values()))
+    seen = {}
+    for r in ranks[before:]:
+        cid = int(r['itemId'].split('-')[1])
+        assert r['seq'] == seen.get(cid, 0), ('out of order', r)
+        seen[cid] = r['seq'] + 1
+    assert seen == {c: n for c, n in sent.items() if n}, 'missing rankings'
+    _, body, _ = request(port, 'GET', '/peer_rank_summary')
+    summary = json.loads(body)
+    for cid, n in sent.items():
+        if n:
+            assert sum(summary['bench-%d' % cid].values()) == n, cid
+    return len(ranks)
+
+
+def main():
+    ap = argparse.ArgumentParser(description='/peer/rank sustained write throughput')
+    ap.add_argument('--clients', type=int, default=32)
+    ap.add_argument('--seconds', type=float, default=5.0)
+    ap.add_argument('--rankings', type=int, default=20000, help='rankings already stored before the run')
+    args = ap.parse_args()
+
+    for fsync in ('1', '0'):
+        with scratch_dir() as d:
+            for name in ('peer_rankings.jsonl', 'suggestions.jsonl'):
+                if os.path.exists(os.path.join(d, name)):
+                    os.remove(os.path.join(d, name))
+            write_rankings(os.path.join(d, 'peer_rankings.json'), args.rankings, 1000)
+            if fsync == '1':
+                rate = old_rewrite_rate(d, min(args.seconds, 5.0))
+                print('%d stored rankings; old rewrite-the-array handler: %.1f rankings/s' % (args.rankings, rate))
+                write_rankings(os.path.join(d, 'peer_rankings.json'), args.rankings, 1000)
+            env = {'JSONL_FSYNC': fsync, 'SERVER_BACKLOG': str(max(64, 2 * args.clients))}
+            with backend(d, env) as port:
+                lat, sent, errors, wall = sustained(port, args.clients, args.seconds)
+                _, body, _ = request(port, 'GET', '/admin/stats', headers=_ADMIN)
+                log = json.loads(body)['peer_rankings_log']
+                total = check(port, sent, args.rankings)
+            s = summarize(lat)
+            print('fsync=%s  %6d rankings in %5.2fs (%7.1f/s)  p50 %6.1fms  p99 %6.1fms  %.1f appends per fsync  '
+                  '%d errors  log holds %d, none lost' % (
+                      fsync, s['count'], wall, s['count'] / wall, s['p50_ms'], s['p99_ms'],
+                      log['appends'] / max(1, log['flushes']), errors, total))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Incremental RerankerModel updates vs a full retrain, at 10k and 100k reviews.
+
+Also checks that a model updated through a random sequence of creates,
+overwrites and deletes is identical to one retrained from the final records,
+and exits non-zero if it is not. --check runs only the checks (more seeds,
+plus overwrites undone again), without the timings:
+
+    python3 -m bench.reranker_incremental --sizes 10000,100000
+    python3 -m bench.reranker_incremental --check
+"""
+import argparse
+import random
+import sys
+import time
+
+from bench.corpus import synthetic_review, synthetic_reviews
+from reranker import RerankerModel, train_from_records
+
+
+def check_exact(n, ops, seed=0):
+    """True if the model updated through `ops` random changes equals a full retrain."""
+    rnd = random.Random(seed)
+    records = {r['messageId']: r for r in synthetic_reviews(n, seed)}
+    model = RerankerModel.from_records(list(records.values()))
+    for _ in range(ops):
+        i = rnd.randrange(n * 2)
+        key = 'm-%d' % i
+        if rnd.random() < 0.3:
+            old = records.pop(key, None)
+            if old is not None:
+                model.remove(old)
+        else:
+            new = synthetic_review(i, rnd)
+            # fractional ratings like the ones chat.html averages (e.g. 3.67)
+            new['rating'] = round(rnd.uniform(1, 5), 2)
+            model.replace(records.get(key), new)
+            records[key] = new
+    return model.token_scores == train_from_records(list(records.values()))
+
+
+def check_undo(n, ops, seed=0):
+    """True if overwriting reviews and overwriting them back restores the exact model."""
+    rnd = random.Random(seed)
+    reviews = synthetic_reviews(n, seed)
+    model = RerankerModel.from_records(reviews)
+    before = train_from_records(reviews)
+    for _ in range(ops):
+        old = reviews[rnd.randrange(n)]
+        new = synthetic_review(rnd.randrange(n), rnd)
+        model.replace(old, new)
+        model.replace(new, old)
+    return model.token_scores == before
+
+
+def run_checks():
+    """Run the exactness checks; returns the names of the failed ones."""
+    failed = []
+    for seed in range(3):
+        if not check_exact(2000, 5000, seed):
+            failed.append('creates/overwrites/deletes, seed %d' % seed)
+    if not check_undo(2000, 2000):
+        failed.append('overwrite and undo')
+    return failed
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Incremental reranker update benchmark')
+    ap.add_argument('--sizes', default='10000,100000')
+    ap.add_argument('--updates', type=int, default=1000)
+    ap.add_argument('--check', action='store_true', help='only run the exactness checks; exit 1 if one fails')
+    args = ap.parse_args()
+
+    if args.check:
+        failed = run_checks()
+        for name in failed:
+            print('FAIL: incremental model != full retrain (%s)' % name)
+        if failed:
+            sys.exit(1)
+        print('ok: incremental model == full retrain (3 seeds x 5000 random changes, 2000 overwrites undone)')
+        return
+
+    if not check_exact(2000, 5000):
+        print('FAIL: incremental model != full retrain after 5000 random creates/overwrites/deletes')
+        sys.exit(1)
+    print('exactness: incremental model == full retrain after 5000 random creates/overwrites/deletes')
+
+    rnd = random.Random(7)
+    for n in [int(x) for x in args.sizes.split(',') if x.strip()]:
+        reviews = synthetic_reviews(n)
+        t0 = time.perf_counter()
+        model = RerankerModel.from_records(reviews)
+        full_s = time.perf_counter() - t0
+        updates = [(reviews[rnd.randrange(n)], synthetic_review(rnd.randrange(n), rnd)) for _ in range(args.updates)]
+        t0 = time.perf_counter()
+        for old, new in updates:
+            model.replace(old, new)
+            model.replace(new, old)
+        inc_s = (time.perf_counter() - t0) / (2 * len(updates))
+        print('%7d reviews: full retrain %8.1fms   incremental overwrite %.3fms   (%.0fx)' % (
+            n, full_s * 1e3, inc_s * 1e3, full_s / inc_s))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Reranker startup: training from reviews.json vs loading the saved model file.
+
+Each variant runs in a fresh interpreter so time and resident memory are
+measured from a cold start (page cache aside):
+
+    python3 -m bench.reranker_model --reviews 100000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from bench.corpus import write_reviews
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CHILD = r'''
+import json, sys, time
+sys.path.insert(0, %(root)r)
+mode, reviews, model_path = sys.argv[1:4]
+
+def rss_kb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+base = rss_kb()
+t0 = time.perf_counter()
+import reranker
+if mode == 'train':
+    from review_store import ReviewStore
+    model = reranker.RerankerModel.from_records(ReviewStore(reviews).all())
+else:
+    model = reranker.load_model(model_path, [reviews, reviews + '.journal'])
+    assert model is not None, 'model file is stale'
+compiled = model.compiled()
+ready = time.perf_counter() - t0
+t1 = time.perf_counter()
+scores = reranker.score_batch(['the sky is blue because light scatter'] * 5, compiled)
+first = time.perf_counter() - t1
+print(json.dumps({'ready_ms': ready * 1e3, 'first_score_ms': first * 1e3,
+                  'rss_mb': (rss_kb() - base) / 1024.0, 'score': scores[0]}))
+'''
+
+
+def run(mode, reviews, model_path):
+    out = subprocess.run([sys.executable, '-c', _CHILD % {'root': _ROOT}, mode, reviews, model_path],
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out)
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Reranker model file load benchmark')
+    ap.add_argument('--reviews', type=int, default=100000)
+    ap.add_argument('--vocab', type=int, default=20000, help='distinct tokens in the synthetic corpus')
+    ap.add_argument('--runs', type=int, default=3)
+    args = ap.parse_args()
+
+    sys.path.insert(0, _ROOT)
+    from reranker import RerankerModel, save_model
+    from review_store import ReviewStore
+
+    with tempfile.TemporaryDirectory() as d:
+        reviews = os.path.join(d, 'reviews.json')
+        model_path = os.path.join(d, 'reranker.model')
+        write_reviews(reviews, args.reviews, vocab_size=args.vocab)
+        save_model(RerankerModel.from_records(ReviewStore(reviews).all()), model_path,
+                   [reviews, reviews + '.journal'])
+        print('%d reviews, %d-token vocabulary, model file %.1f MB' % (
+            args.reviews, args.vocab, os.path.getsize(model_path) / 1e6))
+        results = {}
+        for mode in ('train', 'load'):
+            runs = [run(mode, reviews, model_path) for _ in range(args.runs)]
+            best = min(runs, key=lambda r: r['ready_ms'])
+            results[mode] = best
+            print('%-5s ready %8.1fms   first score_batch %6.2fms   +RSS %6.1f MB' % (
+                mode, best['ready_ms'], best['first_score_ms'], best['rss_mb']))
+        assert results['train']['score'] == results['load']['score'], 'loaded model scores differently'
+        print('speedup %.0fx' % (results['train']['ready_ms'] / results['load']['ready_ms']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Review writes vs reranker training: nothing on the request path waits for it.
+
+1. Cold start without reranker.model: how soon the server answers, and how
+   long until the background build publishes model version 1.
+2. Warm start (model memory-mapped): a burst of review posts and admin
+   deletes from several threads. Reports their latency, how many worker
+   updates the burst was folded into and the lag until the last change was
+   published. The old inline path's cost on the first write after a warm
+   start (materializing the mapped model) is measured in-process for reference.
+3. After a clean shutdown the saved model must equal a full retrain on the
+   final reviews:
+
+    python3 -m bench.reranker_worker --reviews 100000 --writes 400
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+
+from bench.common import backend_process, request, scratch_dir, summarize
+from bench.corpus import write_reviews
+from reranker import RerankerModel, load_model
+from review_store import ReviewStore
+
+_ADMIN = {'X-Admin-Token': 'secret-token'}
+
+
+def reranker_stats(port):
+    _, body, _ = request(port, 'GET', '/admin/stats', headers=_ADMIN)
+    return json.loads(body)['reranker']
+
+
+def stop(proc):
+    # SIGTERM shuts down like Ctrl-C; give compaction and the model save time to finish
+    proc.terminate()
+    proc.wait(timeout=300)
+
+
+def cold_start(d):
+    t0 = time.perf_counter()
+    with backend_process(d) as (port, proc):
+        listening = time.perf_counter() - t0
+        lat = []
+        while reranker_stats(port)['version'] < 1:
+            _, _, elapsed = request(port, 'GET', '/reviews?limit=10')
+            lat.append(elapsed)
+            time.sleep(0.05)
+        ready = time.perf_counter() - t0
+        st = reranker_stats(port)
+        stop(proc)
+    s = summarize(lat)
+    print('cold start: listening after %.2fs, model v%d published after %.2fs (build %.0fms); '
+          '%d GET /reviews while building: p50 %.1fms p99 %.1fms' % (
+              listening, st['version'], ready, st['last_build_ms'], s['count'], s['p50_ms'], s['p99_ms']))
+
+
+def burst(d, reviews, writes, threads):
+    t0 = time.perf_counter()
+    with backend_process(d) as (port, proc):
+        listening = time.perf_counter() - t0
+        before = reranker_stats(port)
+        lat = {'post': [], 'delete': []}
+        lock = threading.Lock()
+
+        def writer(w):
+            rnd = random.Random(w)
+            for i in range(writes // threads):
+                if i % 2:
+                    path, kind = '/admin/review/delete', 'delete'
+                    body = {'messageId': 'm-%d' % rnd.randrange(reviews)}
+                else:
+                    path, kind = '/review', 'post'
+                    body = {'messageId': 'burst-%d-%d' % (w, i), 'rating': rnd.randint(1, 5),
+                            'comment': 'burst', 'assistantText': 'the burst answer number %d' % i}
+                status, _, elapsed = request(port, 'POST', path, body, headers=_ADMIN)
+                assert status < 300, status
+                with lock:
+                    lat[kind].append(elapsed)
+
+        ts = [threading.Thread(target=writer, args=(w,)) for w in range(threads)]
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join()
+        done = time.perf_counter()
+        while True:
+            st = reranker_stats(port)
+            if not st['pending_changes'] and not st['building'] and st['version'] > before['version']:
+                break
+            time.sleep(0.01)
+        published = time.perf_counter() - done
+        stop(proc)
+    print('warm start: listening after %.2fs (model v%d from reranker.model)' % (listening, before['version']))
+    for kind in ('post', 'delete'):
+        s = summarize(lat[kind])
+        print('  %-6s %4d requests  p50 %6.1fms  p99 %6.1fms  max %6.1fms' % (
+            kind, s['count'], s['p50_ms'], s['p99_ms'], s['max_ms']))
+    print('  %d changes applied in %d worker updates (last %.1fms), published v%d %.0fms after the last write' % (
+        st['changes'], st['updates'], st['last_update_ms'] or 0, st['version'], published * 1e3))
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Background reranker training benchmark')
+    ap.add_argument('--reviews', type=int, default=100000)
+    ap.add_argument('--vocab', type=int, default=20000, help='distinct tokens in the synthetic corpus')
+    ap.add_argument('--writes', type=int, default=400)
+    ap.add_argument('--threads', type=int, default=8)
+    args = ap.parse_args()
+
+    with scratch_dir(copy_data=False) as d:
+        reviews = os.path.join(d, 'reviews.json')
+        model_path = os.path.join(d, 'reranker.model')
+        write_reviews(reviews, args.reviews, vocab_size=args.vocab)
+        print('%d reviews, %d-token vocabulary' % (args.reviews, args.vocab))
+        cold_start(d)
+        assert os.path.exists(model_path), 'background build did not save reranker.model'
+
+        model = load_model(model_path, [reviews, reviews + '.journal'])
+        t0 = time.perf_counter()
+        model.replace(None, {'messageId': 'x', 'rating': 5, 'assistantText': 'inline path'})
+        print('old inline path: first review write after a warm start spent %.0fms in the request' % (
+            (time.perf_counter() - t0) * 1e3))
+        del model
+
+        burst(d, args.reviews, args.writes, args.threads)
+        saved = load_model(model_path, [reviews, reviews + '.journal'])
+        assert saved is not None, 'saved model is stale'
+        fresh = RerankerModel.from_records(ReviewStore(reviews).all())
+        assert saved.token_scores == fresh.token_scores and saved.counts == fresh.counts, 'saved model drifted'
+        print('saved model after shutdown == full retrain on the final reviews')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,275 @@
+"""Upstream resilience (resilience.py) against the fault-injecting stub.
+
+1. flaky: 30% of upstream calls fail with 503. /chat success rate without
+   retries vs OPENAI_RETRIES=2.
+2. rate-limited: the stub answers 429 (Retry-After) above 4 concurrent calls,
+   with 16 clients. No retries vs retries honoring Retry-After vs
+   OPENAI_MAX_CONCURRENCY=4.
+3. tail: 5% of calls take 2s longer. p99 without and with OPENAI_HEDGE=1,
+   and how many extra upstream calls the hedges cost.
+4. outage: every upstream call fails. Without the breaker each /chat waits
+   for its retries and gets a 502. With it, requests fail over to the mock
+   reply at once, and the backend goes back to the upstream after
+   OPENAI_BREAKER_RESET once the stub recovers.
+
+    python3 -m bench.resilience
+
+--check instead asserts the behaviour behind those numbers against a fast
+stub (retries, the breaker opening and closing again, a hedge winning over a
+slow call, a stream the client hangs up on being cancelled upstream) and
+exits 1 if one fails:
+
+    python3 -m bench.resilience --check
+"""
+import argparse
+import http.client
+import json
+import socket
+import sys
+import threading
+import time
+
+from bench.common import backend, scratch_dir, summarize
+from bench.stub_openai import start_stub
+
+_COUNTER = [0]
+_COUNTER_LOCK = threading.Lock()
+
+
+def chat(port, stream=False):
+    """(status, X-Upstream-Fallback header, elapsed seconds) for one /chat call with a unique prompt."""
+    with _COUNTER_LOCK:
+        _COUNTER[0] += 1
+        i = _COUNTER[0]
+    body = {'messages': [{'role': 'user', 'content': 'question number %d' % i}], 'n': 2}
+    if stream:
+        body['stream'] = True
+    t0 = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+    try:
+        conn.request('POST', '/chat', json.dumps(body), {'Content-Type': 'application/json'})
+        resp = conn.getresponse()
+        resp.read()
+        return resp.status, resp.getheader('X-Upstream-Fallback'), time.perf_counter() - t0
+    finally:
+        conn.close()
+
+
+def load(port, clients, requests):
+    results = []
+    lock = threading.Lock()
+
+    def worker():
+        mine = [chat(port) for _ in range(requests // clients)]
+        with lock:
+            results.extend(mine)
+
+    ts = [threading.Thread(target=worker) for _ in range(clients)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return results
+
+
+def report(label, results, stub, calls_before):
+    ok = [r for r in results if r[0] == 200 and not r[1]]
+    fallback = [r for r in results if r[0] == 200 and r[1]]
+    s = summarize([r[2] for r in results])
+    print('  %-28s ok %5.1f%%  fallback %3d  errors %3d  p50 %7.1fms  p99 %7.1fms  upstream calls %4d' % (
+        label, 100.0 * len(ok) / max(1, len(results)), len(fallback), len(results) - len(ok) - len(fallback),
+        s['p50_ms'], s['p99_ms'], stub.calls - calls_before))
+    return len(ok), s
+
+
+def run(stub, env, clients, requests, label, warmup=0):
+    base = {'OPENAI_API_KEY': 'stub', 'OPENAI_BASE_URL': stub.base_url}
+    base.update(env)
+    with scratch_dir() as d:
+        with backend(d, base) as port:
+            if warmup:
+                load(port, clients, warmup)
+            calls = stub.calls
+            return report(label, load(port, clients, requests), stub, calls)
+
+
+def flaky(args):
+    print('flaky upstream: 30% of calls answer 503')
+    stub = start_stub(latency=0.05, tokens=20, fail_rate=0.3)
+    try:
+        env = {'OPENAI_BREAKER_FAILURES': '0', 'OPENAI_RETRY_BASE_MS': '50'}
+        off, _ = run(stub, dict(env, OPENAI_RETRIES='0'), 8, args.requests, 'no retries')
+        on, _ = run(stub, dict(env, OPENAI_RETRIES='2'), 8, args.requests, 'OPENAI_RETRIES=2')
+    finally:
+        stub.shutdown()
+    assert on > off, 'retries did not help'
+
+
+def rate_limited(args):
+    print('rate-limited upstream: 429 + Retry-After: 0.2 above 4 concurrent calls, 16 clients')
+    stub = start_stub(latency=0.2, tokens=20, max_inflight=4, retry_after=0.2)
+    try:
+        env = {'OPENAI_BREAKER_FAILURES': '0'}
+        run(stub, dict(env, OPENAI_RETRIES='0'), 16, args.requests, 'no retries')
+        limited = stub.faults['rate_limited']
+        run(stub, dict(env, OPENAI_RETRIES='3'), 16, args.requests, 'retries (Retry-After)')
+        limited, before = stub.faults['rate_limited'] - limited, stub.faults['rate_limited']
+        ok, _ = run(stub, dict(env, OPENAI_MAX_CONCURRENCY='4'), 16, args.requests, 'OPENAI_MAX_CONCURRENCY=4')
+        print('  429s from the stub: %d with retries, %d with the limiter' % (
+            limited, stub.faults['rate_limited'] - before))
+    finally:
+        stub.shutdown()
+    assert ok == args.requests // 16 * 16, 'the limiter still saw failures'
+
+
+def tail(args):
+    print('slow tail: 5% of calls take 2s longer')
+    stub = start_stub(latency=0.1, tokens=20, slow_rate=0.05, slow_latency=2.0)
+    try:
+        _, off = run(stub, {}, 8, args.requests, 'no hedging', warmup=40)
+        _, on = run(stub, {'OPENAI_HEDGE': '1', 'OPENAI_HEDGE_MIN_MS': '150'}, 8, args.requests,
+                    'OPENAI_HEDGE=1', warmup=40)
+    finally:
+        stub.shutdown()
+    print('  (each run sends %d requests; calls above that are hedges)' % (args.requests // 8 * 8))
+    assert on['p99_ms'] < off['p99_ms'], 'hedging did not cut the tail'
+
+
+def outage(args):
+    print('outage: every upstream call fails with 503')
+    for label, failures in (('no breaker', '0'), ('OPENAI_BREAKER_FAILURES=5', '5')):
+        stub = start_stub(latency=0.05, tokens=20)
+        env = {'OPENAI_API_KEY': 'stub', 'OPENAI_BASE_URL': stub.base_url, 'OPENAI_BREAKER_FAILURES': failures,
+               'OPENAI_BREAKER_RESET': '1', 'OPENAI_RETRY_BASE_MS': '200'}
+        try:
+            with scratch_dir() as d:
+                with backend(d, env) as port:
+                    load(port, 4, 20)
+                    stub.config['fail_rate'] = 1.0
+                    calls = stub.calls
+                    report(label, load(port, 4, args.requests // 2), stub, calls)
+                    if failures != '0':
+                        stub.config['fail_rate'] = 0.0
+                        time.sleep(1.2)
+                        after = [chat(port) for _ in range(5)]
+                        recovered = all(r[0] == 200 and not r[1] for r in after)
+                        print('  after the stub recovered and the reset period: %s' % (
+                            'served by the upstream again' if recovered else 'still failing over'))
+                        assert recovered, 'breaker did not close again'
+        finally:
+            stub.shutdown()
+
+
+def hang_up_stream(port):
+    """Start a streamed /chat, read until the first delta, then close the connection."""
+    body = json.dumps({'messages': [{'role': 'user', 'content': 'tell me a long story'}], 'n': 2,
+                       'stream': True}).encode('utf-8')
+    sock = socket.create_connection(('127.0.0.1', port), timeout=30)
+    try:
+        sock.sendall(b'POST /chat HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Type: application/json\r\n'
+                     b'Content-Length: %d\r\n\r\n%s' % (len(body), body))
+        data = b''
+        while b'delta' not in data:
+            more = sock.recv(4096)
+            if not more:
+                break
+            data += more
+    finally:
+        sock.close()
+
+
+def run_checks():
+    """Check retries, the breaker, hedging and stream cancellation; returns the failed checks' descriptions."""
+    failed = []
+
+    def expect(name, ok, detail):
+        print('  %-56s %s%s' % (name, detail, '' if ok else '  FAIL'))
+        if not ok:
+            failed.append(name)
+
+    stub = start_stub(latency=0.02, tokens=20)
+    try:
+        base = {'OPENAI_API_KEY': 'stub', 'OPENAI_BASE_URL': stub.base_url, 'SERVER_LOG_PATH': '',
+                'CHAT_CACHE': '0', 'OPENAI_RETRY_BASE_MS': '10'}
+        with scratch_dir() as d:
+            with backend(d, dict(base, OPENAI_RETRIES='2', OPENAI_BREAKER_FAILURES='0')) as port:
+                stub.config['fail_rate'] = 1.0
+                calls = stub.calls
+                status, _, _ = chat(port)
+                expect('failing upstream: 1 call + 2 retries, then 502', status == 502 and stub.calls - calls == 3,
+                       'status %d, %d upstream calls' % (status, stub.calls - calls))
+                stub.config['fail_rate'] = 0.0
+
+        with scratch_dir() as d:
+            with backend(d, dict(base, OPENAI_RETRIES='0', OPENAI_BREAKER_FAILURES='2',
+                                 OPENAI_BREAKER_RESET='1')) as port:
+                stub.config['fail_rate'] = 1.0
+                calls = stub.calls
+                statuses = [chat(port)[0] for _ in range(2)]
+                status, fallback, _ = chat(port)
+                expect('breaker opens after 2 failures', status == 200 and fallback and stub.calls - calls == 2,
+                       'statuses %s then %d (fallback %s), %d upstream calls' % (
+                           statuses, status, fallback, stub.calls - calls))
+                stub.config['fail_rate'] = 0.0
+                time.sleep(1.2)
+                calls = stub.calls
+                status, fallback, _ = chat(port)
+                expect('breaker closes after the reset period', status == 200 and not fallback and
+                       stub.calls - calls == 1, 'status %d (fallback %s), %d upstream call(s)' % (
+                           status, fallback, stub.calls - calls))
+
+        with scratch_dir() as d:
+            with backend(d, dict(base, OPENAI_HEDGE='1', OPENAI_HEDGE_MIN_MS='100')) as port:
+                # the hedge delay needs 20 latency samples
+                for _ in range(25):
+                    chat(port)
+                stub.config.update(slow_rate=1.0, slow_latency=2.0)
+                calls = stub.calls
+                result = []
+                t = threading.Thread(target=lambda: result.append(chat(port)))
+                t.start()
+                # the first attempt is slow; the hedge, sent after 100ms, is not
+                time.sleep(0.05)
+                stub.config['slow_rate'] = 0.0
+                t.join()
+                status, _, elapsed = result[0]
+                expect('a hedge answers for a slow call', status == 200 and elapsed < 1.0 and stub.calls - calls == 2,
+                       'status %d after %.0fms, %d upstream calls' % (status, elapsed * 1000, stub.calls - calls))
+                # let the losing attempt finish before the backend stops
+                time.sleep(2.1)
+
+        stub.config['token_delay'] = 0.05
+        with scratch_dir() as d:
+            with backend(d, base) as port:
+                gone = stub.disconnects
+                hang_up_stream(port)
+                deadline = time.time() + 3.0
+                while stub.disconnects == gone and time.time() < deadline:
+                    time.sleep(0.05)
+                expect('client hangs up on a stream: upstream stream cancelled', stub.disconnects > gone,
+                       '%d upstream stream(s) closed early' % (stub.disconnects - gone))
+    finally:
+        stub.shutdown()
+    return failed
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Upstream retries, hedging, circuit breaker and limiter')
+    ap.add_argument('--requests', type=int, default=160, help='/chat requests per run')
+    ap.add_argument('--only', help='comma-separated subset of flaky,rate_limited,tail,outage')
+    ap.add_argument('--check', action='store_true', help='only run the behaviour checks; exit 1 if one fails')
+    args = ap.parse_args()
+    if args.check:
+        failed = run_checks()
+        if failed:
+            print('FAIL: %s' % ', '.join(failed))
+            sys.exit(1)
+        print('ok')
+        return
+    scenarios = {'flaky': flaky, 'rate_limited': rate_limited, 'tail': tail, 'outage': outage}
+    for name in (args.only.split(',') if args.only else scenarios):
+        scenarios[name](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""ReviewStore vs the old read-modify-write of reviews.json, at 100k reviews.
+
+    python3 -m bench.review_store --reviews 100000 --ops 2000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from bench.corpus import synthetic_review, write_reviews
+from review_store import ReviewStore
+
+
+def old_upsert(path, review):
+    # what /review did before: load, linear scan, rewrite with indent=2
+    with open(path, 'r', encoding='utf-8') as f:
+        reviews = json.load(f)
+    for i, r in enumerate(reviews):
+        if isinstance(r, dict) and r.get('messageId') == review.get('messageId'):
+            reviews[i] = review
+            break
+    else:
+        reviews.append(review)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(reviews, f, indent=2)
+
+
+def old_read(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Review store benchmark')
+    ap.add_argument('--reviews', type=int, default=100000)
+    ap.add_argument('--ops', type=int, default=2000, help='upserts/deletes against the store')
+    ap.add_argument('--old-ops', type=int, default=5, help='upserts with the old whole-file rewrite')
+    ap.add_argument('--compact-every', type=int, default=1000)
+    args = ap.parse_args()
+    rnd = random.Random(1)
+
+    with tempfile.TemporaryDirectory() as d:
+        path = os.path.join(d, 'reviews.json')
+        write_reviews(path, args.reviews)
+        print('corpus: %d reviews, %.1f MB' % (args.reviews, os.path.getsize(path) / 1e6))
+
+        read_s = timed(old_read, path)
+        upserts = [synthetic_review(rnd.randrange(args.reviews * 2), rnd) for _ in range(args.old_ops)]
+        old_s = sum(timed(old_upsert, path, r) for r in upserts) / len(upserts)
+        print('old:   read %.1fms per request, upsert %.1fms per request' % (read_s * 1e3, old_s * 1e3))
+
+        write_reviews(path, args.reviews)
+        t0 = time.perf_counter()
+        store = ReviewStore(path, compact_every=args.compact_every)
+        load_s = time.perf_counter() - t0
+
+        ops = []
+        for _ in range(args.ops):
+            i = rnd.randrange(args.reviews * 2)
+            ops.append(('del', 'm-%d' % i) if rnd.random() < 0.2 else ('put', synthetic_review(i, rnd)))
+        t0 = time.perf_counter()
+        for kind, arg in ops:
+            if kind == 'put':
+                store.upsert(arg)
+            else:
+                store.delete(arg)
+        write_s = (time.perf_counter() - t0) / len(ops)
+        t0 = time.perf_counter()
+        for _ in range(1000):
+            store.get('m-%d' % rnd.randrange(args.reviews))
+        get_s = (time.perf_counter() - t0) / 1000
+        all_s = timed(store.all)
+        compact_s = timed(store.compact)  # waits for any background compaction first
+        print('store: load %.1fms once, write %.3fms amortized (compaction every %d), get %.4fms, '
+              'snapshot %.1fms, compaction %.1fms' % (load_s * 1e3, write_s * 1e3, args.compact_every,
+                                                     get_s * 1e3, all_s * 1e3, compact_s * 1e3))
+
+        # the journal must round-trip: reload and compare
+        store.upsert(synthetic_review(0, rnd))
+        expected = store.all()
+        assert ReviewStore(path).all() == expected, 'journal replay mismatch'
+        print('reload after journal replay: %d reviews, identical' % len(expected))
+
+
+if __name__ == '__main__':
+    main()
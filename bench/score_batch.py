@@ -0,0 +1,53 @@
+"""score_text loop vs score_batch for N = 1..64 candidates of ~1k tokens.
+
+    python3 -m bench.score_batch --tokens 1000 --repeat 20
+"""
+import argparse
+import random
+import time
+
+from bench.corpus import synthetic_reviews
+from reranker import RerankerModel, score_batch, score_text
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Batch scoring microbenchmark')
+    ap.add_argument('--reviews', type=int, default=5000)
+    ap.add_argument('--vocab', type=int, default=20000)
+    ap.add_argument('--tokens', type=int, default=1000)
+    ap.add_argument('--repeat', type=int, default=20)
+    args = ap.parse_args()
+
+    reviews = synthetic_reviews(args.reviews, vocab_size=args.vocab)
+    # some reviews rate only one criterion, so tables contain gaps (NaN)
+    for r in reviews[::7]:
+        r.pop('rating', None)
+        r['criteria'] = {'clarity': 4}
+    model = RerankerModel.from_records(reviews)
+    compiled = model.compiled()
+    weights = {'factuality': 2, 'clarity': 1, 'ethics': 1}
+    rnd = random.Random(3)
+    vocab = sorted(model.token_scores['factuality']) + ['unseen%d' % i for i in range(500)]
+
+    print('%4s %12s %12s %8s' % ('N', 'score_text', 'score_batch', 'speedup'))
+    for n in (1, 2, 4, 8, 16, 32, 64):
+        texts = [' '.join(rnd.choice(vocab) for _ in range(args.tokens)) for _ in range(n)]
+        expected = [score_text(t, model.token_scores, weights) for t in texts]
+        assert score_batch(texts, compiled, weights) == expected, 'score_batch differs from score_text'
+        loop_s = best_of(lambda: [score_text(t, model.token_scores, weights) for t in texts], args.repeat)
+        batch_s = best_of(lambda: score_batch(texts, compiled, weights), args.repeat)
+        print('%4d %10.2fms %10.2fms %7.1fx' % (n, loop_s * 1e3, batch_s * 1e3, loop_s / batch_s))
+    print('results identical to score_text for every N')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""Near-duplicate prompt cache (similar_cache.py): lookup cost, recall and false hits.
+
+1. In-process, for each --sizes N: N synthetic prompts (8-14 words: a few
+   question words plus topic words from a --vocab word vocabulary) are
+   stored, then --queries lookups of three kinds are timed:
+   - paraphrase: a stored prompt with its words shuffled, its case and
+     punctuation changed, and 1-3 words dropped or filler words added. It
+     should hit when it is still above the threshold, and return that
+     prompt's replies (anything else is a wrong hit).
+   - unrelated: a fresh random prompt; every hit is a false hit.
+   - exact: a stored prompt as is.
+   Reported: store rate, lookup p50/p99, hit rates, LSH candidates and
+   false positives per lookup, and the process RSS growth.
+   At the first size, recall is compared with an exhaustive scan.
+2. End to end: a class asks the peer_dataset.json questions, each student
+   in their own words, with CHAT_CACHE=1 alone and with CHAT_SIMILAR=1;
+   upstream calls and latency.
+
+    python3 -m bench.similar_cache --sizes 10000,100000,1000000
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+
+from bench.common import backend, percentile, proc_status_kb, request, scratch_dir, summarize
+from bench.stub_openai import start_stub
+from reranker import _tokenize
+from similar_cache import SimilarCache
+
+_QUESTION = ('what why how when where which explain describe compare is are does do the a of in '
+             'for to and between').split()
+_FILLER = ('please', 'briefly', 'exactly', 'really', 'simply')
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def topic_words(vocab, seed=0):
+    rnd = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    words = set()
+    while len(words) < vocab:
+        words.add(''.join(rnd.choice(letters) for _ in range(rnd.randint(4, 10))))
+    return sorted(words)
+
+
+def prompt(rnd, topics):
+    words = rnd.sample(_QUESTION, rnd.randint(3, 5)) + [rnd.choice(topics) for _ in range(rnd.randint(5, 9))]
+    return ' '.join(words) + '?'
+
+
+def paraphrase(rnd, text, edits=1):
+    words = text.rstrip('?').split()
+    rnd.shuffle(words)
+    for _ in range(edits):
+        if rnd.random() < 0.5 and len(words) > 4:
+            words.pop(rnd.randrange(len(words)))
+        else:
+            words.insert(rnd.randrange(len(words) + 1), rnd.choice(_FILLER))
+    out = ' '.join(words)
+    return (out.capitalize() if rnd.random() < 0.5 else out.upper()) + rnd.choice(('?', '.', '!', ''))
+
+
+def jaccard(a, b):
+    a, b = set(_tokenize(a)), set(_tokenize(b))
+    return len(a & b) / float(len(a | b))
+
+
+def timed_lookups(cache, queries):
+    """[(replies, elapsed seconds)] for (context, text) queries."""
+    out = []
+    for text in queries:
+        t0 = time.perf_counter()
+        replies, _ = cache.get('ctx', text)
+        out.append((replies, time.perf_counter() - t0))
+    return out
+
+
+def in_process(size, args, topics, exhaustive=False):
+    rnd = random.Random(size)
+    prompts = [prompt(rnd, topics) for _ in range(size)]
+    rss0 = proc_status_kb(os.getpid(), 'VmRSS')
+    cache = SimilarCache(threshold=args.threshold, max_entries=size, max_bytes=1 << 40, ttl=3600.0)
+    t0 = time.perf_counter()
+    for i, text in enumerate(prompts):
+        cache.put('ctx', text, ['reply %d' % i])
+    store_s = time.perf_counter() - t0
+    rss = (proc_status_kb(os.getpid(), 'VmRSS') - rss0) / 1024.0
+    print('  %8d prompts: stored at %7.0f/s, +%.0f MB RSS (index %.0f MB)' % (
+        size, size / store_s, rss, cache.stats()['index_bytes'] / 1048576.0))
+
+    picks = [rnd.randrange(size) for _ in range(args.queries)]
+    # mostly one edit; two or three push some paraphrases under the threshold
+    para = [paraphrase(rnd, prompts[i], rnd.choice((1, 1, 2, 3))) for i in picks]
+    kinds = (('paraphrase', para, picks), ('unrelated', [prompt(rnd, topics) for _ in range(args.queries)], None),
+             ('exact', [prompts[i] for i in picks], picks))
+    for name, queries, sources in kinds:
+        before = cache.stats()
+        results = timed_lookups(cache, queries)
+        after = cache.stats()
+        hits = sum(1 for replies, _ in results if replies is not None)
+        wrong = 0
+        if sources is not None:
+            wrong = sum(1 for (replies, _), i in zip(results, sources)
+                        if replies is not None and replies != ['reply %d' % i])
+        eligible = ''
+        if name == 'paraphrase':
+            above = sum(1 for q, i in zip(queries, sources) if jaccard(q, prompts[i]) >= args.threshold)
+            eligible = ' (%d%% of them at or above the threshold)' % (100 * above // len(queries))
+        us = [e * 1e6 for _, e in results]
+        print('    %-10s p50 %6.1fus  p99 %6.1fus  hits %5.1f%%  wrong %d  candidates %.2f  false positives %.2f'
+              ' per lookup%s' % (
+                  name, percentile(us, 50), percentile(us, 99), 100.0 * hits / len(results), wrong,
+                  (after['candidates'] - before['candidates']) / float(len(results)),
+                  (after['false_positives'] - before['false_positives']) / float(len(results)), eligible))
+        if name == 'unrelated':
+            assert hits <= len(results) // 100, 'unrelated prompts hit the cache'
+        if name == 'paraphrase':
+            paraphrase_hits = hits
+    if exhaustive:
+        # the best possible recall at this threshold: scan every stored prompt
+        found = 0
+        t0 = time.perf_counter()
+        sets = [set(_tokenize(p)) for p in prompts]
+        for q in para[:200]:
+            mine = set(_tokenize(q))
+            found += any(len(mine & s) / float(len(mine | s)) >= args.threshold for s in sets)
+        scan_ms = (time.perf_counter() - t0) * 1000.0 / min(200, len(para))
+        print('    exhaustive scan: %.1f ms per lookup, finds a match for %.1f%% of the paraphrases '
+              '(LSH: %.1f%%)' % (scan_ms, 100.0 * found / min(200, len(para)), 100.0 * paraphrase_hits / len(para)))
+
+
+def class_questions():
+    with open(os.path.join(_ROOT, 'peer_dataset.json'), 'r', encoding='utf-8') as f:
+        return [item['question'] for item in json.load(f) if item.get('question')]
+
+
+def end_to_end(args):
+    questions = class_questions()
+    rnd = random.Random(1)
+    # each student's own wording: shuffled, re-cased, re-punctuated, sometimes with a filler word
+    asked = [[paraphrase(rnd, q) if s else q for q in questions] for s in range(args.students)]
+    stub = start_stub(latency=args.latency, tokens=40)
+    try:
+        for label, extra in (('CHAT_CACHE=1', {}), ('CHAT_CACHE=1 CHAT_SIMILAR=1', {'CHAT_SIMILAR': '1'})):
+            env = {'OPENAI_API_KEY': 'stub', 'OPENAI_BASE_URL': stub.base_url, 'CHAT_CACHE': '1',
+                   'RERANK_ADAPTIVE': '0', 'SERVER_LOG_PATH': '',
+                   'CHAT_SIMILAR_THRESHOLD': str(args.threshold)}
+            env.update(extra)
+            with scratch_dir() as d:
+                with backend(d, env) as port:
+                    calls = stub.calls
+                    latencies = []
+                    lock = threading.Lock()
+
+                    def student(mine):
+                        for q in mine:
+                            status, body, elapsed = request(port, 'POST', '/chat', {
+                                'messages': [{'role': 'user', 'content': q}], 'n': 2, 'temperature': 0})
+                            assert status == 200, body
+                            with lock:
+                                latencies.append(elapsed)
+
+                    # the first student asks alone, the rest of the class follows
+                    student(asked[0])
+                    threads = [threading.Thread(target=student, args=(mine,)) for mine in asked[1:]]
+                    for t in threads:
+                        t.start()
+                    for t in threads:
+                        t.join()
+                    s = summarize(latencies)
+                    print('  %-28s upstream calls %4d of %4d requests  p50 %7.1fms  p99 %7.1fms' % (
+                        label, stub.calls - calls, len(latencies), s['p50_ms'], s['p99_ms']))
+    finally:
+        stub.shutdown()
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Near-duplicate prompt cache: lookup cost, recall, false hits')
+    ap.add_argument('--sizes', default='10000,100000,1000000', help='comma-separated cached prompt counts')
+    ap.add_argument('--queries', type=int, default=2000, help='lookups per kind and size')
+    ap.add_argument('--vocab', type=int, default=20000, help='distinct topic words')
+    ap.add_argument('--threshold', type=float, default=0.8)
+    ap.add_argument('--students', type=int, default=20)
+    ap.add_argument('--latency', type=float, default=0.3, help='stub upstream latency (seconds)')
+    args = ap.parse_args()
+    topics = topic_words(args.vocab)
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    print('in process (threshold %.2f):' % args.threshold)
+    for k, size in enumerate(sizes):
+        in_process(size, args, topics, exhaustive=k == 0)
+    print('end to end (%d students x %d questions, stub latency %.0f ms):' % (
+        args.students, len(class_questions()), args.latency * 1000))
+    end_to_end(args)
+
+
+if __name__ == '__main__':
+    main()
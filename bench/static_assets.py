@@ -0,0 +1,169 @@
+"""Serving the frontend: read-the-file-per-hit vs in-memory assets (static_assets.py).
+
+1. Page visits: --clients threads each make --visits visits; a visit fetches
+   every frontend file (HTML and CSS) over fresh connections, as a browser
+   with an empty connection pool would. Two servers:
+   - per hit: reads the file on every request and sends no caching headers,
+     like local-server.js, so every visit downloads everything again.
+   - backend: server_py.py serving from memory; clients accept gzip and
+     revalidate with If-None-Match after their first visit, so repeat
+     visits are 304s without a body.
+   Reported: visits/s, p50/p99 per visit and bytes per first / repeat visit.
+2. Dev mode: with STATIC_WATCH=1, how long after a file is rewritten the
+   backend serves the new version.
+
+    python3 -m bench.static_assets --clients 8 --visits 50
+"""
+import argparse
+import http.client
+import os
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from bench.common import ROOT, backend, scratch_dir, summarize
+from static_assets import StaticAssets
+
+_EXCLUDE = ('server.js', 'local-server.js')
+
+
+class _PerHitHandler(BaseHTTPRequestHandler):
+    """Reads the file on every request, no ETag / Cache-Control (as local-server.js does)."""
+    types = {'.html': 'text/html', '.css': 'text/css', '.js': 'application/javascript'}
+
+    def do_GET(self):
+        name = self.path.split('?')[0].lstrip('/') or 'index.html'
+        try:
+            with open(os.path.join(self.server.root, name), 'rb') as f:
+                body = f.read()
+        except OSError:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', self.types.get(os.path.splitext(name)[1], 'text/plain'))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_per_hit(root):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _PerHitHandler)
+    server.daemon_threads = True
+    server.root = root
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def fetch(port, path, etag=None):
+    """(status, bytes on the wire, ETag) for one GET over a fresh connection."""
+    headers = {'Accept-Encoding': 'gzip'}
+    if etag:
+        headers['If-None-Match'] = etag
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        conn.request('GET', path, headers=headers)
+        resp = conn.getresponse()
+        body = resp.read()
+        return resp.status, len(body), resp.getheader('ETag')
+    finally:
+        conn.close()
+
+
+def visits(port, paths, clients, count):
+    """Run the visits; returns (visits/s, summary, bytes of a first visit, bytes of a repeat visit)."""
+    latencies = []
+    sizes = {'first': [], 'repeat': []}
+    lock = threading.Lock()
+
+    def client():
+        etags = {}
+        mine = []
+        first = repeat = 0
+        for v in range(count):
+            t0 = time.perf_counter()
+            total = 0
+            for path in paths:
+                status, size, etag = fetch(port, path, etags.get(path))
+                assert status in (200, 304), (path, status)
+                total += size
+                if etag:
+                    etags[path] = etag
+            mine.append(time.perf_counter() - t0)
+            if v == 0:
+                first = total
+            else:
+                repeat = total
+        with lock:
+            latencies.extend(mine)
+            sizes['first'].append(first)
+            sizes['repeat'].append(repeat)
+
+    t0 = time.perf_counter()
+    ts = [threading.Thread(target=client) for _ in range(clients)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    return len(latencies) / elapsed, summarize(latencies), max(sizes['first']), max(sizes['repeat'])
+
+
+def watch_lag(interval_ms):
+    """Milliseconds between rewriting a file and the backend serving the new version (STATIC_WATCH=1)."""
+    with scratch_dir(copy_data=False) as site, scratch_dir() as d:
+        shutil.copy(os.path.join(ROOT, 'styles.css'), os.path.join(site, 'styles.css'))
+        env = {'STATIC_DIR': site, 'STATIC_WATCH': '1', 'STATIC_WATCH_MS': str(interval_ms),
+               'SERVER_LOG_PATH': ''}
+        with backend(d, env) as port:
+            _, _, before = fetch(port, '/styles.css')
+            with open(os.path.join(site, 'styles.css'), 'a') as f:
+                f.write('\n/* edited */\n')
+            t0 = time.perf_counter()
+            while time.perf_counter() - t0 < 10:
+                status, _, etag = fetch(port, '/styles.css')
+                if status == 200 and etag != before:
+                    return (time.perf_counter() - t0) * 1000.0
+                time.sleep(0.01)
+    return None
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Frontend serving: per-hit file reads vs in-memory assets')
+    ap.add_argument('--clients', type=int, default=8)
+    ap.add_argument('--visits', type=int, default=50, help='visits per client (the first one is cold)')
+    ap.add_argument('--watch-ms', type=int, default=200, help='STATIC_WATCH_MS for the dev-mode check')
+    args = ap.parse_args()
+
+    names = StaticAssets(ROOT, exclude=_EXCLUDE).names()
+    paths = ['/' + n for n in names if n.endswith(('.html', '.css'))]
+    print('%d files per visit, %.0f KB' % (len(paths), sum(os.path.getsize(os.path.join(ROOT, p[1:]))
+                                                           for p in paths) / 1024.0))
+    per_hit = start_per_hit(ROOT)
+    results = {}
+    try:
+        rps, s, first, repeat = visits(per_hit.server_address[1], paths, args.clients, args.visits)
+        results['per hit'] = (rps, s, repeat)
+        print('  %-8s %7.1f visits/s  p50 %7.1fms  p99 %7.1fms  first visit %7.1f KB  repeat visit %7.1f KB' % (
+            'per hit', rps, s['p50_ms'], s['p99_ms'], first / 1024.0, repeat / 1024.0))
+    finally:
+        per_hit.shutdown()
+    with scratch_dir() as d:
+        with backend(d, {'SERVER_LOG_PATH': ''}) as port:
+            rps, s, first, repeat = visits(port, paths, args.clients, args.visits)
+            results['backend'] = (rps, s, repeat)
+            print('  %-8s %7.1f visits/s  p50 %7.1fms  p99 %7.1fms  first visit %7.1f KB  repeat visit %7.1f KB' % (
+                'backend', rps, s['p50_ms'], s['p99_ms'], first / 1024.0, repeat / 1024.0))
+    lag = watch_lag(args.watch_ms)
+    print('  dev mode (STATIC_WATCH_MS=%d): edit served after %s' % (
+        args.watch_ms, '%.0f ms' % lag if lag is not None else 'NEVER'))
+    assert results['backend'][2] == 0, 'repeat visits still downloaded bodies'
+    assert lag is not None, 'STATIC_WATCH did not pick up the edit'
+
+
+if __name__ == '__main__':
+    main()
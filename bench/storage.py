@@ -0,0 +1,125 @@
+"""JSON vs SQLite storage backends at 10k-1M records (in-process, no HTTP).
+
+For each size it measures opening the stores (the first open includes the
+one-time import into SQLite, the reopen does not), review read/write mixes
+from several threads (get by messageId vs upsert), appending rankings,
+rankings for one itemId (a full scan of the JSONL log, an index lookup in
+SQLite) and a page of reviews:
+
+    python3 -m bench.storage --sizes 10000,100000,1000000
+"""
+import argparse
+import os
+import random
+import threading
+import time
+
+from bench.common import scratch_dir, summarize
+from bench.corpus import write_rankings, write_reviews
+from jsonl_log import JsonlLog
+from review_store import ReviewStore
+from sqlite_store import SqliteReviewStore, open_log
+
+
+def open_json(d):
+    return (ReviewStore(os.path.join(d, 'reviews.json')),
+            JsonlLog(os.path.join(d, 'peer_rankings.jsonl'), os.path.join(d, 'peer_rankings.json')))
+
+
+def open_sqlite(d, synchronous='NORMAL'):
+    return (SqliteReviewStore(os.path.join(d, 'reviews.db'), os.path.join(d, 'reviews.json'), synchronous),
+            open_log(os.path.join(d, 'peer_rankings.db'), 'peer_rankings', lambda n: os.path.join(d, n), synchronous))
+
+
+def mix(store, size, read_fraction, ops, threads, seed=0):
+    """(ops/s, summary) for `ops` get/upsert calls split over `threads` threads."""
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(w):
+        rnd = random.Random(seed * 1000 + w)
+        mine = []
+        for i in range(ops // threads):
+            mid = 'm-%d' % rnd.randrange(size)
+            t0 = time.perf_counter()
+            if rnd.random() < read_fraction:
+                store.get(mid)
+            else:
+                store.upsert({'messageId': mid, 'rating': rnd.randint(1, 5), 'assistantText': 'updated %d' % i,
+                              'timestamp': '2025-10-01T00:00:00Z'})
+            mine.append(time.perf_counter() - t0)
+        with lock:
+            latencies.extend(mine)
+
+    ts = [threading.Thread(target=worker, args=(w,)) for w in range(threads)]
+    t0 = time.perf_counter()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    wall = time.perf_counter() - t0
+    return len(latencies) / wall, summarize(latencies)
+
+
+def timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e3
+
+
+def run(label, opener, d, size, args):
+    t0 = time.perf_counter()
+    reviews, ranks = opener(d)
+    opened = time.perf_counter() - t0
+    print('  %-7s first open %6.0fms' % (label, opened * 1e3))
+    for read_fraction in (0.9, 0.5):
+        rate, s = mix(reviews, size, read_fraction, args.ops, args.threads)
+        print('  %-7s reviews %2d%% reads  %8.0f ops/s  p50 %6.2fms  p99 %7.2fms' % (
+            label, read_fraction * 100, rate, s['p50_ms'], s['p99_ms']))
+    t0 = time.perf_counter()
+    for i in range(args.appends):
+        ranks.append({'itemId': 'item-%d' % (i % 1000), 'responseIndex': i % 2})
+    print('  %-7s rankings append  %8.0f/s' % (label, args.appends / (time.perf_counter() - t0)))
+    print('  %-7s rankings for one itemId %7.1fms   reviews page of 100 at the end %6.1fms   all rankings %7.0fms' % (
+        label, timed(lambda: list(ranks.select('itemId', 'item-7'))),
+        timed(lambda: reviews.page(max(0, len(reviews) - 100), 100)),
+        timed(lambda: sum(1 for _ in ranks), 1)))
+    t0 = time.perf_counter()
+    reviews.close()
+    ranks.close()
+    closed = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    reviews, ranks = opener(d)
+    reopened = time.perf_counter() - t0
+    reviews.close()
+    ranks.close()
+    print('  %-7s close %7.0fms   reopen %7.0fms' % (label, closed * 1e3, reopened * 1e3))
+
+
+def main():
+    ap = argparse.ArgumentParser(description='JSON vs SQLite storage backends')
+    ap.add_argument('--sizes', default='10000,100000')
+    ap.add_argument('--ops', type=int, default=20000, help='review get/upsert calls per mix')
+    ap.add_argument('--threads', type=int, default=4)
+    ap.add_argument('--appends', type=int, default=2000, help='rankings appended per backend')
+    ap.add_argument('--words', type=int, default=20, help='words per assistantText')
+    ap.add_argument('--synchronous', default='NORMAL', help='SQLite synchronous setting')
+    args = ap.parse_args()
+
+    for size in [int(s) for s in args.sizes.split(',')]:
+        print('%d reviews, %d rankings' % (size, size))
+        for label, opener in (('json', open_json), ('sqlite', lambda d: open_sqlite(d, args.synchronous))):
+            with scratch_dir() as d:
+                for name in os.listdir(d):
+                    os.remove(os.path.join(d, name))
+                write_reviews(os.path.join(d, 'reviews.json'), size, words=args.words)
+                write_rankings(os.path.join(d, 'peer_rankings.json'), size, 1000)
+                run(label, opener, d, size, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Time-to-first-token for /chat with and without SSE streaming.
+
+The stub upstream waits --latency seconds before the first token and then
+--token-delay seconds per word, like a real model generating text:
+
+    python3 -m bench.stream_ttft --requests 10 --tokens 80 --token-delay 0.01
+"""
+import argparse
+import http.client
+import json
+import time
+
+from bench.common import backend, scratch_dir, summarize
+from bench.stub_openai import start_stub
+
+
+def chat_timings(port, stream):
+    """Return (seconds to first reply byte, seconds to full reply) for one /chat call."""
+    body = json.dumps({'messages': [{'role': 'user', 'content': 'Explain why the sky is blue.'}],
+                       'stream': stream}).encode('utf-8')
+    t0 = time.perf_counter()
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request('POST', '/chat', body=body, headers={'Content-Type': 'application/json'})
+        resp = conn.getresponse()
+        first = None
+        if stream:
+            for line in resp:
+                if first is None and line.startswith(b'data: ') and b'"delta"' in line:
+                    first = time.perf_counter() - t0
+        else:
+            resp.read()
+        total = time.perf_counter() - t0
+    finally:
+        conn.close()
+    return (first if first is not None else total), total
+
+
+def main():
+    ap = argparse.ArgumentParser(description='SSE time-to-first-token benchmark')
+    ap.add_argument('--requests', type=int, default=10)
+    ap.add_argument('--latency', type=float, default=0.2)
+    ap.add_argument('--tokens', type=int, default=80)
+    ap.add_argument('--token-delay', type=float, default=0.01)
+    args = ap.parse_args()
+
+    stub = start_stub(latency=args.latency, tokens=args.tokens, token_delay=args.token_delay)
+    try:
+        with scratch_dir() as d:
+            with backend(d, {'OPENAI_API_KEY': 'stub', 'OPENAI_BASE_URL': stub.base_url}) as port:
+                for stream in (False, True):
+                    runs = [chat_timings(port, stream) for _ in range(args.requests)]
+                    ttft = summarize([r[0] for r in runs])
+                    total = summarize([r[1] for r in runs])
+                    print('%-10s ttft p50 %8.1fms p99 %8.1fms   total p50 %8.1fms' % (
+                        'stream' if stream else 'json', ttft['p50_ms'], ttft['p99_ms'], total['p50_ms']))
+    finally:
+        stub.shutdown()
+
+
+if __name__ == '__main__':
+    main()
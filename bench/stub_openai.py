@@ -0,0 +1,240 @@
+"""Local stand-in for the OpenAI chat-completions endpoint.
+
+Serves ``POST /v1/chat/completions`` with canned candidates after a
+configurable delay (as SSE chunks when the payload has ``stream: true``), so the backend can be benchmarked without network access.
+The candidate count follows the payload's ``n`` unless ``--n`` fixes it.
+``--prompt-delay`` adds time per 1000 characters of prompt messages (like
+prefill on a real model); ``server.prompt_chars`` counts what was received.
+
+Faults can be injected to exercise the backend's retries, hedging, circuit
+breaker and concurrency limit (resilience.py): a share of requests failing
+with ``--fail-status`` (``--fail-rate``), a slow tail (``--slow-rate`` /
+``--slow-latency``) and 429 answers with ``Retry-After`` above
+``--max-inflight`` concurrent requests. ``server.config`` can be changed
+while the stub runs (e.g. ``fail_rate=1.0`` for an outage):
+
+    python3 -m bench.stub_openai --port 8001 --latency 0.3
+    python3 -m bench.stub_openai --port 8001 --fail-rate 0.2 --slow-rate 0.05 --slow-latency 3 --max-inflight 4
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=stub python3 server_py.py
+"""
+import argparse
+import json
+import random
+import select
+import socket
+import ssl
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+# the candidates are drawn from these words (bench.corpus.criteria_reviews rates them)
+WORDS = ('the light scatters because shorter wavelengths interact more strongly with '
+         'molecules in the atmosphere which explains why clear skies look blue').split()
+
+
+def make_text(tokens, seed):
+    rnd = random.Random(seed)
+    return ' '.join(rnd.choice(WORDS) for _ in range(max(1, tokens)))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # keep-alive like the real API, so client connection pooling can be measured
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        cfg = self.server.config
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            payload = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+        except Exception:
+            payload = {}
+        with self.server.lock:
+            self.server.calls += 1
+            call = self.server.calls
+            limited = 0 < cfg['max_inflight'] <= self.server.inflight
+            if not limited:
+                self.server.inflight += 1
+            else:
+                self.server.faults['rate_limited'] += 1
+        if limited:
+            self._error(429, 'Rate limit reached', {'Retry-After': '%g' % cfg['retry_after']})
+            return
+        try:
+            self._answer(cfg, payload, call)
+        finally:
+            with self.server.lock:
+                self.server.inflight -= 1
+
+    def _answer(self, cfg, payload, call):
+        prompt_chars = sum(len(str(m.get('content') or '')) for m in payload.get('messages') or []
+                           if isinstance(m, dict))
+        with self.server.lock:
+            self.server.prompt_chars += prompt_chars
+        delay = cfg['latency'] + random.uniform(0, cfg['jitter']) + cfg['prompt_delay'] * prompt_chars / 1000.0
+        if cfg['slow_rate'] and random.random() < cfg['slow_rate']:
+            delay += cfg['slow_latency']
+            with self.server.lock:
+                self.server.faults['slow'] += 1
+        if delay > 0:
+            time.sleep(delay)
+        if self._client_gone():
+            # like the real API, stop instead of answering a closed connection
+            with self.server.lock:
+                self.server.disconnects += 1
+            self.close_connection = True
+            return
+        if cfg['fail_rate'] and random.random() < cfg['fail_rate']:
+            with self.server.lock:
+                self.server.faults['failed'] += 1
+            self._error(cfg['fail_status'], 'Injected failure')
+            return
+        n = cfg['n'] or max(1, int(payload.get('n') or 1))
+        if payload.get('stream'):
+            self._stream(call, n)
+            return
+        if cfg['token_delay'] > 0:
+            time.sleep(cfg['token_delay'] * cfg['tokens'])
+        choices = [{'index': i, 'message': {'role': 'assistant', 'content': make_text(cfg['tokens'], call * 100 + i)},
+                    'finish_reason': 'stop'} for i in range(n)]
+        body = json.dumps({'id': 'stub-%d' % call, 'object': 'chat.completion',
+                           'model': payload.get('model', 'stub'), 'choices': choices}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _client_gone(self):
+        try:
+            readable, _, _ = select.select([self.connection], [], [], 0)
+            return bool(readable) and not self.connection.recv(1, socket.MSG_PEEK)
+        except ValueError:
+            # TLS sockets cannot peek; assume the client is still there
+            return False
+        except OSError:
+            return True
+
+    def _error(self, status, message, headers=None):
+        body = json.dumps({'error': {'message': message, 'type': 'stub_fault'}}).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, call, n):
+        """Send the candidates as chat.completion.chunk events, one word per choice per tick."""
+        cfg = self.server.config
+        words = [make_text(cfg['tokens'], call * 100 + i).split(' ') for i in range(n)]
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for pos in range(cfg['tokens']):
+                for i in range(n):
+                    if pos >= len(words[i]):
+                        continue
+                    delta = words[i][pos] if pos == 0 else ' ' + words[i][pos]
+                    chunk = {'id': 'stub-%d' % call, 'object': 'chat.completion.chunk',
+                             'choices': [{'index': i, 'delta': {'content': delta}, 'finish_reason': None}]}
+                    self._chunk(b'data: ' + json.dumps(chunk).encode('utf-8') + b'\n\n')
+                self.wfile.flush()
+                if cfg['token_delay'] > 0:
+                    time.sleep(cfg['token_delay'])
+            self._chunk(b'data: [DONE]\n\n')
+            self.wfile.write(b'0\r\n\r\n')
+            self.wfile.flush()
+        except ConnectionError:
+            # the client closed the stream before its end
+            with self.server.lock:
+                self.server.disconnects += 1
+            self.close_connection = True
+
+    def _chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # fan-out and hedging open many connections at once; the default backlog of 5 drops SYNs
+    request_queue_size = 128
+
+    def __init__(self, addr, latency=0.2, jitter=0.0, tokens=60, token_delay=0.0, certfile=None, keyfile=None, n=0,
+                 fail_rate=0.0, fail_status=503, slow_rate=0.0, slow_latency=0.0, max_inflight=0, retry_after=1.0,
+                 prompt_delay=0.0):
+        HTTPServer.__init__(self, addr, StubHandler)
+        # n=0 answers with the requested number of candidates
+        self.config = {'latency': latency, 'jitter': jitter, 'tokens': tokens, 'token_delay': token_delay, 'n': n,
+                       'fail_rate': fail_rate, 'fail_status': fail_status, 'slow_rate': slow_rate,
+                       'slow_latency': slow_latency, 'max_inflight': max_inflight, 'retry_after': retry_after,
+                       'prompt_delay': prompt_delay}
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.inflight = 0
+        self.faults = {'failed': 0, 'slow': 0, 'rate_limited': 0}
+        # requests the client gave up on before the answer was ready or while it was streamed
+        # (e.g. cancelled fan-out calls)
+        self.disconnects = 0
+        self.prompt_chars = 0
+        self.tls = bool(certfile)
+        if certfile:
+            ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            ctx.load_cert_chain(certfile, keyfile)
+            self.socket = ctx.wrap_socket(self.socket, server_side=True)
+
+    def handle_error(self, request, client_address):
+        # clients (e.g. the losing attempt of a hedged request) may hang up before the answer is written
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            HTTPServer.handle_error(self, request, client_address)
+
+    @property
+    def base_url(self):
+        return '%s://%s:%d/v1' % (('https' if self.tls else 'http',) + tuple(self.server_address[:2]))
+
+
+def start_stub(port=0, **config):
+    """Start a stub in a daemon thread; returns the server (use .base_url, .calls, .shutdown())."""
+    server = StubServer(('127.0.0.1', port), **config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--port', type=int, default=8001)
+    ap.add_argument('--latency', type=float, default=0.2, help='base delay per request (seconds)')
+    ap.add_argument('--jitter', type=float, default=0.0, help='extra uniform random delay (seconds)')
+    ap.add_argument('--tokens', type=int, default=60, help='words per candidate')
+    ap.add_argument('--token-delay', type=float, default=0.0, help='generation time per word (seconds)')
+    ap.add_argument('--n', type=int, default=0, help='candidates per response (0 = as requested)')
+    ap.add_argument('--fail-rate', type=float, default=0.0, help='share of requests answered with --fail-status')
+    ap.add_argument('--fail-status', type=int, default=503)
+    ap.add_argument('--slow-rate', type=float, default=0.0, help='share of requests delayed by --slow-latency')
+    ap.add_argument('--slow-latency', type=float, default=0.0, help='extra delay of slow requests (seconds)')
+    ap.add_argument('--max-inflight', type=int, default=0, help='answer 429 above this many concurrent requests')
+    ap.add_argument('--retry-after', type=float, default=1.0, help='Retry-After seconds sent with 429s')
+    ap.add_argument('--prompt-delay', type=float, default=0.0, help='delay per 1000 prompt characters (seconds)')
+    args = ap.parse_args()
+    server = StubServer(('127.0.0.1', args.port), args.latency, args.jitter, args.tokens, args.token_delay, n=args.n,
+                        fail_rate=args.fail_rate, fail_status=args.fail_status, slow_rate=args.slow_rate,
+                        slow_latency=args.slow_latency, max_inflight=args.max_inflight, retry_after=args.retry_after,
+                        prompt_delay=args.prompt_delay)
+    print('Stub OpenAI upstream at %s' % server.base_url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,342 @@
+"""Reproducible load suite with machine-readable results for comparing commits.
+
+Each run starts the backend in a scratch directory seeded with a synthetic
+reviews.json and peer_rankings.json of the given size (bench/corpus.py),
+pointed at the stub upstream (bench/stub_openai.py). Closed-loop clients then
+send a fixed, seeded sequence of requests drawn from a scenario's mix, so
+every commit sees the same traffic:
+
+- classroom: a peer review session. Students load and revalidate
+  /peer_dataset and /peer_rank_summary (If-None-Match, like a browser), post
+  rankings, ask /chat and rate answers.
+- chat: mostly /chat (varying n, temperature, streaming and follow-up
+  turns) with reviews of the answers.
+- writes: review and ranking posts with paged /reviews reads.
+
+Results are printed as a table and, with --out, written as JSON (commit,
+configuration and per-endpoint counts, throughput and latency percentiles).
+--compare checks a run against an earlier results file and exits with
+status 1 when a latency or throughput got worse by more than --tolerance:
+
+    python3 -m bench.suite --sizes 1000,100000 --out before.json
+    python3 -m bench.suite --sizes 1000,100000 --out after.json --compare before.json
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from bench.common import ROOT, backend_process, proc_status_kb, scratch_dir, summarize
+from bench.corpus import write_rankings, write_reviews
+from bench.stub_openai import make_text, start_stub
+
+_ADMIN = {'X-Admin-Token': 'secret-token'}
+
+# relative weights of each operation
+SCENARIOS = {
+    'classroom': {'peer_dataset': 30, 'peer_rank_summary': 10, 'peer_rank': 25, 'chat': 20, 'review': 15},
+    'chat': {'chat': 70, 'review': 20, 'reviews_page': 10},
+    'writes': {'review': 40, 'peer_rank': 40, 'reviews_page': 20},
+}
+
+
+def _load_dataset():
+    with open(os.path.join(ROOT, 'peer_dataset.json'), 'r', encoding='utf-8') as f:
+        items = json.load(f)
+    questions = [item['question'] for item in items if item.get('question')]
+    return questions, [item['id'] for item in items if item.get('id')]
+
+
+class Client:
+    """One simulated user: a seeded random stream of operations and the state a browser would keep."""
+
+    def __init__(self, port, index, size, seed, questions, item_ids):
+        self.port = port
+        self.index = index
+        self.size = size
+        self.rnd = random.Random(seed * 100003 + index)
+        self.questions = questions
+        self.item_ids = item_ids
+        self.etags = {}
+        self.cursor = None
+        self.history = []
+        self.posted = 0
+
+    def call(self, method, path, body=None, headers=None):
+        """(status, response headers, body bytes) for one request on a fresh connection."""
+        hdrs = dict(headers or {})
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode('utf-8')
+            hdrs['Content-Type'] = 'application/json'
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=120)
+        try:
+            conn.request(method, path, body=data, headers=hdrs)
+            resp = conn.getresponse()
+            payload = resp.read()
+            return resp.status, resp, payload
+        finally:
+            conn.close()
+
+    def revalidate(self, path):
+        headers = {'If-None-Match': self.etags[path]} if path in self.etags else {}
+        status, resp, _ = self.call('GET', path, headers=headers)
+        if resp.getheader('ETag'):
+            self.etags[path] = resp.getheader('ETag')
+        return status
+
+    def op_peer_dataset(self):
+        return self.revalidate('/peer_dataset')
+
+    def op_peer_rank_summary(self):
+        return self.revalidate('/peer_rank_summary')
+
+    def op_peer_rank(self):
+        body = {'itemId': self.rnd.choice(self.item_ids), 'responseIndex': self.rnd.randrange(2),
+                'student': 'student-%d' % self.index, 'timestamp': '2025-10-01T00:00:00Z'}
+        return self.call('POST', '/peer/rank', body)[0]
+
+    def op_chat(self):
+        rnd = self.rnd
+        if not self.history or rnd.random() < 0.6:
+            self.history = []
+        self.history.append({'role': 'user', 'content': rnd.choice(self.questions)})
+        body = {'messages': self.history[-6:], 'n': rnd.choice((2, 3, 5)),
+                'temperature': rnd.choice((0, 0.7, 1.0))}
+        if rnd.random() < 0.3:
+            body['weights'] = {'factuality': rnd.randint(1, 3), 'clarity': rnd.randint(1, 3), 'ethics': 1}
+        if rnd.random() < 0.25:
+            body['stream'] = True
+        status, _, payload = self.call('POST', '/chat', body)
+        if status == 200 and not body.get('stream'):
+            try:
+                reply = json.loads(payload).get('reply', '')
+            except ValueError:
+                reply = ''
+            self.history.append({'role': 'assistant', 'content': reply})
+        return status
+
+    def op_review(self):
+        rnd = self.rnd
+        if rnd.random() < 0.3:
+            # a student changing an earlier rating
+            message_id = 'm-%d' % rnd.randrange(max(1, self.size))
+        else:
+            self.posted += 1
+            message_id = 'suite-%d-%d' % (self.index, self.posted)
+        body = {'messageId': message_id, 'rating': rnd.randint(1, 5), 'comment': '',
+                'assistantText': make_text(rnd.randint(20, 80), rnd.randrange(1 << 30)),
+                'timestamp': '2025-10-01T00:00:00Z'}
+        if rnd.random() < 0.5:
+            body['criteria'] = {c: rnd.randint(1, 5) for c in ('factuality', 'clarity', 'ethics')}
+        return self.call('POST', '/review', body)[0]
+
+    def op_reviews_page(self):
+        path = '/reviews?limit=50&exclude=assistantText'
+        if self.cursor:
+            path += '&cursor=' + self.cursor
+        status, _, payload = self.call('GET', path)
+        if status == 200:
+            try:
+                self.cursor = json.loads(payload).get('next_cursor')
+            except ValueError:
+                self.cursor = None
+        return status
+
+
+def run_load(port, scenario, size, clients, requests, seed):
+    """Per-operation latencies (seconds), error counts and the wall time of one scenario run."""
+    questions, item_ids = _load_dataset()
+    mix = SCENARIOS[scenario]
+    ops, weights = list(mix), [mix[k] for k in mix]
+    latencies = {op: [] for op in ops}
+    errors = {op: 0 for op in ops}
+    lock = threading.Lock()
+
+    def worker(index):
+        client = Client(port, index, size, seed, questions, item_ids)
+        plan = client.rnd.choices(ops, weights, k=requests // clients)
+        mine = {op: [] for op in ops}
+        failed = {op: 0 for op in ops}
+        for op in plan:
+            t0 = time.perf_counter()
+            try:
+                status = getattr(client, 'op_' + op)()
+            except Exception:
+                status = 0
+            elapsed = time.perf_counter() - t0
+            if status in (200, 201, 304):
+                mine[op].append(elapsed)
+            else:
+                failed[op] += 1
+        with lock:
+            for op in ops:
+                latencies[op].extend(mine[op])
+                errors[op] += failed[op]
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors, time.perf_counter() - t0
+
+
+def wait_for_reranker(port, timeout=600):
+    """Block until the background reranker build has published (so runs do not race it)."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        try:
+            conn.request('GET', '/admin/stats', headers=_ADMIN)
+            stats = json.loads(conn.getresponse().read()).get('reranker') or {}
+        finally:
+            conn.close()
+        if stats.get('version', 1) >= 1 and not stats.get('building') and not stats.get('pending_changes'):
+            return
+        time.sleep(0.1)
+
+
+def run_one(scenario, size, args, stub, extra_env):
+    with scratch_dir(copy_data=False) as d:
+        shutil.copy(os.path.join(ROOT, 'peer_dataset.json'), os.path.join(d, 'peer_dataset.json'))
+        write_reviews(os.path.join(d, 'reviews.json'), size, seed=args.seed, words=40)
+        write_rankings(os.path.join(d, 'peer_rankings.json'), size, 1000, seed=args.seed)
+        env = {'OPENAI_API_KEY': 'stub', 'OPENAI_BASE_URL': stub.base_url, 'SERVER_BACKLOG': str(max(64, 2 * args.clients))}
+        env.update(extra_env)
+        t0 = time.perf_counter()
+        with backend_process(d, env) as (port, proc):
+            wait_for_reranker(port)
+            ready = time.perf_counter() - t0
+            calls = stub.calls
+            latencies, errors, wall = run_load(port, scenario, size, args.clients, args.requests, args.seed)
+            upstream = stub.calls - calls
+            rss = proc_status_kb(proc.pid, 'VmHWM')
+    total = sum(len(v) for v in latencies.values()) + sum(errors.values())
+    endpoints = {}
+    for op, lat in sorted(latencies.items()):
+        s = summarize(lat)
+        s.update({'errors': errors[op], 'rps': round(len(lat) / wall, 1)})
+        endpoints[op] = s
+    return {
+        'scenario': scenario, 'reviews': size, 'requests': total, 'errors': sum(errors.values()),
+        'wall_s': round(wall, 3), 'rps': round(total / wall, 1), 'ready_s': round(ready, 3),
+        'upstream_calls': upstream, 'server_peak_rss_kb': rss, 'endpoints': endpoints,
+    }
+
+
+def git_revision():
+    """(short commit, dirty) of the working tree, or (None, None) outside a git checkout."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, timeout=30).stdout.strip() or None
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                capture_output=True, text=True, timeout=30).stdout
+        return commit, bool(status.strip())
+    except Exception:
+        return None, None
+
+
+def compare(results, baseline, tolerance):
+    """Print per-endpoint changes against a baseline results dict; returns the regressions."""
+    before = {(r['scenario'], r['reviews']): r for r in baseline.get('runs', [])}
+    regressions = []
+    print('\ncompared with %s (%s):' % (baseline.get('commit'), baseline.get('started_at')))
+    for run in results['runs']:
+        old = before.get((run['scenario'], run['reviews']))
+        if old is None:
+            print('  %s/%d: not in the baseline' % (run['scenario'], run['reviews']))
+            continue
+        for op, new in sorted(run['endpoints'].items()):
+            prev = old['endpoints'].get(op)
+            if not prev or not prev['count'] or not new['count']:
+                continue
+            changes = []
+            for key, worse_if_higher in (('p50_ms', True), ('p99_ms', True), ('rps', False)):
+                if not prev[key]:
+                    continue
+                delta = new[key] / prev[key] - 1
+                changes.append('%s %+.0f%%' % (key[:-3] if key.endswith('_ms') else key, delta * 100))
+                if (delta if worse_if_higher else -delta) > tolerance:
+                    regressions.append('%s/%d %s %s %.2f -> %.2f' % (
+                        run['scenario'], run['reviews'], op, key, prev[key], new[key]))
+            print('  %-9s %8d %-18s %s' % (run['scenario'], run['reviews'], op, '  '.join(changes)))
+    for line in regressions:
+        print('REGRESSION ' + line)
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Reproducible load suite (JSON results)')
+    ap.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma-separated: ' + ', '.join(SCENARIOS))
+    ap.add_argument('--sizes', default='1000,20000', help='comma-separated review (and ranking) counts')
+    ap.add_argument('--clients', type=int, default=16)
+    ap.add_argument('--requests', type=int, default=1600, help='requests per run, split over the clients')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--latency', type=float, default=0.05, help='stub upstream delay (seconds)')
+    ap.add_argument('--jitter', type=float, default=0.0)
+    ap.add_argument('--tokens', type=int, default=60, help='words per stub candidate')
+    ap.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                    help='extra backend environment, e.g. --env STORAGE_BACKEND=sqlite (repeatable)')
+    ap.add_argument('--out', help='write the results as JSON to this file')
+    ap.add_argument('--compare', metavar='FILE', help='earlier results file to compare against')
+    ap.add_argument('--tolerance', type=float, default=0.15, help='relative change counted as a regression')
+    args = ap.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    for s in scenarios:
+        if s not in SCENARIOS:
+            ap.error('unknown scenario %r' % s)
+    extra_env = dict(item.split('=', 1) for item in args.env)
+    commit, dirty = git_revision()
+    results = {
+        'suite': 1,
+        'commit': commit,
+        'dirty': dirty,
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'config': {'clients': args.clients, 'requests': args.requests, 'seed': args.seed,
+                   'stub': {'latency': args.latency, 'jitter': args.jitter, 'tokens': args.tokens},
+                   'env': extra_env, 'mixes': {s: SCENARIOS[s] for s in scenarios}},
+        'runs': [],
+    }
+    stub = start_stub(latency=args.latency, jitter=args.jitter, tokens=args.tokens)
+    try:
+        print('%-9s %8s %-18s %6s %5s %8s %8s %8s %8s' % (
+            'scenario', 'reviews', 'endpoint', 'count', 'errs', 'rps', 'p50_ms', 'p90_ms', 'p99_ms'))
+        for size in [int(s) for s in args.sizes.split(',') if s.strip()]:
+            for scenario in scenarios:
+                run = run_one(scenario, size, args, stub, extra_env)
+                results['runs'].append(run)
+                for op, s in sorted(run['endpoints'].items()):
+                    print('%-9s %8d %-18s %6d %5d %8.1f %8.2f %8.2f %8.2f' % (
+                        scenario, size, op, s['count'], s['errors'], s['rps'], s['p50_ms'], s['p90_ms'], s['p99_ms']))
+                print('%-9s %8d %-18s %6d %5d %8.1f   ready %.1fs, %d upstream calls, peak RSS %d MB' % (
+                    scenario, size, 'total', run['requests'], run['errors'], run['rps'], run['ready_s'],
+                    run['upstream_calls'], run['server_peak_rss_kb'] // 1024))
+    finally:
+        stub.shutdown()
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print('results written to %s' % args.out)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Per-request upstream cost: fresh urllib connections vs the pooled UpstreamClient.
+
+Runs against the stub upstream over TLS (self-signed certificate generated
+with the openssl CLI) or plain HTTP with --no-tls:
+
+    python3 -m bench.upstream_pool --requests 50
+"""
+import argparse
+import json
+import os
+import ssl
+import subprocess
+import tempfile
+import time
+import urllib.request
+
+from bench.common import summarize
+from bench.stub_openai import start_stub
+from upstream import UpstreamClient
+
+PAYLOAD = {'model': 'stub', 'messages': [{'role': 'user', 'content': 'hi'}], 'n': 1}
+
+
+def self_signed_cert(directory):
+    cert = os.path.join(directory, 'stub.crt')
+    key = os.path.join(directory, 'stub.key')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=localhost', '-addext', 'subjectAltName=IP:127.0.0.1',
+                    '-keyout', key, '-out', cert], check=True, capture_output=True)
+    return cert, key
+
+
+def urllib_once(url, cafile):
+    # the pre-pool code path: new SSL context and new connection every call
+    req = urllib.request.Request(url, data=json.dumps(PAYLOAD).encode('utf-8'),
+                                 headers={'Content-Type': 'application/json'}, method='POST')
+    t0 = time.perf_counter()
+    ctx = ssl.create_default_context(cafile=cafile) if cafile else None
+    with urllib.request.urlopen(req, timeout=30, context=ctx) as resp:
+        resp.read()
+    return time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Upstream connection pooling benchmark')
+    ap.add_argument('--requests', type=int, default=50)
+    ap.add_argument('--no-tls', action='store_true')
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as d:
+        cert = key = None
+        if not args.no_tls:
+            cert, key = self_signed_cert(d)
+        stub = start_stub(latency=0.0, tokens=20, certfile=cert, keyfile=key)
+        try:
+            url = stub.base_url + '/chat/completions'
+            fresh = [urllib_once(url, cert) for _ in range(args.requests)]
+
+            ctx = ssl.create_default_context(cafile=cert) if cert else None
+            client = UpstreamClient(stub.base_url, pool_size=4, ssl_context=ctx)
+            pooled, timings = [], []
+            for _ in range(args.requests):
+                t0 = time.perf_counter()
+                with client.post_json('/chat/completions', PAYLOAD) as resp:
+                    resp.read()
+                pooled.append(time.perf_counter() - t0)
+                timings.append(resp.timings)
+            client.close()
+        finally:
+            stub.shutdown()
+
+    f, p = summarize(fresh), summarize(pooled)
+    print('scheme: %s' % ('http' if args.no_tls else 'https'))
+    print('urllib (fresh conn)  p50 %7.2fms  p99 %7.2fms' % (f['p50_ms'], f['p99_ms']))
+    print('UpstreamClient       p50 %7.2fms  p99 %7.2fms' % (p['p50_ms'], p['p99_ms']))
+    first, rest = timings[0], timings[1:]
+    print('first request: connect %.2fms tls %.2fms ttfb %.2fms' % (
+        first['connect_ms'], first['tls_ms'], first['ttfb_ms']))
+    print('later requests: %d/%d reused, mean ttfb %.2fms' % (
+        sum(1 for t in rest if t['reused']), len(rest),
+        sum(t['ttfb_ms'] for t in rest) / max(1, len(rest))))
+
+
+if __name__ == '__main__':
+    main()
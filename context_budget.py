@@ -0,0 +1,234 @@
+"""Token-budget trimming of /chat conversations before the upstream call (stdlib only).
+
+Clients send the whole conversation on every turn, so long sessions keep
+growing the prompt. ContextBudget.trim() fits `messages` into `budget`
+prompt tokens:
+
+1. System (and developer) messages and the last `keep_turns` turns are
+   always kept. A turn is a user message and the replies (assistant, tool)
+   that follow it.
+2. With `clip_tokens`, every older message longer than that is shortened
+   to about that many tokens (its beginning plus " [...]").
+3. The oldest turns are dropped until the rest fits. A short system note
+   saying how many messages were left out takes their place.
+
+A conversation that already fits is returned unchanged.
+
+Token counts are estimated, not exact: words count one token per started
+8 characters, digits, punctuation and every character outside the Latin
+scripts count one each, plus a fixed overhead per message. That is close to
+(and, for English, a little above) what the OpenAI tokenizers give, and a
+few regex scans in C instead of a real BPE. TokenCounter caches the count
+of every message text, so a follow-up turn only counts its new messages.
+"""
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# word-ish pieces and single symbols; long words get one more token per 8 characters
+_PIECE_RE = re.compile(r'\w+|[^\w\s]')
+_LONG_RE = re.compile(r'\w{8}(?=\w)')
+# characters outside Latin/IPA (CJK, Cyrillic, ...): BPE vocabularies give these about one token each
+_WIDE_RE = re.compile(r'[^\x00-\u024f\s]')
+
+# per-message framing (role, separators) and the reply primer, as in OpenAI's counting guide
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 3
+# an image part, at low detail
+IMAGE_TOKENS = 85
+
+KEEP_ROLES = ('system', 'developer')
+# replaces the dropped turns
+_NOTE = '(%d earlier messages of this conversation were left out to fit the context budget.)'
+
+
+def estimate_tokens(text):
+    """Approximate token count of a string."""
+    if not text:
+        return 0
+    return len(_PIECE_RE.findall(text)) + len(_LONG_RE.findall(text)) + len(_WIDE_RE.findall(text))
+
+
+def _content_key(content):
+    """Hashable key for a message's content (a string, or a list of parts)."""
+    if isinstance(content, str):
+        return content
+    try:
+        return json.dumps(content, sort_keys=True)
+    except Exception:
+        return str(content)
+
+
+def _content_tokens(content):
+    if isinstance(content, str):
+        return estimate_tokens(content)
+    if isinstance(content, list):
+        n = 0
+        for part in content:
+            if isinstance(part, dict) and part.get('type') == 'text':
+                n += estimate_tokens(part.get('text') or '')
+            elif isinstance(part, dict) and str(part.get('type', '')).startswith('image'):
+                n += IMAGE_TOKENS
+            else:
+                n += estimate_tokens(_content_key(part))
+        return n
+    return estimate_tokens(_content_key(content)) if content is not None else 0
+
+
+class TokenCounter:
+    """Estimated tokens per message content, memoized (LRU of `max_entries` texts)."""
+
+    def __init__(self, max_entries=20000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._counts = OrderedDict()
+        self.counters = {'hits': 0, 'misses': 0}
+
+    def count(self, content):
+        key = _content_key(content)
+        with self._lock:
+            n = self._counts.get(key)
+            if n is not None:
+                self._counts.move_to_end(key)
+                self.counters['hits'] += 1
+                return n
+        n = _content_tokens(content)
+        with self._lock:
+            self.counters['misses'] += 1
+            self._counts[key] = n
+            while len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return n
+
+    def message(self, m):
+        """Tokens one message adds to the prompt."""
+        n = MESSAGE_OVERHEAD + self.count(m.get('content'))
+        if m.get('name'):
+            n += 1 + estimate_tokens(str(m['name']))
+        if m.get('tool_calls'):
+            n += self.count(_content_key(m['tool_calls']))
+        return n
+
+    def stats(self):
+        with self._lock:
+            out = dict(self.counters)
+            out['entries'] = len(self._counts)
+        return out
+
+
+def clip_text(text, limit, tokens):
+    """Beginning of text worth about `limit` of its `tokens` tokens, cut at a space, plus " [...]"."""
+    cut = max(1, int(len(text) * limit / float(tokens)))
+    head = text[:cut]
+    space = head.rfind(' ')
+    if space > cut // 2:
+        head = head[:space]
+    return head.rstrip() + ' [...]'
+
+
+def _turns(messages):
+    """Indexes of the droppable messages grouped into turns (each starts at a user message)."""
+    turns = []
+    for i, m in enumerate(messages):
+        if m.get('role') in KEEP_ROLES:
+            continue
+        if m.get('role') == 'user' or not turns:
+            turns.append([i])
+        else:
+            turns[-1].append(i)
+    return turns
+
+
+class ContextBudget:
+    def __init__(self, budget=0, keep_turns=2, clip_tokens=0, counter=None):
+        # prompt tokens; 0 disables trimming
+        self.budget = budget
+        self.keep_turns = max(1, keep_turns)
+        self.clip_tokens = clip_tokens
+        self.counter = counter if counter is not None else TokenCounter()
+        self._lock = threading.Lock()
+        self.counters = {'requests': 0, 'trimmed': 0, 'over_budget': 0, 'tokens_in': 0, 'tokens_out': 0,
+                         'tokens_saved': 0, 'dropped_messages': 0, 'clipped_messages': 0, 'trim_ms': 0.0}
+
+    def trim(self, messages, budget=None):
+        """(messages to send, info) with info = {'tokens_in', 'tokens_out', 'dropped', 'clipped'}.
+
+        `budget` overrides the configured one for this call (0 disables).
+        Messages that are not a list of dicts are passed through.
+        """
+        budget = self.budget if budget is None else budget
+        if not budget or budget <= 0 or not isinstance(messages, list) \
+                or not all(isinstance(m, dict) for m in messages):
+            return messages, None
+        t0 = time.perf_counter()
+        sizes = [self.counter.message(m) for m in messages]
+        total = REPLY_OVERHEAD + sum(sizes)
+        info = {'tokens_in': total, 'tokens_out': total, 'dropped': 0, 'clipped': 0}
+        out = messages
+        if total > budget:
+            out, info = self._fit(messages, sizes, total, budget, info)
+        elapsed_ms = (time.perf_counter() - t0) * 1000.0
+        with self._lock:
+            c = self.counters
+            c['requests'] += 1
+            c['tokens_in'] += info['tokens_in']
+            c['tokens_out'] += info['tokens_out']
+            c['tokens_saved'] += info['tokens_in'] - info['tokens_out']
+            c['trimmed'] += int(out is not messages)
+            c['over_budget'] += int(info['tokens_out'] > budget)
+            c['dropped_messages'] += info['dropped']
+            c['clipped_messages'] += info['clipped']
+            c['trim_ms'] += elapsed_ms
+        return out, info
+
+    def _fit(self, messages, sizes, total, budget, info):
+        turns = _turns(messages)
+        old = turns[:-self.keep_turns]
+        messages = list(messages)
+        sizes = list(sizes)
+        clipped = set()
+        if self.clip_tokens and self.clip_tokens > 0:
+            for turn in old:
+                for i in turn:
+                    m = messages[i]
+                    content = m.get('content')
+                    if not isinstance(content, str) or sizes[i] - MESSAGE_OVERHEAD <= self.clip_tokens:
+                        continue
+                    messages[i] = dict(m, content=clip_text(content, self.clip_tokens, sizes[i] - MESSAGE_OVERHEAD))
+                    new_size = self.counter.message(messages[i])
+                    total -= sizes[i] - new_size
+                    sizes[i] = new_size
+                    clipped.add(i)
+        dropped = set()
+        # the note costs tokens too
+        note_tokens = MESSAGE_OVERHEAD + estimate_tokens(_NOTE % len(messages))
+        for turn in old:
+            if total + (note_tokens if dropped else 0) <= budget:
+                break
+            for i in turn:
+                dropped.add(i)
+                total -= sizes[i]
+        if dropped:
+            total += note_tokens
+            note = {'role': 'system', 'content': _NOTE % len(dropped)}
+            kept = [m for i, m in enumerate(messages) if i not in dropped]
+            # after the leading system messages, where the dropped turns began
+            at = 0
+            while at < len(kept) and kept[at].get('role') in KEEP_ROLES:
+                at += 1
+            kept.insert(at, note)
+            messages = kept
+        info['dropped'] = len(dropped)
+        info['clipped'] = len(clipped - dropped)
+        info['tokens_out'] = total
+        return messages, info
+
+    def stats(self):
+        with self._lock:
+            out = dict(self.counters)
+        out['trim_ms'] = round(out['trim_ms'], 1)
+        out['budget'] = self.budget
+        out['token_cache'] = self.counter.stats()
+        return out
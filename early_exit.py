@@ -0,0 +1,209 @@
+"""Early-exit reranking of fanned-out /chat candidates (stdlib only).
+
+With fan-out (fanout.py) candidates arrive one at a time and are scored on
+arrival. EarlyExit.pick() looks at the scores so far and names a candidate
+to answer with at once: the first one scoring at least `threshold`, or a
+leader ahead of every other candidate by `margin` once `min_candidates`
+are in (0 disables either rule). The calls still running are then
+cancelled, or, with rest='later', left to finish into an Alternatives
+entry that the client can fetch afterwards (e.g. for the Compare view).
+With `spool` (a directory shared by pre-fork workers, see prefork.py)
+entries are also written there, so any worker can answer for them.
+"""
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+REST_MODES = ('abandon', 'later')
+
+
+class EarlyExit:
+    def __init__(self, threshold=0.0, margin=0.0, min_candidates=2, rest='abandon'):
+        self.threshold = threshold
+        self.margin = margin
+        self.min_candidates = max(1, min_candidates)
+        self.rest = rest if rest in REST_MODES else 'abandon'
+
+    def options(self, option):
+        """{'threshold', 'margin', 'rest'} for a request's "early_exit" value (true or a dict of overrides)."""
+        out = {'threshold': self.threshold, 'margin': self.margin, 'rest': self.rest}
+        if isinstance(option, dict):
+            for name in ('threshold', 'margin'):
+                try:
+                    out[name] = float(option[name])
+                except Exception:
+                    pass
+            if option.get('rest') in REST_MODES:
+                out['rest'] = option['rest']
+        return out
+
+    def pick(self, values, threshold=None, margin=None):
+        """Index of the candidate to answer with now, or None to keep waiting."""
+        threshold = self.threshold if threshold is None else threshold
+        margin = self.margin if margin is None else margin
+        if not values:
+            return None
+        best = max(range(len(values)), key=values.__getitem__)
+        if threshold > 0 and values[best] >= threshold:
+            return best
+        if margin > 0 and len(values) >= max(2, self.min_candidates):
+            runner_up = max(v for i, v in enumerate(values) if i != best)
+            if values[best] - runner_up >= margin:
+                return best
+        return None
+
+
+class Alternatives:
+    """Candidates of early-exited requests, completed in the background and kept for `ttl` seconds."""
+
+    def __init__(self, ttl=300.0, max_entries=1000, spool=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.spool = spool
+        if spool:
+            os.makedirs(spool, exist_ok=True)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.counters = {'opened': 0, 'completed': 0, 'fetched': 0, 'expired': 0}
+
+    def open(self):
+        """Start an empty entry; returns its id."""
+        key = secrets.token_urlsafe(12)
+        entry = {'replies': [], 'scores': [], 'complete': False, 'done': threading.Event(),
+                 'expires': time.monotonic() + self.ttl}
+        with self._lock:
+            self._expire()
+            self._entries[key] = entry
+            self.counters['opened'] += 1
+            sweep = self.spool and self.counters['opened'] % 100 == 1
+        if self.spool:
+            self._spool_write(key, entry)
+            if sweep:
+                self._spool_sweep()
+        return key
+
+    def add(self, key, replies, values, complete=False):
+        """Add scored candidates to an entry; `complete` once the last ones are in."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry['replies'].extend(replies)
+            entry['scores'].extend(values)
+            if complete:
+                entry['complete'] = True
+                self.counters['completed'] += 1
+        if self.spool:
+            self._spool_write(key, entry)
+        if complete:
+            entry['done'].set()
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        self._spool_remove(key)
+
+    def get(self, key, wait=0.0):
+        """{'replies', 'scores', 'best_index', 'complete'}, waiting up to `wait` seconds for completion; None if unknown."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return self._spool_get(key, wait) if self.spool else None
+        if wait > 0:
+            entry['done'].wait(wait)
+        with self._lock:
+            self.counters['fetched'] += 1
+            scores = list(entry['scores'])
+            out = {'replies': list(entry['replies']), 'scores': scores, 'complete': entry['complete']}
+        out['best_index'] = max(range(len(scores)), key=scores.__getitem__) if scores else None
+        return out
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry['expires'] > now and len(self._entries) < self.max_entries:
+                break
+            del self._entries[key]
+            self.counters['expired'] += 1
+            self._spool_remove(key)
+
+    # --- spool shared with other processes ---------------------------------
+
+    def _spool_path(self, key):
+        # ids come from token_urlsafe; anything else cannot name a spool file
+        if not key or not all(c.isalnum() or c in '-_' for c in key):
+            return None
+        return os.path.join(self.spool, key + '.json')
+
+    def _spool_write(self, key, entry):
+        path = self._spool_path(key)
+        if path is None:
+            return
+        with self._lock:
+            data = json.dumps({'replies': entry['replies'], 'scores': entry['scores'],
+                               'complete': entry['complete']})
+        try:
+            tmp = '%s.%d.tmp' % (path, threading.get_ident())
+            with open(tmp, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def _spool_remove(self, key):
+        path = self._spool_path(key) if self.spool else None
+        if path is not None:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _spool_get(self, key, wait):
+        """get() for an entry another process opened: poll its spool file until it is complete or `wait` is over."""
+        path = self._spool_path(key)
+        if path is None:
+            return None
+        end = time.monotonic() + max(0.0, wait)
+        while True:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    out = json.load(f)
+            except (OSError, ValueError):
+                out = None
+            if out is None and not os.path.exists(path):
+                return None
+            if (out is not None and out.get('complete')) or time.monotonic() >= end:
+                break
+            time.sleep(0.05)
+        if out is None:
+            return None
+        with self._lock:
+            self.counters['fetched'] += 1
+        scores = out.get('scores') or []
+        out['best_index'] = max(range(len(scores)), key=scores.__getitem__) if scores else None
+        return out
+
+    def _spool_sweep(self):
+        """Remove spool files older than ttl (e.g. left by a process that was killed)."""
+        cutoff = time.time() - self.ttl
+        try:
+            names = os.listdir(self.spool)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.spool, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            out = dict(self.counters)
+            out['entries'] = len(self._entries)
+        return out
@@ -0,0 +1,186 @@
+"""Fan-out of single-candidate upstream calls for /chat reranking (stdlib only).
+
+Instead of one completion call asking for n candidates (which some models
+and proxies ignore or cap), FanOut sends n calls with n=1 concurrently. Each
+call can use its own model and temperature (`models` / `temperatures` are
+cycled over the calls, or the request passes explicit variants). Every
+candidate is scored as soon as its call returns, and run() returns once
+`need` candidates are in, or once `deadline` seconds have passed and at
+least one is in, or as soon as an `accept` callback picks a candidate
+(early exit, see early_exit.py). Calls still running then are cancelled:
+their sockets are shut down (upstream.Cancellation), so the upstream stops
+generating. Alternatively they finish in the background and a `rest`
+callback gets their candidates.
+
+The latency an early exit saved is measured when the rest finished in the
+background, and estimated from the median duration of recent complete
+fan-outs when it was cancelled.
+"""
+import queue
+import threading
+import time
+from collections import deque
+
+from upstream import Cancellation
+
+# request keys a fan-out variant may override
+VARIANT_KEYS = ('model', 'temperature', 'max_tokens')
+
+
+class FanOut:
+    def __init__(self, models=(), temperatures=(), need=0, deadline=0.0):
+        self.models = list(models)
+        self.temperatures = list(temperatures)
+        # 0 means all candidates / no deadline
+        self.need = need
+        self.deadline = deadline
+        self._lock = threading.Lock()
+        # elapsed ms of recent fan-outs whose calls all finished, to estimate what an early exit saved
+        self.durations = deque(maxlen=200)
+        self.counters = {'requests': 0, 'calls': 0, 'candidates': 0, 'failed_calls': 0,
+                         'cancelled_calls': 0, 'deferred_calls': 0, 'deadline_exits': 0,
+                         'early_exits': 0, 'early_exit_saved_ms': 0.0, 'early_exit_measured': 0,
+                         'early_exit_estimated': 0}
+
+    def payloads(self, payload, n, variants=None):
+        """n single-candidate copies of payload, with the variants (or configured models/temperatures) applied."""
+        out = []
+        for i in range(max(1, n)):
+            p = dict(payload)
+            p['n'] = 1
+            p.pop('stream', None)
+            if variants:
+                v = variants[i % len(variants)]
+                p.update((k, v[k]) for k in VARIANT_KEYS if k in v)
+            else:
+                if self.models:
+                    p['model'] = self.models[i % len(self.models)]
+                if self.temperatures:
+                    p['temperature'] = self.temperatures[i % len(self.temperatures)]
+            out.append(p)
+        return out
+
+    def run(self, call, payloads, score=None, need=None, deadline=None, accept=None, rest=None):
+        """Run call(payload, cancel) -> [texts] for every payload concurrently.
+
+        Returns {'replies', 'values', 'origins', 'elapsed_ms', 'cancelled',
+        'deferred', 'failed', 'accepted', 'saved_ms'}: the candidates in
+        arrival order, their scores (score(texts) -> values, or None), the
+        index of the payload each came from, how many calls were cut off,
+        left running or failed, the candidate accept(values) picked (or
+        None) and the estimated time that saved. Raises the first call's
+        error if no call produced a candidate.
+
+        With `rest`, calls still running are not cancelled: once they are
+        done, rest(texts, elapsed_ms) gets their candidates (unscored) and
+        the time the whole fan-out took.
+        """
+        need = self.need if need is None else need
+        need = len(payloads) if not need or need <= 0 else min(need, len(payloads))
+        deadline = self.deadline if deadline is None else deadline
+        cancel = Cancellation()
+        results = queue.Queue()
+
+        def worker(i, payload):
+            try:
+                results.put((i, call(payload, cancel), None))
+            except Exception as e:
+                results.put((i, None, e))
+
+        t0 = time.monotonic()
+        for i, payload in enumerate(payloads):
+            threading.Thread(target=worker, args=(i, payload), name='fanout-call', daemon=True).start()
+        end = t0 + deadline if deadline and deadline > 0 else None
+        replies, values, origins, errors = [], [], [], []
+        pending = len(payloads)
+        deadline_exit = False
+        accepted = None
+        while pending and len(replies) < need and accepted is None:
+            timeout = None
+            if end is not None:
+                timeout = end - time.monotonic()
+                if timeout <= 0:
+                    if replies:
+                        deadline_exit = True
+                        break
+                    # past the deadline with nothing in: take the first candidate that arrives
+                    timeout = None
+            try:
+                i, texts, error = results.get(timeout=timeout)
+            except queue.Empty:
+                continue
+            pending -= 1
+            if error is not None:
+                errors.append(error)
+                continue
+            texts = [t for t in texts or [] if t is not None]
+            if not texts:
+                continue
+            replies.extend(texts)
+            origins.extend([i] * len(texts))
+            if score is not None:
+                values.extend(score(texts))
+                if accept is not None and pending:
+                    accepted = accept(values)
+        elapsed_ms = (time.monotonic() - t0) * 1000.0
+        deferred = pending if rest is not None else 0
+        saved_ms = None
+        if pending and rest is not None:
+            threading.Thread(target=self._finish_rest, args=(results, pending, rest, t0, elapsed_ms, accepted),
+                             name='fanout-rest', daemon=True).start()
+        elif pending:
+            cancel.cancel()
+            if accepted is not None:
+                saved_ms = self._estimate_saved(elapsed_ms)
+        with self._lock:
+            self.counters['requests'] += 1
+            self.counters['calls'] += len(payloads)
+            self.counters['candidates'] += len(replies)
+            self.counters['failed_calls'] += len(errors)
+            self.counters['cancelled_calls'] += pending - deferred
+            self.counters['deferred_calls'] += deferred
+            self.counters['deadline_exits'] += int(deadline_exit)
+            self.counters['early_exits'] += int(accepted is not None)
+            if saved_ms is not None:
+                self.counters['early_exit_saved_ms'] += saved_ms
+                self.counters['early_exit_estimated'] += 1
+            if not pending:
+                self.durations.append(elapsed_ms)
+        if not replies and errors:
+            raise errors[0]
+        return {'replies': replies, 'values': values if score is not None else None, 'origins': origins,
+                'elapsed_ms': round(elapsed_ms, 1), 'cancelled': pending - deferred, 'deferred': deferred,
+                'failed': len(errors), 'accepted': accepted,
+                'saved_ms': round(saved_ms, 1) if saved_ms is not None else None}
+
+    def _finish_rest(self, results, pending, rest, t0, exit_ms, accepted):
+        texts = []
+        for _ in range(pending):
+            _, got, error = results.get()
+            if error is None:
+                texts.extend(t for t in got or [] if t is not None)
+        elapsed_ms = (time.monotonic() - t0) * 1000.0
+        with self._lock:
+            self.durations.append(elapsed_ms)
+            if accepted is not None:
+                self.counters['early_exit_saved_ms'] += elapsed_ms - exit_ms
+                self.counters['early_exit_measured'] += 1
+        try:
+            rest(texts, round(elapsed_ms, 1))
+        except Exception:
+            pass
+
+    def _estimate_saved(self, elapsed_ms):
+        """Median complete fan-out duration minus elapsed_ms, or None with too few samples."""
+        with self._lock:
+            samples = sorted(self.durations)
+        if len(samples) < 5:
+            return None
+        return max(0.0, samples[len(samples) // 2] - elapsed_ms)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self.counters)
+        out['early_exit_saved_ms'] = round(out['early_exit_saved_ms'], 1)
+        out['models'] = len(self.models)
+        return out
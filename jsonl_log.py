@@ -0,0 +1,210 @@
+"""Append-only JSON Lines log with group commit (stdlib only).
+
+Used for the write-heavy, never-updated stores (suggestions and peer
+rankings). Each record is one line, so an append is O(1) instead of a
+rewrite of the whole JSON array, and readers stream the file line by line.
+
+append() returns once its line is on disk. Concurrent appenders share
+fsyncs: whoever finds no flush in progress writes every queued line and
+fsyncs once for all of them, while the others wait for that flush (group
+commit). If that flush fails, every appender in it raises, and the next flush
+starts with a newline so a partial line it left is not glued to the next
+record. A torn last line left by a crash is cut off when the log is opened.
+
+The first time a log is opened and its .jsonl file does not exist yet, the
+records of the old JSON array file (`legacy_path`) are migrated into it. The
+legacy file is left as it was and is not written to afterwards.
+"""
+import json
+import os
+import threading
+
+
+class JsonlLog:
+    def __init__(self, path, legacy_path=None, fsync=True):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._flushed = threading.Condition(self._lock)
+        self._pending = []
+        self._queued = 0
+        self._durable = 0
+        self._flushing = False
+        # [first, last, error, waiters left] of each failed batch whose other appenders have not raised yet
+        self._failed = []
+        self._torn = False
+        self.counters = {'appends': 0, 'flushes': 0, 'failed_flushes': 0, 'migrated': 0, 'truncated_bytes': 0}
+        if not os.path.exists(path):
+            self._migrate()
+        else:
+            self._drop_torn_tail()
+        self._count = sum(1 for _ in self)
+        self._file = open(path, 'ab')
+
+    def _migrate(self):
+        records = []
+        if self.legacy_path:
+            try:
+                with open(self.legacy_path, 'r', encoding='utf-8') as f:
+                    records = json.load(f)
+            except Exception:
+                records = []
+        if not isinstance(records, list):
+            records = []
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            for r in records:
+                f.write(self._encode(r))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.counters['migrated'] = len(records)
+
+    def _drop_torn_tail(self):
+        # a crash mid-write can leave a partial last line; cut it so the next append starts a fresh line
+        with open(self.path, 'r+b') as f:
+            size = f.seek(0, os.SEEK_END)
+            end = size
+            while end > 0:
+                step = min(end, 64 * 1024)
+                f.seek(end - step)
+                chunk = f.read(step)
+                nl = chunk.rfind(b'\n')
+                if nl >= 0:
+                    end = end - step + nl + 1
+                    break
+                end -= step
+            if end != size:
+                f.truncate(end)
+                self.counters['truncated_bytes'] = size - end
+
+    @staticmethod
+    def _encode(record):
+        # ensure_ascii keeps every line free of raw newlines / separators
+        return json.dumps(record, ensure_ascii=True).encode('ascii') + b'\n'
+
+    def append(self, record):
+        """Append one record; returns once it has been written (and fsynced, if enabled).
+
+        Raises OSError if the flush that carried this record failed, whichever
+        appender ran it.
+        """
+        line = self._encode(record)
+        with self._lock:
+            self._pending.append(line)
+            self._queued += 1
+            mine = self._queued
+            while self._durable < mine:
+                if self._flushing:
+                    self._flushed.wait()
+                    continue
+                # become the flusher for everything queued so far
+                batch, self._pending = self._pending, []
+                first, upto = self._durable + 1, self._queued
+                if self._torn:
+                    # the failed batch may have left a partial line: end it, readers skip it
+                    batch.insert(0, b'\n')
+                self._flushing = True
+                self._lock.release()
+                try:
+                    self._file.write(b''.join(batch))
+                    self._file.flush()
+                    if self.fsync:
+                        os.fsync(self._file.fileno())
+                except BaseException as e:
+                    self._lock.acquire()
+                    self._flushing = False
+                    self._durable = upto
+                    # every appender of the batch sees the error, not only the flusher
+                    if upto > first:
+                        self._failed.append([first, upto, e, upto - first])
+                    self._torn = True
+                    self.counters['failed_flushes'] += 1
+                    self._flushed.notify_all()
+                    self._reopen()
+                    raise
+                self._lock.acquire()
+                self._flushing = False
+                self._durable = upto
+                self._torn = False
+                self._count += len(batch) - (batch[0] == b'\n')
+                self.counters['flushes'] += 1
+                self._flushed.notify_all()
+            for failure in self._failed:
+                if failure[0] <= mine <= failure[1]:
+                    failure[3] -= 1
+                    if failure[3] <= 0:
+                        self._failed.remove(failure)
+                    error = failure[2]
+                    raise OSError('append failed: %s' % error) from error
+            self.counters['appends'] += 1
+
+    def _reopen(self):
+        # drop whatever the failed write left in the file object's buffer, so a later flush cannot write it
+        try:
+            self._file.close()
+        except Exception:
+            pass
+        try:
+            self._file = open(self.path, 'ab')
+        except OSError:
+            pass
+
+    def __iter__(self):
+        """Stream the records on disk in append order (a torn last line is skipped)."""
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    yield json.loads(line)
+                except Exception:
+                    continue
+
+    def since(self, cursor=0):
+        """(records appended after cursor, new cursor); cursors are byte offsets, 0 is the start.
+
+        Lets other processes appending to the same file be followed (see
+        peer_views.RankSummary). An incomplete last line is left for the
+        next call.
+        """
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return [], cursor
+        with f:
+            f.seek(cursor)
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        records = []
+        for line in data[:end].splitlines():
+            try:
+                records.append(json.loads(line))
+            except Exception:
+                continue
+        return records, cursor + end
+
+    def select(self, field, value):
+        """Stream the records whose `field` equals value (compared as strings); a full scan."""
+        value = str(value)
+        return (r for r in self if isinstance(r, dict) and r.get(field) is not None and str(r[field]) == value)
+
+    def __len__(self):
+        return self._count
+
+    def stats(self):
+        with self._lock:
+            out = dict(self.counters)
+            out.update({'records': self._count, 'backend': 'jsonl', 'fsync': self.fsync})
+            return out
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
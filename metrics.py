@@ -0,0 +1,162 @@
+"""Request metrics and structured logs for the backend (stdlib only).
+
+Metrics keeps histograms (latency per endpoint and per /chat stage) and
+counters in memory, keyed by metric name and a tuple of (label, value)
+pairs. render() produces the Prometheus text exposition format served at
+/metrics; collectors registered with add_collector() contribute values that
+are only computed at scrape time (store sizes, the /admin/stats numbers).
+
+EventLog appends one JSON object per line to a file (server_py.log): one
+line per finished request plus the handler's log messages.
+
+Recording is one dict lookup and a few additions under a lock, so the cost
+per request stays in the microseconds (see bench/metrics_overhead.py).
+"""
+import json
+import threading
+import time
+from bisect import bisect_left
+
+# seconds; spans cached GETs (sub-millisecond) to slow upstream calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, n):
+        # one slot per bucket plus the +Inf overflow
+        self.counts = [0] * (n + 1)
+        self.sum = 0.0
+        self.count = 0
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs, extra=None):
+    items = list(pairs)
+    if extra is not None:
+        items.append(extra)
+    if not items:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, _escape(v)) for k, v in items)
+
+
+def _number(v):
+    if isinstance(v, float):
+        if v != v:
+            return 'NaN'
+        if v in (float('inf'), float('-inf')):
+            return '+Inf' if v > 0 else '-Inf'
+        return repr(v)
+    return str(int(v))
+
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._hists = {}
+        self._counters = {}
+        self._help = {}
+        self._collectors = []
+
+    def describe(self, name, kind, help_text):
+        """Set the # TYPE (counter, gauge, histogram, untyped) and # HELP lines for a metric."""
+        self._help[name] = (kind, help_text)
+
+    def observe(self, name, seconds, labels=()):
+        """Add one observation to the histogram `name` with the given (label, value) pairs."""
+        i = bisect_left(self.buckets, seconds)
+        key = (name, labels)
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = _Histogram(len(self.buckets))
+            h.counts[i] += 1
+            h.sum += seconds
+            h.count += 1
+
+    def inc(self, name, labels=(), n=1):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + n
+
+    def add_collector(self, fn):
+        """fn() yields (name, labels, value) samples at scrape time; describe() their names."""
+        self._collectors.append(fn)
+
+    def snapshot(self):
+        """{'histograms': {(name, labels): (counts, sum, count)}, 'counters': {(name, labels): value}}."""
+        with self._lock:
+            hists = {k: (list(h.counts), h.sum, h.count) for k, h in self._hists.items()}
+            counters = dict(self._counters)
+        return {'histograms': hists, 'counters': counters}
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        snap = self.snapshot()
+        families = {}
+        for (name, labels), value in snap['counters'].items():
+            families.setdefault(name, []).append(('%s%s %s' % (name, _labels(labels), _number(value))))
+        for (name, labels), (counts, total, count) in snap['histograms'].items():
+            lines = families.setdefault(name, [])
+            running = 0
+            for le, n in zip(self.buckets + (float('inf'),), counts):
+                running += n
+                lines.append('%s_bucket%s %d' % (name, _labels(labels, ('le', _number(float(le)))), running))
+            lines.append('%s_sum%s %s' % (name, _labels(labels), _number(total)))
+            lines.append('%s_count%s %d' % (name, _labels(labels), count))
+        for fn in self._collectors:
+            try:
+                samples = list(fn())
+            except Exception:
+                continue
+            for name, labels, value in samples:
+                families.setdefault(name, []).append('%s%s %s' % (name, _labels(labels), _number(value)))
+        out = []
+        for name in sorted(families):
+            kind, help_text = self._help.get(name, ('untyped', None))
+            if help_text:
+                out.append('# HELP %s %s' % (name, help_text.replace('\\', '\\\\').replace('\n', '\\n')))
+            out.append('# TYPE %s %s' % (name, kind))
+            out.extend(families[name])
+        return '\n'.join(out) + '\n'
+
+
+def flatten_stats(prefix, stats):
+    """(name, value) pairs for the numeric leaves of a nested stats dict (bools as 0/1, None skipped)."""
+    out = []
+    for key, value in (stats or {}).items():
+        name = '%s_%s' % (prefix, ''.join(ch if ch.isalnum() else '_' for ch in str(key)))
+        if isinstance(value, dict):
+            out.extend(flatten_stats(name, value))
+        elif isinstance(value, bool):
+            out.append((name, int(value)))
+        elif isinstance(value, (int, float)):
+            out.append((name, value))
+    return out
+
+
+class EventLog:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def write(self, event):
+        """Append one event (a dict) as a JSON line, stamped with the current time."""
+        event['ts'] = round(time.time(), 3)
+        line = json.dumps(event, default=str) + '\n'
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line)
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,176 @@
+"""Materialized /peer_dataset and /peer_rank_summary responses (stdlib only).
+
+Both endpoints used to re-read and re-aggregate their JSON files on every
+request. These views keep the encoded response body and its ETag in memory
+and only rebuild when the underlying data changes:
+
+- PeerDatasetView: peer_dataset.json plus one item per review. Review writes
+  call invalidate(); the next request rebuilds once. peer_dataset.json is
+  re-read when its mtime changes, so hand edits still show up.
+- RankSummary: running {itemId: {responseIndex: count}} counters, loaded once
+  and bumped by add() on every /peer/rank POST. With `follow` (a log with
+  since(), e.g. JsonlLog) it counts the log's records instead, catching up
+  on every read, so rankings appended by other processes are included.
+"""
+import hashlib
+import json
+import os
+import threading
+
+
+def etag_for(body):
+    return '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+
+
+def etag_matches(if_none_match, etag):
+    """True if an If-None-Match header value matches etag (weak comparison, as for GET)."""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag == '*':
+            return True
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def review_item(r):
+    """Map a review into the peer dataset item shape; None for malformed entries."""
+    if not isinstance(r, dict):
+        return None
+    item_id = r.get('messageId') or ('review-' + (r.get('timestamp') or ''))
+    # Use the review comment or messageId as the question placeholder
+    question = r.get('comment') or item_id
+    assistant_text = r.get('assistantText') or ''
+    rating = r.get('rating') if 'rating' in r else None
+    review_entry = {'author': r.get('authenticatedBy') or r.get('author') or 'user', 'rating': rating,
+                    'comment': r.get('comment', '')}
+    return {
+        'id': item_id,
+        'question': question,
+        'assistantResponses': [
+            {
+                'text': assistant_text,
+                'reviews': [review_entry]
+            }
+        ]
+    }
+
+
+class PeerDatasetView:
+    def __init__(self, dataset_path, reviews):
+        self.dataset_path = dataset_path
+        # anything with all() returning the current review list (a ReviewStore)
+        self.reviews = reviews
+        self._lock = threading.Lock()
+        self._dirty = True
+        self._base = []
+        self._base_mtime = None
+        self._body = b'[]'
+        self._etag = etag_for(self._body)
+        self.rebuilds = 0
+
+    def invalidate(self):
+        self._dirty = True
+
+    def _base_changed(self):
+        try:
+            mtime = os.stat(self.dataset_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        return mtime != self._base_mtime, mtime
+
+    def get(self):
+        """(body bytes, etag), rebuilt first if reviews or peer_dataset.json changed."""
+        changed, mtime = self._base_changed()
+        if not (self._dirty or changed):
+            return self._body, self._etag
+        with self._lock:
+            changed, mtime = self._base_changed()
+            if changed:
+                try:
+                    with open(self.dataset_path, 'r', encoding='utf-8') as f:
+                        base = json.load(f)
+                except Exception:
+                    base = []
+                self._base = base if isinstance(base, list) else []
+                self._base_mtime = mtime
+            elif not self._dirty:
+                return self._body, self._etag
+            # clear first: a review written while we rebuild marks it dirty again
+            self._dirty = False
+            dataset = list(self._base)
+            for r in self.reviews.all():
+                try:
+                    item = review_item(r)
+                except Exception:
+                    # ignore malformed review entries
+                    item = None
+                if item is not None:
+                    dataset.append(item)
+            body = json.dumps(dataset).encode('utf-8')
+            self._body, self._etag = body, etag_for(body)
+            self.rebuilds += 1
+            return self._body, self._etag
+
+
+class RankSummary:
+    def __init__(self, ranks=(), follow=None):
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._body = None
+        self._etag = None
+        self._log = follow
+        self._cursor = 0
+        if follow is not None:
+            self._catch_up()
+            return
+        for r in ranks:
+            self._add(r)
+
+    def _catch_up(self):
+        records, self._cursor = self._log.since(self._cursor)
+        for r in records:
+            self._add(r)
+
+    def _add(self, r):
+        try:
+            item = r.get('itemId')
+            idx = r.get('responseIndex')
+            if item is None or idx is None:
+                return
+            idx = str(int(idx))
+        except Exception:
+            return
+        counts = self._counts.get(item)
+        if counts is None:
+            counts = self._counts[item] = {'0': 0, '1': 0}
+        counts[idx] = counts.get(idx, 0) + 1
+        self._body = None
+
+    def add(self, rank):
+        """Count one /peer/rank submission (when following a log, read it from there instead)."""
+        with self._lock:
+            if self._log is not None:
+                self._catch_up()
+            else:
+                self._add(rank)
+
+    def summary(self):
+        with self._lock:
+            if self._log is not None:
+                self._catch_up()
+            return {k: dict(v) for k, v in self._counts.items()}
+
+    def get(self):
+        """(body bytes, etag) of the summary, re-encoded only after a change."""
+        with self._lock:
+            if self._log is not None:
+                self._catch_up()
+            if self._body is None:
+                self._body = json.dumps(self._counts).encode('utf-8')
+                self._etag = etag_for(self._body)
+            return self._body, self._etag
@@ -0,0 +1,195 @@
+"""Pre-fork supervisor for server_py.py (stdlib only, POSIX).
+
+With SERVER_PROCESSES=N, `python3 server_py.py` runs this supervisor instead
+of serving: it starts N worker processes of the same script
+(SERVER_WORKER_ID=0..N-1). Each worker binds its own listening socket to the
+same port with SO_REUSEPORT, so the kernel spreads connections over them
+and every worker has its own interpreter and GIL.
+
+- A worker that exits unexpectedly is restarted. One that dies within
+  `restart_window` seconds of starting is restarted after a delay that
+  doubles up to `max_delay`, so a crash loop does not spin.
+- SIGHUP reloads gracefully: a new generation of workers is started and,
+  once a new worker has reported that it is listening, the old worker with
+  the same id gets SIGTERM. It stops accepting, finishes its requests and
+  exits. Workers are fresh interpreters, so code changes are picked up.
+- SIGTERM / SIGINT stop all workers the same way; workers still running
+  after `stop_timeout` seconds are killed.
+
+Workers are started with fork+exec (subprocess) rather than a bare fork(),
+so they do not inherit locks held by the parent's threads. Worker 0 starts
+first and the others once it is ready, so first-time store migrations never
+run twice at once. A worker reports readiness by writing to the pipe named
+in SERVER_READY_FD.
+"""
+import os
+import select
+import signal
+import subprocess
+import sys
+import time
+
+WORKER_ENV = 'SERVER_WORKER_ID'
+READY_FD_ENV = 'SERVER_READY_FD'
+
+
+def signal_ready():
+    """Tell the supervisor this worker is listening (no-op outside pre-fork mode)."""
+    fd = os.environ.pop(READY_FD_ENV, None)
+    if fd is None:
+        return
+    try:
+        os.write(int(fd), b'1')
+        os.close(int(fd))
+    except (OSError, ValueError):
+        pass
+
+
+def _log(message):
+    print('[prefork] %s' % message, flush=True)
+
+
+class Supervisor:
+    def __init__(self, argv, processes, ready_timeout=60.0, stop_timeout=15.0, restart_window=5.0, max_delay=30.0):
+        self.argv = list(argv)
+        self.processes = max(1, processes)
+        self.ready_timeout = ready_timeout
+        self.stop_timeout = stop_timeout
+        self.restart_window = restart_window
+        self.max_delay = max_delay
+        # worker id -> {'proc', 'started', 'ready_fd'}
+        self.workers = {}
+        # worker id -> restart delay after its last exit, and when an exited worker is due to restart
+        self._delay = {}
+        self._due = {}
+        self._reload = False
+        self._stop = False
+        self.counters = {'started': 0, 'restarts': 0, 'reloads': 0}
+
+    def _spawn(self, index):
+        r, w = os.pipe()
+        env = dict(os.environ)
+        env[WORKER_ENV] = str(index)
+        env[READY_FD_ENV] = str(w)
+        try:
+            proc = subprocess.Popen(self.argv, env=env, pass_fds=(w,))
+        finally:
+            os.close(w)
+        self.counters['started'] += 1
+        return {'proc': proc, 'started': time.monotonic(), 'ready_fd': r}
+
+    def _wait_ready(self, workers):
+        """Wait until each of {index: worker} reported readiness; returns the ids that did."""
+        waiting = {w['ready_fd']: index for index, w in workers.items() if w['ready_fd'] is not None}
+        ready = set(index for index, w in workers.items() if w['ready_fd'] is None)
+        deadline = time.monotonic() + self.ready_timeout
+        while waiting and not self._stop:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            readable, _, _ = select.select(list(waiting), [], [], min(left, 0.5))
+            for fd in readable:
+                index = waiting.pop(fd)
+                # one byte when ready, EOF if the worker died first
+                if os.read(fd, 1):
+                    ready.add(index)
+                os.close(fd)
+                workers[index]['ready_fd'] = None
+        for fd in waiting:
+            os.close(fd)
+        for index in waiting.values():
+            workers[index]['ready_fd'] = None
+        return ready
+
+    def _terminate(self, workers):
+        """SIGTERM the given workers, wait for them to drain, kill the ones still running."""
+        for w in workers:
+            if w['proc'].poll() is None:
+                try:
+                    w['proc'].send_signal(signal.SIGTERM)
+                except OSError:
+                    pass
+        deadline = time.monotonic() + self.stop_timeout
+        for w in workers:
+            try:
+                w['proc'].wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                w['proc'].kill()
+                w['proc'].wait()
+            if w['ready_fd'] is not None:
+                os.close(w['ready_fd'])
+                w['ready_fd'] = None
+
+    def start(self):
+        first = {0: self._spawn(0)}
+        self.workers.update(first)
+        if 0 not in self._wait_ready(first):
+            _log('worker 0 did not become ready')
+        rest = {i: self._spawn(i) for i in range(1, self.processes)}
+        self.workers.update(rest)
+        self._wait_ready(rest)
+        _log('%d workers running (pids %s)' % (
+            len(self.workers), ' '.join(str(w['proc'].pid) for _, w in sorted(self.workers.items()))))
+
+    def reload(self):
+        """Start a new generation and retire the old one, worker by worker, once its successor is ready."""
+        self.counters['reloads'] += 1
+        fresh = {i: self._spawn(i) for i in range(self.processes)}
+        ready = self._wait_ready(fresh)
+        retired = []
+        for index, w in fresh.items():
+            if index in ready:
+                retired.append(self.workers[index])
+                self.workers[index] = w
+            else:
+                _log('reload: new worker %d did not become ready; keeping the old one' % index)
+                self._terminate([w])
+        self._terminate(retired)
+        _log('reloaded %d of %d workers' % (len(retired), self.processes))
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for index, w in list(self.workers.items()):
+            if w['proc'].poll() is None:
+                continue
+            if index not in self._due:
+                # a worker that dies right after starting comes back after a growing delay
+                fast = now - w['started'] < self.restart_window
+                delay = min(self.max_delay, max(0.5, self._delay.get(index, 0.0) * 2)) if fast else 0.0
+                self._delay[index] = delay
+                self._due[index] = now + delay
+                _log('worker %d (pid %d) exited with %s; restarting%s' % (
+                    index, w['proc'].pid, w['proc'].returncode, ' in %.1fs' % delay if delay else ''))
+            if now < self._due[index]:
+                continue
+            del self._due[index]
+            if w['ready_fd'] is not None:
+                os.close(w['ready_fd'])
+            self.workers[index] = self._spawn(index)
+            self.counters['restarts'] += 1
+
+    def _on_signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self._reload = True
+        else:
+            self._stop = True
+
+    def run(self):
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, self._on_signal)
+        self.start()
+        while not self._stop:
+            if self._reload:
+                self._reload = False
+                self.reload()
+            self._check_workers()
+            time.sleep(0.2)
+        _log('stopping %d workers' % len(self.workers))
+        self._terminate(list(self.workers.values()))
+        return 0
+
+
+def main(processes, argv=None):
+    """Supervise `processes` workers running this interpreter with argv (default: the current script)."""
+    argv = argv or [sys.executable, os.path.abspath(sys.argv[0])] + sys.argv[1:]
+    return Supervisor(argv, processes).run()
@@ -0,0 +1,399 @@
+"""Offline evaluation and batch scoring for the reranker (reranker.py), stdlib only.
+
+    python3 rerank_eval.py                                    # the repo's JSON files
+    python3 rerank_eval.py --weights factuality=2,clarity=1,ethics=1 --weights clarity=1
+    python3 rerank_eval.py --candidates big.jsonl --processes 1,2,4 --out scores.jsonl
+
+1. Split: reviews (by messageId) and peer dataset items (by id) are hashed
+   into a training and a test split (--test-fraction, --seed). The model is
+   trained on the training split only; --test-fraction 0 evaluates on the
+   training data (in-sample).
+2. Quality, per --weights set, on the test split:
+   - rating correlation: Pearson and Spearman between the reranker score
+     and the rating humans gave (the criteria average, or the rating).
+   - pairwise agreement: for every peer ranking vote on a test item with two
+     or more responses, whether the voted response scores above each other
+     response (ties count half), and how often it scores highest.
+   - best of n: the mean human rating (0..1) of the top-scored candidate
+     among n random test candidates, for each --n; n=1 is a random pick.
+     This is what RERANK_N buys.
+3. Throughput: the candidates (--candidates, or else the test split's texts)
+   are streamed from disk in chunks and scored across 1..N processes
+   (--processes), each worker memory-mapping the same saved model. Texts per
+   second are reported per process count; every run must give the same
+   scores. --out writes them as JSON lines.
+
+Inputs may be JSON arrays or JSON lines (.jsonl, as the append logs use);
+both are read incrementally, so candidate files can be larger than memory.
+Candidates are strings or objects with "assistantText" or "text".
+"""
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import random
+import re
+import tempfile
+import time
+import zlib
+from collections import deque
+
+from reranker import _CRITERIA, RerankerModel, load_model, save_model, score_batch
+
+_WS_RE = re.compile(r'[\s,]*')
+
+
+def iter_json(path, chunk_size=1 << 20):
+    """Yield the records of a JSON array file, or of a JSON lines file, reading `chunk_size` characters at a time."""
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buf = f.read(chunk_size)
+        pos = _WS_RE.match(buf).end()
+        if buf[pos:pos + 1] != '[':
+            # JSON lines
+            f.seek(0)
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+            return
+        pos += 1
+        eof = False
+        while True:
+            pos = _WS_RE.match(buf, pos).end()
+            if pos == len(buf) and not eof:
+                more = f.read(chunk_size)
+                eof = not more
+                buf, pos = buf[pos:] + more, 0
+                continue
+            if buf[pos:pos + 1] == ']' or pos == len(buf):
+                return
+            try:
+                record, end = decoder.raw_decode(buf, pos)
+                # a number cut at the end of the buffer decodes, but is incomplete
+                complete = end < len(buf) or eof
+            except ValueError:
+                if eof:
+                    raise
+                complete = False
+            if not complete:
+                more = f.read(chunk_size)
+                eof = not more
+                buf, pos = buf[pos:] + more, 0
+                continue
+            yield record
+            pos = end
+            if pos > chunk_size:
+                buf, pos = buf[pos:], 0
+
+
+def candidate_text(record):
+    if isinstance(record, str):
+        return record
+    if isinstance(record, dict):
+        text = record.get('assistantText')
+        if text is None:
+            text = record.get('text')
+        return text if isinstance(text, str) else ''
+    return ''
+
+
+def human_rating(record):
+    """The review's criteria average (or rating) on the reranker's 0..1 scale; None if unrated."""
+    crit = record.get('criteria') if isinstance(record.get('criteria'), dict) else {}
+    vals = []
+    for c in _CRITERIA:
+        try:
+            v = float(crit.get(c, record.get('rating')))
+        except (TypeError, ValueError):
+            continue
+        if math.isfinite(v):
+            vals.append(max(0.0, min(1.0, (v - 1.0) / 4.0)))
+    return sum(vals) / len(vals) if vals else None
+
+
+def parse_weights(spec):
+    """'factuality=2,clarity=1' -> {'factuality': 2.0, 'clarity': 1.0}; None for 'equal'."""
+    if not spec or spec == 'equal':
+        return None
+    out = {}
+    for part in spec.split(','):
+        name, _, value = part.partition('=')
+        if name.strip() not in _CRITERIA:
+            raise ValueError('unknown criterion %r (expected one of %s)' % (name.strip(), ', '.join(_CRITERIA)))
+        out[name.strip()] = float(value)
+    return out
+
+
+class Split:
+    """Training records and the test split (rated texts and multi-response items), hashed by key."""
+
+    def __init__(self, test_fraction=0.2, seed=0):
+        self.test_fraction = test_fraction
+        self.seed = seed
+        self.train = []
+        # (text, rating 0..1)
+        self.test = []
+        # item id -> [response text, ...]
+        self.items = {}
+
+    def is_test(self, key):
+        if self.test_fraction <= 0:
+            return True
+        return zlib.crc32(('%d:%s' % (self.seed, key)).encode('utf-8')) % 10000 < self.test_fraction * 10000
+
+    def add_review(self, r, index):
+        if not isinstance(r, dict) or not isinstance(r.get('assistantText'), str):
+            return
+        rating = human_rating(r)
+        if self.is_test(r.get('messageId') or 'review-%d' % index):
+            if rating is not None:
+                self.test.append((r['assistantText'], rating))
+            if self.test_fraction > 0:
+                return
+        self.train.append(r)
+
+    def add_item(self, item):
+        """A peer dataset item: each rated response is a review of its text."""
+        if not isinstance(item, dict) or not isinstance(item.get('assistantResponses'), list):
+            return
+        test = self.is_test(item.get('id'))
+        texts = []
+        for resp in item['assistantResponses']:
+            text = resp.get('text') if isinstance(resp, dict) else None
+            texts.append(text if isinstance(text, str) else '')
+            for review in (resp.get('reviews') or []) if isinstance(resp, dict) else []:
+                if not isinstance(review, dict):
+                    continue
+                record = {'assistantText': texts[-1], 'rating': review.get('rating'),
+                          'criteria': review.get('criteria')}
+                rating = human_rating(record)
+                if test and rating is not None:
+                    self.test.append((texts[-1], rating))
+                if not test or self.test_fraction <= 0:
+                    self.train.append(record)
+        if test and len(texts) > 1:
+            self.items[item.get('id')] = texts
+
+
+def pearson(xs, ys):
+    n = len(xs)
+    if n < 2:
+        return None
+    mx, my = sum(xs) / n, sum(ys) / n
+    sxy = sum((x - mx) * (y - my) for x, y in zip(xs, ys))
+    sxx = sum((x - mx) ** 2 for x in xs)
+    syy = sum((y - my) ** 2 for y in ys)
+    if sxx <= 0 or syy <= 0:
+        return None
+    return sxy / math.sqrt(sxx * syy)
+
+
+def _ranks(values):
+    """Ranks (1-based, ties get their average rank)."""
+    order = sorted(range(len(values)), key=values.__getitem__)
+    ranks = [0.0] * len(values)
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[order[k]] = (i + j) / 2.0 + 1
+        i = j + 1
+    return ranks
+
+
+def spearman(xs, ys):
+    return pearson(_ranks(xs), _ranks(ys)) if len(xs) > 1 else None
+
+
+def pairwise_agreement(votes, scores):
+    """{'votes', 'pairs', 'agreement', 'top1'} for peer ranking votes; scores maps item id -> [score per response]."""
+    pairs = wins = top = n = 0
+    for vote in votes:
+        s = scores.get(vote.get('itemId'))
+        try:
+            picked = int(vote.get('responseIndex'))
+        except (TypeError, ValueError):
+            continue
+        if s is None or not 0 <= picked < len(s):
+            continue
+        n += 1
+        others = [v for j, v in enumerate(s) if j != picked]
+        pairs += len(others)
+        wins += sum(1.0 if s[picked] > v else 0.5 if s[picked] == v else 0.0 for v in others)
+        top += all(s[picked] > v for v in others)
+    return {'votes': n, 'pairs': pairs, 'agreement': wins / pairs if pairs else None,
+            'top1': top / float(n) if n else None}
+
+
+def best_of_n(scores, ratings, n, trials, seed=0):
+    """Mean rating of the top-scored of n random candidates, over `trials` draws."""
+    if len(scores) < n:
+        return None
+    rnd = random.Random(seed)
+    total = 0.0
+    for _ in range(trials):
+        pick = max(rnd.sample(range(len(scores)), n), key=scores.__getitem__)
+        total += ratings[pick]
+    return total / trials
+
+
+# --- parallel scoring ----------------------------------------------------------
+
+_WORKER = {}
+
+
+def _init_worker(model_path, weight_sets):
+    # every worker maps the same file, so the model's pages are shared
+    model = load_model(model_path)
+    _WORKER['model'] = model.compiled()
+    # the compiled tables are views of the mapping the model holds open
+    _WORKER['keep'] = model
+    _WORKER['weights'] = weight_sets
+
+
+def _score_chunk(texts):
+    model, weight_sets = _WORKER['model'], _WORKER['weights']
+    return [score_batch(texts, model, w) for w in weight_sets]
+
+
+def _chunks(records, size):
+    chunk = []
+    for r in records:
+        chunk.append(candidate_text(r))
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def score_stream(records, model_path, weight_sets, processes, chunk_size=2000):
+    """Yield (texts, [scores per weight set]) per chunk, in input order, over `processes` processes.
+
+    At most 2 chunks per process are in flight, so memory stays bounded
+    however long the input is.
+    """
+    chunks = _chunks(records, chunk_size)
+    if processes <= 1:
+        _init_worker(model_path, weight_sets)
+        for texts in chunks:
+            yield texts, _score_chunk(texts)
+        return
+    with multiprocessing.Pool(processes, _init_worker, (model_path, weight_sets)) as pool:
+        pending = deque()
+        for texts in chunks:
+            pending.append((texts, pool.apply_async(_score_chunk, (texts,))))
+            if len(pending) >= 2 * processes:
+                texts, result = pending.popleft()
+                yield texts, result.get()
+        while pending:
+            texts, result = pending.popleft()
+            yield texts, result.get()
+
+
+def _fmt(value, pattern='%.3f'):
+    return pattern % value if value is not None else '-'
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Evaluate the reranker against ratings and peer rankings; '
+                                             'batch-score candidates over a process pool')
+    ap.add_argument('--reviews', default='reviews.json', help='reviews (JSON array or .jsonl)')
+    ap.add_argument('--dataset', default='peer_dataset.json', help='peer dataset items')
+    ap.add_argument('--rankings', default='', help='peer ranking votes (default: peer_rankings.jsonl or .json)')
+    ap.add_argument('--test-fraction', type=float, default=0.2, help='0 = evaluate in-sample')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--weights', action='append', default=[],
+                    help='criterion=weight,... to compare (repeatable; default: equal weights)')
+    ap.add_argument('--n', default='1,2,3,5,8', help='candidate counts for the best-of-n table')
+    ap.add_argument('--trials', type=int, default=2000, help='random draws per best-of-n cell')
+    ap.add_argument('--candidates', default='', help='texts to batch-score (default: the test split)')
+    ap.add_argument('--processes', default='1,%d' % (os.cpu_count() or 1), help='comma-separated process counts')
+    ap.add_argument('--chunk', type=int, default=2000, help='texts per task')
+    ap.add_argument('--out', default='', help='write the candidates\' scores here as JSON lines')
+    args = ap.parse_args()
+
+    labels = args.weights or ['equal']
+    weight_sets = [parse_weights(spec) for spec in labels]
+    counts = sorted(set(max(1, int(p)) for p in args.processes.split(',') if p.strip()))
+    rankings = args.rankings or next((p for p in ('peer_rankings.jsonl', 'peer_rankings.json')
+                                      if os.path.exists(p)), '')
+
+    t0 = time.perf_counter()
+    split = Split(args.test_fraction, args.seed)
+    if os.path.exists(args.reviews):
+        for i, r in enumerate(iter_json(args.reviews)):
+            split.add_review(r, i)
+    if args.dataset and os.path.exists(args.dataset):
+        for item in iter_json(args.dataset):
+            split.add_item(item)
+    model = RerankerModel.from_records(split.train)
+    load_ms = (time.perf_counter() - t0) * 1000.0
+    print('trained on %d reviews in %.0f ms; test split: %d rated texts, %d multi-response items%s' % (
+        len(split.train), load_ms, len(split.test), len(split.items),
+        ' (in-sample)' if args.test_fraction <= 0 else ''))
+
+    fd, model_path = tempfile.mkstemp(prefix='rerank-eval-', suffix='.model')
+    os.close(fd)
+    try:
+        save_model(model, model_path)
+        compiled = load_model(model_path).compiled()
+
+        votes = list(iter_json(rankings)) if rankings and os.path.exists(rankings) else []
+        ns = [int(n) for n in args.n.split(',') if n.strip()]
+        texts = [t for t, _ in split.test]
+        ratings = [r for _, r in split.test]
+        print('\n%-36s %8s %8s %7s %7s %6s  %s' % ('weights', 'pearson', 'spearman', 'pairs', 'agree', 'top1',
+                                                   '  '.join('best-of-%d' % n for n in ns)))
+        for label, weights in zip(labels, weight_sets):
+            scores = score_batch(texts, compiled, weights)
+            item_scores = {i: score_batch(resp, compiled, weights) for i, resp in split.items.items()}
+            agree = pairwise_agreement(votes, item_scores)
+            best = [best_of_n(scores, ratings, n, args.trials, args.seed) for n in ns]
+            print('%-36s %8s %8s %7d %7s %6s  %s' % (
+                label[:36], _fmt(pearson(scores, ratings)), _fmt(spearman(scores, ratings)), agree['pairs'],
+                _fmt(agree['agreement']), _fmt(agree['top1']),
+                '  '.join('%9s' % _fmt(b) for b in best)))
+
+        print('\nthroughput (%s, %d weight set%s, %d cores):' % (
+            args.candidates or 'test split', len(weight_sets), 's' if len(weight_sets) > 1 else '',
+            os.cpu_count() or 1))
+        baseline = checksum = None
+        for procs in counts:
+            source = iter_json(args.candidates) if args.candidates else texts
+            out = open(args.out, 'w', encoding='utf-8') if args.out and procs == counts[0] else None
+            total = 0
+            digest = 0
+            t0 = time.perf_counter()
+            try:
+                for chunk, results in score_stream(source, model_path, weight_sets, procs, args.chunk):
+                    for k, text in enumerate(chunk):
+                        row = [r[k] for r in results]
+                        digest = zlib.crc32(repr(row).encode('ascii'), digest)
+                        if out is not None:
+                            out.write(json.dumps({'index': total + k, 'scores': dict(zip(labels, row))}) + '\n')
+                    total += len(chunk)
+            finally:
+                if out is not None:
+                    out.close()
+            elapsed = time.perf_counter() - t0
+            rate = total / elapsed if elapsed > 0 else 0.0
+            baseline = baseline or rate
+            print('  processes=%-3d %10.0f texts/s  x%.2f  (%d texts in %.2fs%s)' % (
+                procs, rate, rate / baseline if baseline else 0.0, total, elapsed,
+                ', writing --out' if out is not None else ''))
+            if checksum is not None and digest != checksum:
+                raise SystemExit('scores differ between process counts')
+            checksum = digest
+        if args.out:
+            print('scores written to %s' % args.out)
+    finally:
+        os.unlink(model_path)
+
+
+if __name__ == '__main__':
+    main()
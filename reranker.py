@@ -2,19 +2,36 @@
 
 This module trains per-criterion token averages (e.g. factuality, clarity,
 ethics) from stored reviews and provides a composite scorer that accepts
-weights for each criterion to compute a single 0..1 score.
+weights for each criterion to compute a single 0..1 score. RerankerModel
+keeps the training sums so single review changes can be applied incrementally.
 """
+import hashlib
 import json
+import math
+import mmap
+import os
 import re
+import struct
+import threading
+from array import array
 from collections import defaultdict
+from operator import itemgetter
 
 _WORD_RE = re.compile(r"\w+", re.U)
 
 _CRITERIA = ['factuality', 'clarity', 'ethics']
 
+# For ASCII text, \w is exactly [A-Za-z0-9_], so mapping every other character
+# to a space and splitting yields the same tokens as the regex, several times faster.
+_ASCII_WORDS = str.maketrans({i: (chr(i).lower() if chr(i).isalnum() or chr(i) == '_' else ' ')
+                              for i in range(128)})
+
+
 def _tokenize(text):
     if not text:
         return []
+    if text.isascii():
+        return text.translate(_ASCII_WORDS).split()
     return [t.lower() for t in _WORD_RE.findall(text)]
 
 
@@ -30,73 +47,190 @@ def train_from_reviews(path='reviews.json'):
             reviews = json.load(f)
     except Exception:
         return {}
+    return train_from_records(reviews)
 
-    sums = {c: defaultdict(float) for c in _CRITERIA}
-    counts = {c: defaultdict(int) for c in _CRITERIA}
 
-    for r in reviews:
-        if not isinstance(r, dict):
-            continue
-        text = r.get('assistantText') or ''
-        toks = set(_tokenize(text))
-
-        # prefer per-criterion ratings if present
-        criteria = r.get('criteria') if isinstance(r.get('criteria'), dict) else None
-        if criteria:
-            for c in _CRITERIA:
-                val = criteria.get(c)
-                try:
-                    val = float(val)
-                except Exception:
-                    val = None
-                if val is None:
-                    # fallback to top-level rating
-                    try:
-                        val = float(r.get('rating'))
-                    except Exception:
-                        val = None
-                if val is None:
-                    continue
-                for t in toks:
-                    sums[c][t] += val
-                    counts[c][t] += 1
-        else:
-            # no per-criterion data: apply top-level rating to all criteria
-            try:
-                val = float(r.get('rating'))
-            except Exception:
+def train_from_records(reviews):
+    """Same as train_from_reviews, for an already-loaded list of review dicts."""
+    if not isinstance(reviews, list):
+        return {}
+    return RerankerModel.from_records(reviews).token_scores
+
+
+# Running sums are kept as exact integers in units of 2**-60 so that adding and
+# later subtracting a review restores the previous state bit for bit, and the
+# result does not depend on the order reviews were applied in.
+_SCALE = 1 << 60
+
+
+def _review_contributions(r):
+    """Return (tokens, [(criterion, scaled_rating), ...]) for one review."""
+    if not isinstance(r, dict):
+        return set(), []
+    text = r.get('assistantText') or ''
+    toks = set(_tokenize(text))
+
+    def _rating(val):
+        try:
+            val = float(val)
+        except Exception:
+            return None
+        if not math.isfinite(val):
+            return None
+        return int(val * _SCALE)
+
+    contributions = []
+    # prefer per-criterion ratings if present
+    criteria = r.get('criteria') if isinstance(r.get('criteria'), dict) else None
+    if criteria:
+        for c in _CRITERIA:
+            val = _rating(criteria.get(c))
+            if val is None:
+                # fallback to top-level rating
+                val = _rating(r.get('rating'))
+            if val is None:
                 continue
-            for c in _CRITERIA:
+            contributions.append((c, val))
+    else:
+        # no per-criterion data: apply top-level rating to all criteria
+        val = _rating(r.get('rating'))
+        if val is not None:
+            contributions = [(c, val) for c in _CRITERIA]
+    return toks, contributions
+
+
+class RerankerModel:
+    """Per-criterion token averages maintained incrementally.
+
+    Keeps the running `sums` and `counts` per criterion and token, so a new,
+    overwritten or deleted review is applied in O(tokens of that review)
+    instead of a full retrain. `token_scores` is the criterion -> token ->
+    avg_rating dict accepted by score_text; it is updated in place, as is
+    the array-backed form returned by compiled() once it has been built.
+    `version` increases with every change.
+
+    A model loaded with load_model() scores straight from the memory-mapped
+    file; the dicts are only built when first accessed or updated.
+    """
+
+    def __init__(self):
+        self._sums = {c: defaultdict(int) for c in _CRITERIA}
+        self._counts = {c: defaultdict(int) for c in _CRITERIA}
+        self._scores = {c: {} for c in _CRITERIA}
+        self.version = 0
+        self._compiled = None
+        self._file = None
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_records(cls, reviews):
+        """Bulk-train from a list of reviews (averages are computed once at the end)."""
+        model = cls()
+        for r in reviews:
+            toks, contributions = _review_contributions(r)
+            for c, val in contributions:
+                sums, counts = model._sums[c], model._counts[c]
                 for t in toks:
-                    sums[c][t] += val
-                    counts[c][t] += 1
+                    sums[t] += val
+                    counts[t] += 1
+        for c in _CRITERIA:
+            counts = model._counts[c]
+            model._scores[c] = {t: s / (counts[t] * _SCALE) for t, s in model._sums[c].items()}
+        return model
 
-    token_scores = {}
-    for c in _CRITERIA:
-        token_scores[c] = {}
-        for t, s in sums[c].items():
-            token_scores[c][t] = s / max(1, counts[c][t])
+    @property
+    def sums(self):
+        self._materialize()
+        return self._sums
 
-    return token_scores
+    @property
+    def counts(self):
+        self._materialize()
+        return self._counts
 
+    @property
+    def token_scores(self):
+        self._materialize()
+        return self._scores
 
-def score_text(text, token_scores, weights=None):
-    """Compute a weighted composite score (0..1) for the candidate text.
+    def _materialize(self):
+        """Build the dicts (and a writable compiled copy) from a loaded model file."""
+        with self._lock:
+            if self._file is None:
+                return
+            mf, self._file = self._file, None
+            for ci, c in enumerate(_CRITERIA):
+                scores, counts, sums = mf.scores[ci], mf.counts[ci], mf.sums[ci]
+                s_map, c_map, v_map = self._sums[c], self._counts[c], self._scores[c]
+                for i, t in enumerate(mf.tokens):
+                    n = counts[i]
+                    if n:
+                        c_map[t] = n
+                        s_map[t] = int.from_bytes(sums[16 * i:16 * i + 16], 'little', signed=True)
+                        v_map[t] = scores[i]
+            # readers may still hold the read-only mapped model; updates go to a copy
+            self._compiled = CompiledModel(dict(mf.vocab), {c: array('d', mf.scores[ci])
+                                                            for ci, c in enumerate(_CRITERIA)})
 
-    token_scores is expected to be a dict: criterion -> token->avg_rating (1-5 scale).
-    weights is a dict mapping criterion -> weight (weights will be normalized).
+    def _apply(self, review, sign):
+        toks, contributions = _review_contributions(review)
+        compiled = self._compiled
+        for c, val in contributions:
+            sums, counts, scores = self._sums[c], self._counts[c], self._scores[c]
+            for t in toks:
+                n = counts[t] + sign
+                if n <= 0:
+                    sums.pop(t, None)
+                    counts.pop(t, None)
+                    scores.pop(t, None)
+                    if compiled is not None:
+                        compiled.set(c, t, None)
+                    continue
+                total = sums[t] + sign * val
+                sums[t] = total
+                counts[t] = n
+                scores[t] = total / (n * _SCALE)
+                if compiled is not None:
+                    compiled.set(c, t, scores[t])
 
-    Behavior:
-    - For each criterion, compute the average of token ratings present in
-      that criterion's token map. If no tokens matched for a criterion, the
-      criterion score defaults to neutral (0.5).
-    - Composite score is weighted sum of per-criterion scores.
-    """
-    toks = _tokenize(text)
-    if not toks:
-        return 0.5
+    def compiled(self):
+        """Array-backed CompiledModel for score_batch, built on first use and then kept current."""
+        with self._lock:
+            if self._compiled is None:
+                if self._file is not None:
+                    self._compiled = self._file.compiled
+                else:
+                    self._compiled = compile_model(self._scores)
+            return self._compiled
+
+    def snapshot(self):
+        """CompiledModel of the current scores that later changes to this model never touch."""
+        with self._lock:
+            if self._file is not None:
+                # the mapped file is read-only; changes materialize into a separate copy
+                return self._file.compiled
+            c = self.compiled()
+            return CompiledModel(dict(c.vocab), {k: array('d', t) for k, t in c.tables.items()})
+
+    def add(self, review):
+        self.replace(None, review)
+
+    def remove(self, review):
+        self.replace(review, None)
 
-    # normalize weights
+    def replace(self, old, new):
+        """Swap review `old` for `new` (either may be None)."""
+        with self._lock:
+            self._materialize()
+            if old is not None:
+                self._apply(old, -1)
+            if new is not None:
+                self._apply(new, 1)
+            self.version += 1
+
+
+def _normalize_weights(weights):
+    """Return criterion -> weight normalized to sum 1 (equal weights if none/invalid total)."""
     w = {}
     if isinstance(weights, dict):
         total = sum(float(weights.get(k, 0) or 0) for k in _CRITERIA)
@@ -113,18 +247,17 @@ def score_text(text, token_scores, weights=None):
     else:
         for k in _CRITERIA:
             w[k] = 1.0 / len(_CRITERIA)
+    return w
 
+
+def _composite(matched, w):
+    """Combine per-criterion (sum, count) of matched token ratings into the 0..1 score."""
     per_scores = {}
     any_token_found = False
-    for c in _CRITERIA:
-        vals = []
-        c_map = token_scores.get(c, {}) if isinstance(token_scores, dict) else {}
-        for t in toks:
-            if t in c_map:
-                vals.append(c_map[t])
-        if vals:
+    for c, (total, count) in zip(_CRITERIA, matched):
+        if count:
             any_token_found = True
-            avg = sum(vals) / len(vals)
+            avg = total / count
             # normalize 1-5 -> 0..1
             try:
                 per_scores[c] = max(0.0, min(1.0, (avg - 1.0) / 4.0))
@@ -138,3 +271,252 @@ def score_text(text, token_scores, weights=None):
 
     composite = sum(per_scores[c] * w.get(c, 0) for c in _CRITERIA)
     return max(0.0, min(1.0, composite))
+
+
+def score_text(text, token_scores, weights=None):
+    """Compute a weighted composite score (0..1) for the candidate text.
+
+    token_scores is expected to be a dict: criterion -> token->avg_rating (1-5 scale).
+    weights is a dict mapping criterion -> weight (weights will be normalized).
+
+    Behavior:
+    - For each criterion, compute the average of token ratings present in
+      that criterion's token map. If no tokens matched for a criterion, the
+      criterion score defaults to neutral (0.5).
+    - Composite score is weighted sum of per-criterion scores.
+
+    A CompiledModel is accepted too and scored through score_batch.
+    """
+    if isinstance(token_scores, CompiledModel):
+        return score_batch([text], token_scores, weights)[0]
+    toks = _tokenize(text)
+    if not toks:
+        return 0.5
+
+    w = _normalize_weights(weights)
+
+    matched = []
+    for c in _CRITERIA:
+        vals = []
+        c_map = token_scores.get(c, {}) if isinstance(token_scores, dict) else {}
+        for t in toks:
+            # single lookup: the map may be updated concurrently by RerankerModel
+            v = c_map.get(t)
+            if v is not None:
+                vals.append(v)
+        matched.append((sum(vals), len(vals)))
+    return _composite(matched, w)
+
+
+_NAN = float('nan')
+
+
+class CompiledModel:
+    """token_scores compiled to integer token ids and one float array per criterion.
+
+    vocab maps token -> id; tables[criterion][id] is that token's average
+    rating, or NaN when the token has no rating for the criterion.
+    compile_model() assigns ids in sorted token order; tokens added later
+    through set() are appended.
+    """
+
+    def __init__(self, vocab, tables):
+        self.vocab = vocab
+        self.tables = tables
+
+    def __len__(self):
+        """Tokens in the vocabulary, so a model built from no reviews is falsy."""
+        return len(self.vocab)
+
+    def set(self, criterion, token, value):
+        """Set (or clear, with value=None) one token's score for a criterion."""
+        i = self.vocab.get(token)
+        if i is None:
+            if value is None:
+                return
+            i = len(self.vocab)
+            for tab in self.tables.values():
+                tab.append(_NAN)
+            # publish the id only once every table has a slot for it
+            self.vocab[token] = i
+        self.tables[criterion][i] = _NAN if value is None else value
+
+
+def compile_model(token_scores):
+    """Build a CompiledModel from a criterion -> token -> avg_rating dict."""
+    maps = [token_scores.get(c, {}) if isinstance(token_scores, dict) else {} for c in _CRITERIA]
+    tokens = sorted(set().union(*maps))
+    vocab = {t: i for i, t in enumerate(tokens)}
+    tables = {c: array('d', [m.get(t, _NAN) for t in tokens]) for c, m in zip(_CRITERIA, maps)}
+    return CompiledModel(vocab, tables)
+
+
+def score_batch(texts, model, weights=None):
+    """Score many candidate texts at once; returns a list identical to [score_text(t, ...)].
+
+    model is a CompiledModel (or a token_scores dict, compiled on the fly).
+    Each text is tokenized once and mapped to token ids; per criterion the
+    matched ratings are gathered from the array table in one C-level call
+    and summed in token order, exactly like score_text. Weights are
+    normalized once for the whole batch.
+    """
+    if not isinstance(model, CompiledModel):
+        model = compile_model(model)
+    get_id = model.vocab.get
+    tables = [model.tables[c] for c in _CRITERIA]
+    w = None
+    results = []
+    for text in texts:
+        toks = _tokenize(text)
+        if not toks:
+            results.append(0.5)
+            continue
+        if w is None:
+            w = _normalize_weights(weights)
+        ids = [i for i in map(get_id, toks) if i is not None]
+        if not ids:
+            results.append(0.5)
+            continue
+        gather = itemgetter(*ids) if len(ids) > 1 else (lambda tab, i=ids[0]: (tab[i],))
+        matched = []
+        for tab in tables:
+            vals = gather(tab)
+            total = sum(vals)
+            if total != total:
+                # NaN: some tokens have no rating for this criterion; drop them
+                vals = [v for v in vals if v == v]
+                total = sum(vals)
+            matched.append((total, len(vals)))
+        results.append(_composite(matched, w))
+    return results
+
+
+# --- model files -------------------------------------------------------------
+#
+# Layout (little endian):
+#   magic | uint32 header length | JSON header | vocabulary | padding to 8 bytes
+#   | scores: float64[n] per criterion (NaN = no rating)
+#   | counts: int64[n] per criterion
+#   | sums:   int128[n] per criterion (the exact scaled sums RerankerModel keeps)
+# The vocabulary is the sorted tokens joined by newlines (tokens never contain
+# one). The header records the size, mtime and sha256 of the source files the
+# model was built from, so load_model() can tell whether it is still fresh.
+
+_MAGIC = b'RRKM\x01\n'
+
+
+def _fingerprint(path, with_hash=True):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    fp = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    if with_hash:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        fp['sha256'] = h.hexdigest()
+    return fp
+
+
+def _sources_fresh(recorded, sources):
+    """True if every source file still matches the fingerprint stored in the model header.
+
+    Sources are matched by position, so the same files under another path
+    (e.g. a moved checkout) still count as fresh.
+    """
+    if len(recorded) != len(sources):
+        return False
+    for (_, old), path in zip(recorded, sources):
+        cur = _fingerprint(path, with_hash=False)
+        if old is None or cur is None:
+            if old != cur:
+                return False
+            continue
+        if cur['size'] != old['size']:
+            return False
+        if cur['mtime_ns'] != old['mtime_ns']:
+            # touched or rewritten (e.g. compaction): compare contents
+            if _fingerprint(path)['sha256'] != old.get('sha256'):
+                return False
+    return True
+
+
+def save_model(model, path, sources=()):
+    """Write model to path atomically, recording fingerprints of the source files."""
+    scores = model.token_scores
+    counts_map = model.counts
+    sums_map = model.sums
+    tokens = sorted(set().union(*(scores[c] for c in _CRITERIA)))
+    vocab = '\n'.join(tokens).encode('utf-8')
+    header = json.dumps({
+        'criteria': _CRITERIA,
+        'tokens': len(tokens),
+        'vocab_bytes': len(vocab),
+        'sources': [[p, _fingerprint(p)] for p in sources],
+    }).encode('utf-8')
+    head = _MAGIC + struct.pack('<I', len(header)) + header + vocab
+    head += b'\0' * (-len(head) % 8)
+    # per process: during a pre-fork reload the old and the new trainer may both be saving
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(head)
+        for c in _CRITERIA:
+            f.write(array('d', [scores[c].get(t, _NAN) for t in tokens]).tobytes())
+        for c in _CRITERIA:
+            f.write(array('q', [counts_map[c].get(t, 0) for t in tokens]).tobytes())
+        for c in _CRITERIA:
+            sums = sums_map[c]
+            f.write(b''.join(sums.get(t, 0).to_bytes(16, 'little', signed=True) for t in tokens))
+    os.replace(tmp, path)
+
+
+class _ModelFile:
+    """Memory-mapped view of a saved model."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mm = self._mm
+        if mm[:len(_MAGIC)] != _MAGIC:
+            raise ValueError('not a reranker model file')
+        pos = len(_MAGIC)
+        (hlen,) = struct.unpack_from('<I', mm, pos)
+        pos += 4
+        self.header = json.loads(mm[pos:pos + hlen].decode('utf-8'))
+        if self.header.get('criteria') != _CRITERIA:
+            raise ValueError('model was built for different criteria')
+        pos += hlen
+        n = self.header['tokens']
+        vocab = mm[pos:pos + self.header['vocab_bytes']].decode('utf-8')
+        self.tokens = vocab.split('\n') if n else []
+        self.vocab = dict(zip(self.tokens, range(n)))
+        pos += self.header['vocab_bytes']
+        pos += -pos % 8
+        view = memoryview(mm)
+        k = len(_CRITERIA)
+        self.scores = [view[pos + i * 8 * n:pos + (i + 1) * 8 * n].cast('d') for i in range(k)]
+        pos += k * 8 * n
+        self.counts = [view[pos + i * 8 * n:pos + (i + 1) * 8 * n].cast('q') for i in range(k)]
+        pos += k * 8 * n
+        self.sums = [view[pos + i * 16 * n:pos + (i + 1) * 16 * n] for i in range(k)]
+        self.compiled = CompiledModel(self.vocab, dict(zip(_CRITERIA, self.scores)))
+
+
+def load_model(path, sources=None):
+    """Load a saved model (memory-mapped), or None if missing, unreadable or stale.
+
+    When sources is given, the model is only returned if those files still
+    match the fingerprints recorded at save time (size and mtime, falling
+    back to sha256 when only the mtime changed).
+    """
+    try:
+        mf = _ModelFile(path)
+    except Exception:
+        return None
+    if sources is not None and not _sources_fresh(mf.header.get('sources') or [], list(sources)):
+        return None
+    model = RerankerModel()
+    model._file = mf
+    return model
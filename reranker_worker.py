@@ -0,0 +1,282 @@
+"""Background reranker training, off the request path (stdlib only).
+
+Review writes only queue their change with submit(); a worker thread applies
+the queued changes to its own RerankerModel and publishes a fresh snapshot,
+so requests never wait for the reranker:
+
+- Bursts are debounced: the worker waits until no change has arrived for
+  `debounce` seconds (at most `max_delay` after the first one) and then
+  applies the whole batch at once, incrementally (O(tokens) per review).
+- Without a model (no fresh model file) or after rebuild(), the worker builds
+  one from scratch from `records()`. The snapshot of the records is taken
+  under `lock`, the lock the callers hold while they change the store and
+  call submit(), so no change is lost or applied twice.
+- Every publish swaps current() to a new CompiledModel copy in one assignment
+  and bumps `version`; readers keep scoring with the copy they already have.
+
+stats() reports the version, how long builds and updates took and how stale
+the published model is (queued changes and the age of the oldest one).
+
+In pre-fork mode (prefork.py) only one process trains; it saves the model
+file after every publish, and the other workers read it through a
+SharedModel, which memory-maps the file so all of them share one copy of
+the score tables in the page cache.
+"""
+import os
+import threading
+import time
+
+from reranker import RerankerModel, compile_model, load_model
+
+
+class TrainingWorker:
+    def __init__(self, records, lock=None, model=None, debounce=0.25, max_delay=2.0, on_built=None,
+                 on_update=None):
+        # callable returning the current list of reviews
+        self.records = records
+        self.lock = lock if lock is not None else threading.RLock()
+        self.debounce = max(0.0, debounce)
+        self.max_delay = max(self.debounce, max_delay)
+        # called with the model after a full build, under `lock`, if nothing changed meanwhile (e.g. to save it)
+        self.on_built = on_built
+        # called with the model after an incremental update was published (e.g. to save it for other processes)
+        self.on_update = on_update
+        self._model = model
+        self._cond = threading.Condition()
+        self._pending = []
+        self._pending_since = time.monotonic() if model is None else None
+        # arrival time of the oldest change in the batch being applied
+        self._inflight_since = None
+        self._changes = 0
+        self._full = model is None
+        self._closing = False
+        self._busy = False
+        # True while the model holds changes that were not saved (see on_built)
+        self.dirty = False
+        self.version = 1 if model is not None else 0
+        self._current = model.snapshot() if model is not None else compile_model({})
+        self.published_at = time.time() if model is not None else None
+        self.counters = {'builds': 0, 'updates': 0, 'changes': 0, 'errors': 0,
+                         'last_build_ms': None, 'last_update_ms': None}
+        self._thread = threading.Thread(target=self._run, name='reranker-trainer', daemon=True)
+        self._thread.start()
+
+    def current(self):
+        """The published CompiledModel (never modified after publishing)."""
+        return self._current
+
+    def submit(self, old, new):
+        """Queue one review change (old -> new, either may be None); returns immediately."""
+        with self._cond:
+            self._pending.append((old, new))
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            self._changes += 1
+            self._cond.notify()
+
+    def rebuild(self):
+        """Queue a full rebuild from records()."""
+        with self._cond:
+            self._full = True
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            self._changes += 1
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not (self._pending or self._full or self._closing):
+                    self._cond.wait()
+                if self._closing and (self._full or not self._pending):
+                    return
+                # debounce: wait for a quiet period, but no longer than max_delay after the first change
+                while not self._closing:
+                    seen = self._changes
+                    left = self.max_delay - (time.monotonic() - self._pending_since)
+                    if left <= 0:
+                        break
+                    self._cond.wait(min(self.debounce, left))
+                    if self._changes == seen:
+                        break
+                self._busy = True
+            try:
+                self._step()
+            except Exception:
+                self.counters['errors'] += 1
+                # keep the queued work and retry after the next change or debounce period
+                time.sleep(self.max_delay)
+            finally:
+                self._busy = False
+
+    def _step(self):
+        with self._cond:
+            full = self._full or self._model is None
+        if full:
+            t0 = time.perf_counter()
+            with self.lock:
+                records = self.records()
+                with self._cond:
+                    self._inflight_since = self._pending_since
+                    self._pending = []
+                    self._pending_since = None
+                    self._full = False
+            try:
+                model = RerankerModel.from_records(records)
+                snapshot = model.snapshot()
+            except Exception:
+                self._inflight_since = None
+                self.rebuild()
+                raise
+            self._publish(model, snapshot)
+            self.counters['builds'] += 1
+            self.counters['last_build_ms'] = round((time.perf_counter() - t0) * 1000.0, 1)
+            self.dirty = True
+            if self.on_built is not None:
+                with self.lock:
+                    with self._cond:
+                        clean = not self._pending and not self._full
+                    if clean:
+                        try:
+                            self.on_built(model)
+                            self.dirty = False
+                        except Exception:
+                            pass
+            return
+        with self._cond:
+            changes, self._pending = self._pending, []
+            self._inflight_since = self._pending_since
+            self._pending_since = None
+        if not changes:
+            return
+        t0 = time.perf_counter()
+        model = self._model
+        try:
+            for old, new in changes:
+                model.replace(old, new)
+        except Exception:
+            # the model may hold part of the batch; rebuild it from the store instead
+            self._inflight_since = None
+            self.rebuild()
+            raise
+        self._publish(model, model.snapshot())
+        self.dirty = True
+        self.counters['updates'] += 1
+        self.counters['changes'] += len(changes)
+        self.counters['last_update_ms'] = round((time.perf_counter() - t0) * 1000.0, 1)
+        if self.on_update is not None:
+            try:
+                self.on_update(model)
+                self.dirty = False
+            except Exception:
+                pass
+
+    def _publish(self, model, compiled):
+        self._model = model
+        self.version += 1
+        self._current = compiled
+        self.published_at = time.time()
+        self._inflight_since = None
+
+    def model(self):
+        """The worker's RerankerModel (None until the first build finishes)."""
+        return self._model
+
+    def close(self, timeout=10.0):
+        """Apply queued changes and stop; returns True if the model is complete (no build was cut short)."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        with self._cond:
+            return not self._thread.is_alive() and not self._full and not self._pending and self._model is not None
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+            since = self._inflight_since or self._pending_since
+            out = dict(self.counters)
+            out.update({
+                'version': self.version,
+                'building': self._busy,
+                'full_build_queued': self._full,
+                'pending_changes': pending,
+                'stale_ms': round((time.monotonic() - since) * 1000.0, 1) if since is not None else 0.0,
+                'published_at': self.published_at,
+                'debounce_ms': self.debounce * 1000.0,
+            })
+            return out
+
+
+class SharedModel:
+    """Read-only reranker of a pre-fork worker that does not train.
+
+    current() serves the model file the training process saved, memory-mapped,
+    and re-maps it once the file was replaced (checked at most every
+    `interval` seconds). Review changes reach the trainer through the shared
+    store, so submit() and rebuild() do nothing here.
+    """
+
+    dirty = False
+
+    def __init__(self, path, interval=0.5):
+        self.path = path
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._checked = None
+        self._stamp = None
+        self._current = compile_model({})
+        self.version = 0
+        self.published_at = None
+        self.counters = {'reloads': 0, 'errors': 0}
+        self._check()
+
+    def current(self):
+        if self._checked is None or time.monotonic() - self._checked >= self.interval:
+            self._check()
+        return self._current
+
+    def _check(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._checked is not None and now - self._checked < self.interval:
+                return
+            self._checked = now
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                return
+            stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+            if stamp == self._stamp:
+                return
+            model = load_model(self.path)
+            if model is None:
+                # unreadable (e.g. truncated by a full disk); try again after the next interval
+                self.counters['errors'] += 1
+                return
+            self._current = model.snapshot()
+            self._stamp = stamp
+            self.version += 1
+            self.published_at = time.time()
+            self.counters['reloads'] += 1
+
+    def submit(self, old, new):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def model(self):
+        return None
+
+    def close(self, timeout=10.0):
+        return False
+
+    def stats(self):
+        # report the model a request would get now
+        self.current()
+        with self._lock:
+            out = dict(self.counters)
+        out.update({'version': self.version, 'published_at': self.published_at, 'shared': True,
+                    'path': self.path})
+        return out
@@ -0,0 +1,383 @@
+"""Retries, hedged requests, a circuit breaker and a concurrency limit for the upstream (stdlib only).
+
+`ResilientUpstream.post_json()` wraps `UpstreamClient` (upstream.py) and
+returns a response with the same interface (status, headers, timings,
+read(), line iteration, close(), context manager):
+
+- Retries: connection failures, 429 and 5xx answers are retried up to
+  `retries` times with full-jitter exponential backoff (`backoff_base`
+  doubling up to `backoff_max`). A Retry-After / retry-after-ms header from
+  the upstream sets the wait instead. A retry that would end more than
+  `budget` seconds after the first attempt is not made. Streams are only
+  retried before their headers arrive, so nothing has been relayed yet.
+- Hedging (non-streaming calls only): when the first attempt has not
+  finished after the `hedge_quantile` of recent call latencies (at least
+  `hedge_min` seconds), an identical second request is sent and the first
+  complete answer wins. Each attempt reads its body inside the race.
+- CircuitBreaker: after `failures` consecutive failed attempts, calls raise
+  CircuitOpenError at once (the server then answers with its mock reply).
+  After `reset_after` seconds one probe call is let through, and its outcome
+  closes or re-opens the circuit.
+- ConcurrencyLimiter: at most `limit` calls in flight per API key; a caller
+  waits up to `wait` seconds for a slot and then gets UpstreamBusy.
+
+A call made with an upstream.Cancellation is neither retried nor counted by
+the breaker once it has been cancelled.
+"""
+import json
+import queue
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+from upstream import UpstreamCancelled, UpstreamError, UpstreamHTTPError
+
+# answers worth another attempt; other 4xx are the request's fault
+RETRY_STATUSES = frozenset([408, 409, 429, 500, 502, 503, 504])
+
+
+class CircuitOpenError(UpstreamError):
+    """The circuit breaker is open; the upstream was not called."""
+
+
+class UpstreamBusy(UpstreamError):
+    """No concurrency slot for this API key became free in time."""
+
+
+def retry_after(error):
+    """Seconds the upstream asked us to wait (Retry-After or retry-after-ms), or None."""
+    headers = {str(k).lower(): v for k, v in (getattr(error, 'headers', None) or {}).items()}
+    try:
+        if 'retry-after-ms' in headers:
+            return max(0.0, float(headers['retry-after-ms']) / 1000.0)
+        value = headers.get('retry-after')
+        if value is None:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except Exception:
+        return None
+
+
+def retryable(error):
+    if isinstance(error, (CircuitOpenError, UpstreamBusy, UpstreamCancelled)):
+        return False
+    if isinstance(error, UpstreamHTTPError):
+        return error.status in RETRY_STATUSES
+    return isinstance(error, UpstreamError)
+
+
+def _is_failure(error):
+    # a 400/401/404 means the upstream is up and answering
+    if isinstance(error, UpstreamHTTPError):
+        return error.status == 429 or error.status >= 500
+    return True
+
+
+class CircuitBreaker:
+    def __init__(self, failures=5, reset_after=30.0):
+        # failures <= 0 disables the breaker
+        self.threshold = failures
+        self.reset_after = reset_after
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self.counters = {'opened': 0, 'rejected': 0, 'probes': 0}
+
+    def allow(self):
+        """True if a call may go out; every allowed call must be followed by record()."""
+        if self.threshold <= 0:
+            return True
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if not self._probing and time.monotonic() - self._opened_at >= self.reset_after:
+                self._probing = True
+                self.counters['probes'] += 1
+                return True
+            self.counters['rejected'] += 1
+            return False
+
+    def record(self, ok):
+        if self.threshold <= 0:
+            return
+        with self._lock:
+            if ok:
+                self._failures = 0
+                self._opened_at = None
+                self._probing = False
+                return
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= self.threshold):
+                if self._opened_at is None:
+                    self.counters['opened'] += 1
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def release(self):
+        """An allowed call ended without telling anything about the upstream (it was cancelled)."""
+        with self._lock:
+            # a cancelled probe lets the next call probe instead
+            self._probing = False
+
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if self._probing or time.monotonic() - self._opened_at >= self.reset_after:
+                return 'half_open'
+            return 'open'
+
+    def stats(self):
+        state = self.state()
+        with self._lock:
+            out = dict(self.counters)
+            out['consecutive_failures'] = self._failures
+        out['state'] = state
+        out['open'] = state == 'open'
+        return out
+
+
+class ConcurrencyLimiter:
+    def __init__(self, limit, wait=30.0):
+        # limit <= 0 means unlimited
+        self.limit = limit
+        self.wait = wait
+        self._lock = threading.Lock()
+        self._slots = {}
+        self.counters = {'waited': 0, 'wait_ms': 0.0, 'rejected': 0}
+
+    def acquire(self, key, wait=None):
+        """Take a slot for `key`; returns False if none became free within `wait` seconds."""
+        if self.limit <= 0:
+            return True
+        with self._lock:
+            sem = self._slots.get(key)
+            if sem is None:
+                sem = self._slots[key] = threading.BoundedSemaphore(self.limit)
+        if sem.acquire(blocking=False):
+            return True
+        wait = self.wait if wait is None else wait
+        t0 = time.perf_counter()
+        ok = wait > 0 and sem.acquire(timeout=wait)
+        with self._lock:
+            if ok:
+                self.counters['waited'] += 1
+                self.counters['wait_ms'] += (time.perf_counter() - t0) * 1000.0
+            else:
+                self.counters['rejected'] += 1
+        return ok
+
+    def release(self, key):
+        if self.limit <= 0:
+            return
+        with self._lock:
+            sem = self._slots.get(key)
+        sem.release()
+
+    def stats(self):
+        with self._lock:
+            out = dict(self.counters)
+        out['wait_ms'] = round(out['wait_ms'], 1)
+        out['limit'] = self.limit
+        return out
+
+
+class ResilientResponse:
+    """An UpstreamResponse, either live (streams) or with its body already read (`data`)."""
+
+    def __init__(self, resp, data=None, on_close=None):
+        self._resp = resp
+        self._data = data
+        self._on_close = on_close
+        self.status = resp.status
+        self.headers = resp.headers
+        self.timings = resp.timings
+
+    def read(self):
+        if self._data is None:
+            self._data = self._resp.read()
+        self.close()
+        return self._data
+
+    def __iter__(self):
+        if self._data is not None:
+            return iter(self._data.splitlines(True))
+        return iter(self._resp)
+
+    def close(self):
+        self._resp.close()
+        on_close, self._on_close = self._on_close, None
+        if on_close is not None:
+            on_close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class ResilientUpstream:
+    def __init__(self, client, retries=2, backoff_base=0.25, backoff_max=4.0, budget=30.0,
+                 hedge=False, hedge_quantile=0.95, hedge_min=0.5, breaker=None, limiter=None):
+        self.client = client
+        self.retries = max(0, retries)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.budget = budget
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min = hedge_min
+        self.breaker = breaker
+        self.limiter = limiter
+        # durations of recent complete non-streaming attempts (seconds), for the hedge delay
+        self.latencies = deque(maxlen=200)
+        self._lock = threading.Lock()
+        self.counters = {'calls': 0, 'attempts': 0, 'retries': 0, 'failed_attempts': 0,
+                         'hedges': 0, 'hedge_wins': 0, 'retry_after_waits': 0}
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def post_json(self, path, payload, headers=None, timeout=None, key=None, stream=False, cancel=None):
+        """POST a JSON payload with retries (and hedging unless `stream`); returns a ResilientResponse.
+
+        Non-streaming responses come back with their body already read.
+        """
+        body = json.dumps(payload).encode('utf-8')
+        hdrs = {'Content-Type': 'application/json'}
+        hdrs.update(headers or {})
+        self._count('calls')
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            try:
+                if self.hedge and not stream:
+                    return self._hedged(path, body, hdrs, timeout, key, cancel)
+                return self._attempt(path, body, hdrs, timeout, key, cancel, read=not stream)
+            except UpstreamError as e:
+                if attempt >= self.retries or not retryable(e) or (cancel is not None and cancel.cancelled):
+                    raise
+                delay = retry_after(e)
+                if delay is not None:
+                    self._count('retry_after_waits')
+                else:
+                    delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+                if time.monotonic() - started + delay > self.budget:
+                    raise
+                attempt += 1
+                self._count('retries')
+                time.sleep(delay)
+
+    def _attempt(self, path, body, headers, timeout, key, cancel, read, wait=None):
+        limiter = self.limiter
+        if limiter is not None and not limiter.acquire(key, wait):
+            raise UpstreamBusy('too many concurrent upstream calls for this key')
+        release = (lambda: limiter.release(key)) if limiter is not None else None
+        try:
+            if self.breaker is not None and not self.breaker.allow():
+                raise CircuitOpenError('upstream circuit open')
+            self._count('attempts')
+            t0 = time.perf_counter()
+            ok = False
+            try:
+                resp = self.client.request('POST', path, body, headers, timeout, cancel)
+                data = None
+                if read:
+                    try:
+                        data = resp.read()
+                    except Exception as e:
+                        resp.close()
+                        if cancel is not None and cancel.cancelled:
+                            raise UpstreamCancelled('request cancelled')
+                        raise UpstreamError('reading the upstream response failed: %s' % e)
+                ok = True
+            except UpstreamError as e:
+                ok = not _is_failure(e)
+                raise
+            finally:
+                cancelled = not ok and cancel is not None and cancel.cancelled
+                if not ok and not cancelled:
+                    self._count('failed_attempts')
+                if self.breaker is not None:
+                    if cancelled:
+                        self.breaker.release()
+                    else:
+                        self.breaker.record(ok)
+        except BaseException:
+            if release is not None:
+                release()
+            raise
+        if read:
+            self.latencies.append(time.perf_counter() - t0)
+            if release is not None:
+                release()
+            return ResilientResponse(resp, data)
+        # a stream holds its slot until the caller closes it
+        return ResilientResponse(resp, on_close=release)
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None while there are too few samples."""
+        samples = list(self.latencies)
+        if len(samples) < 20:
+            return None
+        samples.sort()
+        q = samples[min(len(samples) - 1, int(self.hedge_quantile * len(samples)))]
+        return max(self.hedge_min, q)
+
+    def _hedged(self, path, body, headers, timeout, key, cancel):
+        delay = self.hedge_delay()
+        if delay is None:
+            return self._attempt(path, body, headers, timeout, key, cancel, read=True)
+        results = queue.Queue()
+
+        def run(hedge):
+            try:
+                # the hedge only goes out if a slot is free right now
+                resp = self._attempt(path, body, headers, timeout, key, cancel, read=True, wait=0 if hedge else None)
+                results.put((hedge, resp, None))
+            except Exception as e:
+                results.put((hedge, None, e))
+
+        threading.Thread(target=run, args=(False,), name='upstream-attempt', daemon=True).start()
+        launched = 1
+        try:
+            item = results.get(timeout=delay)
+        except queue.Empty:
+            item = None
+            self._count('hedges')
+            threading.Thread(target=run, args=(True,), name='upstream-hedge', daemon=True).start()
+            launched = 2
+        errors = []
+        while True:
+            if item is None:
+                item = results.get()
+            hedge, resp, error = item
+            item = None
+            if resp is not None:
+                # a slower attempt still finishing in its thread is simply dropped
+                if hedge:
+                    self._count('hedge_wins')
+                return resp
+            errors.append((hedge, error))
+            if len(errors) == launched:
+                # report the primary's error rather than a hedge that found no free slot
+                errors.sort(key=lambda pair: pair[0])
+                raise errors[0][1]
+
+    def stats(self):
+        with self._lock:
+            out = dict(self.counters)
+        delay = self.hedge_delay() if self.hedge else None
+        out['hedge_delay_ms'] = round(delay * 1000.0, 1) if delay is not None else None
+        out['breaker'] = self.breaker.stats() if self.breaker is not None else None
+        out['limiter'] = self.limiter.stats() if self.limiter is not None else None
+        return out
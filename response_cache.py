@@ -0,0 +1,170 @@
+"""LRU cache of upstream /chat candidates (stdlib only).
+
+Entries are keyed on a hash of the normalized conversation plus the sampling
+parameters sent upstream (model, n, temperature, max_tokens) and hold the
+candidate reply texts, not the reranked result, so a hit is still reranked
+with the caller's weights and the current reranker. The cache is bounded by
+entry count and by the UTF-8 size of the stored texts, entries expire after
+`ttl` seconds, and it can be persisted to a JSON file across restarts.
+
+Sampled requests (temperature > 0, or no temperature, which means the
+upstream default of 1) are not cached unless `cache_sampled` is set, since
+callers expect a fresh draw each time.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+_SPACE_RE = re.compile(r'\s+')
+
+
+def _normalize_text(text):
+    if not isinstance(text, str):
+        return text
+    return _SPACE_RE.sub(' ', text).strip()
+
+
+def cache_key(payload):
+    """Hash of the normalized messages + model/n/temperature/max_tokens (+ fan-out variants) of an upstream payload."""
+    messages = []
+    for m in payload.get('messages') or []:
+        if isinstance(m, dict):
+            messages.append([m.get('role'), _normalize_text(m.get('content'))])
+    material = {
+        'messages': messages,
+        'model': payload.get('model'),
+        'n': payload.get('n', 1),
+        'temperature': payload.get('temperature'),
+        'max_tokens': payload.get('max_tokens'),
+    }
+    if payload.get('fanout'):
+        # fan-out variants (server_py._fanout_plan) change which models answer
+        material['fanout'] = payload['fanout']
+    blob = json.dumps(material, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+def _entry_size(key, replies):
+    return len(key) + sum(len(r.encode('utf-8')) for r in replies)
+
+
+class ResponseCache:
+    def __init__(self, max_entries=1000, max_bytes=32 * 1024 * 1024, ttl=3600.0, path=None,
+                 cache_sampled=False):
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max(1, max_bytes)
+        self.ttl = ttl
+        self.path = path
+        self.cache_sampled = cache_sampled
+        # key -> (expires_at, replies, size); ordered oldest use first
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'misses': 0, 'bypassed': 0, 'stores': 0,
+                         'evictions': 0, 'expirations': 0}
+        if path:
+            self.load()
+
+    def cacheable(self, payload):
+        """False for sampled requests unless cache_sampled is set."""
+        if self.cache_sampled:
+            return True
+        temperature = payload.get('temperature')
+        return temperature is not None and temperature <= 0
+
+    def bypass(self):
+        """Count a request that skipped the cache."""
+        with self._lock:
+            self.counters['bypassed'] += 1
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= time.time():
+                self._drop(key)
+                self.counters['expirations'] += 1
+                entry = None
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return list(entry[1])
+
+    def put(self, key, replies, expires_at=None):
+        """Store candidate texts under key; entries larger than max_bytes are not cached."""
+        replies = [r for r in replies if isinstance(r, str)]
+        if key is None or not replies:
+            return
+        size = _entry_size(key, replies)
+        if size > self.max_bytes:
+            return
+        if expires_at is None:
+            expires_at = time.time() + self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (expires_at, replies, size)
+            self._bytes += size
+            self.counters['stores'] += 1
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.counters['evictions'] += 1
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            out = dict(self.counters)
+            out.update({'entries': len(self._entries), 'bytes': self._bytes,
+                        'max_entries': self.max_entries, 'max_bytes': self.max_bytes,
+                        'ttl': self.ttl, 'cache_sampled': self.cache_sampled})
+            return out
+
+    def __len__(self):
+        return len(self._entries)
+
+    # --- persistence -------------------------------------------------------
+
+    def load(self):
+        """Load unexpired entries from `path` (oldest use first); a missing or corrupt file is ignored."""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except Exception:
+            return
+        now = time.time()
+        for item in saved if isinstance(saved, list) else []:
+            try:
+                key, expires_at, replies = item['key'], float(item['expires_at']), item['replies']
+            except Exception:
+                continue
+            if expires_at > now and isinstance(replies, list):
+                self.put(key, replies, expires_at)
+        with self._lock:
+            self.counters['stores'] = 0
+
+    def save(self):
+        """Write unexpired entries to `path` atomically."""
+        if not self.path:
+            return
+        now = time.time()
+        with self._lock:
+            items = [{'key': k, 'expires_at': e[0], 'replies': e[1]}
+                     for k, e in self._entries.items() if e[0] > now]
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(items, f)
+        os.replace(tmp, self.path)
@@ -0,0 +1,398 @@
+"""In-memory review store backed by reviews.json plus an append-only journal.
+
+The store loads reviews.json once and keeps a messageId -> record index, so
+lookups, upserts and deletes are O(1) and reads never touch the disk.
+Changes are appended to `<path>.journal` (one JSON op per line) and folded
+back into reviews.json by compaction every `compact_every` ops (on a
+background thread) and on close(). Loading replays the journal on top of
+reviews.json, so a crash between compactions loses nothing that was flushed.
+
+reviews.json keeps its current format (an indented JSON array), so existing
+files load unchanged. Records without a messageId (or with one that is not
+a string or an integer, such as a list), or repeats of an id already present
+in an old file, are kept in order but are not addressable;
+delete() removes every record with the given id, like the old list filter.
+
+page() walks the records in file order with a cursor that stays valid
+across concurrent inserts and deletes (for the lifetime of the process).
+
+With shared=True several processes can open the same store (pre-fork
+workers, see prefork.py). Writes append to the journal under an exclusive
+flock on `<path>.lock`, after catching up with the ops the other processes
+appended, so read-modify-write cycles stay serialized across processes.
+Every read first checks (one stat) whether the journal grew and replays the
+new ops; `on_change(old, new)` is called for each record another process
+changed. Compaction is done by one process at a time (`<path>.compact.lock`);
+the others notice the replaced journal and continue in the new one. Journal
+ops are last-writer-wins per messageId, so replaying ops already folded
+into reviews.json is harmless.
+"""
+import bisect
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not POSIX: shared stores are unavailable
+    fcntl = None
+
+
+def _addressable(message_id):
+    # ids the index can hold; the server only accepts these, older files may have others
+    return isinstance(message_id, (str, int))
+
+
+class ReviewStore:
+    def __init__(self, path='reviews.json', compact_every=1000, shared=False, lock=None):
+        self.path = path
+        self.journal_path = path + '.journal'
+        # files whose contents make up the store (checked by the reranker model cache)
+        self.sources = [path, self.journal_path]
+        self.compact_every = max(1, compact_every)
+        # an RLock the caller also holds around writes, so on_change runs serialized with them
+        self._lock = lock if lock is not None else threading.RLock()
+        self._journal = None
+        # held for the whole compaction; never taken while holding _lock
+        self._compact_lock = threading.Lock()
+        self.shared = shared
+        if shared and fcntl is None:
+            raise RuntimeError('shared review stores need fcntl (POSIX)')
+        # called with (old, new) for every record another process changed
+        self.on_change = None
+        self._lock_file = open(path + '.lock', 'ab') if shared else None
+        # journal read position (shared): the inode and offset replayed so far
+        self._tail = None
+        self._tail_ino = None
+        self._tail_pos = 0
+        self.load()
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock among the processes sharing the store; take _lock first (a no-op unless shared)."""
+        if not self.shared:
+            yield
+            return
+        fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def load(self):
+        """(Re)load reviews.json and replay the journal."""
+        with self._lock, self._file_lock():
+            self._records = {}
+            self._extra = {}
+            self._seq = 0
+            # file order for page(): parallel append-only lists of position and key,
+            # with deleted keys left in place until they make up half the list
+            self._pos = {}
+            self._order_pos = []
+            self._order_keys = []
+            self._next_pos = 0
+            self._journal_ops = 0
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    base = json.load(f)
+            except Exception:
+                base = []
+            for r in base if isinstance(base, list) else []:
+                self._insert(r)
+            if self.shared:
+                # keep the journal open to follow the other processes' appends
+                open(self.journal_path, 'ab').close()
+                if self._tail is not None:
+                    self._tail.close()
+                self._tail = open(self.journal_path, 'rb')
+                self._tail_ino = os.fstat(self._tail.fileno()).st_ino
+                self._tail_pos = 0
+                self._read_tail(False)
+                return
+            try:
+                with open(self.journal_path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        self._replay(line)
+            except FileNotFoundError:
+                pass
+
+    def sync(self):
+        """Replay the ops other processes appended since the last call (shared stores; cheap when there are none)."""
+        if not self.shared:
+            return
+        try:
+            st = os.stat(self.journal_path)
+        except OSError:
+            return
+        if st.st_ino == self._tail_ino and st.st_size == self._tail_pos:
+            return
+        with self._lock:
+            self._sync_locked()
+
+    def _sync_locked(self):
+        if not self.shared or self._tail is None:
+            # closed: the records stay readable, but no longer follow the journal
+            return
+        self._read_tail(True)
+        try:
+            ino = os.stat(self.journal_path).st_ino
+        except OSError:
+            return
+        if ino != self._tail_ino:
+            # another process compacted: the old journal is complete, go on with the new one
+            self._tail.close()
+            self._tail = open(self.journal_path, 'rb')
+            self._tail_ino = os.fstat(self._tail.fileno()).st_ino
+            self._tail_pos = 0
+            self._journal_ops = 0
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            self._read_tail(True)
+
+    def _read_tail(self, notify):
+        self._tail.seek(self._tail_pos)
+        data = self._tail.read()
+        end = data.rfind(b'\n') + 1
+        # an incomplete last line is still being written (or torn); read it next time
+        for line in data[:end].splitlines():
+            self._replay(line, notify)
+        self._tail_pos += end
+
+    def _notify(self, old, new):
+        if self.on_change is not None:
+            try:
+                self.on_change(old, new)
+            except Exception:
+                pass
+
+    def _next_key(self, kind, message_id=None):
+        self._seq += 1
+        return (kind, message_id, self._seq)
+
+    def _place(self, key):
+        self._next_pos += 1
+        self._pos[key] = self._next_pos
+        self._order_pos.append(self._next_pos)
+        self._order_keys.append(key)
+
+    def _unplace(self, key):
+        self._pos.pop(key, None)
+        if len(self._order_keys) > 64 and len(self._pos) * 2 < len(self._order_keys):
+            live = [(p, k) for p, k in zip(self._order_pos, self._order_keys) if self._pos.get(k) == p]
+            self._order_pos = [p for p, _ in live]
+            self._order_keys = [k for _, k in live]
+
+    def _insert(self, record):
+        mid = record.get('messageId') if isinstance(record, dict) else None
+        if not _addressable(mid):
+            key = self._next_key('anon')
+        elif mid in self._records:
+            key = self._next_key('dup', mid)
+            self._extra.setdefault(mid, []).append(key)
+        else:
+            key = mid
+        self._records[key] = record
+        self._place(key)
+
+    def _replay(self, line, notify=False):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            op = json.loads(line)
+        except Exception:
+            # a torn last line from a crash mid-append
+            return
+        self._journal_ops += 1
+        if op.get('op') == 'put' and isinstance(op.get('record'), dict):
+            if not _addressable(op['record'].get('messageId')):
+                return
+            old = self._put(op['record'])
+            if notify and old != op['record']:
+                self._notify(old, op['record'])
+        elif op.get('op') == 'del' and _addressable(op.get('messageId')):
+            for removed in self._del(op.get('messageId')):
+                if notify:
+                    self._notify(removed, None)
+
+    def _put(self, record):
+        mid = record['messageId']
+        old = self._records.get(mid)
+        # assigning to an existing key keeps its position, like the old in-place overwrite
+        self._records[mid] = record
+        if old is None:
+            self._place(mid)
+        return old
+
+    def _del(self, message_id):
+        removed = []
+        if message_id in self._records:
+            removed.append(self._records.pop(message_id))
+            self._unplace(message_id)
+        for key in self._extra.pop(message_id, []):
+            removed.append(self._records.pop(key))
+            self._unplace(key)
+        return removed
+
+    def _append(self, op):
+        # shared: the caller holds the file lock and has just synced, so the journal ends at _tail_pos
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'ab')
+        self._journal.write(json.dumps(op).encode('utf-8') + b'\n')
+        self._journal.flush()
+        if self.shared:
+            self._tail_pos = self._journal.tell()
+        self._journal_ops += 1
+        if self._journal_ops >= self.compact_every and not self._compact_lock.locked():
+            threading.Thread(target=self.compact, kwargs={'wait': False}, daemon=True).start()
+
+    # --- reads -------------------------------------------------------------
+
+    def get(self, message_id):
+        self.sync()
+        with self._lock:
+            return self._records.get(message_id)
+
+    def all(self):
+        """Snapshot list of all records in file order."""
+        self.sync()
+        with self._lock:
+            return list(self._records.values())
+
+    def page(self, after=0, limit=100):
+        """Up to limit records following cursor `after` (0 = from the start), in file order.
+
+        Returns (records, cursor); cursor is None once the end is reached.
+        Records inserted after the cursor position show up on later pages;
+        deleted ones are skipped.
+        """
+        self.sync()
+        with self._lock:
+            i = bisect.bisect_right(self._order_pos, after)
+            out = []
+            last = after
+            n = len(self._order_pos)
+            while i < n and len(out) < limit:
+                pos, key = self._order_pos[i], self._order_keys[i]
+                i += 1
+                if self._pos.get(key) != pos:
+                    continue
+                out.append(self._records[key])
+                last = pos
+            # skip trailing deleted slots so a cursor is only returned when more records follow
+            while i < n and self._pos.get(self._order_keys[i]) != self._order_pos[i]:
+                i += 1
+            return out, (last if i < n else None)
+
+    def __len__(self):
+        self.sync()
+        return len(self._records)
+
+    # --- writes ------------------------------------------------------------
+
+    def upsert(self, record):
+        """Insert or overwrite the review with record['messageId']; returns the previous record or None."""
+        with self._lock, self._file_lock():
+            self._sync_locked()
+            old = self._put(record)
+            self._append({'op': 'put', 'record': record})
+            return old
+
+    def update(self, message_id, fields):
+        """Merge fields into an existing review; returns (old, new) or None if it does not exist."""
+        with self._lock, self._file_lock():
+            self._sync_locked()
+            old = self._records.get(message_id)
+            if old is None:
+                return None
+            new = dict(old)
+            new.update(fields)
+            self._put(new)
+            self._append({'op': 'put', 'record': new})
+            return old, new
+
+    def delete(self, message_id):
+        """Remove every review with message_id; returns the removed records (empty list if none)."""
+        with self._lock, self._file_lock():
+            self._sync_locked()
+            if message_id not in self._records:
+                return []
+            removed = self._del(message_id)
+            self._append({'op': 'del', 'messageId': message_id})
+            return removed
+
+    def compact(self, wait=True):
+        """Rewrite reviews.json from memory and drop the journal ops it now contains.
+
+        Only the snapshot is taken under the lock; the (slow) file write runs
+        without it, and ops appended meanwhile are carried over to the new
+        journal. Replaying ops that are already in reviews.json is harmless,
+        so a crash at any point leaves a loadable store. With wait=False the
+        call returns immediately if another compaction is running.
+        """
+        if not self._compact_lock.acquire(blocking=wait):
+            return
+        try:
+            compacting = None
+            if self.shared:
+                compacting = open(self.path + '.compact.lock', 'ab')
+                try:
+                    fcntl.flock(compacting.fileno(), fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+                except OSError:
+                    # another process is compacting
+                    compacting.close()
+                    return
+            try:
+                self._compact()
+            finally:
+                if compacting is not None:
+                    compacting.close()
+        finally:
+            self._compact_lock.release()
+
+    def _compact(self):
+        with self._lock, self._file_lock():
+            self._sync_locked()
+            records = list(self._records.values())
+            if self.shared:
+                offset = self._tail_pos
+            else:
+                offset = self._journal.tell() if self._journal is not None else 0
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(records, f, indent=2)
+        os.replace(tmp, self.path)
+        with self._lock, self._file_lock():
+            self._sync_locked()
+            tail = b''
+            if self._journal is not None:
+                self._journal.close()
+            if self._journal is not None or self.shared:
+                with open(self.journal_path, 'rb') as f:
+                    f.seek(offset)
+                    tail = f.read()
+            jtmp = self.journal_path + '.tmp'
+            with open(jtmp, 'wb') as f:
+                f.write(tail)
+            os.replace(jtmp, self.journal_path)
+            self._journal = open(self.journal_path, 'ab')
+            self._journal_ops = tail.count(b'\n')
+            if self.shared:
+                # the new journal only holds ops that are already applied here
+                self._tail.close()
+                self._tail = open(self.journal_path, 'rb')
+                self._tail_ino = os.fstat(self._tail.fileno()).st_ino
+                self._tail_pos = len(tail)
+
+    def close(self):
+        if self._journal_ops:
+            self.compact()
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            if self._tail is not None:
+                self._tail.close()
+                self._tail = None
@@ -4,10 +4,30 @@ Handles OPTIONS /chat and POST /chat and returns a simple JSON reply.
 """
 import json
 import os
-import ssl
-import urllib.request
-import urllib.error
+import signal
+import sys
+import threading
+import time
+import zlib
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs
+
+from adaptive_n import AdaptiveN, prompt_key, score_spread
+from context_budget import ContextBudget
+from early_exit import Alternatives, EarlyExit
+from fanout import FanOut
+from jsonl_log import JsonlLog
+from metrics import EventLog, Metrics, flatten_stats
+from peer_views import PeerDatasetView, RankSummary, etag_matches
+from prefork import WORKER_ENV, signal_ready
+from resilience import CircuitBreaker, CircuitOpenError, ConcurrencyLimiter, ResilientUpstream, UpstreamBusy
+from response_cache import ResponseCache, cache_key
+from review_store import ReviewStore
+from similar_cache import SimilarCache, split_prompt
+from singleflight import SingleFlight
+from static_assets import StaticAssets
+from upstream import UpstreamClient, UpstreamError, UpstreamHTTPError
 
 # Load simple .env file into environment (no external deps). This lets you keep
 # secrets out of the chat and version control. Create a `.env` file in the
@@ -27,12 +47,122 @@ if os.path.exists('.env'):
     except Exception:
         pass
 
-# Optional reranker trained from reviews.json (import after .env so RERANK_N can come from .env)
+# Pre-fork mode (POSIX): with SERVER_PROCESSES=N > 1, `python3 server_py.py`
+# runs a supervisor (prefork.py) that starts N worker processes of this script
+# on the same port (SO_REUSEPORT), restarts crashed ones and reloads them all
+# on SIGHUP. Each worker has its own GIL, threads and caches. The stores are
+# shared through their files: every worker sees the others' review writes
+# within STORE_SYNC_MS (and right away on its own reads of the JSON store).
+# Worker 0 trains the reranker and saves the model file after every update;
+# the others memory-map that file and re-map it within RERANKER_RELOAD_MS of
+# a change, so the score tables exist once in the page cache.
+try:
+    SERVER_PROCESSES = int(os.environ.get('SERVER_PROCESSES', '1'))
+except Exception:
+    SERVER_PROCESSES = 1
+if __name__ == '__main__' and SERVER_PROCESSES > 1 and WORKER_ENV not in os.environ:
+    import prefork
+    sys.exit(prefork.main(SERVER_PROCESSES))
+PREFORK = WORKER_ENV in os.environ
+try:
+    SERVER_WORKER_ID = int(os.environ.get(WORKER_ENV, '0'))
+except Exception:
+    SERVER_WORKER_ID = 0
+try:
+    STORE_SYNC_MS = float(os.environ.get('STORE_SYNC_MS', '200'))
+except Exception:
+    STORE_SYNC_MS = 200.0
+try:
+    RERANKER_RELOAD_MS = float(os.environ.get('RERANKER_RELOAD_MS', '500'))
+except Exception:
+    RERANKER_RELOAD_MS = 500.0
+# Pre-fork workers finish their in-flight requests for up to this long after SIGTERM
+try:
+    SERVER_DRAIN_TIMEOUT = float(os.environ.get('SERVER_DRAIN_TIMEOUT', '10'))
+except Exception:
+    SERVER_DRAIN_TIMEOUT = 10.0
+
+# Storage backend for reviews, suggestions and peer rankings: 'json' (default)
+# or 'sqlite'. Both offer the same interface, see sqlite_store.py.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json').strip().lower()
+
+# json: reviews are loaded once and kept in memory; changes go to an append-only
+# journal that is compacted back into reviews.json every REVIEW_COMPACT_EVERY writes.
 try:
-    from reranker import train_from_reviews, score_text
-    RERANKER_SCORES = train_from_reviews('reviews.json')
+    REVIEW_COMPACT_EVERY = int(os.environ.get('REVIEW_COMPACT_EVERY', '1000'))
 except Exception:
-    RERANKER_SCORES = {}
+    REVIEW_COMPACT_EVERY = 1000
+
+# json: suggestions and peer rankings are only ever appended, so they live in
+# JSON Lines logs (one record per line, concurrent appends share one fsync).
+# On first start the old suggestions.json / peer_rankings.json arrays are
+# copied in; those files are not written any more. JSONL_FSYNC=0 skips the fsync.
+JSONL_FSYNC = os.environ.get('JSONL_FSYNC', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+# sqlite: reviews.db, suggestions.db and peer_rankings.db (WAL mode), filled
+# from the JSON files above the first time. SQLITE_SYNCHRONOUS is NORMAL or FULL.
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').strip().upper()
+if SQLITE_SYNCHRONOUS not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+    SQLITE_SYNCHRONOUS = 'NORMAL'
+
+# Serializes review read-modify-write cycles with queuing their reranker update
+# so concurrent requests cannot lose each other's updates. In pre-fork mode the
+# review store uses it too, so changes read from other workers are queued in order.
+_STORE_LOCK = threading.RLock()
+
+if STORAGE_BACKEND == 'sqlite':
+    from sqlite_store import SqliteReviewStore, open_log
+    REVIEWS = SqliteReviewStore('reviews.db', 'reviews.json', synchronous=SQLITE_SYNCHRONOUS, shared=PREFORK,
+                                lock=_STORE_LOCK if PREFORK else None)
+    SUGGESTIONS = open_log('suggestions.db', 'suggestions', synchronous=SQLITE_SYNCHRONOUS)
+    PEER_RANKINGS = open_log('peer_rankings.db', 'peer_rankings', synchronous=SQLITE_SYNCHRONOUS)
+else:
+    STORAGE_BACKEND = 'json'
+    REVIEWS = ReviewStore('reviews.json', compact_every=REVIEW_COMPACT_EVERY, shared=PREFORK,
+                          lock=_STORE_LOCK if PREFORK else None)
+    SUGGESTIONS = JsonlLog('suggestions.jsonl', 'suggestions.json', fsync=JSONL_FSYNC)
+    PEER_RANKINGS = JsonlLog('peer_rankings.jsonl', 'peer_rankings.json', fsync=JSONL_FSYNC)
+
+# Optional reranker trained from the reviews (import after .env so RERANK_N can come from .env).
+# A background worker (reranker_worker.py) owns the model: review writes only
+# queue their change, and the worker applies bursts of changes every
+# RERANKER_DEBOUNCE_MS (at most RERANKER_MAX_DELAY_MS after the first) and
+# swaps in a new version for scoring. The model is saved to RERANKER_MODEL_PATH
+# and memory-mapped on the next start instead of retraining, as long as the
+# review store's files (reviews.json and its journal, or reviews.db) are
+# unchanged since it was saved; otherwise it is rebuilt in the background
+# while the server already answers (reranking is neutral until then).
+RERANKER_MODEL_PATH = os.environ.get('RERANKER_MODEL_PATH', 'reranker.model')
+RERANKER_SOURCES = REVIEWS.sources
+try:
+    RERANKER_DEBOUNCE_MS = float(os.environ.get('RERANKER_DEBOUNCE_MS', '250'))
+except Exception:
+    RERANKER_DEBOUNCE_MS = 250.0
+try:
+    RERANKER_MAX_DELAY_MS = float(os.environ.get('RERANKER_MAX_DELAY_MS', '2000'))
+except Exception:
+    RERANKER_MAX_DELAY_MS = 2000.0
+try:
+    from reranker import load_model, save_model, score_batch
+    from reranker_worker import SharedModel, TrainingWorker
+    if PREFORK and SERVER_WORKER_ID != 0:
+        RERANKER_WORKER = SharedModel(RERANKER_MODEL_PATH, interval=RERANKER_RELOAD_MS / 1000.0)
+    elif PREFORK:
+        # the store files change under other workers' writes, so the saved model
+        # cannot name the state it was built from: save it without sources and
+        # rebuild once on start
+        _publish_model = lambda model: save_model(model, RERANKER_MODEL_PATH, ())
+        RERANKER_WORKER = TrainingWorker(
+            REVIEWS.all, _STORE_LOCK, None,
+            debounce=RERANKER_DEBOUNCE_MS / 1000.0, max_delay=RERANKER_MAX_DELAY_MS / 1000.0,
+            on_built=_publish_model, on_update=_publish_model)
+    else:
+        RERANKER_WORKER = TrainingWorker(
+            REVIEWS.all, _STORE_LOCK, load_model(RERANKER_MODEL_PATH, RERANKER_SOURCES),
+            debounce=RERANKER_DEBOUNCE_MS / 1000.0, max_delay=RERANKER_MAX_DELAY_MS / 1000.0,
+            on_built=lambda model: save_model(model, RERANKER_MODEL_PATH, RERANKER_SOURCES))
+except Exception:
+    RERANKER_WORKER = None
 
 # How many candidates to request from OpenAI for reranking. Set RERANK_N=1 to disable reranking.
 # Default increased to 5 to request more candidates (higher chance of better rerank at cost of latency/cost).
@@ -41,14 +171,711 @@ try:
 except Exception:
     RERANK_N = 5
 
+# Adaptive mode (RERANK_ADAPTIVE=1): start with RERANK_MIN_N candidates and
+# request the rest (up to RERANK_N) only when the first ones score within
+# RERANK_SPREAD of each other and the latency/token budgets allow. See
+# adaptive_n.py. Applies when the client does not set `n` itself.
+RERANK_ADAPTIVE = None
+if os.environ.get('RERANK_ADAPTIVE', '').strip().lower() in ('1', 'true', 'yes', 'on'):
+    try:
+        RERANK_ADAPTIVE = AdaptiveN(
+            min_n=int(os.environ.get('RERANK_MIN_N', '2')),
+            max_n=RERANK_N,
+            spread_threshold=float(os.environ.get('RERANK_SPREAD', '0.01')),
+            latency_budget_ms=float(os.environ.get('RERANK_LATENCY_BUDGET_MS', '0') or 0),
+            token_budget=int(os.environ.get('RERANK_TOKEN_BUDGET', '0') or 0),
+        )
+    except Exception:
+        RERANK_ADAPTIVE = AdaptiveN(max_n=RERANK_N)
+
+# Base URL of the OpenAI-compatible upstream. Point it at a local stub
+# (e.g. http://127.0.0.1:8001/v1) to benchmark without calling OpenAI.
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1').rstrip('/')
+
+# Upstream calls share a pool of keep-alive connections (and one SSL context)
+# instead of paying a TCP+TLS handshake per message.
+try:
+    OPENAI_POOL_SIZE = int(os.environ.get('OPENAI_POOL_SIZE', '8'))
+except Exception:
+    OPENAI_POOL_SIZE = 8
+try:
+    OPENAI_TIMEOUT = float(os.environ.get('OPENAI_TIMEOUT', '30'))
+except Exception:
+    OPENAI_TIMEOUT = 30.0
+UPSTREAM = UpstreamClient(OPENAI_BASE_URL, pool_size=OPENAI_POOL_SIZE, timeout=OPENAI_TIMEOUT)
+
+# /chat calls go through resilience.py: OPENAI_RETRIES retries of 429/5xx and
+# connection failures with jittered exponential backoff (honoring Retry-After)
+# within OPENAI_RETRY_BUDGET seconds; optional hedging of slow non-streaming
+# calls (OPENAI_HEDGE=1); a circuit breaker that answers with the mock reply
+# after OPENAI_BREAKER_FAILURES consecutive failures (0 disables) for
+# OPENAI_BREAKER_RESET seconds; and at most OPENAI_MAX_CONCURRENCY calls in
+# flight per API key (0 = unlimited).
+try:
+    OPENAI_RETRIES = int(os.environ.get('OPENAI_RETRIES', '2'))
+except Exception:
+    OPENAI_RETRIES = 2
+try:
+    OPENAI_RETRY_BASE_MS = float(os.environ.get('OPENAI_RETRY_BASE_MS', '250'))
+except Exception:
+    OPENAI_RETRY_BASE_MS = 250.0
+try:
+    OPENAI_RETRY_MAX_MS = float(os.environ.get('OPENAI_RETRY_MAX_MS', '4000'))
+except Exception:
+    OPENAI_RETRY_MAX_MS = 4000.0
+try:
+    OPENAI_RETRY_BUDGET = float(os.environ.get('OPENAI_RETRY_BUDGET', str(OPENAI_TIMEOUT)))
+except Exception:
+    OPENAI_RETRY_BUDGET = OPENAI_TIMEOUT
+OPENAI_HEDGE = os.environ.get('OPENAI_HEDGE', '0').strip().lower() in ('1', 'true', 'yes', 'on')
+try:
+    OPENAI_HEDGE_QUANTILE = float(os.environ.get('OPENAI_HEDGE_QUANTILE', '0.95'))
+except Exception:
+    OPENAI_HEDGE_QUANTILE = 0.95
+try:
+    OPENAI_HEDGE_MIN_MS = float(os.environ.get('OPENAI_HEDGE_MIN_MS', '500'))
+except Exception:
+    OPENAI_HEDGE_MIN_MS = 500.0
+try:
+    OPENAI_BREAKER_FAILURES = int(os.environ.get('OPENAI_BREAKER_FAILURES', '5'))
+except Exception:
+    OPENAI_BREAKER_FAILURES = 5
+try:
+    OPENAI_BREAKER_RESET = float(os.environ.get('OPENAI_BREAKER_RESET', '30'))
+except Exception:
+    OPENAI_BREAKER_RESET = 30.0
+try:
+    OPENAI_MAX_CONCURRENCY = int(os.environ.get('OPENAI_MAX_CONCURRENCY', '0'))
+except Exception:
+    OPENAI_MAX_CONCURRENCY = 0
+OPENAI = ResilientUpstream(
+    UPSTREAM,
+    retries=OPENAI_RETRIES,
+    backoff_base=OPENAI_RETRY_BASE_MS / 1000.0,
+    backoff_max=OPENAI_RETRY_MAX_MS / 1000.0,
+    budget=OPENAI_RETRY_BUDGET,
+    hedge=OPENAI_HEDGE,
+    hedge_quantile=OPENAI_HEDGE_QUANTILE,
+    hedge_min=OPENAI_HEDGE_MIN_MS / 1000.0,
+    breaker=CircuitBreaker(OPENAI_BREAKER_FAILURES, OPENAI_BREAKER_RESET),
+    limiter=ConcurrencyLimiter(OPENAI_MAX_CONCURRENCY, wait=OPENAI_TIMEOUT),
+)
+
+# Opt-in cache of upstream candidates for repeated prompts (CHAT_CACHE=1).
+# Hits are still reranked with the caller's weights. Sampled requests
+# (temperature > 0 or unset) bypass it unless CHAT_CACHE_SAMPLED=1.
+CHAT_CACHE_ENABLED = os.environ.get('CHAT_CACHE', '').strip().lower() in ('1', 'true', 'yes', 'on')
+try:
+    CHAT_CACHE_MAX_ENTRIES = int(os.environ.get('CHAT_CACHE_MAX_ENTRIES', '1000'))
+except Exception:
+    CHAT_CACHE_MAX_ENTRIES = 1000
+try:
+    CHAT_CACHE_MAX_BYTES = int(os.environ.get('CHAT_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+except Exception:
+    CHAT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+try:
+    CHAT_CACHE_TTL = float(os.environ.get('CHAT_CACHE_TTL', '3600'))
+except Exception:
+    CHAT_CACHE_TTL = 3600.0
+CHAT_CACHE = None
+if CHAT_CACHE_ENABLED:
+    CHAT_CACHE = ResponseCache(
+        max_entries=CHAT_CACHE_MAX_ENTRIES,
+        max_bytes=CHAT_CACHE_MAX_BYTES,
+        ttl=CHAT_CACHE_TTL,
+        path=os.environ.get('CHAT_CACHE_PATH') or None,
+        cache_sampled=os.environ.get('CHAT_CACHE_SAMPLED', '').strip().lower() in ('1', 'true', 'yes', 'on'),
+    )
+
+# Opt-in near-duplicate cache (similar_cache.py, CHAT_SIMILAR=1): a /chat whose
+# last user message has nearly the same words as an earlier one (Jaccard
+# similarity >= CHAT_SIMILAR_THRESHOLD), with everything else in the request
+# equal, reuses its candidates (X-Cache: SIMILAR). It holds at most
+# CHAT_SIMILAR_MAX_ENTRIES prompts and follows CHAT_CACHE_MAX_BYTES,
+# CHAT_CACHE_TTL and CHAT_CACHE_SAMPLED.
+try:
+    CHAT_SIMILAR_THRESHOLD = float(os.environ.get('CHAT_SIMILAR_THRESHOLD', '0.8'))
+except Exception:
+    CHAT_SIMILAR_THRESHOLD = 0.8
+try:
+    CHAT_SIMILAR_MAX_ENTRIES = int(os.environ.get('CHAT_SIMILAR_MAX_ENTRIES', '10000'))
+except Exception:
+    CHAT_SIMILAR_MAX_ENTRIES = 10000
+try:
+    CHAT_SIMILAR_MIN_TOKENS = int(os.environ.get('CHAT_SIMILAR_MIN_TOKENS', '3'))
+except Exception:
+    CHAT_SIMILAR_MIN_TOKENS = 3
+SIMILAR_CACHE = None
+if os.environ.get('CHAT_SIMILAR', '').strip().lower() in ('1', 'true', 'yes', 'on'):
+    SIMILAR_CACHE = SimilarCache(
+        threshold=CHAT_SIMILAR_THRESHOLD,
+        max_entries=CHAT_SIMILAR_MAX_ENTRIES,
+        max_bytes=CHAT_CACHE_MAX_BYTES,
+        ttl=CHAT_CACHE_TTL,
+        min_tokens=CHAT_SIMILAR_MIN_TOKENS,
+        cache_sampled=os.environ.get('CHAT_CACHE_SAMPLED', '').strip().lower() in ('1', 'true', 'yes', 'on'),
+    )
+
+# Concurrent /chat requests with the same normalized payload (see
+# response_cache.cache_key) share one upstream call; each still reranks with
+# its own weights. Followers wait at most CHAT_COALESCE_WAIT seconds for the
+# leader before making their own call. CHAT_COALESCE=0 disables this.
+CHAT_INFLIGHT = None
+if os.environ.get('CHAT_COALESCE', '1').strip().lower() not in ('0', 'false', 'no', 'off'):
+    CHAT_INFLIGHT = SingleFlight()
+try:
+    CHAT_COALESCE_WAIT = float(os.environ.get('CHAT_COALESCE_WAIT', str(OPENAI_TIMEOUT)))
+except Exception:
+    CHAT_COALESCE_WAIT = OPENAI_TIMEOUT
+
+# Fan-out (CHAT_FANOUT=1, or "fanout" in the request): a non-streaming
+# request for n > 1 candidates sends n concurrent n=1 upstream calls instead
+# of one call, cycling through CHAT_FANOUT_MODELS / CHAT_FANOUT_TEMPERATURES
+# (comma-separated). It answers once CHAT_FANOUT_MIN candidates are in (0 =
+# all) or CHAT_FANOUT_DEADLINE_MS has passed with at least one (0 = no
+# deadline); calls still running are cancelled.
+CHAT_FANOUT = os.environ.get('CHAT_FANOUT', '0').strip().lower() in ('1', 'true', 'yes', 'on')
+CHAT_FANOUT_MODELS = [m.strip() for m in os.environ.get('CHAT_FANOUT_MODELS', '').split(',') if m.strip()]
+try:
+    CHAT_FANOUT_TEMPERATURES = [float(t) for t in os.environ.get('CHAT_FANOUT_TEMPERATURES', '').split(',')
+                                if t.strip()]
+except Exception:
+    CHAT_FANOUT_TEMPERATURES = []
+try:
+    CHAT_FANOUT_MIN = int(os.environ.get('CHAT_FANOUT_MIN', '0'))
+except Exception:
+    CHAT_FANOUT_MIN = 0
+try:
+    CHAT_FANOUT_DEADLINE_MS = float(os.environ.get('CHAT_FANOUT_DEADLINE_MS', '0'))
+except Exception:
+    CHAT_FANOUT_DEADLINE_MS = 0.0
+# upper bound on the calls of one fan-out (n, or the request's variants)
+try:
+    CHAT_FANOUT_MAX = max(1, int(os.environ.get('CHAT_FANOUT_MAX', str(RERANK_N))))
+except Exception:
+    CHAT_FANOUT_MAX = max(1, RERANK_N)
+FANOUT = FanOut(CHAT_FANOUT_MODELS, CHAT_FANOUT_TEMPERATURES, need=CHAT_FANOUT_MIN,
+                deadline=CHAT_FANOUT_DEADLINE_MS / 1000.0)
+
+# Early exit (RERANK_EARLY_EXIT=1, or "early_exit" in the request) fans the
+# request out and answers with the first candidate scoring at least
+# RERANK_EARLY_THRESHOLD, or leading all others by RERANK_EARLY_MARGIN once
+# RERANK_EARLY_MIN are in, instead of waiting for every candidate (0
+# disables a rule). The remaining calls are cancelled, or with
+# RERANK_EARLY_REST=later they finish in the background and the response
+# names an "alternatives" id for GET /chat/alternatives, kept for
+# RERANK_ALTERNATIVES_TTL seconds.
+RERANK_EARLY_EXIT = os.environ.get('RERANK_EARLY_EXIT', '0').strip().lower() in ('1', 'true', 'yes', 'on')
+try:
+    RERANK_EARLY_THRESHOLD = float(os.environ.get('RERANK_EARLY_THRESHOLD', '0.85'))
+except Exception:
+    RERANK_EARLY_THRESHOLD = 0.85
+try:
+    RERANK_EARLY_MARGIN = float(os.environ.get('RERANK_EARLY_MARGIN', '0.05'))
+except Exception:
+    RERANK_EARLY_MARGIN = 0.05
+try:
+    RERANK_EARLY_MIN = int(os.environ.get('RERANK_EARLY_MIN', '2'))
+except Exception:
+    RERANK_EARLY_MIN = 2
+try:
+    RERANK_ALTERNATIVES_TTL = float(os.environ.get('RERANK_ALTERNATIVES_TTL', '300'))
+except Exception:
+    RERANK_ALTERNATIVES_TTL = 300.0
+EARLY_EXIT = EarlyExit(RERANK_EARLY_THRESHOLD, RERANK_EARLY_MARGIN, RERANK_EARLY_MIN,
+                       os.environ.get('RERANK_EARLY_REST', 'abandon').strip().lower())
+# pre-fork: a follow-up GET may reach another worker, so entries are also kept in a shared directory
+ALTERNATIVES = Alternatives(RERANK_ALTERNATIVES_TTL, spool='chat_alternatives' if PREFORK else None)
+
+# Conversation trimming (context_budget.py): with CHAT_CONTEXT_BUDGET > 0, /chat
+# sends at most about that many prompt tokens (estimated) upstream. System
+# messages and the last CHAT_CONTEXT_KEEP_TURNS turns are always kept; older
+# messages longer than CHAT_CONTEXT_CLIP_TOKENS are shortened (0 = never) and
+# the oldest turns dropped. A request may ask for a smaller "context_budget".
+try:
+    CHAT_CONTEXT_BUDGET = int(os.environ.get('CHAT_CONTEXT_BUDGET', '0'))
+except Exception:
+    CHAT_CONTEXT_BUDGET = 0
+try:
+    CHAT_CONTEXT_KEEP_TURNS = int(os.environ.get('CHAT_CONTEXT_KEEP_TURNS', '2'))
+except Exception:
+    CHAT_CONTEXT_KEEP_TURNS = 2
+try:
+    CHAT_CONTEXT_CLIP_TOKENS = int(os.environ.get('CHAT_CONTEXT_CLIP_TOKENS', '0'))
+except Exception:
+    CHAT_CONTEXT_CLIP_TOKENS = 0
+CONTEXT = ContextBudget(CHAT_CONTEXT_BUDGET, CHAT_CONTEXT_KEEP_TURNS, CHAT_CONTEXT_CLIP_TOKENS)
+
+# Frontend (static_assets.py): the HTML, CSS and JS next to this file (or in
+# STATIC_DIR; empty disables) are read once at startup and served from
+# memory, pre-gzipped, with strong ETags, so a revalidating browser gets a
+# 304. HTML always revalidates; with STATIC_MAX_AGE > 0 browsers reuse CSS,
+# JS and images for that many seconds without asking. STATIC_WATCH=1 (dev)
+# reloads files that change, checking every STATIC_WATCH_MS.
+STATIC_DIR = os.environ.get('STATIC_DIR', os.path.dirname(os.path.abspath(__file__)))
+try:
+    STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', '0'))
+except Exception:
+    STATIC_MAX_AGE = 0
+try:
+    STATIC_WATCH_MS = int(os.environ.get('STATIC_WATCH_MS', '1000'))
+except Exception:
+    STATIC_WATCH_MS = 1000
+STATIC = None
+if STATIC_DIR:
+    # the Node servers are backend code, not frontend
+    STATIC = StaticAssets(STATIC_DIR, exclude=('server.js', 'local-server.js'), max_age=STATIC_MAX_AGE,
+                          watch=os.environ.get('STATIC_WATCH', '0').strip().lower() in ('1', 'true', 'yes', 'on'),
+                          interval=max(0.05, STATIC_WATCH_MS / 1000.0))
+
+# Concurrency: at most SERVER_WORKERS requests are handled at once; further
+# connections wait in the listen backlog (SERVER_BACKLOG). SERVER_WORKERS=1
+# restores the old single-threaded server.
+try:
+    SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', '16'))
+except Exception:
+    SERVER_WORKERS = 16
+try:
+    SERVER_BACKLOG = int(os.environ.get('SERVER_BACKLOG', '64'))
+except Exception:
+    SERVER_BACKLOG = 64
+
+# Responses larger than GZIP_MIN_BYTES are gzip-compressed for clients that
+# accept it; listings are serialized and sent incrementally (chunked for
+# HTTP/1.1 clients) instead of being built in memory first.
+try:
+    GZIP_MIN_BYTES = int(os.environ.get('GZIP_MIN_BYTES', '1024'))
+except Exception:
+    GZIP_MIN_BYTES = 1024
+# Compression level for streamed responses (compressed per request, so favour
+# speed); pre-encoded bodies are compressed once at level 6
+try:
+    GZIP_LEVEL = max(1, min(9, int(os.environ.get('GZIP_LEVEL', '1'))))
+except Exception:
+    GZIP_LEVEL = 1
+# Largest page /reviews and /admin/reviews return for ?limit=
+LISTING_MAX_LIMIT = 1000
+# Stream writes are batched into pieces of about this size
+_STREAM_CHUNK = 64 * 1024
+
+# Latency histograms per endpoint and per /chat stage, response and upstream
+# error counters, served in Prometheus text format at /metrics (METRICS=0
+# turns them off). They include the admin stats, so scrapers must send the
+# admin token, as X-Admin-Token or as a Bearer token (METRICS_TOKEN sets a
+# separate one); METRICS_PUBLIC=1 serves them without a token. Finished
+# requests and log messages are also appended as JSON lines to
+# SERVER_LOG_PATH (empty to disable).
+METRICS = None
+if os.environ.get('METRICS', '1').strip().lower() not in ('0', 'false', 'no', 'off'):
+    METRICS = Metrics()
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '') or os.environ.get('ADMIN_TOKEN', 'secret-token')
+METRICS_PUBLIC = os.environ.get('METRICS_PUBLIC', '0').strip().lower() in ('1', 'true', 'yes', 'on')
+SERVER_LOG_PATH = os.environ.get('SERVER_LOG_PATH', 'server_py.log')
+try:
+    EVENT_LOG = EventLog(SERVER_LOG_PATH) if SERVER_LOG_PATH else None
+except Exception:
+    EVENT_LOG = None
+# endpoint label values; anything else is counted as 'other' to keep the label set small
+_METRIC_ENDPOINTS = frozenset([
+    '/chat', '/review', '/suggestion', '/peer/rank', '/reviews', '/peer_dataset', '/peer_rank_summary',
+    '/admin/reviews', '/admin/peer_rankings', '/admin/suggestions', '/admin/stats', '/admin/review/delete',
+    '/admin/review/authenticate', '/metrics', '/chat/alternatives', '/reviews.json',
+])
+
+
+def _accepts_gzip(accept_encoding):
+    """True if an Accept-Encoding header value allows gzip."""
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if coding.strip().lower() not in ('gzip', '*'):
+            continue
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def _listing_params(query):
+    """Parse limit/cursor/fields/exclude from a listing query string.
+
+    Returns (limit, cursor, project); limit is None for the unpaginated
+    array. Raises ValueError with a client-facing message on bad input.
+    """
+    params = parse_qs(query or '')
+
+    def one(name):
+        values = params.get(name)
+        return values[-1] if values else None
+
+    limit = one('limit')
+    cursor = one('cursor')
+    if limit is not None or cursor is not None:
+        try:
+            limit = int(limit) if limit is not None else 100
+        except ValueError:
+            raise ValueError('Invalid limit')
+        if limit < 1:
+            raise ValueError('Invalid limit')
+        limit = min(limit, LISTING_MAX_LIMIT)
+        try:
+            cursor = int(cursor) if cursor else 0
+        except ValueError:
+            raise ValueError('Invalid cursor')
+    fields = [f for f in (one('fields') or '').split(',') if f]
+    exclude = set(f for f in (one('exclude') or '').split(',') if f)
+    project = None
+    if fields:
+        def project(r):
+            return {k: r[k] for k in fields if k in r} if isinstance(r, dict) else r
+    elif exclude:
+        def project(r):
+            return {k: v for k, v in r.items() if k not in exclude} if isinstance(r, dict) else r
+    return limit, cursor, project
+
+
+def _json_array_pieces(records, project=None):
+    """Encode an iterable as a JSON array one element at a time (same bytes as json.dumps(list))."""
+    yield b'['
+    for i, r in enumerate(records):
+        if project is not None:
+            r = project(r)
+        yield (', ' if i else '').encode('utf-8') + json.dumps(r).encode('utf-8')
+    yield b']'
+
+
+_GZIP_CACHE = {}
+_GZIP_CACHE_LOCK = threading.Lock()
+
+
+def _gzipped(body, etag):
+    """(gzip body, etag) for a pre-encoded body, compressed once per ETag."""
+    with _GZIP_CACHE_LOCK:
+        hit = _GZIP_CACHE.get(etag)
+    if hit is not None:
+        return hit
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    gz = compressor.compress(body) + compressor.flush()
+    hit = (gz, etag[:-1] + '-gzip"')
+    with _GZIP_CACHE_LOCK:
+        # only the current bodies are worth keeping
+        if len(_GZIP_CACHE) >= 8:
+            _GZIP_CACHE.clear()
+        _GZIP_CACHE[etag] = hit
+    return hit
+
+
+def _scoring_model():
+    """Model used to rerank candidates: the latest version published by the training worker."""
+    if RERANKER_WORKER is not None:
+        return RERANKER_WORKER.current()
+    return {}
+
+
+def _update_reranker(old, new):
+    """Queue one review change for the reranker (no-op if the reranker is unavailable)."""
+    if RERANKER_WORKER is not None:
+        RERANKER_WORKER.submit(old, new)
+
+
+def _reviews_changed(old, new):
+    """Propagate one review write to everything derived from the reviews."""
+    _update_reranker(old, new)
+    PEER_DATASET.invalidate()
+
+
+# Materialized peer exercise responses, kept current as reviews and rankings change
+PEER_DATASET = PeerDatasetView('peer_dataset.json', REVIEWS)
+# pre-fork: count the rankings log itself, which includes other workers' appends
+RANK_SUMMARY = RankSummary(follow=PEER_RANKINGS) if PREFORK else RankSummary(PEER_RANKINGS)
+
+
+def _reviews_reset():
+    """Another worker changed reviews.db in ways this one missed (sqlite backend): rebuild what derives from them."""
+    PEER_DATASET.invalidate()
+    if RERANKER_WORKER is not None:
+        RERANKER_WORKER.rebuild()
+
+
+def _follow_stores():
+    """Pre-fork worker thread: pick up other workers' review writes; exit if the supervisor is gone."""
+    parent = os.getppid()
+    while True:
+        time.sleep(STORE_SYNC_MS / 1000.0)
+        if os.getppid() != parent:
+            print('Supervisor exited; stopping worker %d' % SERVER_WORKER_ID)
+            os.kill(os.getpid(), signal.SIGTERM)
+            return
+        try:
+            REVIEWS.sync()
+        except Exception:
+            pass
+
+
+if PREFORK:
+    REVIEWS.on_change = _reviews_changed
+    if STORAGE_BACKEND == 'sqlite':
+        REVIEWS.on_reset = _reviews_reset
+    threading.Thread(target=_follow_stores, name='store-follower', daemon=True).start()
+
+
+def _admin_stats():
+    """Counters of the caches, upstream, reranker and stores (GET /admin/stats, also exported at /metrics)."""
+    return {
+        'chat_cache': CHAT_CACHE.stats() if CHAT_CACHE is not None else None,
+        'chat_similar': SIMILAR_CACHE.stats() if SIMILAR_CACHE is not None else None,
+        'chat_coalesce': CHAT_INFLIGHT.stats() if CHAT_INFLIGHT is not None else None,
+        'rerank_adaptive': RERANK_ADAPTIVE.stats() if RERANK_ADAPTIVE is not None else None,
+        'chat_fanout': FANOUT.stats(),
+        'chat_alternatives': ALTERNATIVES.stats(),
+        'chat_context': CONTEXT.stats(),
+        'static': STATIC.stats() if STATIC is not None else None,
+        'upstream': dict(UPSTREAM.stats),
+        'upstream_resilience': OPENAI.stats(),
+        'storage_backend': STORAGE_BACKEND,
+        'reranker': RERANKER_WORKER.stats() if RERANKER_WORKER is not None else None,
+        'suggestions_log': SUGGESTIONS.stats(),
+        'peer_rankings_log': PEER_RANKINGS.stats(),
+        # pre-fork: every section above counts this worker only
+        'worker': {'id': SERVER_WORKER_ID, 'pid': os.getpid(), 'processes': SERVER_PROCESSES if PREFORK else 1},
+    }
+
+
+def _store_samples():
+    """Records and bytes on disk per store, computed at scrape time."""
+    for name, store in (('reviews', REVIEWS), ('suggestions', SUGGESTIONS), ('peer_rankings', PEER_RANKINGS)):
+        labels = (('store', name),)
+        yield 'chatbot_store_records', labels, len(store)
+        files = set(getattr(store, 'sources', [store.path]))
+        files.update([store.path, store.path + '-wal'])
+        yield 'chatbot_store_bytes', labels, sum(os.path.getsize(f) for f in files if os.path.exists(f))
+
+
+def _stats_samples():
+    for section, stats in _admin_stats().items():
+        if isinstance(stats, dict):
+            for name, value in flatten_stats('chatbot_' + section, stats):
+                yield name, (), value
+
+
+if METRICS is not None:
+    METRICS.describe('chatbot_http_request_seconds', 'histogram', 'Request handling time by endpoint and method.')
+    METRICS.describe('chatbot_http_responses_total', 'counter', 'Responses by endpoint and status code.')
+    METRICS.describe('chatbot_stage_seconds', 'histogram',
+                     'Time per request stage (parse, trim, upstream_connect, upstream_wait, upstream_read, '
+                     'decode, score, serialize).')
+    METRICS.describe('chatbot_candidates_scored_total', 'counter', 'Candidate replies scored by the reranker.')
+    METRICS.describe('chatbot_upstream_errors_total', 'counter', 'Failed upstream calls by reason.')
+    METRICS.describe('chatbot_store_records', 'gauge', 'Records per store.')
+    METRICS.describe('chatbot_store_bytes', 'gauge', 'Bytes on disk per store.')
+    METRICS.add_collector(_store_samples)
+    METRICS.add_collector(_stats_samples)
+
+
+def _last_user_message(messages):
+    for m in reversed(messages):
+        if isinstance(m, dict) and m.get('role') == 'user':
+            return m.get('content')
+    return None
+
+
+def _request_weights(data):
+    """Criterion weights for reranking: request-provided, else OPENAI_WEIGHT_* env vars."""
+    if isinstance(data, dict) and isinstance(data.get('weights'), dict):
+        return data.get('weights')
+    try:
+        return {
+            'factuality': float(os.environ.get('OPENAI_WEIGHT_FACTUALITY', '0') or 0),
+            'clarity': float(os.environ.get('OPENAI_WEIGHT_CLARITY', '0') or 0),
+            'ethics': float(os.environ.get('OPENAI_WEIGHT_ETHICS', '0') or 0),
+        }
+    except Exception:
+        return None
+
+
+def _chat_payload(data, messages, scores):
+    """Build the upstream chat-completions payload from the client request."""
+    # Prefer model from client, otherwise env default
+    model = None
+    if isinstance(data, dict) and data.get('model'):
+        model = data.get('model')
+    if not model:
+        model = os.environ.get('OPENAI_MODEL', 'gpt-3.5-turbo')
+
+    # Request multiple candidates so we can rerank using collected reviews
+    n = RERANK_N if scores else 1
+    # If user explicitly requested a single sample, respect it
+    if isinstance(data, dict) and data.get('n'):
+        try:
+            n = int(data.get('n'))
+        except Exception:
+            pass
+    payload = {'model': model, 'messages': messages, 'n': max(1, n)}
+    # Allow the client to suggest temperature (optional)
+    if isinstance(data, dict) and 'temperature' in data:
+        try:
+            payload['temperature'] = float(data.get('temperature'))
+        except Exception:
+            pass
+    # Allow client max tokens
+    if isinstance(data, dict) and 'max_tokens' in data:
+        try:
+            payload['max_tokens'] = int(data.get('max_tokens'))
+        except Exception:
+            pass
+    return payload
+
+
+def _choice_text(c):
+    """Extract the text of a completion choice (chat or legacy completion style)."""
+    text = None
+    msg = c.get('message') if isinstance(c, dict) else None
+    if isinstance(msg, dict) and 'content' in msg:
+        text = msg.get('content')
+    if text is None and isinstance(c, dict) and 'text' in c:
+        text = c.get('text')
+    return text
+
+
+def _fanout_plan(data, payload, stream):
+    """(variants, calls, need, deadline, early) if this request fans out (see fanout.py), else None.
+
+    `early` holds the early-exit options (early_exit.py), or None. Calls and
+    variants are capped at CHAT_FANOUT_MAX; raises ValueError if `n` is not an
+    integer.
+    """
+    if stream or not isinstance(data, dict):
+        return None
+    early = data.get('early_exit', RERANK_EARLY_EXIT)
+    early = EARLY_EXIT.options(early) if early else None
+    option = data.get('fanout', CHAT_FANOUT) or early is not None
+    if not option:
+        return None
+    n = data.get('n')
+    if n is not None and (isinstance(n, bool) or not isinstance(n, int)):
+        raise ValueError('n must be an integer')
+    variants = None
+    if isinstance(option, list):
+        variants = [v for v in option if isinstance(v, dict)][:CHAT_FANOUT_MAX] or None
+    calls = payload.get('n', 1)
+    if variants and not n:
+        calls = len(variants)
+    calls = min(calls, CHAT_FANOUT_MAX)
+    if calls < 2 and not variants:
+        return None
+    need = deadline = None
+    try:
+        if data.get('fanout_min') is not None:
+            need = int(data.get('fanout_min'))
+        if data.get('fanout_deadline_ms') is not None:
+            deadline = float(data.get('fanout_deadline_ms')) / 1000.0
+    except Exception:
+        pass
+    return variants, calls, need, deadline, early
+
+
+def _parse_candidates(raw):
+    """Candidate texts and completion token count from a chat-completions JSON body."""
+    try:
+        parsed = json.loads(raw)
+    except Exception:
+        parsed = None
+    replies = []
+    tokens = 0
+    if parsed and isinstance(parsed, dict):
+        choices = parsed.get('choices')
+        if isinstance(choices, list) and len(choices) > 0:
+            # Collect all returned candidate texts so the frontend can show A/B (or more)
+            for c in choices:
+                text = _choice_text(c)
+                if text is not None:
+                    replies.append(text)
+        usage = parsed.get('usage')
+        if isinstance(usage, dict):
+            try:
+                tokens = int(usage.get('completion_tokens') or 0)
+            except Exception:
+                tokens = 0
+    if not tokens:
+        # rough estimate when the upstream does not report usage
+        tokens = sum(len(r.split()) for r in replies) * 4 // 3
+    return replies, tokens
+
+
+def _candidate_scores(replies, scores, weights):
+    """Composite score per candidate (0.5 each without a reranker)."""
+    if scores:
+        try:
+            return score_batch(replies, scores, weights=weights)
+        except Exception:
+            try:
+                return score_batch(replies, scores)
+            except Exception:
+                return [0.0] * len(replies)
+    return [0.5] * len(replies)
+
+
+def _rerank(replies, scores, weights, values=None):
+    """Score all candidates in one batch (unless `values` are given) and return (best_index, best_score).
+
+    (None, -1.0) if there are none.
+    """
+    if values is None:
+        values = _candidate_scores(replies, scores, weights)
+    best_score = -1.0
+    best_index = None
+    for i, score in enumerate(values):
+        if score > best_score:
+            best_score = score
+            best_index = i
+    return best_index, best_score
+
+
+def _chat_result(replies, messages, scores, weights, values=None):
+    """Rerank candidate replies into the /chat response shape."""
+    best_index, best_score = _rerank(replies, scores, weights, values)
+    if best_index is None:
+        # Fallback to echoing the last user message
+        assistant_text = f"Mock fallback reply — you said: {_last_user_message(messages) or '(no user message)'}"
+    else:
+        assistant_text = replies[best_index]
+
+    # Ensure we have a replies array for the frontend; if none were returned, include the chosen assistant_text
+    if not replies:
+        replies = [assistant_text]
+        best_index = 0
+    return {'reply': assistant_text, 'score': best_score, 'replies': replies, 'best_index': best_index}
+
+
 class Handler(BaseHTTPRequestHandler):
-    def _set_cors_headers(self, status=200):
+    def _set_cors_headers(self, status=200, content_type='application/json', headers=None):
         self.send_response(status)
-        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if content_type == 'text/event-stream':
+            self.send_header('Cache-Control', 'no-cache')
+        timings = getattr(self, '_upstream_timings', None)
+        if timings:
+            # Expose upstream connection reuse/handshake/TTFB to browser devtools
+            self.send_header('Server-Timing', 'upstream-connect;dur=%s, upstream-tls;dur=%s, upstream-ttfb;dur=%s' % (
+                timings.get('connect_ms', 0), timings.get('tls_ms', 0), timings.get('ttfb_ms', 0)))
+        cache_status = getattr(self, '_cache_status', None)
+        if getattr(self, '_coalesced', False):
+            cache_status = 'COALESCED'
+        if cache_status:
+            self.send_header('X-Cache', cache_status)
+        fallback = getattr(self, '_upstream_fallback', None)
+        if fallback:
+            self.send_header('X-Upstream-Fallback', fallback)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Expose-Headers', 'Server-Timing, X-Cache, X-Upstream-Fallback, ETag')
         # Allow the admin token header used by the admin UI
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, X-Admin-Token')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type, X-Admin-Token, If-None-Match')
         self.end_headers()
 
     def do_OPTIONS(self):
@@ -56,121 +883,118 @@ class Handler(BaseHTTPRequestHandler):
         self._set_cors_headers(200)
 
     def do_GET(self):
+        path, _, query = self.path.partition('?')
         # Serve a preloaded peer review dataset for classroom mock exercises
-        if self.path == '/peer_dataset':
-            try:
-                with open('peer_dataset.json', 'r', encoding='utf-8') as f:
-                    dataset = json.load(f)
-            except Exception:
-                dataset = []
-            # Also include any authenticated reviews from reviews.json so admin-approved reviews
-            # surface in the peer review exercises. Map reviews into the same item shape.
-            try:
-                with open('reviews.json', 'r', encoding='utf-8') as rf:
-                    reviews = json.load(rf)
-            except Exception:
-                reviews = []
-            if isinstance(reviews, list):
-                for r in reviews:
-                    try:
-                        # Include any review entries (no admin authentication required)
-                        if isinstance(r, dict):
-                            # Create a lightweight dataset item from the review
-                            item_id = r.get('messageId') or ('review-' + (r.get('timestamp') or ''))
-                            # Use the review comment or messageId as the question placeholder
-                            question = r.get('comment') or item_id
-                            assistant_text = r.get('assistantText') or ''
-                            rating = r.get('rating') if 'rating' in r else None
-                            review_entry = {'author': r.get('authenticatedBy') or r.get('author') or 'user', 'rating': rating, 'comment': r.get('comment','')}
-                            mapped = {
-                                'id': item_id,
-                                'question': question,
-                                'assistantResponses': [
-                                    {
-                                        'text': assistant_text,
-                                        'reviews': [ review_entry ]
-                                    }
-                                ]
-                            }
-                            dataset.append(mapped)
-                    except Exception:
-                        # ignore malformed review entries
-                        pass
-            self._set_cors_headers(200)
-            self.wfile.write(json.dumps(dataset).encode('utf-8'))
+        if path == '/peer_dataset':
+            # peer_dataset.json plus one item per review, pre-encoded (see peer_views.py)
+            if PREFORK:
+                REVIEWS.sync()
+            body, etag = PEER_DATASET.get()
+            self._send_cached(body, etag)
             return
-        if self.path == '/peer_rank_summary':
-            # Return aggregated vote counts from peer_rankings.json in shape { itemId: { '0': count, '1': count } }
-            try:
-                with open('peer_rankings.json', 'r', encoding='utf-8') as f:
-                    ranks = json.load(f)
-            except Exception:
-                ranks = []
-            summary = {}
-            if isinstance(ranks, list):
-                for r in ranks:
-                    try:
-                        item = r.get('itemId')
-                        idx = r.get('responseIndex')
-                        if item is None or idx is None:
-                            continue
-                        idx = str(int(idx))
-                        if item not in summary:
-                            summary[item] = {'0': 0, '1': 0}
-                        if idx not in summary[item]:
-                            summary[item][idx] = 0
-                        summary[item][idx] += 1
-                    except Exception:
-                        pass
-            self._set_cors_headers(200)
-            self.wfile.write(json.dumps(summary).encode('utf-8'))
+        if path == '/peer_rank_summary':
+            # Aggregated vote counts in shape { itemId: { '0': count, '1': count } }, kept as running counters
+            body, etag = RANK_SUMMARY.get()
+            self._send_cached(body, etag)
             return
-        if self.path == '/reviews':
+        if path == '/reviews':
+            self._send_listing(query)
+            return
+        if path == '/chat/alternatives':
+            # all candidates of an early-exited /chat request (RERANK_EARLY_REST=later), for the Compare view
+            params = parse_qs(query)
             try:
-                with open('reviews.json', 'r', encoding='utf-8') as f:
-                    reviews = json.load(f)
-            except Exception:
-                reviews = []
+                wait = min(float(params.get('wait', ['0'])[0]), OPENAI_TIMEOUT)
+            except ValueError:
+                wait = 0.0
+            found = ALTERNATIVES.get(params.get('id', [''])[0], wait)
+            if found is None:
+                self._set_cors_headers(404)
+                self.wfile.write(json.dumps({'error': 'unknown or expired id'}).encode('utf-8'))
+                return
             self._set_cors_headers(200)
-            self.wfile.write(json.dumps(reviews).encode('utf-8'))
+            self.wfile.write(json.dumps(found).encode('utf-8'))
             return
 
         # Admin-only listing endpoint
-        if self.path == '/admin/reviews':
+        if path == '/admin/reviews':
             token = self.headers.get('X-Admin-Token')
             ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', 'secret-token')
             if token != ADMIN_TOKEN:
                 self._set_cors_headers(403)
                 self.wfile.write(json.dumps({'error': 'forbidden'}).encode('utf-8'))
                 return
-            try:
-                with open('reviews.json', 'r', encoding='utf-8') as f:
-                    reviews = json.load(f)
-            except Exception:
-                reviews = []
-            self._set_cors_headers(200)
-            self.wfile.write(json.dumps(reviews).encode('utf-8'))
+            self._send_listing(query)
             return
 
         # Admin endpoint to fetch peer rankings
-        if self.path == '/admin/peer_rankings':
+        if path == '/admin/peer_rankings':
+            token = self.headers.get('X-Admin-Token')
+            ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', 'secret-token')
+            if token != ADMIN_TOKEN:
+                self._set_cors_headers(403)
+                self.wfile.write(json.dumps({'error': 'forbidden'}).encode('utf-8'))
+                return
+            item = parse_qs(query).get('itemId')
+            ranks = PEER_RANKINGS.select('itemId', item[0]) if item else PEER_RANKINGS
+            self._send_json_pieces(_json_array_pieces(ranks))
+            return
+
+        # Admin endpoint to fetch suggestions
+        if path == '/admin/suggestions':
+            token = self.headers.get('X-Admin-Token')
+            ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', 'secret-token')
+            if token != ADMIN_TOKEN:
+                self._set_cors_headers(403)
+                self.wfile.write(json.dumps({'error': 'forbidden'}).encode('utf-8'))
+                return
+            mid = parse_qs(query).get('messageId')
+            suggestions = SUGGESTIONS.select('messageId', mid[0]) if mid else SUGGESTIONS
+            self._send_json_pieces(_json_array_pieces(suggestions))
+            return
+
+        if path == '/admin/stats':
             token = self.headers.get('X-Admin-Token')
             ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', 'secret-token')
             if token != ADMIN_TOKEN:
                 self._set_cors_headers(403)
                 self.wfile.write(json.dumps({'error': 'forbidden'}).encode('utf-8'))
                 return
-            try:
-                with open('peer_rankings.json', 'r', encoding='utf-8') as f:
-                    ranks = json.load(f)
-            except Exception:
-                ranks = []
             self._set_cors_headers(200)
-            self.wfile.write(json.dumps(ranks).encode('utf-8'))
+            self.wfile.write(json.dumps(_admin_stats()).encode('utf-8'))
+            return
+
+        if path == '/metrics':
+            if METRICS is None:
+                self._set_cors_headers(404)
+                self.wfile.write(json.dumps({'error': 'metrics disabled'}).encode('utf-8'))
+                return
+            auth = self.headers.get('Authorization') or ''
+            bearer = auth[len('Bearer '):] if auth.startswith('Bearer ') else None
+            if not METRICS_PUBLIC and METRICS_TOKEN not in (self.headers.get('X-Admin-Token'), bearer):
+                self._set_cors_headers(403)
+                self.wfile.write(json.dumps({'error': 'forbidden'}).encode('utf-8'))
+                return
+            body = METRICS.render().encode('utf-8')
+            self._set_cors_headers(200, 'text/plain; version=0.0.4; charset=utf-8',
+                                   headers={'Content-Length': str(len(body))})
+            self.wfile.write(body)
+            return
+
+        # compare.html and peer_review.html fetch reviews.json next to themselves
+        if path == '/reviews.json':
+            self._send_listing(query)
             return
 
+        # Frontend pages, styles and scripts, from memory (see static_assets.py)
+        asset = STATIC.get(path) if STATIC is not None else None
+        if asset is not None:
+            self._send_asset(asset)
+            return
+        self._set_cors_headers(404)
+        self.wfile.write(json.dumps({'error': 'not found'}).encode('utf-8'))
+
     def do_POST(self):
-        global RERANKER_SCORES
         if self.path == '/review':
             # Save or update review in reviews.json (deduplicate by messageId)
             content_length = int(self.headers.get('Content-Length', 0))
@@ -186,55 +1010,35 @@ class Handler(BaseHTTPRequestHandler):
                 self._set_cors_headers(400)
                 self.wfile.write(json.dumps({'error': 'Missing messageId'}).encode())
                 return
-
-            # Load existing reviews
-            try:
-                with open('reviews.json', 'r', encoding='utf-8') as f:
-                    reviews = json.load(f)
-            except Exception:
-                reviews = []
-
-            # Check for existing review with same messageId
-            existing_index = None
-            for i, r in enumerate(reviews):
-                if isinstance(r, dict) and r.get('messageId') == review.get('messageId'):
-                    existing_index = i
-                    break
-
-            if existing_index is not None:
-                # Update existing review (overwrite)
-                reviews[existing_index] = review
-                status_code = 200
-                result = {'status': 'updated'}
-            else:
-                reviews.append(review)
-                status_code = 201
-                result = {'status': 'created'}
-
-            try:
-                with open('reviews.json', 'w', encoding='utf-8') as f:
-                    json.dump(reviews, f, indent=2)
-            except Exception as e:
-                self._set_cors_headers(500)
-                self.wfile.write(json.dumps({'error': 'Failed to save review', 'detail': str(e)}).encode())
+            # the stores index reviews by messageId, so it has to be hashable
+            if not isinstance(review['messageId'], (str, int)):
+                self._set_cors_headers(400)
+                self.wfile.write(json.dumps({'error': 'messageId must be a string or an integer'}).encode())
                 return
-            # Reload reranker scores so new reviews affect ranking immediately
-            try:
-                # update module-level RERANKER_SCORES if reranker module is available
-                if 'train_from_reviews' in globals():
-                    try:
-                        RERANKER_SCORES = train_from_reviews('reviews.json')
-                    except Exception:
-                        pass
-            except Exception:
-                pass
+
+            with _STORE_LOCK:
+                # Insert or overwrite (deduplicated by messageId through the store's index)
+                try:
+                    existing = REVIEWS.upsert(review)
+                except Exception as e:
+                    self._set_cors_headers(500)
+                    self.wfile.write(json.dumps({'error': 'Failed to save review', 'detail': str(e)}).encode())
+                    return
+                if existing is not None:
+                    status_code = 200
+                    result = {'status': 'updated'}
+                else:
+                    status_code = 201
+                    result = {'status': 'created'}
+                # Update reranker scores so new reviews affect ranking immediately
+                _reviews_changed(existing, review)
 
             self._set_cors_headers(status_code)
             self.wfile.write(json.dumps(result).encode())
             return
 
         if self.path == '/suggestion':
-            # Save suggestion into suggestions.json
+            # Append suggestion to suggestions.jsonl
             content_length = int(self.headers.get('Content-Length', 0))
             body = self.rfile.read(content_length) if content_length else b''
             try:
@@ -249,14 +1053,7 @@ class Handler(BaseHTTPRequestHandler):
                 self.wfile.write(json.dumps({'error': 'Missing fields'}).encode())
                 return
             try:
-                with open('suggestions.json', 'r', encoding='utf-8') as f:
-                    suggestions = json.load(f)
-            except Exception:
-                suggestions = []
-            suggestions.append(suggestion)
-            try:
-                with open('suggestions.json', 'w', encoding='utf-8') as f:
-                    json.dump(suggestions, f, indent=2)
+                SUGGESTIONS.append(suggestion)
             except Exception as e:
                 self._set_cors_headers(500)
                 self.wfile.write(json.dumps({'error': 'Failed to save suggestion', 'detail': str(e)}).encode())
@@ -281,18 +1078,12 @@ class Handler(BaseHTTPRequestHandler):
                 self.wfile.write(json.dumps({'error': 'Missing fields'}).encode())
                 return
             try:
-                with open('peer_rankings.json', 'r', encoding='utf-8') as f:
-                    ranks = json.load(f)
-            except Exception:
-                ranks = []
-            ranks.append(payload)
-            try:
-                with open('peer_rankings.json', 'w', encoding='utf-8') as f:
-                    json.dump(ranks, f, indent=2)
+                PEER_RANKINGS.append(payload)
             except Exception as e:
                 self._set_cors_headers(500)
                 self.wfile.write(json.dumps({'error': 'Failed to save ranking', 'detail': str(e)}).encode())
                 return
+            RANK_SUMMARY.add(payload)
             self._set_cors_headers(201)
             self.wfile.write(json.dumps({'status': 'created'}).encode())
             return
@@ -318,28 +1109,20 @@ class Handler(BaseHTTPRequestHandler):
                 self._set_cors_headers(400)
                 self.wfile.write(json.dumps({'error': 'Missing messageId'}).encode())
                 return
-            try:
-                with open('reviews.json', 'r', encoding='utf-8') as f:
-                    reviews = json.load(f)
-            except Exception:
-                reviews = []
-            new_reviews = [r for r in reviews if not (isinstance(r, dict) and r.get('messageId') == messageId)]
-            try:
-                with open('reviews.json', 'w', encoding='utf-8') as f:
-                    json.dump(new_reviews, f, indent=2)
-            except Exception as e:
-                self._set_cors_headers(500)
-                self.wfile.write(json.dumps({'error': 'Failed to delete review', 'detail': str(e)}).encode())
+            if not isinstance(messageId, (str, int)):
+                self._set_cors_headers(400)
+                self.wfile.write(json.dumps({'error': 'messageId must be a string or an integer'}).encode())
                 return
-            # Reload reranker after deletion
-            try:
-                if 'train_from_reviews' in globals():
-                    try:
-                        RERANKER_SCORES = train_from_reviews('reviews.json')
-                    except Exception:
-                        pass
-            except Exception:
-                pass
+            with _STORE_LOCK:
+                try:
+                    removed = REVIEWS.delete(messageId)
+                except Exception as e:
+                    self._set_cors_headers(500)
+                    self.wfile.write(json.dumps({'error': 'Failed to delete review', 'detail': str(e)}).encode())
+                    return
+                # Update reranker after deletion
+                for old in removed:
+                    _reviews_changed(old, None)
             self._set_cors_headers(200)
             self.wfile.write(json.dumps({'status': 'deleted'}).encode())
             return
@@ -365,39 +1148,28 @@ class Handler(BaseHTTPRequestHandler):
                 self._set_cors_headers(400)
                 self.wfile.write(json.dumps({'error': 'Missing messageId'}).encode())
                 return
-            try:
-                with open('reviews.json', 'r', encoding='utf-8') as f:
-                    reviews = json.load(f)
-            except Exception:
-                reviews = []
-            found = False
-            for r in reviews:
-                if isinstance(r, dict) and r.get('messageId') == messageId:
-                    r['authenticated'] = True
-                    r['authenticatedBy'] = payload.get('adminName') or 'admin'
-                    r['authenticatedAt'] = payload.get('timestamp') or ("%s" % (__import__('datetime').datetime.utcnow().isoformat() + 'Z'))
-                    found = True
-                    break
-            if not found:
-                self._set_cors_headers(404)
-                self.wfile.write(json.dumps({'error': 'review not found'}).encode())
-                return
-            try:
-                with open('reviews.json', 'w', encoding='utf-8') as f:
-                    json.dump(reviews, f, indent=2)
-            except Exception as e:
-                self._set_cors_headers(500)
-                self.wfile.write(json.dumps({'error': 'Failed to save review', 'detail': str(e)}).encode())
+            if not isinstance(messageId, (str, int)):
+                self._set_cors_headers(400)
+                self.wfile.write(json.dumps({'error': 'messageId must be a string or an integer'}).encode())
                 return
-            # Reload reranker after authentication (so authenticated reviews can be used if desired)
-            try:
-                if 'train_from_reviews' in globals():
-                    try:
-                        RERANKER_SCORES = train_from_reviews('reviews.json')
-                    except Exception:
-                        pass
-            except Exception:
-                pass
+            with _STORE_LOCK:
+                if REVIEWS.get(messageId) is None:
+                    self._set_cors_headers(404)
+                    self.wfile.write(json.dumps({'error': 'review not found'}).encode())
+                    return
+                try:
+                    changed = REVIEWS.update(messageId, {
+                        'authenticated': True,
+                        'authenticatedBy': payload.get('adminName') or 'admin',
+                        'authenticatedAt': payload.get('timestamp') or ("%s" % (__import__('datetime').datetime.utcnow().isoformat() + 'Z')),
+                    })
+                except Exception as e:
+                    self._set_cors_headers(500)
+                    self.wfile.write(json.dumps({'error': 'Failed to save review', 'detail': str(e)}).encode())
+                    return
+                # Update reranker after authentication (so authenticated reviews can be used if desired)
+                if changed:
+                    _reviews_changed(*changed)
             self._set_cors_headers(200)
             self.wfile.write(json.dumps({'status': 'authenticated'}).encode())
             return
@@ -407,6 +1179,7 @@ class Handler(BaseHTTPRequestHandler):
             self.wfile.write(json.dumps({'error': 'Not found'}).encode())
             return
 
+        t0 = time.perf_counter()
         content_length = int(self.headers.get('Content-Length', 0))
         body = self.rfile.read(content_length) if content_length else b''
         try:
@@ -415,146 +1188,119 @@ class Handler(BaseHTTPRequestHandler):
             self._set_cors_headers(400)
             self.wfile.write(json.dumps({'error': 'Invalid JSON'}).encode())
             return
+        self._stage('parse', time.perf_counter() - t0)
 
         messages = data.get('messages', []) if isinstance(data, dict) else []
+        # Opt-in server-sent events: relay tokens as they arrive instead of one JSON blob
+        stream = isinstance(data, dict) and bool(data.get('stream'))
         # If an OpenAI API key is present, proxy the request to OpenAI's Chat Completions API
         OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
         if OPENAI_API_KEY:
-            # Prefer model from client, otherwise env default
-            model = None
-            if isinstance(data, dict) and data.get('model'):
-                model = data.get('model')
-            if not model:
-                model = os.environ.get('OPENAI_MODEL', 'gpt-3.5-turbo')
-
-            # Request multiple candidates so we can rerank using collected reviews
-            n = RERANK_N if RERANKER_SCORES else 1
-            # If user explicitly requested a single sample, respect it
-            if isinstance(data, dict) and data.get('n'):
-                try:
-                    n = int(data.get('n'))
-                except Exception:
-                    pass
-            payload = {'model': model, 'messages': messages, 'n': max(1, n)}
-            # Allow the client to suggest temperature (optional)
-            if isinstance(data, dict) and 'temperature' in data:
-                try:
-                    payload['temperature'] = float(data.get('temperature'))
-                except Exception:
-                    pass
-            # Allow client max tokens
-            if isinstance(data, dict) and 'max_tokens' in data:
-                try:
-                    payload['max_tokens'] = int(data.get('max_tokens'))
-                except Exception:
-                    pass
-            
-
-            body_bytes = json.dumps(payload).encode('utf-8')
-            req = urllib.request.Request(
-                'https://api.openai.com/v1/chat/completions',
-                data=body_bytes,
-                headers={
-                    'Content-Type': 'application/json',
-                    'Authorization': f'Bearer {OPENAI_API_KEY}'
-                },
-                method='POST'
-            )
+            scores = _scoring_model()
+            payload = _chat_payload(data, self._trim_context(data, messages), scores)
+            # Determine weights for composite scoring: prefer request-provided weights, then env vars, else equal
+            weights = _request_weights(data)
             try:
-                ctx = ssl.create_default_context()
-                with urllib.request.urlopen(req, timeout=30, context=ctx) as resp:
-                    raw = resp.read().decode('utf-8')
-                    try:
-                        parsed = json.loads(raw)
-                    except Exception:
-                        parsed = None
-
-                # Extract choices and optionally rerank them using token scores
-                assistant_text = None
-                best_score = -1.0
-                replies = []
-                best_index = None
-                # Determine weights for composite scoring: prefer request-provided weights, then env vars, else equal
-                weights = None
-                if isinstance(data, dict) and isinstance(data.get('weights'), dict):
-                    weights = data.get('weights')
+                plan = _fanout_plan(data, payload, stream)
+            except ValueError as e:
+                self._set_cors_headers(400)
+                self.wfile.write(json.dumps({'error': str(e)}).encode())
+                return
+            key = cache_key(payload) if plan is None else cache_key(dict(payload, fanout=plan[0] or True))
+            cacheable = False
+            if CHAT_CACHE is not None:
+                cacheable = CHAT_CACHE.cacheable(payload)
+                if cacheable and plan is not None and plan[0]:
+                    cacheable = all(CHAT_CACHE.cacheable(dict(payload, **v)) for v in plan[0])
+                if not cacheable:
+                    CHAT_CACHE.bypass()
+                    self._cache_status = 'BYPASS'
                 else:
-                    try:
-                        weights = {
-                            'factuality': float(os.environ.get('OPENAI_WEIGHT_FACTUALITY', '0') or 0),
-                            'clarity': float(os.environ.get('OPENAI_WEIGHT_CLARITY', '0') or 0),
-                            'ethics': float(os.environ.get('OPENAI_WEIGHT_ETHICS', '0') or 0),
-                        }
-                    except Exception:
-                        weights = None
-
-                if parsed and isinstance(parsed, dict):
-                    choices = parsed.get('choices')
-                    if isinstance(choices, list) and len(choices) > 0:
-                        # Collect all returned candidate texts so the frontend can show A/B (or more)
-                        for c in choices:
-                            # extract text from either new or older style
-                            text = None
-                            msg = c.get('message') if isinstance(c, dict) else None
-                            if isinstance(msg, dict) and 'content' in msg:
-                                text = msg.get('content')
-                            if text is None and isinstance(c, dict) and 'text' in c:
-                                text = c.get('text')
-                            if text is None:
-                                continue
-                            replies.append(text)
-                            if RERANKER_SCORES:
-                                try:
-                                    score = score_text(text, RERANKER_SCORES, weights=weights)
-                                except Exception:
-                                    try:
-                                        score = score_text(text, RERANKER_SCORES)
-                                    except Exception:
-                                        score = 0.0
-                            else:
-                                score = 0.5
-                            if score > best_score:
-                                best_score = score
-                                assistant_text = text
-                                # index within the replies array
-                                best_index = len(replies) - 1
-
-                if assistant_text is None:
-                    # Fallback to echoing the last user message
-                    last_user = None
-                    for m in reversed(messages):
-                        if isinstance(m, dict) and m.get('role') == 'user':
-                            last_user = m.get('content')
-                            break
-                    assistant_text = f"Mock fallback reply — you said: {last_user or '(no user message)'}"
-
-                # Ensure we have a replies array for the frontend; if none were returned, include the chosen assistant_text
-                if not replies:
-                    replies = [assistant_text]
-                    best_index = 0 if best_index is None else best_index
-
-                self._set_cors_headers(200)
-                self.wfile.write(json.dumps({'reply': assistant_text, 'score': best_score, 'replies': replies, 'best_index': best_index}).encode('utf-8'))
-                return
-            except urllib.error.HTTPError as e:
+                    cached = CHAT_CACHE.get(key)
+                    if cached is not None:
+                        self._cache_status = 'HIT'
+                        self._send_chat_result(self._result(cached, messages, scores, weights), stream)
+                        return
+                    self._cache_status = 'MISS'
+            similar = self._similar_lookup(payload, plan) if SIMILAR_CACHE is not None else None
+            if similar is not None and similar[2] is not None:
+                self._send_chat_result(self._result(similar[2], messages, scores, weights), stream)
+                return
+            # Identical concurrent requests share one upstream call (see singleflight.py)
+            flight, leader = None, False
+            if CHAT_INFLIGHT is not None:
+                flight, leader = CHAT_INFLIGHT.begin(key)
+            replies = None
+            error = None
+            try:
+                if flight is not None and not leader:
+                    # Falls back to an own upstream call if the leader takes longer than CHAT_COALESCE_WAIT
+                    replies = flight.wait(CHAT_COALESCE_WAIT)
+                    if replies is not None:
+                        self._coalesced = True
+                        self._send_chat_result(self._result(replies, messages, scores, weights), stream)
+                        return
+                if plan is not None:
+                    replies, complete = self._fanout_chat(plan, payload, messages, scores, weights, OPENAI_API_KEY)
+                    if cacheable and complete:
+                        CHAT_CACHE.put(key, replies)
+                    if similar is not None and similar[0] is not None and complete:
+                        SIMILAR_CACHE.put(similar[0], similar[1], replies)
+                    return
+                adaptive_key = None
+                if RERANK_ADAPTIVE is not None and scores and not (isinstance(data, dict) and data.get('n')):
+                    adaptive_key = prompt_key(_last_user_message(messages))
+                    payload['n'] = RERANK_ADAPTIVE.initial_n(adaptive_key)
+                if stream:
+                    payload['stream'] = True
+                replies = self._upstream_chat(payload, stream, messages, scores, weights, OPENAI_API_KEY,
+                                              adaptive_key)
+                if cacheable and replies:
+                    CHAT_CACHE.put(key, replies)
+                if similar is not None and similar[0] is not None and replies:
+                    SIMILAR_CACHE.put(similar[0], similar[1], replies)
+                return
+            except UpstreamHTTPError as e:
+                error = e
+                self._count_upstream_error(e)
                 try:
-                    detail = e.read().decode('utf-8')
+                    detail = e.body.decode('utf-8')
                 except Exception:
                     detail = str(e)
                 self._set_cors_headers(502)
                 self.wfile.write(json.dumps({'error': 'OpenAI error', 'detail': detail}).encode('utf-8'))
                 return
+            except CircuitOpenError as e:
+                # the upstream is failing: answer at once with the offline mock instead of waiting for it
+                error = e
+                self._count_upstream_error(e)
+                self._upstream_fallback = 'circuit-open'
+                self._mock_chat(data, messages, stream)
+                return
+            except UpstreamBusy as e:
+                error = e
+                self._count_upstream_error(e)
+                self._set_cors_headers(503, headers={'Retry-After': '1'})
+                self.wfile.write(json.dumps({'error': 'Too many concurrent requests', 'detail': str(e)}).encode('utf-8'))
+                return
             except Exception as e:
+                error = e
+                self._count_upstream_error(e)
                 self._set_cors_headers(502)
                 self.wfile.write(json.dumps({'error': 'OpenAI request failed', 'detail': str(e)}).encode('utf-8'))
                 return
+            finally:
+                if leader:
+                    # an upstream error is shared too; a failure writing to our own client is not
+                    shared = error if isinstance(error, UpstreamError) else None
+                    CHAT_INFLIGHT.finish(flight, replies or None, shared)
 
         # Fallback behavior when OPENAI_API_KEY is not set: simple mock replies
-        last_user = None
-        for m in reversed(messages):
-            if isinstance(m, dict) and m.get('role') == 'user':
-                last_user = m.get('content')
-                break
+        self._mock_chat(data, messages, stream)
+
+    def _mock_chat(self, data, messages, stream):
+        """Answer /chat with canned replies (no API key, or the upstream circuit is open)."""
+        last_user = _last_user_message(messages)
 
         # Respect an 'n' parameter from the client so Compare can request multiple candidates
         n = 1
@@ -572,20 +1318,585 @@ class Handler(BaseHTTPRequestHandler):
                 text = f"Mock reply #{i+1} — you said: {last_user or '(no user message)'}"
             replies.append(text)
 
-        self._set_cors_headers(200)
         response = {'reply': replies[0], 'replies': replies, 'best_index': 0, 'score': 0.5}
+        if stream:
+            # Stream the mock word by word so the SSE path can be exercised offline
+            self._start_event_stream()
+            for i, word in enumerate(replies[0].split(' ')):
+                self._send_event({'delta': word if i == 0 else ' ' + word})
+            self._finish_event_stream(response)
+            return
+        self._set_cors_headers(200)
         self.wfile.write(json.dumps(response).encode('utf-8'))
 
+    def _log_upstream_timings(self):
+        t = getattr(self, '_upstream_timings', None)
+        if t:
+            connect = t.get('connect_ms', 0) + t.get('tls_ms', 0)
+            self._stage('upstream_connect', connect / 1000.0)
+            self._stage('upstream_wait', t.get('ttfb_ms', 0) / 1000.0)
+            self._stage('upstream_read', max(0.0, t.get('total_ms', 0) - connect - t.get('ttfb_ms', 0)) / 1000.0)
+            self.log_message('upstream reused=%s connect=%.1fms tls=%.1fms ttfb=%.1fms total=%.1fms',
+                             t.get('reused'), t.get('connect_ms', 0), t.get('tls_ms', 0),
+                             t.get('ttfb_ms', 0), t.get('total_ms', 0))
+
+    def _upstream_chat(self, payload, stream, messages, scores, weights, api_key, adaptive_key=None):
+        """Call the upstream, answer the client and return the candidate texts (None if a stream broke off).
+
+        With adaptive_key set (adaptive RERANK_N), a non-streaming request may
+        make a second call for more candidates; see _expand_candidates.
+        """
+        with OPENAI.post_json('/chat/completions', payload, headers={'Authorization': f'Bearer {api_key}'},
+                              key=api_key, stream=stream) as resp:
+            self._upstream_timings = resp.timings
+            if stream and 'text/event-stream' in (resp.headers.get('Content-Type') or ''):
+                replies = self._relay_stream(resp, messages, scores, weights)
+                resp.close()
+                self._log_upstream_timings()
+                if adaptive_key is not None:
+                    # the first candidate is already on its way; no second round for streams
+                    self.log_message('adaptive-n prompt=%s n=%d decision=stream', adaptive_key, payload['n'])
+                return replies
+            raw = resp.read().decode('utf-8')
+        self._log_upstream_timings()
+
+        t0 = time.perf_counter()
+        replies, tokens = _parse_candidates(raw)
+        self._stage('decode', time.perf_counter() - t0)
+        if adaptive_key is not None:
+            replies = self._expand_candidates(payload, replies, tokens, scores, weights, api_key, adaptive_key)
+        # Upstream may have ignored stream=true; still answer in the event-stream format
+        self._send_chat_result(self._result(replies, messages, scores, weights), stream)
+        return replies
+
+    def _fanout_chat(self, plan, payload, messages, scores, weights, api_key):
+        """Get the candidates from concurrent single-candidate calls, answer the client; returns (replies, complete).
+
+        With early exit the answer goes out as soon as EARLY_EXIT picks a
+        candidate; see early_exit.py.
+        """
+        variants, calls, need, deadline, early = plan
+        headers = {'Authorization': f'Bearer {api_key}'}
+
+        def call(p, cancel):
+            with OPENAI.post_json('/chat/completions', p, headers=headers, key=api_key, cancel=cancel) as resp:
+                raw = resp.read().decode('utf-8')
+            return _parse_candidates(raw)[0]
+
+        accept = rest = alternatives = None
+        # without a reranker every candidate scores the same; there is nothing to exit early on
+        if early is not None and scores:
+            accept = lambda values: EARLY_EXIT.pick(values, early['threshold'], early['margin'])
+            if early['rest'] == 'later':
+                alternatives = ALTERNATIVES.open()
+                first_added = threading.Event()
+
+                def rest(texts, elapsed_ms):
+                    # the late candidates go after the ones the client already got
+                    first_added.wait(5.0)
+                    ALTERNATIVES.add(alternatives, texts, _candidate_scores(texts, scores, weights), complete=True)
+
+        t0 = time.perf_counter()
+        try:
+            out = FANOUT.run(call, FANOUT.payloads(payload, calls, variants),
+                             score=lambda texts: self._scores(texts, scores, weights), need=need, deadline=deadline,
+                             accept=accept, rest=rest)
+        except Exception:
+            if alternatives is not None:
+                ALTERNATIVES.discard(alternatives)
+            raise
+        self._stage('fanout', time.perf_counter() - t0 - self._stages.get('score', 0.0))
+        self.log_message('fanout calls=%d candidates=%d cancelled=%d deferred=%d failed=%d early_exit=%s '
+                         'saved=%sms elapsed=%.1fms', calls, len(out['replies']), out['cancelled'], out['deferred'],
+                         out['failed'], out['accepted'] is not None, out['saved_ms'], out['elapsed_ms'])
+        result = self._result(out['replies'], messages, scores, weights, out['values'])
+        if out['accepted'] is not None:
+            result['early_exit'] = {'candidates': len(out['replies']), 'pending': out['cancelled'] + out['deferred']}
+        if alternatives is not None:
+            if out['deferred']:
+                ALTERNATIVES.add(alternatives, out['replies'], out['values'])
+                result['alternatives'] = alternatives
+            else:
+                ALTERNATIVES.discard(alternatives)
+            first_added.set()
+        self._send_chat_result(result, False)
+        return out['replies'], not out['cancelled'] and not out['deferred'] and not out['failed']
+
+    def _expand_candidates(self, payload, replies, tokens, scores, weights, api_key, key):
+        """Ask for more candidates if the first ones are a close call (adaptive RERANK_N); returns all candidates."""
+        values = self._scores(replies, scores, weights)
+        spread, _ = score_spread(values)
+        elapsed_ms = (self._upstream_timings or {}).get('total_ms', 0.0)
+        extra, decision = RERANK_ADAPTIVE.extra_n(key, values, elapsed_ms, tokens)
+        won = None
+        if extra:
+            more = dict(payload)
+            more.pop('stream', None)
+            more['n'] = extra
+            try:
+                with OPENAI.post_json('/chat/completions', more, headers={'Authorization': f'Bearer {api_key}'},
+                                      key=api_key) as resp:
+                    raw = resp.read().decode('utf-8')
+                added, _ = _parse_candidates(raw)
+            except Exception as e:
+                # keep the first candidates rather than failing the request
+                self._count_upstream_error(e)
+                self.log_message('adaptive-n prompt=%s second round failed: %s', key, e)
+                added = []
+            if added:
+                first_best = max(values) if values else -1.0
+                final_best = max(first_best, max(self._scores(added, scores, weights)))
+                won = RERANK_ADAPTIVE.record(key, first_best, final_best)
+                replies = replies + added
+        self.log_message('adaptive-n prompt=%s n=%d spread=%.4f decision=%s extra=%d won=%s total_n=%d',
+                         key, payload['n'], spread, decision, extra, won, len(replies))
+        return replies
+
+    def _send_cached(self, body, etag):
+        """Send pre-encoded JSON with an ETag, or 304 if the client's If-None-Match still matches.
+
+        Large bodies go out gzip-compressed (compressed once per body) to
+        clients that accept it, under their own ETag.
+        """
+        # no-cache: browsers may keep the body but must revalidate (cheap 304) before reusing it
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding'}
+        if len(body) >= GZIP_MIN_BYTES and _accepts_gzip(self.headers.get('Accept-Encoding')):
+            body, headers['ETag'] = _gzipped(body, etag)
+            headers['Content-Encoding'] = 'gzip'
+        if etag_matches(self.headers.get('If-None-Match'), headers['ETag']):
+            headers.pop('Content-Encoding', None)
+            self._set_cors_headers(304, headers=headers)
+            return
+        headers['Content-Length'] = str(len(body))
+        self._set_cors_headers(200, headers=headers)
+        self.wfile.write(body)
+
+    def _send_asset(self, asset):
+        """Send a static asset (gzip copy to clients that accept it), or 304 if If-None-Match still matches."""
+        headers = {'ETag': asset.etag, 'Cache-Control': asset.cache_control, 'Vary': 'Accept-Encoding'}
+        body = asset.body
+        if asset.gz is not None and _accepts_gzip(self.headers.get('Accept-Encoding')):
+            body, headers['ETag'] = asset.gz, asset.gz_etag
+            headers['Content-Encoding'] = 'gzip'
+        if etag_matches(self.headers.get('If-None-Match'), headers['ETag']):
+            headers.pop('Content-Encoding', None)
+            self._set_cors_headers(304, asset.content_type, headers)
+            return
+        headers['Content-Length'] = str(len(body))
+        self._set_cors_headers(200, asset.content_type, headers)
+        self.wfile.write(body)
+
+    def _send_listing(self, query):
+        """Reviews as a JSON array, or one page of them ({items, next_cursor}) when limit/cursor is given."""
+        try:
+            limit, cursor, project = _listing_params(query)
+        except ValueError as e:
+            self._set_cors_headers(400)
+            self.wfile.write(json.dumps({'error': str(e)}).encode('utf-8'))
+            return
+        if limit is None:
+            self._send_json_pieces(_json_array_pieces(REVIEWS.all(), project))
+            return
+        records, next_cursor = REVIEWS.page(cursor, limit)
+
+        def pieces():
+            yield b'{"items": '
+            for piece in _json_array_pieces(records, project):
+                yield piece
+            yield b', "next_cursor": ' + json.dumps(str(next_cursor) if next_cursor is not None else None).encode('utf-8') + b'}'
+        self._send_json_pieces(pieces())
+
+    def _send_json_pieces(self, pieces, status=200):
+        """Send a JSON body produced piece by piece without joining it in memory.
+
+        Bodies below GZIP_MIN_BYTES go out as-is with a Content-Length.
+        Larger ones are gzip-compressed if the client accepts it and are
+        streamed: chunked for HTTP/1.1 clients, delimited by closing the
+        connection for HTTP/1.0 ones.
+        """
+        head = []
+        size = 0
+        pieces = iter(pieces)
+        for piece in pieces:
+            head.append(piece)
+            size += len(piece)
+            if size >= GZIP_MIN_BYTES:
+                break
+        else:
+            body = b''.join(head)
+            self._set_cors_headers(status, headers={'Content-Length': str(len(body)), 'Vary': 'Accept-Encoding'})
+            self.wfile.write(body)
+            return
+
+        headers = {'Vary': 'Accept-Encoding'}
+        compressor = None
+        if _accepts_gzip(self.headers.get('Accept-Encoding')):
+            headers['Content-Encoding'] = 'gzip'
+            # wbits=31: gzip container
+            compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        chunked = self.request_version == 'HTTP/1.1'
+        if chunked:
+            self.protocol_version = 'HTTP/1.1'
+            headers['Transfer-Encoding'] = 'chunked'
+            headers['Connection'] = 'close'
+        self._set_cors_headers(status, headers=headers)
+
+        def emit(data):
+            if compressor is not None:
+                data = compressor.compress(data)
+            if not data:
+                return
+            if chunked:
+                data = b'%x\r\n' % len(data) + data + b'\r\n'
+            self.wfile.write(data)
+
+        buf = bytearray(b''.join(head))
+        for piece in pieces:
+            buf += piece
+            if len(buf) >= _STREAM_CHUNK:
+                emit(bytes(buf))
+                buf.clear()
+        emit(bytes(buf))
+        if compressor is not None:
+            tail = compressor.flush()
+            if chunked and tail:
+                tail = b'%x\r\n' % len(tail) + tail + b'\r\n'
+            self.wfile.write(tail)
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
+
+    def _send_chat_result(self, result, stream):
+        """Answer /chat with a complete result, as JSON or as a one-delta event stream."""
+        if stream:
+            self._start_event_stream()
+            self._send_event({'delta': result['reply']})
+            self._finish_event_stream(result)
+            return
+        t0 = time.perf_counter()
+        body = json.dumps(result).encode('utf-8')
+        self._stage('serialize', time.perf_counter() - t0)
+        self._set_cors_headers(200)
+        self.wfile.write(body)
+
+    def _start_event_stream(self):
+        self._set_cors_headers(200, content_type='text/event-stream')
+
+    def _send_event(self, obj):
+        self.wfile.write(b'data: ' + json.dumps(obj).encode('utf-8') + b'\n\n')
+        self.wfile.flush()
+
+    def _finish_event_stream(self, result):
+        """Send the final event (reply/replies/best_index/score) and the [DONE] marker."""
+        final = dict(result)
+        final['done'] = True
+        self._send_event(final)
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+
+    def _relay_stream(self, resp, messages, scores, weights):
+        """Relay an upstream SSE completion to the client as it arrives.
+
+        Deltas of the first choice to produce content (the provisional leader)
+        are forwarded immediately; the other candidates are accumulated and the
+        final event carries the reranked `replies`, `best_index` and `score`.
+        Returns the candidate texts, or None if the stream broke off.
+        """
+        self._start_event_stream()
+        parts = {}
+        leader = None
+        try:
+            for raw in resp:
+                line = raw.decode('utf-8').strip()
+                if not line.startswith('data:'):
+                    continue
+                chunk = line[5:].strip()
+                if chunk == '[DONE]':
+                    # keep reading to the end so the connection can go back to the pool
+                    continue
+                try:
+                    parsed = json.loads(chunk)
+                except Exception:
+                    continue
+                choices = parsed.get('choices') if isinstance(parsed, dict) else None
+                for c in choices or []:
+                    if not isinstance(c, dict):
+                        continue
+                    delta = c.get('delta') if isinstance(c.get('delta'), dict) else {}
+                    text = delta.get('content') or c.get('text')
+                    if not text:
+                        continue
+                    idx = c.get('index', 0)
+                    parts.setdefault(idx, []).append(text)
+                    if leader is None:
+                        leader = idx
+                    if idx == leader:
+                        self._send_event({'delta': text})
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            self._count_upstream_error(e)
+            self._send_event({'error': 'OpenAI stream failed', 'detail': str(e)})
+            complete = False
+        else:
+            complete = True
+        replies = [''.join(parts[i]) for i in sorted(parts)]
+        self._finish_event_stream(self._result(replies, messages, scores, weights))
+        return replies if complete else None
+
+    # --- instrumentation (see metrics.py) ------------------------------------
+
+    def parse_request(self):
+        # timing starts once the request line has arrived
+        self._started = time.perf_counter()
+        self._stages = {}
+        self._status = None
+        # per-request state; the handler instance is reused on keep-alive connections
+        self._upstream_timings = None
+        self._cache_status = None
+        self._coalesced = False
+        self._upstream_fallback = None
+        self._context = None
+        self._similarity = None
+        return BaseHTTPRequestHandler.parse_request(self)
+
+    def send_response(self, code, message=None):
+        self._status = code
+        BaseHTTPRequestHandler.send_response(self, code, message)
+
+    def handle_one_request(self):
+        self._started = None
+        try:
+            BaseHTTPRequestHandler.handle_one_request(self)
+        finally:
+            if self._started is not None:
+                self._finish_request()
+
+    def _stage(self, name, seconds):
+        self._stages[name] = self._stages.get(name, 0.0) + seconds
+
+    def _trim_context(self, data, messages):
+        """The messages to send upstream, fitted to the context budget (context_budget.py); timed as 'trim'."""
+        budget = None
+        if isinstance(data, dict) and data.get('context_budget') is not None:
+            try:
+                requested = int(data.get('context_budget'))
+                # a client may tighten the server's budget, not lift it
+                if requested > 0 and (CONTEXT.budget <= 0 or requested < CONTEXT.budget):
+                    budget = requested
+            except Exception:
+                pass
+        t0 = time.perf_counter()
+        out, self._context = CONTEXT.trim(messages, budget)
+        if self._context is not None:
+            self._stage('trim', time.perf_counter() - t0)
+        return out
+
+    def _similar_lookup(self, payload, plan):
+        """(context, message, replies) from the near-duplicate cache, timed as 'similar'.
+
+        replies is None on a miss; context is None when the request cannot use
+        the cache (sampled, or not ending with a user message).
+        """
+        cacheable = SIMILAR_CACHE.cacheable(payload)
+        if cacheable and plan is not None and plan[0]:
+            cacheable = all(SIMILAR_CACHE.cacheable(dict(payload, **v)) for v in plan[0])
+        if not cacheable:
+            SIMILAR_CACHE.bypass()
+            if self._cache_status is None:
+                self._cache_status = 'BYPASS'
+            return None, None, None
+        t0 = time.perf_counter()
+        # fan-out variants are part of the context, as in the exact cache key
+        context, text = split_prompt(payload if plan is None else dict(payload, fanout=plan[0] or True))
+        if context is None:
+            SIMILAR_CACHE.bypass()
+            return None, None, None
+        replies, similarity = SIMILAR_CACHE.get(context, text)
+        self._stage('similar', time.perf_counter() - t0)
+        if replies is not None:
+            self._cache_status = 'SIMILAR'
+            self._similarity = similarity
+        elif self._cache_status is None:
+            self._cache_status = 'MISS'
+        return context, text, replies
+
+    def _scores(self, replies, scores, weights):
+        """_candidate_scores, timed as the 'score' stage."""
+        t0 = time.perf_counter()
+        values = _candidate_scores(replies, scores, weights)
+        self._stage('score', time.perf_counter() - t0)
+        if METRICS is not None:
+            METRICS.inc('chatbot_candidates_scored_total', n=len(replies))
+        return values
+
+    def _result(self, replies, messages, scores, weights, values=None):
+        """_chat_result, timed as the 'score' stage (unless the candidates were scored already)."""
+        t0 = time.perf_counter()
+        result = _chat_result(replies, messages, scores, weights, values)
+        self._stage('score', time.perf_counter() - t0)
+        if METRICS is not None and values is None:
+            METRICS.inc('chatbot_candidates_scored_total', n=len(replies))
+        return result
+
+    def _count_upstream_error(self, e):
+        if METRICS is not None:
+            reason = 'http_%d' % e.status if isinstance(e, UpstreamHTTPError) else type(e).__name__
+            METRICS.inc('chatbot_upstream_errors_total', (('reason', reason),))
+
+    def _finish_request(self):
+        elapsed = time.perf_counter() - self._started
+        path = self.path.partition('?')[0]
+        status = self._status or 0
+        if METRICS is not None:
+            endpoint = path if path in _METRIC_ENDPOINTS else 'other'
+            if endpoint == 'other' and STATIC is not None and STATIC.get(path) is not None:
+                endpoint = 'static'
+            METRICS.observe('chatbot_http_request_seconds', elapsed, (('endpoint', endpoint), ('method', self.command)))
+            METRICS.inc('chatbot_http_responses_total', (('endpoint', endpoint), ('status', str(status))))
+            for name, seconds in self._stages.items():
+                METRICS.observe('chatbot_stage_seconds', seconds, (('endpoint', endpoint), ('stage', name)))
+        if EVENT_LOG is not None:
+            event = {'event': 'request', 'client': self.client_address[0], 'method': self.command, 'path': path,
+                     'status': status, 'duration_ms': round(elapsed * 1000.0, 3)}
+            if PREFORK:
+                event['worker'] = SERVER_WORKER_ID
+            if self._stages:
+                event['stages_ms'] = {k: round(v * 1000.0, 3) for k, v in self._stages.items()}
+            cache_status = 'COALESCED' if getattr(self, '_coalesced', False) else getattr(self, '_cache_status', None)
+            if cache_status:
+                event['cache'] = cache_status
+            if self._upstream_fallback:
+                event['fallback'] = self._upstream_fallback
+            if self._similarity is not None:
+                event['similarity'] = round(self._similarity, 4)
+            if self._context is not None:
+                event['context_tokens'] = self._context['tokens_out']
+                event['context_tokens_saved'] = self._context['tokens_in'] - self._context['tokens_out']
+            try:
+                EVENT_LOG.write(event)
+            except Exception:
+                pass
+
+    def log_request(self, code='-', size='-'):
+        # the structured line for EVENT_LOG is written when the request finishes
+        self._print_log('"%s" %s %s', self.requestline, str(code), str(size))
+
     def log_message(self, format, *args):
+        self._print_log(format, *args)
+        if EVENT_LOG is not None:
+            try:
+                EVENT_LOG.write({'event': 'log', 'client': self.client_address[0], 'message': format % args})
+            except Exception:
+                pass
+
+    def _print_log(self, format, *args):
         # keep log output concise
         print("[mock-backend] %s - - %s" % (self.address_string(), format%args))
 
+class PooledHTTPServer(ThreadingMixIn, HTTPServer):
+    """HTTPServer that handles each request on its own thread, at most `workers` at a time.
+
+    When every worker is busy the accept loop waits for a free slot, so extra
+    connections queue in the kernel listen backlog (`backlog` entries) instead
+    of spawning unbounded threads.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class, workers=16, backlog=64, bind_and_activate=True):
+        self.request_queue_size = max(1, backlog)
+        self._workers = max(1, workers)
+        self._slots = threading.BoundedSemaphore(self._workers)
+        HTTPServer.__init__(self, server_address, handler_class, bind_and_activate)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        try:
+            ThreadingMixIn.process_request(self, request, client_address)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def process_request_thread(self, request, client_address):
+        try:
+            ThreadingMixIn.process_request_thread(self, request, client_address)
+        finally:
+            self._slots.release()
+
+    def drain(self, timeout):
+        """Wait up to `timeout` seconds for the requests being handled to finish; True if they did."""
+        end = time.monotonic() + timeout
+        taken = 0
+        while taken < self._workers and self._slots.acquire(timeout=max(0.0, end - time.monotonic())):
+            taken += 1
+        for _ in range(taken):
+            self._slots.release()
+        return taken == self._workers
+
+
+def make_server(host='0.0.0.0', port=3000, workers=None, backlog=None, reuse_port=False):
+    """Build the backend server; workers <= 1 gives the plain single-threaded HTTPServer.
+
+    reuse_port sets SO_REUSEPORT, so the pre-fork workers can each bind the port.
+    """
+    workers = SERVER_WORKERS if workers is None else workers
+    backlog = SERVER_BACKLOG if backlog is None else backlog
+    if workers <= 1:
+        server = HTTPServer((host, port), Handler, bind_and_activate=False)
+    else:
+        server = PooledHTTPServer((host, port), Handler, workers=workers, backlog=backlog, bind_and_activate=False)
+    server.allow_reuse_port = reuse_port
+    try:
+        server.server_bind()
+        server.server_activate()
+    except Exception:
+        server.server_close()
+        raise
+    return server
+
+
+def _on_sigterm(signum, frame):
+    # `pkill -f server_py.py` (see deploy.yml) should shut down like Ctrl-C so stores get compacted
+    raise KeyboardInterrupt
+
+
 if __name__ == '__main__':
-    port = 3000
-    server = HTTPServer(('0.0.0.0', port), Handler)
-    print(f"Mock Python backend running at http://localhost:{port}/")
+    signal.signal(signal.SIGTERM, _on_sigterm)
+    port = int(os.environ.get('PORT', '3000'))
+    server = make_server('0.0.0.0', port, reuse_port=PREFORK)
+    if PREFORK:
+        print(f"Worker {SERVER_WORKER_ID} (pid {os.getpid()}) serving http://localhost:{port}/ "
+              f"(workers={SERVER_WORKERS}, backlog={SERVER_BACKLOG})")
+        signal_ready()
+    else:
+        print(f"Mock Python backend running at http://localhost:{port}/ (workers={SERVER_WORKERS}, backlog={SERVER_BACKLOG})")
     try:
         server.serve_forever()
     except KeyboardInterrupt:
         print('Shutting down')
         server.server_close()
+        # pre-fork: after a SIGHUP reload the new generation's trainer owns the model file, and it
+        # follows the same store, so this worker must not publish or save over it any more
+        if PREFORK and SERVER_WORKER_ID == 0 and RERANKER_WORKER is not None:
+            RERANKER_WORKER.on_built = RERANKER_WORKER.on_update = None
+        # pre-fork: the other workers take the new connections; finish the requests already accepted
+        if PREFORK and hasattr(server, 'drain') and not server.drain(SERVER_DRAIN_TIMEOUT):
+            print('Requests still running after %.0fs; stopping anyway' % SERVER_DRAIN_TIMEOUT)
+        # close the review store first: its final sync/compaction may still queue changes for the
+        # reranker, which then applies them before it stops (a cut-short rebuild is not saved)
+        REVIEWS.close()
+        reranker_complete = RERANKER_WORKER is not None and RERANKER_WORKER.close()
+        SUGGESTIONS.close()
+        PEER_RANKINGS.close()
+        if EVENT_LOG is not None:
+            EVENT_LOG.close()
+        # pre-fork: the workers' caches would overwrite each other's file; worker 0's is kept
+        if CHAT_CACHE is not None and SERVER_WORKER_ID == 0:
+            try:
+                CHAT_CACHE.save()
+            except Exception:
+                pass
+        if reranker_complete and RERANKER_WORKER.dirty and not PREFORK:
+            try:
+                save_model(RERANKER_WORKER.model(), RERANKER_MODEL_PATH, RERANKER_SOURCES)
+            except Exception:
+                pass
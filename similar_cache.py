@@ -0,0 +1,275 @@
+"""Near-duplicate cache of upstream /chat candidates (stdlib only).
+
+Students ask the same question in slightly different words ("Explain why the
+sky is blue" / "why is the sky blue?"), which the exact-match ResponseCache
+never matches. SimilarCache keys entries on the last user message instead,
+and a lookup returns the replies stored for an earlier message whose words
+are similar enough:
+
+- The message is split into words with the reranker's _tokenize (lower
+  case, punctuation dropped), so word order, case and punctuation do not
+  matter. Similarity is the Jaccard index of the two word sets.
+- Each message gets a MinHash signature of `bands` x `rows` values. A band
+  is a hash of `rows` signature values plus the context (everything else in
+  the payload: earlier messages, model, n, temperature, ...), so only
+  requests that differ in the last user message alone can match. Two
+  messages with Jaccard similarity s share at least one band with
+  probability 1 - (1 - s**rows)**bands; candidates found that way are then
+  checked with the exact similarity against `threshold`.
+- The index is one direct-mapped table per band (a band hash -> entry slot
+  array; a later entry takes over a colliding cell), and entries live in
+  preallocated slots, so memory is bounded by `max_entries` whatever the
+  traffic. Replies are bounded by `max_bytes`. Full, the cache evicts with
+  the CLOCK (second chance) policy, and entries expire after `ttl` seconds.
+
+Messages with fewer than `min_tokens` words are skipped ("what?" matches
+too much). Counters: hits (same word set), near_hits (similar), misses,
+candidates (band matches looked at) and false_positives (candidates below
+the threshold).
+"""
+import random
+import threading
+import time
+from array import array
+
+from reranker import _tokenize
+from response_cache import cache_key
+
+# MinHash: h(x) = (a * x + b) mod a Mersenne prime, over 32-bit word hashes
+_PRIME = (1 << 61) - 1
+_WORD_MASK = 0xffffffff
+# words whose permuted hashes are memoized
+_WORD_CACHE = 50000
+
+
+def split_prompt(payload):
+    """(context key, last user message) of an upstream payload; (None, None) unless the last message is user text."""
+    messages = payload.get('messages') or []
+    last = messages[-1] if messages else None
+    if not isinstance(last, dict) or last.get('role') != 'user' or not isinstance(last.get('content'), str):
+        return None, None
+    return cache_key(dict(payload, messages=messages[:-1])), last['content']
+
+
+def _entry_size(replies):
+    return sum(len(r.encode('utf-8')) for r in replies)
+
+
+class SimilarCache:
+    def __init__(self, threshold=0.8, max_entries=10000, max_bytes=32 * 1024 * 1024, ttl=3600.0, bands=8, rows=3,
+                 min_tokens=3, cache_sampled=False, seed=1):
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max(1, max_bytes)
+        self.ttl = ttl
+        self.bands = max(1, bands)
+        self.rows = max(1, rows)
+        self.min_tokens = min_tokens
+        self.cache_sampled = cache_sampled
+        rnd = random.Random(seed)
+        self._perms = [(rnd.randrange(1, _PRIME), rnd.randrange(_PRIME)) for _ in range(self.bands * self.rows)]
+        # word hash -> its permuted values
+        self._word_perms = {}
+        # about 4 cells per entry and band keeps takeovers of live cells rare
+        cells = 1
+        while cells < 4 * self.max_entries:
+            cells *= 2
+        self._mask = cells - 1
+        # per band: cell -> slot + 1 (0 = empty)
+        self._tables = [array('i', [0]) * cells for _ in range(self.bands)]
+        # per slot: its band hashes, context hash, sorted word hashes, replies, size, expiry, CLOCK bit
+        self._band_keys = array('q', [0]) * (self.max_entries * self.bands)
+        self._contexts = array('q', [0]) * self.max_entries
+        self._words = [None] * self.max_entries
+        self._replies = [None] * self.max_entries
+        self._sizes = array('q', [0]) * self.max_entries
+        self._expires = array('d', [0.0]) * self.max_entries
+        self._ref = bytearray(self.max_entries)
+        self._used = 0
+        self._free = []
+        self._hand = 0
+        self._count = 0
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'near_hits': 0, 'misses': 0, 'bypassed': 0, 'skipped': 0, 'stores': 0,
+                         'candidates': 0, 'false_positives': 0, 'evictions': 0, 'expirations': 0,
+                         'similarity_sum': 0.0}
+
+    def cacheable(self, payload):
+        """False for sampled requests unless cache_sampled is set (as in ResponseCache)."""
+        if self.cache_sampled:
+            return True
+        temperature = payload.get('temperature')
+        return temperature is not None and temperature <= 0
+
+    def bypass(self):
+        """Count a request that skipped the cache."""
+        with self._lock:
+            self.counters['bypassed'] += 1
+
+    def fingerprint(self, context, text):
+        """(word hashes, band hashes) of a message in a context; (None, None) if it has too few words."""
+        words = sorted(set(hash(t) & _WORD_MASK for t in _tokenize(text)))
+        if len(words) < max(1, self.min_tokens):
+            return None, None
+        perms = self._word_perms
+        sig = list(map(min, zip(*[perms.get(x) or self._permute(x) for x in words])))
+        ctx = hash(context)
+        r = self.rows
+        return words, [hash((ctx, i) + tuple(sig[i * r:(i + 1) * r])) for i in range(self.bands)]
+
+    def _permute(self, x):
+        """A word hash under every MinHash permutation (memoized: prompts reuse a small vocabulary)."""
+        vec = array('Q', [(a * x + b) % _PRIME for a, b in self._perms])
+        if len(self._word_perms) >= _WORD_CACHE:
+            self._word_perms.clear()
+        self._word_perms[x] = vec
+        return vec
+
+    def _find(self, ctx, words, keys, now, counters):
+        """(slot, similarity) of the most similar live entry at or above the threshold, or (None, 0.0)."""
+        mine = set(words)
+        best, best_sim = None, 0.0
+        seen = set()
+        b = self.bands
+        for i, key in enumerate(keys):
+            slot = self._tables[i][key & self._mask] - 1
+            if slot < 0 or slot in seen:
+                continue
+            seen.add(slot)
+            # the cell may have been taken over by another band hash
+            if self._band_keys[slot * b + i] != key:
+                continue
+            if self._expires[slot] <= now:
+                self._evict(slot)
+                self._free.append(slot)
+                self.counters['expirations'] += 1
+                continue
+            counters['candidates'] += 1
+            theirs = array('I', self._words[slot])
+            common = len(mine.intersection(theirs))
+            sim = common / float(len(mine) + len(theirs) - common)
+            if sim < self.threshold or self._contexts[slot] != ctx:
+                counters['false_positives'] += 1
+                continue
+            if sim > best_sim:
+                best, best_sim = slot, sim
+        return best, best_sim
+
+    def get(self, context, text):
+        """(replies, similarity) of the closest stored message above the threshold, or (None, None)."""
+        words, keys = self.fingerprint(context, text)
+        if words is None:
+            with self._lock:
+                self.counters['skipped'] += 1
+            return None, None
+        ctx = hash(context)
+        with self._lock:
+            slot, sim = self._find(ctx, words, keys, time.time(), self.counters)
+            if slot is None:
+                self.counters['misses'] += 1
+                return None, None
+            self._ref[slot] = 1
+            self.counters['hits' if sim >= 1.0 else 'near_hits'] += 1
+            self.counters['similarity_sum'] += sim
+            return list(self._replies[slot]), sim
+
+    def put(self, context, text, replies):
+        """Store candidate texts for a message; replaces an entry with the same word set."""
+        replies = [r for r in replies if isinstance(r, str)]
+        size = _entry_size(replies)
+        if not replies or size > self.max_bytes:
+            return
+        words, keys = self.fingerprint(context, text)
+        if words is None:
+            return
+        ctx = hash(context)
+        now = time.time()
+        b = self.bands
+        with self._lock:
+            # stores follow a miss: the lookup counters already counted these candidates
+            slot, sim = self._find(ctx, words, keys, now, {'candidates': 0, 'false_positives': 0})
+            if slot is not None and sim >= 1.0:
+                self._evict(slot)
+            else:
+                slot = self._take_slot()
+            self._contexts[slot] = ctx
+            self._words[slot] = array('I', words).tobytes()
+            self._replies[slot] = replies
+            self._sizes[slot] = size
+            self._expires[slot] = now + self.ttl
+            self._ref[slot] = 1
+            for i, key in enumerate(keys):
+                self._band_keys[slot * b + i] = key
+                self._tables[i][key & self._mask] = slot + 1
+            self._count += 1
+            self._bytes += size
+            self.counters['stores'] += 1
+            while self._bytes > self.max_bytes and self._count > 1:
+                victim = self._victim(slot)
+                self._evict(victim)
+                self._free.append(victim)
+                self.counters['evictions'] += 1
+
+    def _take_slot(self):
+        if self._free:
+            return self._free.pop()
+        if self._used < self.max_entries:
+            self._used += 1
+            return self._used - 1
+        slot = self._victim()
+        self._evict(slot)
+        self.counters['evictions'] += 1
+        return slot
+
+    def _victim(self, keep=None):
+        """Next live slot whose CLOCK bit is clear (clearing bits on the way)."""
+        while True:
+            slot = self._hand
+            self._hand = (self._hand + 1) % self._used
+            if self._replies[slot] is None or slot == keep:
+                continue
+            if self._ref[slot]:
+                self._ref[slot] = 0
+                continue
+            return slot
+
+    def _evict(self, slot):
+        """Drop a slot's entry and its index cells (the slot itself is reused by the caller)."""
+        if self._replies[slot] is None:
+            return
+        b = self.bands
+        for i in range(b):
+            key = self._band_keys[slot * b + i]
+            table = self._tables[i]
+            if table[key & self._mask] == slot + 1:
+                table[key & self._mask] = 0
+        self._replies[slot] = None
+        self._words[slot] = None
+        self._count -= 1
+        self._bytes -= self._sizes[slot]
+
+    def clear(self):
+        with self._lock:
+            for table in self._tables:
+                table[:] = array('i', [0]) * len(table)
+            self._replies = [None] * self.max_entries
+            self._words = [None] * self.max_entries
+            self._used = self._hand = self._count = self._bytes = 0
+            self._free = []
+
+    def stats(self):
+        with self._lock:
+            out = dict(self.counters)
+            out.update({'entries': self._count, 'bytes': self._bytes, 'max_entries': self.max_entries,
+                        'max_bytes': self.max_bytes, 'threshold': self.threshold, 'bands': self.bands,
+                        'rows': self.rows,
+                        'index_bytes': sum(t.itemsize * len(t) for t in self._tables) +
+                        self._band_keys.itemsize * len(self._band_keys)})
+        hits = out['hits'] + out['near_hits']
+        out['similarity_sum'] = round(out['similarity_sum'], 3)
+        out['mean_similarity'] = round(out['similarity_sum'] / hits, 4) if hits else None
+        return out
+
+    def __len__(self):
+        return self._count
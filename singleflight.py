@@ -0,0 +1,66 @@
+"""Single-flight coalescing of identical concurrent calls (stdlib only).
+
+The first caller for a key becomes the leader and does the work; callers
+that arrive while it is in flight wait for the leader's result instead of
+repeating the call. Nothing is remembered once the leader finishes, so this
+only merges calls that actually overlap (see response_cache.py for reuse
+across time).
+"""
+import threading
+
+
+class Flight:
+    """One in-flight call; followers wait() on it."""
+
+    def __init__(self, key):
+        self.key = key
+        self.followers = 0
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def wait(self, timeout=None):
+        """The leader's result, or None if it did not finish within timeout.
+
+        Re-raises the leader's exception if its call failed.
+        """
+        if not self._done.wait(timeout):
+            return None
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.counters = {'leaders': 0, 'followers': 0}
+
+    def begin(self, key):
+        """Return (flight, is_leader). The leader must call finish() exactly once."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.counters['followers'] += 1
+                return flight, False
+            flight = Flight(key)
+            self._flights[key] = flight
+            self.counters['leaders'] += 1
+            return flight, True
+
+    def finish(self, flight, result=None, error=None):
+        """Publish the leader's result (or exception) to its followers."""
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        flight._result = result
+        flight._error = error
+        flight._done.set()
+
+    def stats(self):
+        with self._lock:
+            out = dict(self.counters)
+            out['in_flight'] = len(self._flights)
+            return out
@@ -0,0 +1,456 @@
+"""SQLite storage backend (stdlib sqlite3, WAL mode).
+
+Drop-in alternatives to the JSON stores, selected with STORAGE_BACKEND=sqlite:
+
+- SqliteReviewStore: same interface as review_store.ReviewStore, one row per
+  review in reviews.db, indexed on messageId and timestamp. Row ids give the
+  file order, so page() cursors also survive restarts. The messageId column
+  holds the id as JSON, so 1 and "1" are different reviews, as in the JSON
+  store; ids that are neither strings nor integers are not addressable.
+- SqliteLog: same interface as jsonl_log.JsonlLog for suggestions.db and
+  peer_rankings.db, with the given record fields (itemId, messageId,
+  timestamp) copied into indexed columns for select().
+
+Each store is its own database file, so the reranker's freshness check on
+reviews.db is not disturbed by ranking writes. Opening and closing a store
+checkpoints the WAL (including one left by a crash) into the main file. Reads use a small pool of
+connections (WAL readers never block the writer); writes are serialized on
+one connection and commit per call. `synchronous` is the SQLite PRAGMA:
+NORMAL (default) survives a process crash, FULL also a power loss.
+Several processes may open the same databases (pre-fork workers, see
+prefork.py): SQLite serializes their writes, and SqliteReviewStore.sync()
+notices commits made by the others. With shared=True every review write also
+records its (old, new) pair in a change log table (the last
+_CHANGE_LOG_KEEP of them), in the same transaction, and sync() and all()
+pass the other processes' changes to `on_change(old, new)`, like the
+journal of the JSON store. A process that fell further behind than the log
+reaches gets `on_reset()` instead.
+
+A database that does not exist yet is filled from the JSON files it replaces
+(`legacy_path`), like the JSONL migration. To convert ahead of time:
+
+    python3 sqlite_store.py [--dir .] [--force]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+_POOL_SIZE = 8
+# review changes kept for other processes to catch up with (shared stores)
+_CHANGE_LOG_KEEP = 10000
+
+
+class _Database:
+    def __init__(self, path, synchronous='NORMAL'):
+        self.path = path
+        self.synchronous = synchronous
+        self._write_lock = threading.Lock()
+        self._idle = []
+        self._idle_lock = threading.Lock()
+        self.created = not os.path.exists(path)
+        self._writer = self._connect()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=%s' % self.synchronous)
+        return conn
+
+    @contextmanager
+    def reader(self):
+        with self._idle_lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            with self._idle_lock:
+                if len(self._idle) < _POOL_SIZE and self._writer is not None:
+                    self._idle.append(conn)
+                    conn = None
+            if conn is not None:
+                conn.close()
+
+    @contextmanager
+    def writer(self):
+        """One write transaction; held under the write lock and committed on exit."""
+        with self._write_lock:
+            conn = self._writer
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def data_version(self):
+        """PRAGMA data_version of the writer connection: it changes when another process commits."""
+        with self._write_lock:
+            return self._writer.execute('PRAGMA data_version').fetchone()[0]
+
+    def checkpoint(self):
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def close(self):
+        with self._write_lock:
+            with self._idle_lock:
+                idle, self._idle = self._idle, []
+            for conn in idle:
+                conn.close()
+            if self._writer is not None:
+                self._writer.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                self._writer.close()
+                self._writer = None
+
+
+def _field(record, name):
+    value = record.get(name) if isinstance(record, dict) else None
+    return None if value is None else str(value)
+
+
+def _message_key(message_id):
+    # type-preserving: '1' for 1 and '"1"' for "1"; None (matches no row) for ids the JSON store does not index
+    return json.dumps(message_id) if isinstance(message_id, (str, int)) else None
+
+
+def _record_id(encoded):
+    try:
+        record = json.loads(encoded)
+    except Exception:
+        return None
+    return record.get('messageId') if isinstance(record, dict) else None
+
+
+def _encode(record):
+    return json.dumps(record)
+
+
+def legacy_log_records(path):
+    """Records of an old suggestions/rankings file: JSON Lines (.jsonl) or a JSON array."""
+    if not path or not os.path.exists(path):
+        return []
+    if path.endswith('.jsonl'):
+        from jsonl_log import JsonlLog
+        log = JsonlLog(path)
+        try:
+            return list(log)
+        finally:
+            log.close()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except Exception:
+        return []
+    return data if isinstance(data, list) else []
+
+
+class SqliteReviewStore:
+    def __init__(self, path='reviews.db', legacy_path=None, synchronous='NORMAL', shared=False, lock=None):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.shared = shared
+        # an RLock the caller also holds around writes, so on_change runs serialized with them
+        self._lock = lock if lock is not None else threading.RLock()
+        # the WAL is folded in on open and close, so the main file alone describes the data
+        self.sources = [path]
+        self._db = _Database(path, synchronous)
+        with self._db.writer() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS reviews (pos INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'message_id TEXT, timestamp TEXT, record TEXT NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS reviews_message_id ON reviews (message_id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS reviews_timestamp ON reviews (timestamp)')
+            conn.execute('CREATE TABLE IF NOT EXISTS review_changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'writer INTEGER, old TEXT, new TEXT)')
+            if conn.execute('PRAGMA user_version').fetchone()[0] < 1:
+                # databases written before message_id held JSON keys stored str(messageId)
+                rows = conn.execute('SELECT pos, record FROM reviews').fetchall()
+                conn.executemany('UPDATE reviews SET message_id = ? WHERE pos = ?',
+                                 [(_message_key(_record_id(rec)), pos) for pos, rec in rows])
+                conn.execute('PRAGMA user_version = 1')
+        self.imported = 0
+        if self._db.created and legacy_path and (os.path.exists(legacy_path)
+                                                 or os.path.exists(legacy_path + '.journal')):
+            from review_store import ReviewStore
+            self.imported = self.insert_many(ReviewStore(legacy_path).all())
+        self._db.checkpoint()
+        with self._db.reader() as conn:
+            self._count = conn.execute('SELECT COUNT(*) FROM reviews').fetchone()[0]
+            # last change seen: the ones before this are already in the records read from now on
+            self._change_seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM review_changes').fetchone()[0]
+        # called with (old, new) for each review another process changed (shared stores)
+        self.on_change = None
+        # called (without arguments) when sync() finds reviews another process changed but cannot tell which
+        self.on_reset = None
+        self._data_version = self._db.data_version()
+
+    def sync(self):
+        """Notice commits by other processes sharing reviews.db (pre-fork workers); reads are always current."""
+        version = self._db.data_version()
+        if version == self._data_version:
+            return
+        with self._lock:
+            self._data_version = version
+            with self._db.reader() as conn:
+                self._count = conn.execute('SELECT COUNT(*) FROM reviews').fetchone()[0]
+                changes = self._changes(conn) if self.shared else None
+            self._deliver(changes)
+
+    def _changes(self, conn):
+        return conn.execute('SELECT seq, writer, old, new FROM review_changes WHERE seq > ? ORDER BY seq',
+                            (self._change_seq,)).fetchall()
+
+    def _deliver(self, changes):
+        """Pass other processes' changes to on_change (None: changes unknown, call on_reset)."""
+        if changes is not None and changes and changes[0][0] != self._change_seq + 1:
+            # fell behind the change log: the missing changes were pruned
+            changes = None
+        if changes is None:
+            callbacks = [(self.on_reset, ())]
+        else:
+            if changes:
+                self._change_seq = changes[-1][0]
+            pid = os.getpid()
+            callbacks = [(self.on_change, (json.loads(old) if old else None, json.loads(new) if new else None))
+                         for _, writer, old, new in changes if writer != pid]
+        for callback, args in callbacks:
+            if callback is not None:
+                try:
+                    callback(*args)
+                except Exception:
+                    pass
+
+    def _log_change(self, conn, old, new):
+        """Record one review write for the other processes (shared stores); old/new are encoded records or None."""
+        if not self.shared:
+            return
+        cur = conn.execute('INSERT INTO review_changes (writer, old, new) VALUES (?, ?, ?)', (os.getpid(), old, new))
+        conn.execute('DELETE FROM review_changes WHERE seq <= ?', (cur.lastrowid - _CHANGE_LOG_KEEP,))
+
+    def insert_many(self, records):
+        """Append records in order without upsert semantics (used for imports); returns the count."""
+        rows = [(_message_key(r.get('messageId') if isinstance(r, dict) else None), _field(r, 'timestamp'),
+                 _encode(r)) for r in records]
+        with self._db.writer() as conn:
+            conn.executemany('INSERT INTO reviews (message_id, timestamp, record) VALUES (?, ?, ?)', rows)
+            self._count = conn.execute('SELECT COUNT(*) FROM reviews').fetchone()[0]
+        return len(rows)
+
+    # --- reads -------------------------------------------------------------
+
+    def get(self, message_id):
+        with self._db.reader() as conn:
+            row = conn.execute('SELECT record FROM reviews WHERE message_id = ? ORDER BY pos LIMIT 1',
+                               (_message_key(message_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def all(self):
+        """Snapshot list of all records in insertion order.
+
+        Shared: the changes other processes made up to the snapshot are passed
+        to on_change first, so a caller holding the lock (the reranker's full
+        build) never gets one of them again afterwards.
+        """
+        with self._lock:
+            with self._db.reader() as conn:
+                conn.execute('BEGIN')
+                try:
+                    changes = self._changes(conn) if self.shared else []
+                    records = [json.loads(rec) for (rec,) in conn.execute('SELECT record FROM reviews ORDER BY pos')]
+                finally:
+                    conn.execute('COMMIT')
+            self._deliver(changes)
+            return records
+
+    def page(self, after=0, limit=100):
+        """Up to limit records following cursor `after` (0 = from the start); returns (records, cursor or None)."""
+        with self._db.reader() as conn:
+            rows = conn.execute('SELECT pos, record FROM reviews WHERE pos > ? ORDER BY pos LIMIT ?',
+                                (after, limit + 1)).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return [json.loads(rec) for _, rec in rows], (rows[-1][0] if more and rows else None)
+
+    def __len__(self):
+        return self._count
+
+    # --- writes ------------------------------------------------------------
+
+    def _first(self, conn, message_id):
+        return conn.execute('SELECT pos, record FROM reviews WHERE message_id = ? ORDER BY pos LIMIT 1',
+                            (message_id,)).fetchone()
+
+    def upsert(self, record):
+        """Insert or overwrite the review with record['messageId']; returns the previous record or None."""
+        mid = _message_key(record.get('messageId'))
+        with self._db.writer() as conn:
+            row = self._first(conn, mid)
+            if row is None:
+                conn.execute('INSERT INTO reviews (message_id, timestamp, record) VALUES (?, ?, ?)',
+                             (mid, _field(record, 'timestamp'), _encode(record)))
+                self._log_change(conn, None, _encode(record))
+                self._count += 1
+                return None
+            # overwrite in place so the review keeps its position
+            conn.execute('UPDATE reviews SET timestamp = ?, record = ? WHERE pos = ?',
+                         (_field(record, 'timestamp'), _encode(record), row[0]))
+            self._log_change(conn, row[1], _encode(record))
+            return json.loads(row[1])
+
+    def update(self, message_id, fields):
+        """Merge fields into an existing review; returns (old, new) or None if it does not exist."""
+        with self._db.writer() as conn:
+            row = self._first(conn, _message_key(message_id))
+            if row is None:
+                return None
+            old = json.loads(row[1])
+            new = dict(old)
+            new.update(fields)
+            conn.execute('UPDATE reviews SET timestamp = ?, record = ? WHERE pos = ?',
+                         (_field(new, 'timestamp'), _encode(new), row[0]))
+            self._log_change(conn, row[1], _encode(new))
+            return old, new
+
+    def delete(self, message_id):
+        """Remove every review with message_id; returns the removed records (empty list if none)."""
+        with self._db.writer() as conn:
+            rows = conn.execute('SELECT record FROM reviews WHERE message_id = ? ORDER BY pos',
+                                (_message_key(message_id),)).fetchall()
+            if rows:
+                conn.execute('DELETE FROM reviews WHERE message_id = ?', (_message_key(message_id),))
+                for (rec,) in rows:
+                    self._log_change(conn, rec, None)
+                self._count -= len(rows)
+        return [json.loads(rec) for (rec,) in rows]
+
+    def compact(self, wait=True):
+        """Fold the WAL back into reviews.db."""
+        self._db.checkpoint()
+
+    def close(self):
+        self._db.close()
+
+
+class SqliteLog:
+    def __init__(self, path, fields=(), legacy_path=None, synchronous='NORMAL'):
+        self.path = path
+        self.legacy_path = legacy_path
+        # record fields copied into indexed columns
+        self.fields = tuple(fields)
+        self._db = _Database(path, synchronous)
+        self.counters = {'appends': 0, 'imported': 0}
+        cols = ''.join(', "%s" TEXT' % f for f in self.fields)
+        with self._db.writer() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS records (seq INTEGER PRIMARY KEY%s, record TEXT NOT NULL)' % cols)
+            for f in self.fields:
+                conn.execute('CREATE INDEX IF NOT EXISTS "records_%s" ON records ("%s")' % (f, f))
+        self._insert_sql = 'INSERT INTO records (%s) VALUES (%s)' % (
+            ', '.join(['"%s"' % f for f in self.fields] + ['record']), ', '.join('?' * (len(self.fields) + 1)))
+        if self._db.created and legacy_path:
+            self.counters['imported'] = self.insert_many(legacy_log_records(legacy_path))
+        self._db.checkpoint()
+        with self._db.reader() as conn:
+            self._count = conn.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+
+    def _row(self, record):
+        return tuple(_field(record, f) for f in self.fields) + (_encode(record),)
+
+    def insert_many(self, records):
+        rows = [self._row(r) for r in records]
+        with self._db.writer() as conn:
+            conn.executemany(self._insert_sql, rows)
+        return len(rows)
+
+    def append(self, record):
+        """Append one record; returns once it is committed."""
+        row = self._row(record)
+        with self._db.writer() as conn:
+            conn.execute(self._insert_sql, row)
+            self._count += 1
+            self.counters['appends'] += 1
+
+    def _stream(self, sql, args=()):
+        with self._db.reader() as conn:
+            cur = conn.execute(sql, args)
+            try:
+                while True:
+                    rows = cur.fetchmany(500)
+                    if not rows:
+                        return
+                    for (rec,) in rows:
+                        yield json.loads(rec)
+            finally:
+                cur.close()
+
+    def __iter__(self):
+        """Stream the records in append order."""
+        return self._stream('SELECT record FROM records ORDER BY seq')
+
+    def since(self, cursor=0):
+        """(records appended after cursor, new cursor); cursors are row sequence numbers, 0 is the start."""
+        with self._db.reader() as conn:
+            rows = conn.execute('SELECT seq, record FROM records WHERE seq > ? ORDER BY seq', (cursor,)).fetchall()
+        if not rows:
+            return [], cursor
+        return [json.loads(rec) for _, rec in rows], rows[-1][0]
+
+    def select(self, field, value):
+        """Stream the records whose `field` equals value (compared as strings), in append order."""
+        if field in self.fields:
+            return self._stream('SELECT record FROM records WHERE "%s" = ? ORDER BY seq' % field, (str(value),))
+        return (r for r in self if _field(r, field) == str(value))
+
+    def __len__(self):
+        return self._count
+
+    def stats(self):
+        out = dict(self.counters)
+        out.update({'records': self._count, 'backend': 'sqlite', 'synchronous': self._db.synchronous})
+        return out
+
+    def close(self):
+        self._db.close()
+
+
+LOG_FIELDS = {'suggestions': ('messageId', 'timestamp'), 'peer_rankings': ('itemId', 'timestamp')}
+
+
+def open_log(db_path, kind, path=lambda name: name, synchronous='NORMAL'):
+    """SqliteLog for 'suggestions' or 'peer_rankings', importing <kind>.jsonl (or <kind>.json) on creation."""
+    legacy = path(kind + '.jsonl')
+    if not os.path.exists(legacy):
+        legacy = path(kind + '.json')
+    return SqliteLog(db_path, LOG_FIELDS[kind], legacy, synchronous)
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Import the JSON stores into SQLite databases')
+    ap.add_argument('--dir', default='.', help='directory holding the JSON files (databases are written there)')
+    ap.add_argument('--force', action='store_true', help='replace existing databases')
+    args = ap.parse_args()
+
+    def path(name):
+        return os.path.join(args.dir, name)
+
+    if args.force:
+        for name in ('reviews.db', 'suggestions.db', 'peer_rankings.db'):
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path(name) + suffix):
+                    os.remove(path(name) + suffix)
+    stores = [
+        ('reviews.db', SqliteReviewStore(path('reviews.db'), path('reviews.json'))),
+        ('suggestions.db', open_log(path('suggestions.db'), 'suggestions', path)),
+        ('peer_rankings.db', open_log(path('peer_rankings.db'), 'peer_rankings', path)),
+    ]
+    for name, store in stores:
+        print('%s: %d records' % (name, len(store)))
+        store.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""In-memory frontend assets for server_py.py (stdlib only).
+
+StaticAssets reads the frontend files (HTML, CSS, JS, images) in `root`
+once at startup and keeps each one in memory with a strong ETag (a hash of
+its bytes) and, for text types, a gzip copy compressed once at level 9.
+Serving an asset never touches the disk, and a browser revalidating with
+If-None-Match gets a 304 without a body.
+
+Only top-level files with a frontend extension are served, minus the names
+in `exclude` (e.g. the Node servers), so the backend's code, data files and
+.env are never exposed.
+
+HTML is always sent with `Cache-Control: no-cache` (reuse only after a
+cheap revalidation), so a deploy shows up on the next page load. Other
+assets may be reused without asking for `max_age` seconds (0: revalidate
+them too). With `watch` (dev mode) a thread compares the files' mtimes and
+sizes every `interval` seconds and reloads changed, new and removed files;
+everything is then sent with no-cache.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+import time
+from urllib.parse import unquote
+
+EXTENSIONS = frozenset(['.html', '.css', '.js', '.mjs', '.svg', '.png', '.jpg', '.jpeg', '.gif', '.webp', '.ico',
+                        '.woff', '.woff2'])
+# gzip only pays off for text; images and fonts are compressed already
+_COMPRESSIBLE = ('text/', 'application/javascript', 'image/svg+xml')
+_TYPES = {'.js': 'application/javascript', '.mjs': 'application/javascript', '.svg': 'image/svg+xml',
+          '.woff2': 'font/woff2', '.woff': 'font/woff', '.webp': 'image/webp', '.ico': 'image/x-icon'}
+
+
+class Asset:
+    __slots__ = ('name', 'body', 'etag', 'gz', 'gz_etag', 'content_type', 'cache_control', 'stamp')
+
+
+class StaticAssets:
+    def __init__(self, root, exclude=(), max_age=0, watch=False, interval=1.0, gzip_min=256):
+        self.root = root
+        self.exclude = frozenset(exclude)
+        self.max_age = max_age
+        self.watch = watch
+        self.interval = interval
+        self.gzip_min = gzip_min
+        # name -> Asset; replaced as a whole on reload, so readers need no lock
+        self._assets = {}
+        self.counters = {'reloads': 0, 'errors': 0}
+        self.reload()
+        if watch:
+            threading.Thread(target=self._watch, name='static-watch', daemon=True).start()
+
+    def _scan(self):
+        """{name: (mtime_ns, size)} of the files to serve."""
+        out = {}
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return out
+        for entry in entries:
+            name = entry.name
+            if name.startswith('.') or name in self.exclude or os.path.splitext(name)[1].lower() not in EXTENSIONS:
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            out[name] = (st.st_mtime_ns, st.st_size)
+        return out
+
+    def _load(self, name, stamp):
+        with open(os.path.join(self.root, name), 'rb') as f:
+            body = f.read()
+        ext = os.path.splitext(name)[1].lower()
+        content_type = _TYPES.get(ext) or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        compressible = content_type.startswith(_COMPRESSIBLE)
+        if compressible:
+            content_type += '; charset=utf-8'
+        a = Asset()
+        a.name = name
+        a.body = body
+        a.etag = '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+        a.gz = a.gz_etag = None
+        if compressible and len(body) >= self.gzip_min:
+            # mtime=0: the same bytes always give the same gzip body (and ETag)
+            gz = gzip.compress(body, 9, mtime=0)
+            if len(gz) < len(body):
+                a.gz = gz
+                a.gz_etag = a.etag[:-1] + '-gzip"'
+        a.content_type = content_type
+        if self.watch or ext == '.html' or self.max_age <= 0:
+            a.cache_control = 'no-cache'
+        else:
+            a.cache_control = 'public, max-age=%d' % self.max_age
+        a.stamp = stamp
+        return a
+
+    def reload(self):
+        """Re-read the files that changed, appeared or disappeared; returns how many did."""
+        current = self._assets
+        fresh = {}
+        changed = 0
+        for name, stamp in self._scan().items():
+            old = current.get(name)
+            if old is not None and old.stamp == stamp:
+                fresh[name] = old
+                continue
+            try:
+                fresh[name] = self._load(name, stamp)
+            except OSError:
+                self.counters['errors'] += 1
+                continue
+            changed += 1
+        changed += sum(1 for name in current if name not in fresh)
+        if changed:
+            self._assets = fresh
+            self.counters['reloads'] += 1
+        return changed
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.reload()
+            except Exception:
+                self.counters['errors'] += 1
+
+    def get(self, path):
+        """The Asset for a request path ('/' is index.html), or None."""
+        name = unquote(path).lstrip('/') or 'index.html'
+        if '/' in name or '\\' in name:
+            return None
+        return self._assets.get(name)
+
+    def names(self):
+        return sorted(self._assets)
+
+    def stats(self):
+        assets = list(self._assets.values())
+        out = dict(self.counters)
+        out.update({'files': len(assets), 'bytes': sum(len(a.body) for a in assets),
+                    'gzip_bytes': sum(len(a.gz if a.gz is not None else a.body) for a in assets),
+                    'watch': self.watch})
+        return out
@@ -0,0 +1,273 @@
+"""Keep-alive HTTP(S) client for the OpenAI-compatible upstream (stdlib only).
+
+`UpstreamClient` keeps a small pool of persistent connections to one base URL
+and builds its SSL context once, so consecutive /chat calls skip the TCP and
+TLS handshakes. Every response carries a `timings` dict:
+
+- reused: True if the request went out on an already-open connection
+- connect_ms / tls_ms: TCP connect and TLS handshake time (0 when reused)
+- ttfb_ms: time from sending the request to receiving the response headers
+- total_ms: time until the body was fully read (set when the response closes)
+
+A `Cancellation` passed to request() aborts the requests attached to it by
+shutting down their sockets, e.g. fan-out calls whose answer is no longer
+needed; the upstream sees the client go away and stops generating.
+"""
+import http.client
+import json
+import socket
+import ssl
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+class UpstreamError(Exception):
+    """The upstream could not be reached or returned an unusable response."""
+
+
+class UpstreamCancelled(UpstreamError):
+    """The request was aborted through its Cancellation."""
+
+
+class UpstreamHTTPError(UpstreamError):
+    """The upstream answered with an HTTP error status."""
+
+    def __init__(self, status, body, headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+        UpstreamError.__init__(self, 'HTTP %d' % status)
+
+
+def _ms(seconds):
+    return round(seconds * 1000.0, 2)
+
+
+def _nodelay(sock):
+    # Small request/response writes on a kept-alive socket otherwise stall on
+    # Nagle + delayed ACK (~40ms per request)
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    except OSError:
+        pass
+
+
+class _TimedHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection that records how long connect() took."""
+
+    def connect(self):
+        t0 = time.perf_counter()
+        http.client.HTTPConnection.connect(self)
+        _nodelay(self.sock)
+        self.timings['connect_ms'] = _ms(time.perf_counter() - t0)
+
+
+class _TimedHTTPSConnection(http.client.HTTPSConnection):
+    """HTTPSConnection that times the TCP connect and the TLS handshake separately."""
+
+    def connect(self):
+        t0 = time.perf_counter()
+        sock = socket.create_connection((self.host, self.port), self.timeout, self.source_address)
+        _nodelay(sock)
+        t1 = time.perf_counter()
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+        self.timings['connect_ms'] = _ms(t1 - t0)
+        self.timings['tls_ms'] = _ms(time.perf_counter() - t1)
+
+
+class Cancellation:
+    """Aborts the in-flight requests attached to it (cancel() shuts their sockets down)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conns = set()
+        self.cancelled = False
+
+    def attach(self, conn):
+        with self._lock:
+            if self.cancelled:
+                return False
+            self._conns.add(conn)
+            return True
+
+    def detach(self, conn):
+        """Stop tracking conn; False if it was shut down by cancel() (do not reuse it)."""
+        with self._lock:
+            self._conns.discard(conn)
+            return not self.cancelled
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            conns, self._conns = self._conns, set()
+            # under the lock, so a connection cannot be detached and pooled in between
+            for conn in conns:
+                try:
+                    conn.sock.shutdown(socket.SHUT_RDWR)
+                except Exception:
+                    pass
+
+
+class UpstreamResponse:
+    """A response bound to a pooled connection; returns it to the pool on close()."""
+
+    def __init__(self, client, conn, resp, timings, started, cancel=None):
+        self._client = client
+        self._conn = conn
+        self._resp = resp
+        self._started = started
+        self._cancel = cancel
+        self.status = resp.status
+        self.headers = resp.headers
+        self.timings = timings
+
+    def read(self):
+        data = self._resp.read()
+        self.close()
+        return data
+
+    def __iter__(self):
+        # Line iterator, used to relay server-sent events
+        while True:
+            line = self._resp.readline()
+            if not line:
+                break
+            yield line
+
+    def close(self):
+        if self._conn is None:
+            return
+        if 'total_ms' not in self.timings:
+            self.timings['total_ms'] = _ms(time.perf_counter() - self._started)
+        conn, self._conn = self._conn, None
+        intact = self._cancel.detach(conn) if self._cancel is not None else True
+        # Only a fully consumed response leaves the connection reusable
+        if intact and self._resp.isclosed() and not self._resp.will_close:
+            self._client._release(conn)
+        else:
+            self._resp.close()
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class UpstreamClient:
+    """Pooled keep-alive client for one base URL (e.g. https://api.openai.com/v1).
+
+    Thread-safe: each request takes an idle connection (or opens a new one)
+    and gives it back once the response has been read. At most `pool_size`
+    idle connections are kept.
+    """
+
+    def __init__(self, base_url, pool_size=8, timeout=30, ssl_context=None):
+        parts = urlsplit(base_url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError('unsupported upstream URL: %r' % base_url)
+        self.base_url = base_url.rstrip('/')
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.prefix = parts.path.rstrip('/')
+        self.pool_size = max(0, pool_size)
+        self.timeout = timeout
+        # Loading the CA store is expensive; do it once per client, not per request
+        if self.scheme == 'https':
+            self._ssl = ssl_context or ssl.create_default_context()
+        else:
+            self._ssl = None
+        self._idle = []
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'connections_opened': 0, 'reused': 0}
+
+    def _new_connection(self, timeout):
+        if self._ssl is not None:
+            conn = _TimedHTTPSConnection(self.host, self.port, timeout=timeout, context=self._ssl)
+        else:
+            conn = _TimedHTTPConnection(self.host, self.port, timeout=timeout)
+        conn.timings = {}
+        return conn
+
+    def _acquire(self, timeout):
+        with self._lock:
+            while self._idle:
+                conn = self._idle.pop()
+                if conn.sock is not None:
+                    conn.timeout = timeout
+                    conn.sock.settimeout(timeout)
+                    return conn
+        return self._new_connection(timeout)
+
+    def _release(self, conn):
+        with self._lock:
+            if conn.sock is not None and len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def request(self, method, path, body=None, headers=None, timeout=None, cancel=None):
+        """Send a request and return an UpstreamResponse (use it as a context manager).
+
+        Raises UpstreamHTTPError for status >= 400 and UpstreamError for
+        connection failures. A request that fails on a reused connection
+        (the server may have dropped it while idle) is retried once on a
+        fresh connection. With `cancel`, the request (until its response is
+        closed) can be aborted with cancel.cancel(); it then raises
+        UpstreamCancelled.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        url = self.prefix + path
+        for attempt in (0, 1):
+            conn = self._acquire(timeout)
+            reused = conn.sock is not None
+            if cancel is not None and not cancel.attach(conn):
+                self._release(conn)
+                raise UpstreamCancelled('request cancelled')
+            conn.timings = {'reused': reused, 'connect_ms': 0.0, 'tls_ms': 0.0}
+            started = time.perf_counter()
+            try:
+                conn.request(method, url, body=body, headers=headers or {})
+                sent = time.perf_counter()
+                resp = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionError, BrokenPipeError, OSError,
+                    http.client.HTTPException) as e:
+                if cancel is not None and not cancel.detach(conn):
+                    conn.close()
+                    raise UpstreamCancelled('request cancelled')
+                conn.close()
+                if reused and attempt == 0 and isinstance(e, (http.client.RemoteDisconnected, ConnectionError)):
+                    continue
+                raise UpstreamError(str(e))
+            timings = conn.timings
+            timings['ttfb_ms'] = _ms(time.perf_counter() - sent)
+            with self._lock:
+                self.stats['requests'] += 1
+                self.stats['reused' if reused else 'connections_opened'] += 1
+            response = UpstreamResponse(self, conn, resp, timings, started, cancel)
+            if resp.status >= 400:
+                try:
+                    detail = response.read()
+                except Exception:
+                    detail = b''
+                    response.close()
+                raise UpstreamHTTPError(resp.status, detail, dict(resp.headers))
+            return response
+        raise UpstreamError('upstream request failed')
+
+    def post_json(self, path, payload, headers=None, timeout=None):
+        """POST a JSON payload; returns the UpstreamResponse (body not yet read)."""
+        hdrs = {'Content-Type': 'application/json'}
+        hdrs.update(headers or {})
+        return self.request('POST', path, json.dumps(payload).encode('utf-8'), hdrs, timeout)